@@ -1,7 +1,6 @@
 import click
 
-from src import Application
-from src.api import Option as opt, validate, Command
+from src.api import Option as opt, validate, Command, Engine
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -9,6 +8,8 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 def runner(command: str, **kwargs):
     try:
         validate(command, **kwargs)
+        # the application is imported by the commands only, so the help is shown without loading it
+        from src import Application
         if command == Command.create_new_db:
             Application.create_db(db_name=kwargs[opt.database],
                                   url=kwargs[opt.url],
@@ -16,6 +17,8 @@ def runner(command: str, **kwargs):
                                   local_access=kwargs[opt.local_access],
                                   set_index=kwargs[opt.set_index],
                                   drop_csv=kwargs[opt.drop_csv],
+                                  surrogate_keys=kwargs[opt.surrogate_keys],
+                                  engine=kwargs[opt.engine],
                                   new_db=True)
         elif command == Command.append_data:
             Application.create_db(db_name=kwargs[opt.database],
@@ -24,12 +27,23 @@ def runner(command: str, **kwargs):
                                   local_access=kwargs[opt.local_access],
                                   set_index=kwargs[opt.set_index],
                                   drop_csv=kwargs[opt.drop_csv],
+                                  engine=kwargs[opt.engine],
                                   new_db=False)
         elif command == Command.run_study:
             Application.run_study(db_name=kwargs[opt.database], out_dir=kwargs[opt.out_dir],
-                                  study_list=kwargs[opt.study], local_db=kwargs[opt.local_access])
+                                  study_list=kwargs[opt.study], local_db=kwargs[opt.local_access],
+                                  engine=kwargs[opt.engine], attribute_pushdown=kwargs[opt.attribute_pushdown],
+                                  memory_budget=kwargs[opt.memory_budget], chains_output=kwargs[opt.chains_output],
+                                  query_log=kwargs[opt.query_log])
         elif command == Command.validate_study:
-            Application.validate_study(study_list=kwargs[opt.study])
+            Application.validate_study(study_list=kwargs[opt.study], db_name=kwargs[opt.database],
+                                       local_db=kwargs[opt.local_access], engine=kwargs[opt.engine],
+                                       out_file=kwargs[opt.out_dir])
+        elif command == Command.replay_queries:
+            Application.replay_queries(db_name=kwargs[opt.database], query_log=kwargs[opt.query_log],
+                                       concurrency=kwargs[opt.concurrency], repeat=kwargs[opt.repeat],
+                                       local_db=kwargs[opt.local_access], engine=kwargs[opt.engine],
+                                       out_file=kwargs[opt.out_dir])
     except ValueError as e:
         print(e)
 
@@ -64,6 +78,14 @@ def run():
 @click.option(f'--{opt.drop_csv}', default=True,
               help='If TRUE, then .csv files with the common data model will be deleted after data uploaded to the '
                    'database.')
+@click.option(f'--{opt.surrogate_keys}', default=True,
+              help='If TRUE, then patient and encounter ids are stored as integer surrogate ids. '
+                   'It reduces indexes size and speeds up data search. Original ids are restored in the study results. '
+                   'Default value is TRUE')
+@click.option(f'--{opt.engine}', default=Engine.mariadb,
+              help=f'Storage engine of the database: {Engine.mariadb} or {Engine.parquet}. '
+                   f'{Engine.parquet} engine stores tables as parquet files in the local store directory '
+                   f'and does not require a database server. Default value is {Engine.mariadb}')
 def create(**kwargs):
     runner(command=Command.create_new_db, **kwargs)
 
@@ -92,6 +114,10 @@ def create(**kwargs):
 @click.option(f'--{opt.drop_csv}', default=True,
               help='If TRUE, then .csv files with the common data model will be deleted after data uploaded to the '
                    'database.')
+@click.option(f'--{opt.engine}', default=Engine.mariadb,
+              help=f'Storage engine of the database: {Engine.mariadb} or {Engine.parquet}. '
+                   f'{Engine.parquet} engine stores tables as parquet files in the local store directory '
+                   f'and does not require a database server. Default value is {Engine.mariadb}')
 def append(**kwargs):
     runner(command=Command.append_data, **kwargs)
 
@@ -107,6 +133,26 @@ def append(**kwargs):
               default=True,
               help='If False, then SSH connection will be used. '
                    'Otherwise, the local host DB connection will be establish.')
+@click.option(f'--{opt.engine}', default=Engine.mariadb,
+              help=f'Storage engine of the database: {Engine.mariadb}, {Engine.mariadb_async} or {Engine.parquet}. '
+                   f'{Engine.mariadb_async} engine sends the requests concurrently over an asyncio connection pool, '
+                   f'it requires the aiomysql package. Default value is {Engine.mariadb}')
+@click.option(f'--{opt.attribute_pushdown}', default=False,
+              help='If TRUE, then having and exclusion events are checked by the database in the event requests, '
+                   'so only the filtered records are transferred. '
+                   f'It is not supported by the {Engine.parquet} engine. Default value is FALSE')
+@click.option(f'--{opt.memory_budget}', default=None, type=int,
+              help='Memory budget of a patients group in MB. Events frames exceeding it are spilled to disk and '
+                   'levels are matched partition by partition. By default, all frames are kept in memory')
+@click.option(f'--{opt.chains_output}', default=False,
+              help='If TRUE, then the full chains of each patients group are saved in a single chains.parquet file '
+                   'with the event id, code and date columns of every level and the time intervals between them, '
+                   'described by chains_manifest.json. The level and transition files are not saved. '
+                   'Default value is FALSE')
+@click.option(f'--{opt.query_log}', default=None,
+              help='Directory to capture the database queries of the study to. Every query is saved with its '
+                   'fingerprint, size, latency, result size and the calling study stage. The captured queries can be '
+                   f'replayed with the replay command. It is not supported by the {Engine.parquet} engine')
 def run_study(**kwargs):
     runner(command=Command.run_study, **kwargs)
 
@@ -114,9 +160,43 @@ def run_study(**kwargs):
 @run.command()
 @click.option(f'--{opt.study}', multiple=True,
               help='Study configuration file to be validated. Multiple studies can be set using --s option')
+@click.option(f'--{opt.database}', default=None,
+              help='Name of the database to check the event codes in. The codes of all studies are checked together '
+                   'by a few requests, and the unknown codes and the estimated patients of the levels are reported '
+                   'for every study. By default, only the config structure is validated')
+@click.option(f'--{opt.local_access}',
+              default=True,
+              help='If False, then SSH connection will be used. '
+                   'Otherwise, the local host DB connection will be establish.')
+@click.option(f'--{opt.engine}', default=Engine.mariadb,
+              help=f'Storage engine of the database: {Engine.mariadb}, {Engine.mariadb_async} or {Engine.parquet}. '
+                   f'Default value is {Engine.mariadb}')
+@click.option(f'--{opt.out_dir}', default=None,
+              help='CSV file to save the codes report to: records and patients of every code of the studies')
 def validate_study(**kwargs):
     runner(command=Command.validate_study, **kwargs)
 
 
+@run.command()
+@click.option(f'--{opt.database}',
+              help='Name of the database to replay the queries against')
+@click.option(f'--{opt.query_log}',
+              help='Query log directory of a study run or a single queries file')
+@click.option(f'--{opt.concurrency}', default=8, type=int,
+              help='Number of the concurrent queries. Default value is 8')
+@click.option(f'--{opt.repeat}', default=1, type=int,
+              help='Number of the workload repeats. Default value is 1')
+@click.option(f'--{opt.local_access}',
+              default=True,
+              help='If False, then SSH connection will be used. '
+                   'Otherwise, the local host DB connection will be establish.')
+@click.option(f'--{opt.engine}', default=Engine.mariadb,
+              help=f'Database engine: {Engine.mariadb} or {Engine.mariadb_async}. Default value is {Engine.mariadb}')
+@click.option(f'--{opt.out_dir}', default=None,
+              help='CSV file to save the latencies of the captured and the replayed queries to')
+def replay(**kwargs):
+    runner(command=Command.replay_queries, **kwargs)
+
+
 if __name__ == '__main__':
     run()
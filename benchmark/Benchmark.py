@@ -0,0 +1,117 @@
+import dataclasses
+import logging
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from mashumaro.mixins.json import DataClassJSONMixin
+
+from benchmark.StageProfiler import StageProfiler, StageResult
+from benchmark.SyntheticEhr import SyntheticEhr, SyntheticEhrConfig
+from src.api import Engine
+
+
+def generate_dataset(config: SyntheticEhrConfig, dataset_dir: str) -> str:
+    return SyntheticEhr(config).write(dataset_dir, archive=True)
+
+
+@dataclass
+class BenchmarkRun(DataClassJSONMixin):
+    """Measurements of a benchmark run with its parameters"""
+    label: str
+    started: str
+    commit: Optional[str]
+    engine: str
+    dataset: dict = field(default_factory=dict)
+    stages: list[StageResult] = field(default_factory=list)
+
+
+class Benchmark:
+    """
+    End-to-end benchmark of EHRchitect: generate a synthetic TNX dataset, import it with createdb and run the study
+    configs on it. Every stage is measured by StageProfiler, and the run is appended to the results file, one JSON
+    record per line, so the runs of different commits and parameters can be compared.
+    """
+    studies_path = Path(__file__).resolve().parent / 'studies'
+    results_file = 'benchmark_results.jsonl'
+
+    def __init__(self, work_dir: str, engine: str = Engine.parquet, db_name: str = 'ehrchitect_benchmark',
+                 trace_python_memory: bool = False):
+        """
+        :param work_dir: directory of the generated data, the study outputs and the results file
+        :param engine: storage engine of the benchmark database
+        :param db_name: benchmark database name, the database is recreated by every run
+        :param trace_python_memory: trace the Python allocations of the stages
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.work_dir = Path(work_dir).resolve()
+        self.engine = engine
+        self.db_name = db_name
+        self.trace_python_memory = trace_python_memory
+
+    def run(self, config: SyntheticEhrConfig, studies: Optional[list] = None, label: Optional[str] = None,
+            skip_import: bool = False) -> BenchmarkRun:
+        """
+        Run the benchmark stages
+        :param config: synthetic dataset parameters
+        :param studies: study config files, all configs of the benchmark studies directory if None
+        :param label: run label, the commit and the start time if None
+        :param skip_import: run the studies on the database imported by the previous run
+        :return: run measurements
+        """
+        from src import Application
+
+        studies = sorted(str(s) for s in self.studies_path.glob('*.json')) if studies is None else studies
+        started = datetime.now().isoformat(timespec='seconds')
+        commit = self.__git_commit()
+        run = BenchmarkRun(label=label or f'{commit or "local"}@{started}', started=started, commit=commit,
+                           engine=self.engine, dataset=dataclasses.asdict(config))
+        profiler = StageProfiler(self.trace_python_memory)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        if not skip_import:
+            dataset_dir = self.work_dir / 'tnx'
+            archive = str(dataset_dir.with_suffix('.zip'))
+            profiler.run('generate', generate_dataset, config, str(dataset_dir))
+            profiler.run('createdb', Application.create_db, self.db_name, None, archive, True, True, True, True,
+                         False, self.engine)
+        out_dir = self.work_dir / 'out'
+        shutil.rmtree(out_dir, ignore_errors=True)
+        for study in studies:
+            profiler.run(f'run_study:{Path(study).stem}', Application.run_study, self.db_name, str(out_dir), [study],
+                         True, self.engine)
+        run.stages = profiler.results
+        with open(self.work_dir / self.results_file, 'a') as f:
+            f.write(run.to_json() + '\n')
+        return run
+
+    @staticmethod
+    def read_results(results_file: str) -> list[BenchmarkRun]:
+        with open(results_file) as f:
+            return [BenchmarkRun.from_json(line) for line in f if line.strip()]
+
+    @staticmethod
+    def compare(base: BenchmarkRun, head: BenchmarkRun) -> list[tuple]:
+        """
+        Compare the stages of two runs
+        :return: list of tuples (stage, base seconds, head seconds, time ratio, base max RSS MB, head max RSS MB)
+        """
+        base_stages = {s.stage: s for s in base.stages}
+        rows = []
+        for s in head.stages:
+            b = base_stages.get(s.stage)
+            if b is None:
+                continue
+            rows.append((s.stage, b.seconds, s.seconds, s.seconds / b.seconds if b.seconds else float('nan'),
+                         max(b.max_rss_mb, b.children_max_rss_mb), max(s.max_rss_mb, s.children_max_rss_mb)))
+        return rows
+
+    @staticmethod
+    def __git_commit() -> Optional[str]:
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
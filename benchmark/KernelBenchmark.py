@@ -0,0 +1,240 @@
+import gc
+import json
+import logging
+import math
+import time
+import warnings
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from mashumaro.mixins.json import DataClassJSONMixin
+
+from src.datamodel.CodeFormat import CodeFormat
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.Event import AttributeMode, Event, EventCategory, EventTimeInterval
+from src.datamodel.ExperimentConfig import ExperimentEvent, ExperimentLevel, ExperimentTimeInterval
+from src.repository.EventRepository import EventRepository
+from src.usecase.FindEventsChain import FindEventsChain
+from src.usecase.GetEventData import GetEventData
+from src.util.FrameSchema import FrameSchema
+
+
+@dataclass
+class KernelResult(DataClassJSONMixin):
+    """
+    Measurement of a kernel on the frames of the size
+    :param kernel: kernel name
+    :param rows: number of rows of the input frames
+    :param seconds: best time of the repeats
+    :param throughput: input rows per second
+    """
+    kernel: str
+    rows: int
+    seconds: float
+    throughput: float
+
+
+class KernelBenchmark:
+    """
+    Micro-benchmarks of the pandas kernels of the chain builder. The kernels are private methods of FindEventsChain,
+    EventRepository and GetEventData, they are called on synthetic frames in process without a database.
+    Every kernel runs on the frames of every size, a fresh copy of the input for every repeat, and the best time of
+    the repeats is taken. The sizes of a kernel are stopped when a size takes longer than the time limit.
+    """
+    kernels = ['match_events', 'filter_events_within_period', 'get_date_patient_map', 'convert_to_base_codes',
+               'process_negative_codes', 'group_patient_params', 'filter_excluded_events', 'filter_having_events']
+    default_sizes = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+    rows_per_patient = 5
+    days = 5 * 365
+    min_date = pd.Timestamp('2015-01-01')
+
+    def __init__(self, sizes: Optional[list] = None, repeat: int = 3, time_limit: float = 120.0, seed: int = 1):
+        """
+        :param sizes: numbers of rows of the input frames, from 10^3 to 10^7
+        :param repeat: number of runs of a kernel on a size
+        :param time_limit: larger sizes of a kernel are skipped when a run takes longer, seconds
+        :param seed: random seed of the frames
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.sizes = sorted(sizes or self.default_sizes)
+        self.repeat = repeat
+        self.time_limit = time_limit
+        self.seed = seed
+        self.__chain = FindEventsChain(None, None, None)
+        self.__event_repo = EventRepository(None)
+        self.__event_data = GetEventData(None, self.__event_repo)
+
+    def run(self, kernels: Optional[list] = None) -> list[KernelResult]:
+        results = []
+        for kernel in kernels or self.kernels:
+            if kernel not in self.kernels:
+                raise ValueError(f'Unknown kernel {kernel}. Available kernels: {self.kernels}')
+            for rows in self.sizes:
+                result = self.measure(kernel, rows)
+                results.append(result)
+                self.logger.info(f'{kernel} rows={rows}: {result.seconds:.4f} s, {result.throughput:,.0f} rows/s')
+                if result.seconds > self.time_limit:
+                    self.logger.warning(f'{kernel} takes longer than {self.time_limit} s, larger sizes are skipped')
+                    break
+        return results
+
+    def measure(self, kernel: str, rows: int) -> KernelResult:
+        rng = np.random.default_rng(self.seed)
+        f, make_params = getattr(self, f'_KernelBenchmark__case_{kernel}')(rows, rng)
+        best = math.inf
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for _ in range(self.repeat):
+                params = make_params()
+                gc.collect()
+                start = time.perf_counter()
+                f(*params)
+                best = min(best, time.perf_counter() - start)
+        return KernelResult(kernel=kernel, rows=rows, seconds=best, throughput=rows / best if best > 0 else math.inf)
+
+    @staticmethod
+    def save(results: list[KernelResult], file_path: str):
+        with open(file_path, 'w') as f:
+            json.dump([r.to_dict() for r in results], f, indent=2)
+
+    @staticmethod
+    def read(file_path: str) -> list[KernelResult]:
+        with open(file_path) as f:
+            return [KernelResult.from_dict(r) for r in json.load(f)]
+
+    @staticmethod
+    def scaling(results: list[KernelResult]) -> dict:
+        """
+        Scaling exponent of every kernel: the slope of log(time) by log(rows) between the smallest and the largest
+        measured sizes. 1 is linear scaling
+        """
+        exponents = {}
+        for kernel in dict.fromkeys(r.kernel for r in results):
+            points = sorted((r.rows, r.seconds) for r in results if r.kernel == kernel and r.seconds > 0)
+            if len(points) > 1:
+                (r0, s0), (r1, s1) = points[0], points[-1]
+                exponents[kernel] = math.log(s1 / s0) / math.log(r1 / r0)
+        return exponents
+
+    @staticmethod
+    def regressions(results: list[KernelResult], baseline: list[KernelResult], tolerance: float) -> list[tuple]:
+        """
+        Throughput regressions against the baseline results. Measurements without the baseline measurement of the same
+        kernel and size are not compared, they are reported by a warning
+        :param tolerance: allowed relative throughput drop, e.g. 0.2
+        :return: list of tuples (kernel, rows, baseline throughput, throughput) of the regressed measurements
+        :raises ValueError: no measurement has the baseline measurement
+        """
+        base = {(r.kernel, r.rows): r.throughput for r in baseline}
+        compared = [r for r in results if (r.kernel, r.rows) in base]
+        unmatched = [(r.kernel, r.rows) for r in results if (r.kernel, r.rows) not in base]
+        if unmatched:
+            logging.getLogger(KernelBenchmark.__name__).warning(
+                f'{len(unmatched)} measurements have no baseline and are not compared: {unmatched}')
+        if results and not compared:
+            raise ValueError('No measurement matches the baseline kernels and sizes')
+        return [(r.kernel, r.rows, base[(r.kernel, r.rows)], r.throughput) for r in compared
+                if r.throughput < (1 - tolerance) * base[(r.kernel, r.rows)]]
+
+    # synthetic frames
+
+    def __patients(self, rows: int, rng: np.random.Generator) -> pd.api.extensions.ExtensionArray:
+        n_patients = max(1, rows // self.rows_per_patient)
+        patients = np.char.add('p', rng.integers(0, n_patients, rows).astype(str))
+        return pd.array(patients, dtype=FrameSchema.patient_id_str_dtype)
+
+    def __dates(self, rows: int, rng: np.random.Generator) -> pd.Series:
+        return pd.Series(self.min_date + pd.to_timedelta(rng.integers(0, self.days, rows), unit='D')) \
+            .astype(FrameSchema.date_dtype)
+
+    def __level_frame(self, rows: int, rng: np.random.Generator, level_number: int, event_ids: list,
+                      codes: list) -> pd.DataFrame:
+        df = pd.DataFrame({
+            cc.patient_id: self.__patients(rows, rng),
+            cc.get_column_at_level(cc.code, level_number): rng.choice(codes, rows),
+            cc.get_column_at_level(cc.date, level_number): self.__dates(rows, rng),
+            cc.get_column_at_level(cc.event_id, level_number): rng.choice(event_ids, rows),
+        })
+        return FrameSchema.apply(df)
+
+    @staticmethod
+    def __levels() -> tuple[ExperimentLevel, ExperimentLevel]:
+        index_level = ExperimentLevel(level=0, events=[ExperimentEvent(id='dm', codes=['E11'])])
+        target_level = ExperimentLevel(level=1, period=ExperimentTimeInterval(0, 365), events=[
+            ExperimentEvent(id='htn', codes=['I10']),
+            ExperimentEvent(id='no_hf', codes=['I50.9'], negation=True),
+            ExperimentEvent(id='ckd', codes=['N18.3'], period=ExperimentTimeInterval(30, 730))])
+        return index_level, target_level
+
+    # kernel cases: kernel function and the factory of its fresh params
+
+    def __case_match_events(self, rows: int, rng: np.random.Generator) -> tuple:
+        index_level, target_level = self.__levels()
+        index_df = self.__level_frame(rows, rng, 0, ['dm'], ['E11', 'E11.9'])
+        target_df = self.__level_frame(rows, rng, 1, ['htn', 'no_hf', 'ckd'],
+                                       ['I10', CodeFormat.simple_to_negative(['I50.9']), 'N18.3'])
+        return self.__chain._FindEventsChain__match_events, \
+            lambda: (index_df, target_df, index_level, target_level)
+
+    def __case_filter_events_within_period(self, rows: int, rng: np.random.Generator) -> tuple:
+        index_level, target_level = self.__levels()
+        df = pd.concat([self.__level_frame(rows, rng, 0, ['dm'], ['E11']).drop(columns=[cc.patient_id]),
+                        self.__level_frame(rows, rng, 1, ['htn', 'no_hf', 'ckd'],
+                                           ['I10', CodeFormat.simple_to_negative(['I50.9']), 'N18.3'])], axis=1)
+        return self.__chain._FindEventsChain__filter_events_within_period, \
+            lambda: (df.copy(), index_level, target_level)
+
+    def __case_get_date_patient_map(self, rows: int, rng: np.random.Generator) -> tuple:
+        df = pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.date: self.__dates(rows, rng)})
+        return self.__chain._FindEventsChain__get_date_patient_map, \
+            lambda: (df, ExperimentTimeInterval(0, 365), None)
+
+    def __case_convert_to_base_codes(self, rows: int, rng: np.random.Generator) -> tuple:
+        df = pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.date: self.__dates(rows, rng),
+                           cc.code: rng.choice(['E11', 'E11.9', 'E11.65', 'I10', 'I50.9', 'I50.1'], rows)})
+        return self.__event_repo._BaseDbRepository__convert_to_base_codes, lambda: (df.copy(), ['E11', 'I50'])
+
+    def __case_process_negative_codes(self, rows: int, rng: np.random.Generator) -> tuple:
+        positive_df = pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.code: 'I50.9',
+                                    cc.date: self.__dates(rows, rng)})
+        return self.__event_repo._BaseDbRepository__process_negative_codes, \
+            lambda: (positive_df, self.__patients_info(rows, rng), ['I50.9'])
+
+    def __patients_info(self, rows: int, rng: np.random.Generator) -> list:
+        # windows of the patients grouped by the window dates, as the cohort requests get them
+        df = pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.date: self.__dates(rows, rng)})
+        patients = df.groupby(cc.date)[cc.patient_id].agg(list)
+        return [(d.strftime('%Y-%m-%d'), (d + timedelta(days=180)).strftime('%Y-%m-%d'), p)
+                for d, p in patients.items()]
+
+    def __case_group_patient_params(self, rows: int, rng: np.random.Generator) -> tuple:
+        df = pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.date: self.__dates(rows, rng)})
+        patients = df.groupby(cc.date)[cc.patient_id].agg(list)
+        date_patient_map = {(d, d + timedelta(days=365)): p for d, p in patients.items()}
+        return self.__event_repo._group_patient_params, lambda: (date_patient_map,)
+
+    def __attribute_case(self, rows: int, rng: np.random.Generator, exclude: bool) -> tuple:
+        attr_events = [Event(id='asthma', category=EventCategory.Diagnosis, codes=['J45']),
+                       Event(id='copd', category=EventCategory.Diagnosis, codes=['J44'])]
+        period = EventTimeInterval(-365, 0)
+        event = Event(id='dm', category=EventCategory.Diagnosis, codes=['E11'],
+                      exclusion_events=attr_events if exclude else None, exclusion_period=period if exclude else None,
+                      having_events=None if exclude else attr_events, having_period=None if exclude else period,
+                      inclusion_mode=AttributeMode.any, exclusion_mode=AttributeMode.all)
+        df = FrameSchema.apply(pd.DataFrame({cc.patient_id: self.__patients(rows, rng), cc.code: 'E11',
+                                             cc.date: self.__dates(rows, rng), cc.event_id: 'dm'}))
+        attr_df = FrameSchema.apply(pd.DataFrame({cc.patient_id: self.__patients(rows, rng),
+                                                  cc.date: self.__dates(rows, rng),
+                                                  cc.event_id: rng.choice(['asthma', 'copd'], rows)}))
+        return df, attr_df, event
+
+    def __case_filter_excluded_events(self, rows: int, rng: np.random.Generator) -> tuple:
+        df, attr_df, event = self.__attribute_case(rows, rng, exclude=True)
+        return self.__event_data._GetEventData__filter_excluded_events, lambda: (df, attr_df, event)
+
+    def __case_filter_having_events(self, rows: int, rng: np.random.Generator) -> tuple:
+        df, attr_df, event = self.__attribute_case(rows, rng, exclude=False)
+        return self.__event_data._GetEventData__filter_having_events, lambda: (df, attr_df, event)
@@ -0,0 +1,82 @@
+import logging
+import multiprocessing
+import resource
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from mashumaro.mixins.json import DataClassJSONMixin
+
+
+@dataclass
+class StageResult(DataClassJSONMixin):
+    """
+    Measurements of a benchmark stage
+    :param stage: stage name
+    :param seconds: wall time of the stage
+    :param max_rss_mb: peak resident memory of the stage process
+    :param children_max_rss_mb: peak resident memory of the largest worker process started by the stage
+    :param python_peak_mb: peak of the memory allocated by Python and numpy, if the allocations were traced
+    :param error: error message if the stage failed
+    """
+    stage: str
+    seconds: float = 0.0
+    max_rss_mb: float = 0.0
+    children_max_rss_mb: float = 0.0
+    python_peak_mb: Optional[float] = None
+    error: Optional[str] = None
+
+
+class StageProfiler:
+    """
+    Runner of the benchmark stages. Every stage runs in its own forked process, so the peak memory of the process and
+    of the worker processes it starts (the patient groups and the table imports run in process pools) belongs to the
+    stage only, and a stage does not warm the caches of the next ones.
+    """
+
+    def __init__(self, trace_python_memory: bool = False):
+        """
+        :param trace_python_memory: trace the Python and numpy allocations with tracemalloc. It gives the exact
+        allocation peak of the stage process, but slows the stage down
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.trace_python_memory = trace_python_memory
+        self.results: list[StageResult] = []
+
+    def run(self, stage: str, f, *params) -> StageResult:
+        """
+        Run the function in a separate process and measure it
+        :param stage: stage name
+        :param f: function of the stage, it is called with the params
+        :return: stage measurements. Errors of the stage are recorded, not raised
+        """
+        self.logger.info(f'Run stage {stage}')
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+            result = executor.submit(StageProfiler._measure, stage, self.trace_python_memory, f, params).result()
+        self.logger.info(f'Stage {stage}: {result.seconds:.2f} s, max RSS {result.max_rss_mb:.1f} MB'
+                         + (f', error: {result.error}' if result.error else ''))
+        self.results.append(result)
+        return result
+
+    @staticmethod
+    def _measure(stage: str, trace_python_memory: bool, f, params: tuple) -> StageResult:
+        result = StageResult(stage=stage)
+        if trace_python_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            f(*params)
+        except Exception as e:
+            result.error = f'{type(e).__name__}: {e}'
+            traceback.print_exc()
+        result.seconds = time.perf_counter() - start
+        if trace_python_memory:
+            result.python_peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        # ru_maxrss is in kilobytes on Linux
+        result.max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        result.children_max_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        return result
@@ -0,0 +1,191 @@
+import logging
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.datamodel.DataColumns import TnxMapColumns as map_cols
+from src.datamodel.DataConstant import CodeSystem
+from src.util.FileProvider import FileProvider
+
+
+@dataclass(frozen=True)
+class SyntheticEhrConfig:
+    """
+    Parameters of the synthetic TNX dataset
+    :param patients: number of patients
+    :param events_per_patient: mean number of fact records of a patient, the numbers are Poisson distributed
+    :param table_shares: shares of the fact records in the TNX files
+    :param codes_per_table: number of distinct codes of a fact table, the codes of the benchmark studies included
+    :param code_skew: exponent of the Zipf distribution of the codes. 0 means uniform distribution
+    :param icd9_share: share of the diagnoses coded with ICD-9-CM
+    :param death_rate: share of the dead patients
+    :param min_date: first date of the records
+    :param days: length of the records period in days
+    :param chunk_patients: number of patients generated at once
+    :param seed: random seed, the same config and seed give the same files
+    """
+    patients: int = 10_000
+    events_per_patient: float = 40.0
+    table_shares: dict = field(default_factory=lambda: {'diagnosis.csv': 0.4, 'lab_result.csv': 0.25,
+                                                        'medication_ingredient.csv': 0.15, 'procedure.csv': 0.1,
+                                                        'vitals_signs.csv': 0.1})
+    codes_per_table: int = 200
+    code_skew: float = 1.1
+    icd9_share: float = 0.1
+    death_rate: float = 0.1
+    min_date: str = '2010-01-01'
+    days: int = 10 * 365
+    chunk_patients: int = 50_000
+    seed: int = 1
+
+
+class SyntheticEhr:
+    """
+    Deterministic generator of TNX-shaped datasets. The files and the columns follow the TNX side of the data model
+    map, so the archive is imported by createdb as a real TNX dataset. Patients are generated by chunks and the files
+    are appended chunk by chunk, so the size of the dataset is not limited by memory.
+    Codes of the fact tables are drawn from fixed vocabularies with the Zipf distribution, and the codes used by the
+    benchmark studies are the most frequent ones.
+    """
+    # codes of the benchmark studies go first to be the most frequent
+    study_codes = {
+        'diagnosis.csv': (CodeSystem.icd10cm, ['E11.9', 'I10', 'E11.65', 'I50.9', 'N18.3', 'J45.909', 'K21.9',
+                                               'E78.5', 'I25.10', 'F32.9']),
+        'lab_result.csv': (CodeSystem.loinc, ['4548-4', '2345-7', '2160-0', '33914-3']),
+        'medication_ingredient.csv': (CodeSystem.RxNorm, ['6809', '860975', '29046', '83367']),
+        'procedure.csv': (CodeSystem.cpt, ['99213', '93000', '80053', '36415']),
+        'vitals_signs.csv': (CodeSystem.loinc, ['8480-6', '8462-4', '39156-5', '8867-4']),
+    }
+    icd9_codes = ['250.00', '401.9', '428.0', '585.3', '493.90', '530.81', '272.4', '414.01', '311']
+    routes = ['Oral', 'Intravenous', 'Subcutaneous', 'Topical']
+    encounter_types = ['AMB', 'EMER', 'IMP', 'OBSENC']
+
+    def __init__(self, config: SyntheticEhrConfig):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.config = config
+        self.__map = pd.read_csv(FileProvider().tnx_data_map_file)
+        self.__vocabularies = {f: self.__vocabulary(f) for f in self.study_codes}
+
+    def write(self, dir_path: str, archive: bool = True) -> str:
+        """
+        Generate the dataset
+        :param dir_path: directory of the TNX files
+        :param archive: if True, the files are packed to the zip archive dir_path.zip and removed
+        :return: path of the archive or the directory
+        """
+        path = Path(dir_path)
+        path.mkdir(parents=True, exist_ok=True)
+        for f in self.__map[map_cols.tnx_file].unique():
+            (path / f).unlink(missing_ok=True)
+        rng = np.random.default_rng(self.config.seed)
+        first_patient = 0
+        while first_patient < self.config.patients:
+            n = min(self.config.chunk_patients, self.config.patients - first_patient)
+            self.logger.debug(f'generate patients {first_patient}..{first_patient + n}')
+            for file_name, df in self.__generate_chunk(rng, first_patient, n).items():
+                self.__append(path / file_name, file_name, df)
+            first_patient += n
+        self.__append(path / 'standardized_terminology.csv', 'standardized_terminology.csv', self.__terminology())
+        if not archive:
+            return str(path)
+        archive_path = path.with_suffix('.zip')
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for f in sorted(path.glob('*.csv')):
+                zf.write(f, f.name)
+                f.unlink()
+        path.rmdir()
+        return str(archive_path)
+
+    def __vocabulary(self, file_name: str) -> tuple:
+        """Codes of the file with their code systems and Zipf probabilities"""
+        code_system, codes = self.study_codes[file_name]
+        prefix = {'diagnosis.csv': 'Z', 'procedure.csv': '9', 'medication_ingredient.csv': '7'}.get(file_name, '1')
+        extra = [f'{prefix}{i:02d}.{i % 10}' if file_name == 'diagnosis.csv' else f'{prefix}{i:04d}-{i % 10}'
+                 for i in range(max(0, self.config.codes_per_table - len(codes)))]
+        codes = np.array(codes + extra, dtype=object)
+        weights = 1.0 / np.arange(1, len(codes) + 1) ** self.config.code_skew
+        return code_system, codes, weights / weights.sum()
+
+    def __terminology(self) -> pd.DataFrame:
+        dfs = [pd.DataFrame({'code_system': code_system, 'code': codes, 'code_description': [f'{c} description'
+                                                                                             for c in codes]})
+               for code_system, codes, _ in self.__vocabularies.values()]
+        dfs.append(pd.DataFrame({'code_system': CodeSystem.icd9cm, 'code': self.icd9_codes,
+                                 'code_description': [f'{c} description' for c in self.icd9_codes]}))
+        return pd.concat(dfs, ignore_index=True).drop_duplicates(['code_system', 'code'])
+
+    def __generate_chunk(self, rng: np.random.Generator, first_patient: int, n: int) -> dict:
+        c = self.config
+        min_date = np.datetime64(c.min_date, 'D')
+        patient_ids = np.array([f'p{i:09d}' for i in range(first_patient, first_patient + n)], dtype=object)
+        dead = rng.random(n) < c.death_rate
+        death_dates = min_date + rng.integers(c.days // 2, c.days, n).astype('timedelta64[D]')
+        res = {'patient.csv': pd.DataFrame({
+            'patient_id': patient_ids,
+            'sex': rng.choice(['M', 'F'], n),
+            'race': rng.choice(['White', 'Black', 'Asian', 'Unknown'], n),
+            'ethnicity': rng.choice(['Hispanic', 'Not Hispanic', 'Unknown'], n),
+            'marital_status': rng.choice(['Single', 'Married', 'Unknown'], n),
+            'year_of_birth': rng.integers(1930, 2005, n),
+            'month_year_death': np.where(dead, pd.DatetimeIndex(death_dates).strftime('%Y%m'), ''),
+        })}
+
+        # encounters of a patient cover all its records
+        n_encounters = rng.poisson(max(1.0, c.events_per_patient / 5), n) + 1
+        encounter_patients = np.repeat(np.arange(n), n_encounters)
+        encounter_ids = np.array([f'e{first_patient}_{i}' for i in range(len(encounter_patients))], dtype=object)
+        start = min_date + rng.integers(0, c.days, len(encounter_patients)).astype('timedelta64[D]')
+        res['encounter.csv'] = pd.DataFrame({
+            'encounter_id': encounter_ids,
+            'patient_id': patient_ids[encounter_patients],
+            'start_date': self.__tnx_date(start),
+            'end_date': self.__tnx_date(start + rng.integers(0, 5, len(start)).astype('timedelta64[D]')),
+            'type': rng.choice(self.encounter_types, len(start)),
+        })
+        encounter_offsets = np.concatenate([[0], np.cumsum(n_encounters)[:-1]])
+
+        for file_name, share in c.table_shares.items():
+            counts = rng.poisson(c.events_per_patient * share, n)
+            patients = np.repeat(np.arange(n), counts)
+            m = len(patients)
+            encounters = encounter_offsets[patients] + (rng.random(m) * n_encounters[patients]).astype(int)
+            code_system, codes, p = self.__vocabularies[file_name]
+            code_values = codes[rng.choice(len(codes), m, p=p)]
+            code_systems = np.full(m, code_system, dtype=object)
+            if file_name == 'diagnosis.csv':
+                icd9 = rng.random(m) < c.icd9_share
+                code_values[icd9] = rng.choice(self.icd9_codes, icd9.sum())
+                code_systems[icd9] = CodeSystem.icd9cm
+            df = pd.DataFrame({'patient_id': patient_ids[patients], 'encounter_id': encounter_ids[encounters],
+                               'code_system': code_systems, 'code': code_values})
+            dates = self.__tnx_date(start[encounters])
+            if file_name == 'lab_result.csv':
+                df['date'] = dates
+                df['lab_result_num_val'] = rng.normal(7.5, 2.0, m).round(1)
+                df['lab_result_text_val'] = ''
+                df['units_of_measure'] = '%'
+            elif file_name == 'medication_ingredient.csv':
+                df['start_date'] = dates
+                df['route'] = rng.choice(self.routes, m)
+                df['brand'] = ''
+                df['strength'] = rng.choice(['5 mg', '10 mg', '500 mg'], m)
+            elif file_name == 'vitals_signs.csv':
+                df['date'] = dates
+                df['value'] = rng.normal(120, 15, m).round(0)
+                df['text_value'] = ''
+                df['units_of_measure'] = 'mm[Hg]'
+            else:
+                df['date'] = dates
+            res[file_name] = df
+        return res
+
+    @staticmethod
+    def __tnx_date(dates: np.ndarray) -> np.ndarray:
+        return pd.DatetimeIndex(dates).strftime('%Y%m%d').astype(int).to_numpy()
+
+    def __append(self, file_path: Path, file_name: str, df: pd.DataFrame):
+        columns = self.__map.loc[self.__map[map_cols.tnx_file] == file_name, map_cols.tnx_column].tolist()
+        df[columns].to_csv(file_path, mode='a', header=not file_path.exists(), index=False)
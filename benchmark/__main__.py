@@ -0,0 +1,102 @@
+import logging
+
+import click
+
+from benchmark.Benchmark import Benchmark
+from benchmark.KernelBenchmark import KernelBenchmark
+from benchmark.SyntheticEhr import SyntheticEhrConfig
+from src.api import Engine
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def cli():
+    pass
+
+
+@cli.command(name='run', context_settings=CONTEXT_SETTINGS)
+@click.option('--work_dir', default='benchmark_data', help='Directory of the generated data, study outputs and results')
+@click.option('--engine', default=Engine.parquet, type=click.Choice(sorted(Engine.values)),
+              help=f'Storage engine of the benchmark database. Default value is {Engine.parquet}')
+@click.option('--patients', default=10_000, type=int, help='Number of patients')
+@click.option('--events_per_patient', default=40.0, type=float, help='Mean number of fact records of a patient')
+@click.option('--codes_per_table', default=200, type=int, help='Number of distinct codes of a fact table')
+@click.option('--code_skew', default=1.1, type=float, help='Exponent of the Zipf distribution of the codes')
+@click.option('--seed', default=1, type=int, help='Random seed of the dataset')
+@click.option('-s', '--study', multiple=True,
+              help='Study config file. By default, all configs of the benchmark/studies directory are run')
+@click.option('--label', default=None, help='Run label. By default, the commit and the start time')
+@click.option('--skip_import', is_flag=True, help='Run the studies on the database imported by the previous run')
+@click.option('--trace_memory', is_flag=True, help='Trace the Python allocation peak of the stages (slower)')
+@click.option('--log_level', default='WARNING', help='Log level of the application. Default value is WARNING')
+def run(work_dir, engine, patients, events_per_patient, codes_per_table, code_skew, seed, study, label,
+        skip_import, trace_memory, log_level):
+    config = SyntheticEhrConfig(patients=patients, events_per_patient=events_per_patient,
+                                codes_per_table=codes_per_table, code_skew=code_skew, seed=seed)
+    benchmark = Benchmark(work_dir, engine, trace_python_memory=trace_memory)
+    # the application configures its logging on import
+    from src import Application  # noqa: F401
+    logging.getLogger().setLevel(log_level)
+    logging.getLogger('simpleLogger').setLevel(log_level)
+    result = benchmark.run(config, list(study) or None, label, skip_import)
+    click.echo(f'Run {result.label}')
+    click.echo(f'{"stage":<32}{"seconds":>10}{"max RSS MB":>12}{"workers MB":>12}')
+    for s in result.stages:
+        click.echo(f'{s.stage:<32}{s.seconds:>10.2f}{s.max_rss_mb:>12.1f}{s.children_max_rss_mb:>12.1f}'
+                   + (f'  FAILED: {s.error}' if s.error else ''))
+
+
+@cli.command(name='compare', context_settings=CONTEXT_SETTINGS)
+@click.option('--results', default=f'benchmark_data/{Benchmark.results_file}', help='Benchmark results file')
+@click.option('--base', default=None, help='Label of the base run. By default, the last but one run')
+@click.option('--head', default=None, help='Label of the compared run. By default, the last run')
+def compare(results, base, head):
+    runs = {r.label: r for r in Benchmark.read_results(results)}
+    labels = list(runs)
+    if len(labels) < 2 and (base is None or head is None):
+        raise click.UsageError('At least two runs are required')
+    base_run, head_run = runs[base or labels[-2]], runs[head or labels[-1]]
+    click.echo(f'base {base_run.label}, head {head_run.label}')
+    click.echo(f'{"stage":<32}{"base s":>10}{"head s":>10}{"ratio":>8}{"base MB":>10}{"head MB":>10}')
+    for stage, b_s, h_s, ratio, b_mb, h_mb in Benchmark.compare(base_run, head_run):
+        click.echo(f'{stage:<32}{b_s:>10.2f}{h_s:>10.2f}{ratio:>8.2f}{b_mb:>10.1f}{h_mb:>10.1f}')
+
+
+@cli.command(name='kernels', context_settings=CONTEXT_SETTINGS)
+@click.option('-k', '--kernel', multiple=True, type=click.Choice(KernelBenchmark.kernels),
+              help='Kernel to measure. By default, all kernels are measured')
+@click.option('--sizes', default=','.join(str(s) for s in KernelBenchmark.default_sizes),
+              help='Comma separated numbers of rows of the input frames')
+@click.option('--repeat', default=3, type=int, help='Number of runs of a kernel on a size, the best time is taken')
+@click.option('--time_limit', default=120.0, type=float,
+              help='Larger sizes of a kernel are skipped when a run takes longer, seconds')
+@click.option('--save', default=None, help='Save the results to the JSON file, e.g. as a baseline')
+@click.option('--baseline', default=None, help='Baseline results file. Regressions are reported with exit code 1')
+@click.option('--tolerance', default=0.2, type=float, help='Allowed relative throughput drop against the baseline')
+def kernels(kernel, sizes, repeat, time_limit, save, baseline, tolerance):
+    benchmark = KernelBenchmark([int(s) for s in sizes.split(',')], repeat, time_limit)
+    results = benchmark.run(list(kernel) or None)
+    exponents = KernelBenchmark.scaling(results)
+    click.echo(f'{"kernel":<32}{"rows":>10}{"seconds":>10}{"rows/s":>14}')
+    for r in results:
+        click.echo(f'{r.kernel:<32}{r.rows:>10}{r.seconds:>10.4f}{r.throughput:>14,.0f}')
+    click.echo(f'{"kernel":<32}{"scaling exponent":>18}')
+    for k, exponent in exponents.items():
+        click.echo(f'{k:<32}{exponent:>18.2f}')
+    if save is not None:
+        KernelBenchmark.save(results, save)
+    if baseline is None:
+        return
+    try:
+        regressions = KernelBenchmark.regressions(results, KernelBenchmark.read(baseline), tolerance)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for k, rows, base_throughput, throughput in regressions:
+        click.echo(f'REGRESSION {k} rows={rows}: {throughput:,.0f} rows/s, baseline {base_throughput:,.0f} rows/s')
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,107 +1,216 @@
 import logging.config
 import shutil
+from typing import Optional
 
+from src.api import Engine
 from src.config.AppConfig import AppConfig
+from src.datamodel.DataColumns import CommonColumns as cc
 from src.datamodel.ExperimentConfig import ExperimentConfig
-from src.db.DatabaseManager import DatabaseManager
-from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
-from src.repository.EventRepository import EventRepository
-from src.repository.PatientRepository import PatientRepository
-from src.usecase import ImportDataToDB
-from src.usecase.BuildEventsMetadata import BuildEventsMetadata
-from src.usecase.ConvertDataModel import ConvertDataModel
-from src.usecase.CreateSqlTablesStructure import CreateSqlTablesStructure
-from src.usecase.DownloadTnxDataset import DownloadTnxDataset
-from src.usecase.FindEventsChain import FindEventsChain
-from src.usecase.FindPatients import FindPatients
-from src.usecase.ParseDataDictionary import ParseDataDictionary
-from src.usecase.StudyConfigReader import StudyConfigReader
-from src.util.ConcurrentUtil import ConcurrentUtil
 from src.util.FileProvider import FileProvider
 
+# the command functions import their use cases and database drivers when they are called, so the light commands
+# and the worker processes do not load the dependencies of the other commands
+
 fp = FileProvider()
 logging.config.fileConfig(fp.log_config_file)
 logger = logging.getLogger('Main')
 
 
-def create_db(db_name: str, url: str, archive: str, local_access: bool, new_db: bool, set_index: bool, drop_csv: bool):
+def create_db(db_name: str, url: str, archive: str, local_access: bool, new_db: bool, set_index: bool, drop_csv: bool,
+              surrogate_keys: bool = True, engine: str = Engine.mariadb):
+    from src.repository.CodeDescriptionCache import CodeDescriptionCache
+    from src.usecase import ImportDataToLocalStore
+    from src.usecase.ConvertDataModel import ConvertDataModel
+    from src.usecase.CreateSqlTablesStructure import CreateSqlTablesStructure
+    from src.usecase.ParseDataDictionary import ParseDataDictionary
+
     logger.debug('======Start======')
     if (url is not None) and (not download_dataset(url, archive)):
         return
     data_path = ConvertDataModel().execute(archive, 'tnx')
     tables_data = ParseDataDictionary().execute(data_path)
 
-    app_config = init_app_config()
+    app_config = init_app_config(required=engine != Engine.parquet)
+    if engine == Engine.parquet:
+        code_map_table = CreateSqlTablesStructure.code_map_table(fp.code_map_table_file)
+        ImportDataToLocalStore.execute(get_local_store_path(app_config), db_name, tables_data, archive, new_db,
+                                       code_map_table)
+    else:
+        import_to_mariadb(app_config, db_name, tables_data, archive, local_access, new_db, set_index, surrogate_keys)
+    # cached code descriptions of the database can be outdated after the import
+    CodeDescriptionCache.clear(db_name)
+    # remove temp data files
+    if drop_csv:
+        logger.debug(f'Delete data model csv files {data_path}')
+        shutil.rmtree(data_path)
+    logger.debug('======Finish======')
+
+
+def import_to_mariadb(app_config: AppConfig, db_name: str, tables_data: list, archive: str, local_access: bool,
+                      new_db: bool, set_index: bool, surrogate_keys: bool):
+    from src.datamodel.DataColumns import CommonTables as ct
+    from src.db.DatabaseManager import DatabaseManager
+    from src.db.SqlDataElement import default_surrogate_keys
+    from src.usecase import ImportDataToDB
+    from src.usecase.CreateSqlTablesStructure import CreateSqlTablesStructure
+
     db_manager = DatabaseManager(app_config, db_name=db_name, local_access=local_access)
 
     # crete MySQL DB
     code_map_table = None
     if new_db:
         table_creator = CreateSqlTablesStructure(db_manager)
-        tables_data = table_creator.execute(db_name, tables_data)
+        tables_data = table_creator.execute(db_name, tables_data, surrogate_keys)
         code_map_table = table_creator.create_code_map_table(db_name, fp.code_map_table_file)
+    else:
+        # appended data should follow the ids format of the existing database
+        db_manager.open_ssh_tunnel()
+        if db_manager.has_table(ct.patient_key):
+            tables_data = [t.apply_surrogate_keys(default_surrogate_keys) for t in tables_data]
+        db_manager.close_ssh_tunnel()
 
     # upload data to the DB
     if code_map_table is not None:
         ImportDataToDB.import_code_mapping_data(db_manager, code_map_table)
     ImportDataToDB.execute(app_config, local_access, db_name, tables_data, archive, set_index)
-    # remove temp data files
-    if drop_csv:
-        logger.debug(f'Delete data model csv files {data_path}')
-        shutil.rmtree(data_path)
-    logger.debug('======Finish======')
 
 
-def run_study(db_name: str, out_dir: str, study_list: list, local_db: bool = True):
+def run_study(db_name: str, out_dir: str, study_list: list, local_db: bool = True, engine: str = Engine.mariadb,
+              attribute_pushdown: bool = False, memory_budget: Optional[int] = None, chains_output: bool = False,
+              query_log: Optional[str] = None):
+    from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
+    from src.repository.EventRepository import EventRepository
+    from src.repository.PatientAttributeCache import PatientAttributeCache
+    from src.repository.PatientRepository import PatientRepository
+    from src.usecase.BuildChainsManifest import BuildChainsManifest
+    from src.usecase.BuildEventsMetadata import BuildEventsMetadata
+    from src.usecase.BuildTransitionStats import BuildTransitionStats
+    from src.usecase.FindPatients import FindPatients
+    from src.usecase.StudyConfigReader import StudyConfigReader
+    from src.util.ConcurrentUtil import ConcurrentUtil
+
     logger.debug('======Run Study Data Selection======')
-    logger.debug(f'DB: {db_name}, out dir: {out_dir}, study list: {study_list}')
-    app_config = init_app_config()
-    db_manager = DatabaseManager(app_config)
-    dbs = db_manager.list_databases()
-    if db_name not in dbs:
-        logger.error(f'Database {db_name} not found in the config.\n'
-                     f'Available databases: {dbs}')
-        return
-    db_manager.database_name = db_name
-    db_manager.local_access = local_db
-    # db_manager = DatabaseManager(app_config, db_name=db_name, local_access=local_db)
+    logger.debug(f'DB: {db_name}, out dir: {out_dir}, study list: {study_list}, engine: {engine}, '
+                 f'attribute pushdown: {attribute_pushdown}, memory budget: {memory_budget} MB, '
+                 f'chains output: {chains_output}, query log: {query_log}')
+    app_config = init_app_config(required=engine != Engine.parquet)
+    with create_db_manager(app_config, engine, query_log=query_log) as db_manager:
+        dbs = db_manager.list_databases()
+        if db_name not in dbs:
+            logger.error(f'Database {db_name} not found in the config.\n'
+                         f'Available databases: {dbs}')
+            return
+        db_manager.database_name = db_name
+        db_manager.local_access = local_db
+        # db_manager = DatabaseManager(app_config, db_name=db_name, local_access=local_db)
 
-    fp.set_result_path(out_dir)
-    event_repo = EventRepository(db_manager)
-    patient_repo = PatientRepository(db_manager)
-    cd_repo = CodeDescriptionRepository(db_manager)
-    include_icd9 = True  # todo: make this flag an event parameter
+        fp.set_result_path(out_dir)
+        event_repo = EventRepository(db_manager, attribute_pushdown)
+        patient_repo = PatientRepository(db_manager)
+        cd_repo = CodeDescriptionRepository(db_manager)
+        include_icd9 = True  # todo: make this flag an event parameter
 
-    for config_file_name in study_list:
-        logger.debug(f'RUN CONFIG {config_file_name}')
-        study_config = StudyConfigReader().read(config_file_name)
-        create_study_outcome_file_structure(study_config)
+        for config_file_name in study_list:
+            logger.debug(f'RUN CONFIG {config_file_name}')
+            study_config = StudyConfigReader().read(config_file_name)
+            create_study_outcome_file_structure(study_config, chains_output)
 
-        patient_groups = FindPatients(patient_repo, event_repo).execute(study_config, include_icd9)
-        if not patient_groups:
-            logger.warning(f'No patients found for study {study_config.name}')
-            continue
+            try:
+                patient_groups = FindPatients(patient_repo, event_repo).execute(study_config, include_icd9)
+                if not patient_groups:
+                    logger.warning(f'No patients found for study {study_config.name}')
+                    continue
 
-        BuildEventsMetadata(cd_repo).execute(study_config)
+                BuildEventsMetadata(cd_repo).execute(study_config)
 
-        params = [(app_config, pg, study_config, db_name, include_icd9, local_db) for pg in enumerate(patient_groups)]
-        ConcurrentUtil.run_in_separate_processes(find_event_chain_async, params)
+                params = [(app_config, pg, study_config, db_name, include_icd9, local_db, engine, attribute_pushdown,
+                           memory_budget * 1024 * 1024 if memory_budget else None, chains_output, query_log)
+                          for pg in enumerate(patient_groups)]
+                ConcurrentUtil.run_in_separate_processes(find_event_chain_async, params)
+            finally:
+                # patients of the next study are other ones
+                PatientAttributeCache.clear(PatientAttributeCache.key(db_manager))
+            BuildTransitionStats().execute(study_config)
+            if chains_output:
+                BuildChainsManifest().execute(study_config)
 
-        logger.debug(f'FINISH {config_file_name}')
+            logger.debug(f'FINISH {config_file_name}')
 
     logger.debug('======Finish Study Data Selection======')
 
 
-def validate_study(study_list: list):
+def validate_study(study_list: list, db_name: Optional[str] = None, local_db: bool = True,
+                   engine: str = Engine.mariadb, out_file: Optional[str] = None):
+    """
+    Validate the study configs. If the database is set, the event codes of all valid configs are checked against it
+    together, the unknown codes and the estimated patients of the levels are reported for every config
+    :param out_file: CSV file to save the codes report to
+    """
+    from src.usecase.StudyConfigReader import StudyConfigReader
+
     logger.debug('======Run Study Validation======')
+    valid_configs = []
     for config_file_name in study_list:
         logger.debug(f'Validate config {config_file_name}')
         if StudyConfigReader().validate(config_file_name):
             logger.info(f'Config {config_file_name} is correct')
+            valid_configs.append(config_file_name)
+    if db_name is not None and valid_configs:
+        validate_study_codes(valid_configs, db_name, local_db, engine, out_file)
 
     logger.debug('======Study Validation is Finished======')
 
+
+def validate_study_codes(study_list: list, db_name: str, local_db: bool = True, engine: str = Engine.mariadb,
+                         out_file: Optional[str] = None):
+    from src.repository.CodeCatalogRepository import CodeCatalogRepository
+    from src.usecase.StudyConfigReader import StudyConfigReader
+    from src.usecase.ValidateStudyCodes import ValidateStudyCodes
+
+    logger.debug(f'Validate codes of {len(study_list)} configs in DB {db_name}')
+    app_config = init_app_config(required=engine != Engine.parquet)
+    study_configs = [StudyConfigReader().read(f) for f in study_list]
+    config_files = {c.name: f for c, f in zip(study_configs, study_list)}
+    include_icd9 = True  # the same as run_study
+    with create_db_manager(app_config, engine, db_name=db_name, local_access=local_db) as db_manager:
+        catalog_repo = CodeCatalogRepository(db_manager)
+        validator = ValidateStudyCodes(catalog_repo)
+        report_df = validator.execute(study_configs, include_icd9)
+        total_patients = catalog_repo.get_patients_count()
+    if report_df is None:
+        logger.error(f'Failed to check the codes in DB {db_name}')
+        return
+    for _, row in validator.summarize(report_df, total_patients).iterrows():
+        config_file_name = config_files[row[validator.study]]
+        if row[validator.unknown_codes]:
+            logger.error(f'Config {config_file_name} level {row[cc.level]}: '
+                         f'unknown codes {row[validator.unknown_codes]}')
+        logger.info(f'Config {config_file_name} level {row[cc.level]}: estimated patients '
+                    f'{row[validator.min_patients]} - {row[validator.max_patients]}')
+    if out_file is not None:
+        report_df.to_csv(out_file, index=False)
+
+
+def replay_queries(db_name: str, query_log: str, concurrency: int = 8, repeat: int = 1, local_db: bool = True,
+                   engine: str = Engine.mariadb, out_file: Optional[str] = None):
+    from src.usecase.ReplayQueries import ReplayQueries
+
+    logger.debug('======Replay Queries======')
+    logger.debug(f'DB: {db_name}, query log: {query_log}, concurrency: {concurrency}, repeat: {repeat}, '
+                 f'engine: {engine}')
+    app_config = init_app_config()
+    with create_db_manager(app_config, engine, db_name=db_name, local_access=local_db) as db_manager:
+        summary_df = ReplayQueries(db_manager).execute(query_log, concurrency, repeat)
+    if summary_df is not None:
+        print(summary_df.to_string(max_colwidth=60))
+        if out_file is not None:
+            summary_df.to_csv(out_file, index=False)
+    logger.debug('======Finish Replay Queries======')
+
+
 def download_dataset(url: str, archive: str):
+    from src.usecase.DownloadTnxDataset import DownloadTnxDataset
+
     logger.debug(f'Download dataset {url} to {archive}')
     if url is None or archive is None:
         logger.error(f'Download error: url or archive is not defined.')
@@ -114,18 +223,54 @@ def download_dataset(url: str, archive: str):
     return True
 
 
-def init_app_config():
+def init_app_config(required: bool = True) -> Optional[AppConfig]:
+    """
+    Read the application config
+    :param required: if False and the config file does not exist, None is returned
+    """
     logger.debug('Init app config')
+    if not required and not fp.app_config_file.exists():
+        logger.debug(f'App config {fp.app_config_file} is not found')
+        return None
     with open(fp.app_config_file) as f:
         lines = f.readlines()
     data = ''.join(lines)
     return AppConfig.from_json(data)
 
 
-def create_study_outcome_file_structure(study_config: ExperimentConfig):
+def get_local_store_path(app_config: Optional[AppConfig]) -> str:
+    if app_config is not None and app_config.local_store_path:
+        return app_config.local_store_path
+    return str(fp.local_store_path)
+
+
+def create_db_manager(app_config: Optional[AppConfig], engine: str, db_name: Optional[str] = None,
+                      local_access: bool = True, query_log: Optional[str] = None):
+    """
+    Create data manager of the storage engine. All managers have the same requests interface, and they are context
+    managers closing their connections on exit
+    :param query_log: directory to capture the database queries to. Not supported by the parquet engine
+    """
+    if engine == Engine.parquet:
+        from src.db.LocalStoreManager import LocalStoreManager
+        return LocalStoreManager(get_local_store_path(app_config), db_name=db_name)
+    if engine == Engine.mariadb_async:
+        from src.db.AsyncDatabaseManager import AsyncDatabaseManager
+        return AsyncDatabaseManager(app_config, db_name=db_name, local_access=local_access, query_log=query_log)
+    from src.db.DatabaseManager import DatabaseManager
+    return DatabaseManager(app_config, db_name=db_name, local_access=local_access, query_log=query_log)
+
+
+def create_study_outcome_file_structure(study_config: ExperimentConfig, chains_output: bool = False):
     logger.debug('Create Outcome File Structure')
     study_res_full_path = fp.get_result_file_path(study_config.outcome_dir)
     study_res_full_path.mkdir(parents=True, exist_ok=True)
+    # partial transition statistics of the previous run
+    stats_dir, _ = fp.get_transition_stats_group_location(study_config.outcome_dir, 0)
+    shutil.rmtree(stats_dir.parent, ignore_errors=True)
+    if chains_output:
+        fp.get_chains_path(outcome_dir=study_config.outcome_dir).mkdir(parents=True, exist_ok=True)
+        return
     for i in range(len(study_config.levels)):
         e_path = fp.get_events_path(outcome_dir=study_config.outcome_dir, level_number=i)
         e_path.mkdir(parents=True, exist_ok=True)
@@ -136,14 +281,22 @@ def create_study_outcome_file_structure(study_config: ExperimentConfig):
 
 
 def find_event_chain_async(app_config: AppConfig, patient_group: tuple, experiment_config: ExperimentConfig,
-                           db_name: str, include_icd9: bool, local_db: bool):
-    db_manager = DatabaseManager(app_config, db_name=db_name, local_access=local_db)
-    event_repo = EventRepository(db_manager)
-    patients_repo = PatientRepository(db_manager)
-    cd_repo = CodeDescriptionRepository(db_manager)
-
-    FindEventsChain(patients_repo, event_repo, cd_repo).execute(
-        patient_group=patient_group,
-        experiment_config=experiment_config,
-        include_icd9=include_icd9
-    )
+                           db_name: str, include_icd9: bool, local_db: bool, engine: str = Engine.mariadb,
+                           attribute_pushdown: bool = False, memory_budget: Optional[int] = None,
+                           chains_output: bool = False, query_log: Optional[str] = None):
+    from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
+    from src.repository.EventRepository import EventRepository
+    from src.repository.PatientRepository import PatientRepository
+    from src.usecase.FindEventsChain import FindEventsChain
+
+    with create_db_manager(app_config, engine, db_name=db_name, local_access=local_db,
+                           query_log=query_log) as db_manager:
+        event_repo = EventRepository(db_manager, attribute_pushdown)
+        patients_repo = PatientRepository(db_manager)
+        cd_repo = CodeDescriptionRepository(db_manager)
+
+        FindEventsChain(patients_repo, event_repo, cd_repo, memory_budget, chains_output).execute(
+            patient_group=patient_group,
+            experiment_config=experiment_config,
+            include_icd9=include_icd9
+        )
@@ -3,6 +3,15 @@ class Command:
     append_data = 'append'
     run_study = "run_study"
     validate_study = "validate_study"
+    replay_queries = 'replay'
+
+
+class Engine:
+    mariadb = 'mariadb'
+    mariadb_async = 'mariadb-async'
+    parquet = 'parquet'
+
+    values = {mariadb, mariadb_async, parquet}
 
 
 class Option:
@@ -13,6 +22,14 @@ class Option:
     local_access = 'la'
     set_index = 'set_index'
     drop_csv = 'drop_csv'
+    surrogate_keys = 'surrogate_keys'
+    engine = 'engine'
+    attribute_pushdown = 'attribute_pushdown'
+    memory_budget = 'memory_budget'
+    chains_output = 'chains_output'
+    query_log = 'query_log'
+    concurrency = 'concurrency'
+    repeat = 'repeat'
     out_dir = 'out'
 
     format_values = {'TNX'}  # OMOP, MIMICIV
@@ -27,10 +44,22 @@ def validate(command: str, **kwargs) -> bool:
         return validate_run_study(**kwargs)
     if command == Command.validate_study:
         return validate_validate_study(**kwargs)
+    if command == Command.replay_queries:
+        return validate_replay_queries(**kwargs)
     return False
 
 
+def validate_engine(**kwargs) -> bool:
+    if kwargs[Option.engine] not in Engine.values:
+        raise ValueError(
+            f'Value Error: Invalid {Option.engine} value: "{kwargs[Option.engine]}". '
+            f'Possible values: {sorted(Engine.values)}'
+        )
+    return True
+
+
 def validate_data_import(**kwargs) -> bool:
+    validate_engine(**kwargs)
     valid_url = kwargs[Option.url] is not None and len(kwargs[Option.url].strip()) > 0
     valid_archive = kwargs[Option.archive] is not None and len(kwargs[Option.archive].strip()) > 0
     if kwargs[Option.database] is not None and kwargs[Option.database].strip() == "":
@@ -53,6 +82,7 @@ def validate_data_import(**kwargs) -> bool:
 
 
 def validate_run_study(**kwargs) -> bool:
+    validate_engine(**kwargs)
     if kwargs[Option.database].strip() == "":
         raise ValueError(
             f'Value Error: Invalid {Option.database} value: "{kwargs[Option.database]}"'
@@ -61,6 +91,10 @@ def validate_run_study(**kwargs) -> bool:
         raise ValueError(
             f'Value Error: AT least one study should be set'
         )
+    if kwargs[Option.query_log] is not None and kwargs[Option.engine] == Engine.parquet:
+        raise ValueError(
+            f'Value Error: {Option.query_log} is not supported by the {Engine.parquet} engine'
+        )
     if len(kwargs[Option.out_dir]) == 0:
         raise ValueError(
             f'Value Error: Invalid {Option.out_dir} value: "{kwargs[Option.out_dir]}"'
@@ -73,6 +107,8 @@ def validate_run_study(**kwargs) -> bool:
 
 
 def validate_validate_study(**kwargs) -> bool:
+    if kwargs[Option.database] is not None:
+        validate_engine(**kwargs)
     if len(kwargs[Option.study]) == 0:
         raise ValueError(
             f'Value Error: AT least one study should be set'
@@ -82,3 +118,24 @@ def validate_validate_study(**kwargs) -> bool:
             f'Value Error: Invalid {Option.study} value. All study files should have JSON format'
         )
     return True
+
+
+def validate_replay_queries(**kwargs) -> bool:
+    validate_engine(**kwargs)
+    if kwargs[Option.engine] == Engine.parquet:
+        raise ValueError(
+            f'Value Error: queries can not be replayed by the {Engine.parquet} engine'
+        )
+    if kwargs[Option.database] is None or kwargs[Option.database].strip() == "":
+        raise ValueError(
+            f'Value Error: Invalid {Option.database} value: "{kwargs[Option.database]}"'
+        )
+    if kwargs[Option.query_log] is None or kwargs[Option.query_log].strip() == "":
+        raise ValueError(
+            f'Value Error: Invalid {Option.query_log} value: "{kwargs[Option.query_log]}"'
+        )
+    if kwargs[Option.concurrency] < 1 or kwargs[Option.repeat] < 1:
+        raise ValueError(
+            f'Value Error: {Option.concurrency} and {Option.repeat} should be positive'
+        )
+    return True
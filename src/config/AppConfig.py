@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+from typing import Optional
+
 from mashumaro.mixins.json import DataClassJSONMixin
 
 
@@ -11,3 +13,5 @@ class AppConfig(DataClassJSONMixin):
     mysql_password: str
     localhost: str
     localport: int
+    # root directory of the local parquet store. Default is the store directory of the project
+    local_store_path: Optional[str] = None
@@ -0,0 +1,29 @@
+from dataclasses import dataclass, field
+
+from mashumaro.mixins.json import DataClassJSONMixin
+
+
+@dataclass(frozen=True)
+class ChainsLevel(DataClassJSONMixin):
+    level: int
+    name: str = None
+    event_ids: list[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class ChainsGroupFile(DataClassJSONMixin):
+    group: int
+    path: str
+    records: int
+    patients: int
+
+
+@dataclass
+class ChainsManifest(DataClassJSONMixin):
+    """Description of the chains output of a study: levels, columns with their Arrow types and group files"""
+    study: str = None
+    levels: list[ChainsLevel] = field(default_factory=list)
+    columns: dict[str, str] = field(default_factory=dict)
+    files: list[ChainsGroupFile] = field(default_factory=list)
+    records: int = 0
+    patients: int = 0
@@ -16,8 +16,16 @@ class DataDictionaryColumns:
     primary_key = "Primary Key"
     foreign_key = "Foreign Key"
     index = "Index"
+    partition = "Partition"
 
     fk_separator = "|"
+    # Index column can contain "Yes" and composite index items "index_name:position" separated by ";"
+    index_separator = ";"
+    index_position_separator = ":"
+    # Partition column contains "RANGE:first_year:last_year" or "KEY:partitions_number" for the partitioning column
+    partition_separator = ":"
+    partition_range = "RANGE"
+    partition_key = "KEY"
 
     val_yes = 'Yes'
     val_no = 'No'
@@ -45,6 +53,8 @@ class CommonColumns:
     date_of_birth = "date_of_birth"
     date_of_death = "date_of_death"
     code_description = "code_description"
+    # surrogate key tables
+    surrogate_id = "surrogate_id"
     # ICD map
     icd9_code = 'icd9_code'
     icd10_code = 'icd10_code'
@@ -55,6 +65,11 @@ class CommonColumns:
     category = 'category'
     level = 'level'
     time_interval = "t"
+    # code statistics
+    subcodes = 'subcodes'
+    records = 'records'
+    patients = 'patients'
+    table_name = 'table_name'
 
     date_columns = ["date", "start_date", "end_date", "date_of_birth", "date_of_death"]
 
@@ -73,3 +88,6 @@ class CommonTables:
     vital_sign = "vital_sign"
     code_description = "code_description"
     icd9_map_icd10 = "icd9_map_icd10"
+    code_catalog = "code_catalog"
+    patient_key = "patient_key"
+    encounter_key = "encounter_key"
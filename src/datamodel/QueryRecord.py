@@ -0,0 +1,37 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from mashumaro.mixins.json import DataClassJSONMixin
+
+
+@dataclass
+class QueryRecord(DataClassJSONMixin):
+    """
+    Captured database query
+    :param start: start time, unix seconds
+    :param fingerprint: hash of the normalized template, the same for the queries of the same shape
+    :param template: SQL template with %s placeholders
+    :param params: values bound to the placeholders
+    :param sql_bytes: size of the template and the bound values
+    :param params_count: number of the bound values
+    :param latency_ms: execution and fetch time
+    :param rows: number of the result rows
+    :param result_bytes: memory size of the result
+    :param stage: calling stage of the study: study, group, level, event_id, cohort
+    :param pid: process id
+    :param thread: thread name
+    :param error: error of the failed query
+    """
+    start: float
+    fingerprint: str
+    template: str
+    params: list = field(default_factory=list)
+    sql_bytes: int = 0
+    params_count: int = 0
+    latency_ms: float = 0.0
+    rows: int = 0
+    result_bytes: int = 0
+    stage: dict = field(default_factory=dict)
+    pid: int = 0
+    thread: str = None
+    error: Optional[str] = None
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from typing import Optional
+
+import pandas as pd
+
+from src.config.AppConfig import AppConfig
+from src.db.DatabaseManager import DatabaseManager
+from src.db.SqlDataElement import SqlQuery
+from src.util.ConcurrentUtil import ConcurrentUtil
+
+
+class AsyncDatabaseManager(DatabaseManager):
+    """
+    Database manager with asyncio data requests over a bounded connection pool of the aiomysql driver.
+    The manager has an event loop running in its own thread, and the loop does the I/O of the requests only: the
+    queries are sent and the result rows are fetched by batches on the loop. The calling threads wait for their rows
+    and decode them to dataframes, so the CPU work of the requests runs in the threads of map_requests.
+    The connections are reused by the requests, and the pool size bounds the number of open connections.
+    Database creation and data import use the blocking connections of DatabaseManager.
+    The manager should be closed after use.
+    """
+
+    def __init__(self, app_config: AppConfig, db_name: Optional[str] = None, local_access=True,
+                 query_log: Optional[str] = None, pool_size: int = 16, fetch_size: int = 10_000):
+        """
+        :param query_log: directory to capture the data requests to. Requests are not captured if None
+        :param pool_size: max number of open connections and of concurrent requests of map_requests
+        :param fetch_size: number of rows fetched from the server at once
+        """
+        super().__init__(app_config, db_name=db_name, local_access=local_access, query_log=query_log)
+        try:
+            import aiomysql
+        except ImportError as e:
+            raise ImportError('Async database access requires the aiomysql package: pip install aiomysql') from e
+        self.__aiomysql = aiomysql
+        self.pool_size = pool_size
+        self.fetch_size = fetch_size
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__loop_thread: Optional[threading.Thread] = None
+        self.__loop_lock = threading.Lock()
+        self.__pool = None
+        self.__pool_params = None
+        self.__pool_lock: Optional[asyncio.Lock] = None
+
+    def map_requests(self, f, params_list: list, ordered: bool = False) -> list:
+        """
+        Run data requests concurrently, see DatabaseManager.map_requests.
+        A thread per pool connection runs the function calls, the threads wait for the I/O of the manager loop
+        """
+        params_list = [(f, p, i) for i, p in enumerate(params_list)]
+        return ConcurrentUtil.do_async_job(self._call_in_cohort, params_list, max_workers=self.pool_size,
+                                           ordered=ordered)
+
+    def close(self):
+        """Close the connection pool and stop the event loop"""
+        with self.__loop_lock:
+            loop, self.__loop = self.__loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.__close_pool(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            self.__loop_thread.join()
+            loop.close()
+            # the lock is bound to the closed loop
+            self.__pool_lock = None
+
+    def _read_sql(self, sql_query: SqlQuery, parse_dates: Optional[list] = None) -> pd.DataFrame:
+        columns, batches = self.__run(self.__fetch(sql_query))
+        return self.__decode(columns, batches, parse_dates)
+
+    def _fetch_rows(self, sql_query: SqlQuery) -> tuple:
+        columns, batches = self.__run(self.__fetch(sql_query))
+        return tuple(r for batch in batches for r in batch)
+
+    def __run(self, coroutine):
+        """Run the coroutine on the manager loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__get_loop()).result()
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.__loop_lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__loop_thread = threading.Thread(target=self.__loop.run_forever, daemon=True,
+                                                      name=f'{type(self).__name__}Loop')
+                self.__loop_thread.start()
+            return self.__loop
+
+    async def __get_pool(self):
+        if self.__pool_lock is None:
+            self.__pool_lock = asyncio.Lock()
+        async with self.__pool_lock:
+            # the pool is recreated if the server port is changed by a new SSH tunnel
+            params = self._connection_params()
+            if self.__pool is None or self.__pool_params != params:
+                await self.__close_pool()
+                self.logger.debug(f'Create connection pool of {self.pool_size} connections')
+                self.__pool = await self.__aiomysql.create_pool(minsize=1, maxsize=self.pool_size, autocommit=True,
+                                                                **params)
+                self.__pool_params = params
+        return self.__pool
+
+    async def __close_pool(self):
+        if self.__pool is not None:
+            self.__pool.close()
+            await self.__pool.wait_closed()
+            self.__pool = None
+
+    async def __fetch(self, sql_query: SqlQuery) -> tuple[list, list]:
+        pool = await self.__get_pool()
+        async with pool.acquire() as conn:
+            # unbuffered cursor streams the rows by batches instead of reading the whole result at once
+            async with conn.cursor(self.__aiomysql.SSCursor) as cursor:
+                await cursor.execute(sql_query.template, sql_query.params)
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                batches = []
+                while True:
+                    rows = await cursor.fetchmany(self.fetch_size)
+                    if not rows:
+                        break
+                    batches.append(rows)
+        return columns, batches
+
+    @staticmethod
+    def __decode(columns: list, batches: list, parse_dates: Optional[list]) -> pd.DataFrame:
+        df = pd.DataFrame.from_records([r for batch in batches for r in batch], columns=columns,
+                                       coerce_float=True)
+        for c in parse_dates or []:
+            if c in df.columns:
+                df[c] = pd.to_datetime(df[c])
+        return df
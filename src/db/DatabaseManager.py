@@ -10,19 +10,30 @@ from sshtunnel import SSHTunnelForwarder
 
 import src.db.QueryBuilder as QB
 from src.config.AppConfig import AppConfig
-from src.db.SqlDataElement import SqlTable
+from src.db.QueryProfiler import QueryProfiler
+from src.db.SqlDataElement import AttributeFilter, CodeSet, SqlQuery, SqlTable, SurrogateKey
 from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.ConcurrentUtil import ConcurrentUtil
 
 
 class DatabaseManager:
+    # having and exclusion attribute events can be checked by the database in the codes request
+    supports_attribute_pushdown = True
+    # windows without the negation event codes can be requested from the database
+    supports_absence_request = True
 
-    def __init__(self, app_config: AppConfig, db_name: Optional[str] = None, local_access=True):
+    def __init__(self, app_config: AppConfig, db_name: Optional[str] = None, local_access=True,
+                 query_log: Optional[str] = None):
+        """
+        :param query_log: directory to capture the data requests to. Requests are not captured if None
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.database_name = db_name
         self.__app_config = app_config
         self.__sql_engine = None
         self.__local_access = local_access
         self.tunnel: Optional[SSHTunnelForwarder] = None
+        self.query_profiler = QueryProfiler(query_log) if query_log is not None else None
 
     def __create_sql_engine(self):
         self.logger.debug('Create SQL engine')
@@ -63,18 +74,31 @@ class DatabaseManager:
             self.tunnel.stop()
         self.__sql_engine = None
 
+    def close(self):
+        # connections are opened by every request, there is nothing to release
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _connection_params(self) -> dict:
+        """Connection parameters of the database server"""
+        return dict(
+            host=self.__app_config.localhost,
+            user=self.__app_config.mysql_username,
+            password=self.__app_config.mysql_password,
+            db=self.database_name,
+            port=self.__app_config.localport if self.__local_access else self.tunnel.local_bind_port
+        )
+
     def connect_to_db(self, local_infile: bool = False) -> Connection:
         self.logger.debug(f'Connect to DB {self.database_name}')
 
         try:
-            conn = pymysql.connect(
-                host=self.__app_config.localhost,
-                user=self.__app_config.mysql_username,
-                passwd=self.__app_config.mysql_password,
-                db=self.database_name,
-                port=self.__app_config.localport if self.__local_access else self.tunnel.local_bind_port,
-                local_infile=local_infile
-            )
+            conn = pymysql.connect(**self._connection_params(), local_infile=local_infile)
         except pymysql.Error as e:
             self.logger.debug(f"Error connecting to MariaDB Platform: {e}")
             sys.exit(1)
@@ -96,7 +120,9 @@ class DatabaseManager:
         conn = self.connect_to_db()
         query = QB.create_table(table.name, table.column_names(), table.column_types(),
                                 primary_keys=table.primary_keys(),
-                                foreign_keys=table.foreign_keys())
+                                foreign_keys=table.foreign_keys(),
+                                partition=table.partition,
+                                not_null=table.not_null_columns())
         res = self.__exec_query(conn, query)
         if res is None or len(res) == 0:
             self.logger.debug(f'Table {table.name} was created')
@@ -115,9 +141,7 @@ class DatabaseManager:
 
     def create_indexes(self, table: SqlTable):
         self.logger.debug(f'Add indexes into table {table.name}')
-        indexes_dict = {f'idx_{i}': i for i in table.indexes()
-                        # MariaDB creates indexes for PK and FK automatically
-                        if i not in table.primary_keys() and i not in table.foreign_key_names()}
+        indexes_dict = {i.name: list(i.columns) for i in table.index_definitions()}
         if len(indexes_dict) == 0:
             self.logger.debug('No indexes to add')
             return
@@ -129,55 +153,137 @@ class DatabaseManager:
             self.logger.debug(f'Indexes for table {table.name} were created')
         conn.close()
 
-    def upload_file_to_sql(self, file_name: str, table_name: str):
-        self.logger.debug(f'Upload data from file {file_name} into table {table_name}')
-        query = QB.upload_table_from_file(self.database_name, table_name, file_name)
+    def create_surrogate_key_table(self, key: SurrogateKey, natural_type: str):
+        self.logger.debug(f'Create surrogate key table {key.table_name}')
+        conn = self.connect_to_db()
+        query = QB.create_surrogate_key_table(key, natural_type)
+        res = self.__exec_query(conn, query)
+        if res is None or len(res) == 0:
+            self.logger.debug(f'Table {key.table_name} was created')
+        conn.close()
+
+    def register_surrogate_keys(self, file_name: str, key: SurrogateKey, columns: list):
+        self.logger.debug(f'Register {key.column_name} ids from file {file_name} in table {key.table_name}')
+        query = QB.register_surrogate_keys_from_file(self.database_name, key, file_name, columns)
         conn = self.connect_to_db(local_infile=True)
         self.__exec_query(conn, query)
         conn.close()
+
+    def upload_file_to_sql(self, file_name: str, table_name: str, columns: Optional[list] = None,
+                           surrogate_keys: Optional[list[SurrogateKey]] = None) -> int:
+        """
+        Upload data from CSV file into the table. A file with surrogate keys is loaded to a temporary staging table
+        first, and the records with the patient ids missing in the patient key table are not inserted into the table
+        :return: number of rejected records
+        """
+        self.logger.debug(f'Upload data from file {file_name} into table {table_name}')
+        conn = self.connect_to_db(local_infile=True)
+        if not surrogate_keys:
+            self.__exec_query(conn, QB.upload_table_from_file(self.database_name, table_name, file_name))
+            conn.close()
+            self.logger.debug(f'Data from {file_name} uploaded successfully')
+            return 0
+        # ids of the keys not registered by the table must exist in the key tables, e.g. patient ids of fact tables
+        required_keys = [k for k in surrogate_keys if not k.is_registered_by(table_name)]
+        staging_table = QB.staging_table(table_name)
+        try:
+            cur = conn.cursor()
+            self.__exec_count(cur, QB.create_staging_table(self.database_name, table_name, surrogate_keys))
+            loaded = self.__exec_count(cur, QB.upload_table_from_file(self.database_name, staging_table, file_name,
+                                                                      columns, surrogate_keys))
+            inserted = self.__exec_count(cur, QB.insert_from_staging_table(self.database_name, table_name, columns,
+                                                                           required_keys))
+            self.__exec_count(cur, QB.drop_staging_table(self.database_name, table_name))
+            conn.commit()
+        finally:
+            conn.close()
+        rejected = loaded - inserted
+        if rejected > 0:
+            self.logger.warning(f'{rejected} records of table {table_name} are rejected: their '
+                                f'{", ".join(k.column_name for k in required_keys)} ids are not found in '
+                                f'{", ".join(k.table_name for k in required_keys)}')
         self.logger.debug(f'Data from {file_name} uploaded successfully')
+        return rejected
+
+    def __exec_count(self, cur, query: str) -> int:
+        """Execute the query by the cursor of the connection and return the number of the affected rows"""
+        self.logger.debug(f'Execute query : {query}')
+        return cur.execute(query)
 
-    def __do_request_df(self, sql_query: str, parse_dates: list = None) -> Optional[pd.DataFrame]:
-        if len(sql_query) > 400:
-            self.logger.debug(f'__do_request_df: {sql_query[:200]} ... {sql_query[-200:]}')
+    def __do_request_df(self, sql_query: SqlQuery, parse_dates: list = None) -> Optional[pd.DataFrame]:
+        query_str = str(sql_query)
+        if len(query_str) > 400:
+            self.logger.debug(f'__do_request_df: {query_str[:200]} ... {query_str[-200:]}')
         else:
-            self.logger.debug(f'__do_request_df: {sql_query}')
+            self.logger.debug(f'__do_request_df: {query_str}')
 
-        conn = self.connect_to_db()
-        if conn is None:
-            return None
+        try:
+            df = self.__profile(sql_query, lambda: self._read_sql(sql_query, parse_dates))
+        except Exception as e:
+            self.logger.debug(e)
+            df = None
+        return df
+
+    def __do_request(self, sql_query: SqlQuery):
+        self.logger.debug(f'__do_request: {str(sql_query)[:500]}')
 
+        try:
+            result = self.__profile(sql_query, lambda: self._fetch_rows(sql_query))
+        except Exception as e:
+            self.logger.debug(e)
+            result = None
+        return result
+
+    def __profile(self, sql_query: SqlQuery, f):
+        return f() if self.query_profiler is None else self.query_profiler.run(sql_query, f)
+
+    def replay_query(self, sql_query: SqlQuery) -> int:
+        """
+        Execute a captured query
+        :return: number of the result rows
+        """
+        return len(self.__profile(sql_query, lambda: self._fetch_rows(sql_query)))
+
+    def _read_sql(self, sql_query: SqlQuery, parse_dates: Optional[list] = None) -> pd.DataFrame:
+        """Execute the query in a new connection and read the result to a dataframe"""
+        conn = self.connect_to_db()
         try:
             conn.connect()
             self.logger.debug('perform request')
-            df = pd.read_sql(sql_query, conn, parse_dates=parse_dates if parse_dates else None)
-        except BaseException as e:
-            self.logger.debug(e)
-            df = None
+            # values are bound by the driver, the template is the same for the queries of the same shape
+            return pd.read_sql(sql_query.template, conn, params=sql_query.params,
+                               parse_dates=parse_dates if parse_dates else None)
         finally:
             self.logger.debug('close db connection')
             conn.close()
-        return df
-
-    def __do_request(self, sql_query):
-        self.logger.debug(f'__do_request: {sql_query[:500]}')
 
+    def _fetch_rows(self, sql_query: SqlQuery) -> tuple:
+        """Execute the query in a new connection and fetch all rows"""
         conn = self.connect_to_db()
-        if conn is None:
-            return None
-
         try:
             conn.connect()
             self.logger.debug('perform request')
             with conn.cursor() as cursor:
-                cursor.execute(sql_query)
-                result = cursor.fetchall()
-        except BaseException as e:
-            self.logger.debug(e)
-            result = None
+                cursor.execute(sql_query.template, sql_query.params)
+                return cursor.fetchall()
         finally:
             conn.close()
-        return result
+
+    def map_requests(self, f, params_list: list, ordered: bool = False) -> list:
+        """
+        Run data requests concurrently
+        :param f: function doing data requests of the manager
+        :param params_list: list of tuples of params for the function
+        :param ordered: if True, results are returned in the params order. Otherwise, in the completion order
+        :return: list of results
+        """
+        # the request number is the cohort of the captured requests
+        params_list = [(f, p, i) for i, p in enumerate(params_list)]
+        return ConcurrentUtil.do_async_job(self._call_in_cohort, params_list, ordered=ordered)
+
+    @staticmethod
+    def _call_in_cohort(f, params: tuple, cohort: int):
+        return QueryProfiler.call_in_stage(f, params, cohort=cohort)
 
     def request_subcodes(self, codes, table_name) -> Optional[list]:
         """
@@ -194,9 +300,9 @@ class DatabaseManager:
         result = [x[0] for x in db_result]
         return list(set(result))
 
-    def request_icd9_icd10_map(self, codes, search_column):
+    def request_icd9_icd10_map(self, codes, search_column, include_subcodes: bool = False):
         self.logger.debug(f'request_icd9_icd10_map: code N={len(codes)}')
-        query = QB.get_icd9_icd10_map(codes, search_column)
+        query = QB.get_icd9_icd10_map(codes, search_column, include_subcodes)
         result = self.__do_request_df(query)
         return result
 
@@ -216,15 +322,69 @@ class DatabaseManager:
         result = self.__do_request_df(query, parse_dates=parse_dates)
         return result
 
+    def request_natural_ids(self, key: SurrogateKey, surrogate_ids: list) -> Optional[pd.DataFrame]:
+        self.logger.debug(f'request_natural_ids: table={key.table_name} ids N={len(surrogate_ids)}')
+        query = QB.get_natural_ids(key, surrogate_ids)
+        return self.__do_request_df(query)
+
+    def has_table(self, table_name: str) -> bool:
+        result = self.__do_request(QB.has_table(table_name))
+        return bool(result)
+
+    def update_code_catalog(self, table_name: str):
+        """
+        Count the records and the distinct patients of every code of the fact table into the code catalog table, so
+        the code counts are requested from the catalog without scanning the fact table. The catalog is created if it
+        does not exist, the previous counts of the table are replaced
+        """
+        self.logger.debug(f'Update code catalog of table {table_name}')
+        conn = self.connect_to_db()
+        for query in [QB.create_code_catalog_table(), QB.delete_code_catalog(table_name),
+                      QB.insert_code_catalog(table_name)]:
+            self.__exec_query(conn, query)
+        conn.close()
+
+    def has_code_catalog(self, table_name: str) -> bool:
+        result = self.__do_request(QB.has_code_catalog(table_name))
+        return bool(result)
+
+    def request_code_counts(self, codes: list, prefixes: list, table: str) -> Optional[pd.DataFrame]:
+        """
+        Number of records and distinct patients of the codes and of the subcodes of the prefixes from the code catalog
+        :param codes: codes counted exactly
+        :param prefixes: codes counted with their subcodes, the patients of the subcodes are summed
+        :param table: table of the codes
+        :return: dataframe with the code, subcodes flag, records and patients columns. Codes without records are
+        not returned
+        """
+        self.logger.debug(f'request_code_counts: table={table} codes N={len(codes)} prefixes N={len(prefixes)}')
+        return self.__do_request_df(QB.get_code_counts(codes, prefixes, table))
+
+    def request_patients_count(self) -> Optional[int]:
+        result = self.__do_request(QB.get_patients_count())
+        return None if not result else int(result[0][0])
+
     def request_codes_description(self, codes):
         self.logger.debug(f'request_codes_description: codes={codes}'[:500])
         query = QB.get_codes_description(codes)
         result = self.__do_request_df(query)
         return result
 
+    def request_codes_description_batch(self, codes: list, code_systems: list) -> Optional[pd.DataFrame]:
+        """
+        Get descriptions of the codes in any of the code systems
+        :param codes: list of codes
+        :param code_systems: list of code systems
+        :return: dataframe with code description table records or None if the request failed
+        """
+        self.logger.debug(f'request_codes_description_batch: codes N={len(codes)} code_systems={code_systems}')
+        query = QB.get_codes_description_batch(codes, code_systems)
+        return self.__do_request_df(query)
+
     def request_code_info(self, codes: Optional[list], table: str, columns: Optional[list] = None,
                           include_subcodes: bool = False, patients_info: Optional[list] = None,
-                          first_incident: bool = False, num_value: str = None, text_value: str = None
+                          first_incident: bool = False, num_value: str = None, text_value: str = None,
+                          having: Optional[AttributeFilter] = None, exclusion: Optional[AttributeFilter] = None
                           ) -> Optional[pd.DataFrame]:
         """
         Get codes description from table
@@ -237,14 +397,58 @@ class DatabaseManager:
         :param first_incident: get only first (earliest) fitted record for each patient
         :param text_value: numerical value threshold for labs and vitals. Contains operation sign and value ">18", "<=0.01"
         :param num_value: text value to filter for labs and vitals.
+        :param having: attribute events the records should have. They are checked by the database
+        :param exclusion: attribute events the records should not have. They are checked by the database
         :return: dataframe with result
         """
         self.logger.debug(f'request_codes_info: codes={codes} table={table} '
                           f'column={columns} include_subcodes = {include_subcodes} first_incident = {first_incident} '
-                          f'num_value = {num_value} text_value = {text_value}')
+                          f'num_value = {num_value} text_value = {text_value} '
+                          f'having = {having is not None} exclusion = {exclusion is not None}')
 
         query = QB.get_code_info(codes, table, columns, include_subcodes, patients_info, first_incident, num_value,
-                                 text_value)
+                                 text_value, having, exclusion)
+        parse_dates = [c for c in columns if c in cc.date_columns]
+        result = self.__do_request_df(query, parse_dates=parse_dates)
+        return result.dropna().drop_duplicates() if result is not None else None
+
+    def request_code_absence_windows(self, codes: list, table: str, patients_info: list,
+                                     include_subcodes: bool = False, mapped_codes: Optional[list] = None,
+                                     num_value: str = None, text_value: str = None) -> Optional[pd.DataFrame]:
+        """
+        Get patient windows without the codes records. Only the windows are returned, not the codes records
+        :param codes: codes for search
+        :param table: table where to search codes
+        :param patients_info: list of tuples with min_date, max_date, patients ids for this dates
+        :param include_subcodes: search subcodes of the given codes
+        :param mapped_codes: codes searched exactly in addition to the codes, e.g. ICD9 analogs of the codes
+        :param num_value: numerical value threshold for labs and vitals
+        :param text_value: text value to filter for labs and vitals
+        :return: dataframe with patient id and window end date columns
+        """
+        self.logger.debug(f'request_code_absence_windows: codes={codes} table={table} '
+                          f'include_subcodes = {include_subcodes} mapped codes N={len(mapped_codes or [])} '
+                          f'num_value = {num_value} text_value = {text_value}')
+        query = QB.get_code_absence_windows(codes, table, patients_info, include_subcodes, mapped_codes, num_value,
+                                            text_value)
+        result = self.__do_request_df(query, parse_dates=[cc.date])
+        return result.drop_duplicates() if result is not None else None
+
+    def request_batch_code_info(self, code_sets: list[CodeSet], table: str, columns: list,
+                                patients_info: Optional[list] = None, first_incident: bool = False
+                                ) -> Optional[pd.DataFrame]:
+        """
+        Get records of several code sets from the table in one request
+        :param code_sets: code sets to search. The result has the flag column of each code set
+        :param table: table where to search codes
+        :param columns: columns to return
+        :param patients_info: list of tuples with min_date, max_date, patients ids for this dates
+        :param first_incident: get only first (earliest) fitted record for each patient, code and flags combination
+        :return: dataframe with result
+        """
+        self.logger.debug(f'request_batch_code_info: code sets={[s.flag for s in code_sets]} table={table} '
+                          f'column={columns} first_incident = {first_incident}')
+        query = QB.get_batch_code_info(code_sets, table, columns, patients_info, first_incident)
         parse_dates = [c for c in columns if c in cc.date_columns]
         result = self.__do_request_df(query, parse_dates=parse_dates)
         return result.dropna().drop_duplicates() if result is not None else None
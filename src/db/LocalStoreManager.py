@@ -0,0 +1,513 @@
+import bisect
+import logging
+import operator
+import re
+import shutil
+import uuid
+from functools import reduce
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.datamodel.DataColumns import CommonColumns as cc, CommonTables as ct
+from src.db.SqlDataElement import AttributeFilter, CodeSet, SqlTable
+from src.util.ConcurrentUtil import ConcurrentUtil
+
+
+class LocalStoreManager:
+    """
+    Columnar local data store. It is an alternative to the MariaDB database with the same requests interface as
+    DatabaseManager, so the repositories can work with both of them.
+    Each database is a directory in the store and each table is a parquet dataset in the database directory.
+    Fact tables (tables with code and patient id columns) are hive partitioned by the code prefix, and every
+    partition is sorted by (code, patient_id, date). Requests read only the requested columns, and the code, date
+    and patient conditions are pushed down to the dataset scan: partitions are pruned by the code prefix and row
+    groups are skipped by their min/max statistics.
+    Partitions are sorted with bounded memory: sorted runs of at most sort_run_rows rows are merged by batches of
+    merge_batch_rows rows of every run, so neither a source file nor a partition is loaded in memory.
+    """
+    code_group = 'code_group'
+    code_group_length = 1
+    row_group_size = 128 * 1024
+    sort_run_rows = 1024 * 1024
+    merge_batch_rows = 64 * 1024
+    compression = 'zstd'
+    read_block_size = 64 * 1024 * 1024
+    # having and exclusion attribute events are filtered by the client
+    supports_attribute_pushdown = False
+    # negation event windows are found by the client from the positive records
+    supports_absence_request = False
+
+    __sort_columns = [cc.code, cc.patient_id, cc.date]
+    __num_value_pattern = re.compile(r'^\s*(>=|<=|<>|!=|=|>|<)\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*$')
+    __operators = {'>=': operator.ge, '<=': operator.le, '<>': operator.ne, '!=': operator.ne, '=': operator.eq,
+                   '>': operator.gt, '<': operator.lt}
+
+    def __init__(self, store_path: str, db_name: Optional[str] = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.store_path = Path(store_path)
+        self.database_name = db_name
+        self.local_access = True
+        self.__datasets = {}
+
+    def open_ssh_tunnel(self):
+        # local store has no connection to open
+        pass
+
+    def close_ssh_tunnel(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def list_databases(self) -> list:
+        if not self.store_path.exists():
+            return []
+        return sorted([p.name for p in self.store_path.iterdir() if p.is_dir()])
+
+    def create_db(self, db_name: str):
+        self.logger.debug(f'Create local store DB {db_name}')
+        (self.store_path / db_name).mkdir(parents=True, exist_ok=True)
+        self.database_name = db_name
+
+    def has_table(self, table_name: str) -> bool:
+        return self.__table_path(table_name).exists()
+
+    def write_table(self, table: SqlTable, replace: bool = True):
+        """
+        Write table data from its CSV source file into the store. The file is read in blocks, so the whole file is not
+        loaded into memory. Each partition of the table is sorted after writing by merging its sorted runs.
+        :param table: table with the source file
+        :param replace: if True, existing table data is removed. Otherwise, the data is appended to the table
+        """
+        self.logger.debug(f'Write table {table.name} from {table.src_file}')
+        table_path = self.__table_path(table.name)
+        if replace and table_path.exists():
+            shutil.rmtree(table_path)
+        table_path.mkdir(parents=True, exist_ok=True)
+
+        schema = pa.schema([(c.name, self.__arrow_type(c.type)) for c in table.columns])
+        reader = pa_csv.open_csv(
+            table.src_file,
+            read_options=pa_csv.ReadOptions(block_size=self.read_block_size),
+            convert_options=pa_csv.ConvertOptions(column_types=schema, include_columns=schema.names)
+        )
+        partitioned = self.__is_fact_table(schema.names)
+        if partitioned:
+            schema = schema.append(pa.field(self.code_group, pa.string()))
+            reader = pa.RecordBatchReader.from_batches(schema, (self.__add_code_group(b) for b in reader))
+        ds.write_dataset(reader, table_path, format='parquet',
+                         partitioning=self.__partitioning() if partitioned else None,
+                         basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        self.__sort_partitions(table_path, [c for c in self.__sort_columns if c in schema.names] or
+                               table.primary_keys())
+        self.__datasets.pop(table.name, None)
+        if partitioned:
+            self.update_code_catalog(table.name)
+        self.logger.debug(f'Table {table.name} was written to {table_path}')
+
+    def __sort_partitions(self, table_path: Path, sort_columns: list):
+        partitions = [p for p in table_path.iterdir() if p.is_dir()] or [table_path]
+        ConcurrentUtil.do_async_job(self.__sort_partition, [(p, sort_columns) for p in partitions])
+
+    def __sort_partition(self, partition_path: Path, sort_columns: list):
+        files = sorted(partition_path.glob('*.parquet'))
+        if not files:
+            return
+        batches = ds.dataset([str(f) for f in files], format='parquet').to_batches(batch_size=self.merge_batch_rows)
+        # hidden files are not read by the table dataset
+        tmp_file = partition_path / '.part-0.parquet.tmp'
+        runs = []
+        try:
+            if sort_columns:
+                runs = self.__write_sorted_runs(batches, partition_path, sort_columns)
+                tables = self.__merge_runs(runs, sort_columns)
+            else:
+                tables = (pa.Table.from_batches([b]) for b in batches)
+            self.__write_row_groups(tables, tmp_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        finally:
+            for r in runs:
+                r.unlink(missing_ok=True)
+        for f in files:
+            f.unlink()
+        tmp_file.rename(partition_path / 'part-0.parquet')
+
+    def __write_sorted_runs(self, batches, partition_path: Path, sort_columns: list) -> list[Path]:
+        """Split the batches to runs of at most sort_run_rows rows, and write every run sorted to a file"""
+        runs, buffer, rows = [], [], 0
+        for batch in batches:
+            if buffer and rows + batch.num_rows > self.sort_run_rows:
+                runs.append(self.__write_run(buffer, partition_path / f'.run-{len(runs)}.parquet.tmp', sort_columns))
+                buffer, rows = [], 0
+            buffer.append(batch)
+            rows += batch.num_rows
+        if buffer:
+            runs.append(self.__write_run(buffer, partition_path / f'.run-{len(runs)}.parquet.tmp', sort_columns))
+        return runs
+
+    def __write_run(self, batches: list, file_path: Path, sort_columns: list) -> Path:
+        run = pa.Table.from_batches(batches).sort_by([(c, 'ascending') for c in sort_columns])
+        pq.write_table(run, file_path, row_group_size=self.merge_batch_rows)
+        return file_path
+
+    def __merge_runs(self, runs: list[Path], sort_columns: list):
+        """
+        Merge the sorted runs by batches. Every step takes the rows of the run batches up to the least last key of
+        the batches: the rows left in the runs are greater, so the sorted steps are in order
+        :return: generator of the sorted tables
+        """
+        readers = [pq.ParquetFile(r).iter_batches(batch_size=self.merge_batch_rows) for r in runs]
+        buffers = [self.__next_batch(r) for r in readers]
+        while any(b is not None for b in buffers):
+            active = [i for i, b in enumerate(buffers) if b is not None]
+            bound = min(self.__row_key(buffers[i], sort_columns, buffers[i].num_rows - 1) for i in active)
+            parts = []
+            for i in active:
+                b = buffers[i]
+                n = bisect.bisect_right(range(b.num_rows), bound, key=lambda k: self.__row_key(b, sort_columns, k))
+                parts.append(b.slice(0, n))
+                buffers[i] = b.slice(n) if n < b.num_rows else self.__next_batch(readers[i])
+            yield pa.concat_tables(parts).sort_by([(c, 'ascending') for c in sort_columns])
+
+    def __write_row_groups(self, tables, file_path: Path):
+        """Write the tables to the file combining them to row groups of row_group_size rows"""
+        writer, buffer, rows = None, [], 0
+        try:
+            for t in tables:
+                buffer.append(t)
+                rows += t.num_rows
+                if rows >= self.row_group_size:
+                    writer = self.__write_row_group(writer, buffer, file_path)
+                    buffer, rows = [], 0
+            if buffer or writer is None:
+                writer = self.__write_row_group(writer, buffer, file_path)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def __write_row_group(self, writer: Optional[pq.ParquetWriter], tables: list, file_path: Path) \
+            -> pq.ParquetWriter:
+        data = pa.concat_tables(tables)
+        if writer is None:
+            writer = pq.ParquetWriter(file_path, data.schema, compression=self.compression)
+        writer.write_table(data, row_group_size=self.row_group_size)
+        return writer
+
+    @staticmethod
+    def __next_batch(reader) -> Optional[pa.Table]:
+        batch = next(reader, None)
+        return None if batch is None else pa.Table.from_batches([batch])
+
+    @staticmethod
+    def __row_key(table: pa.Table, columns: list, i: int) -> tuple:
+        # nulls are sorted at the end as by Table.sort_by
+        return tuple((v is None, v) for v in (table.column(c)[i].as_py() for c in columns))
+
+    def update_code_catalog(self, table_name: str):
+        """
+        Count the records and the distinct patients of every code of the fact table into the code catalog, see
+        DatabaseManager.update_code_catalog. The catalog has a file of every table. Partitions are sorted by the code
+        and the patient id, so the codes are counted by batches without loading the partitions
+        """
+        self.logger.debug(f'Update code catalog of table {table_name}')
+        table_path = self.__table_path(table_name)
+        counts = []
+        for file_path in sorted(table_path.glob('**/*.parquet')):
+            last = None
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=self.merge_batch_rows,
+                                                                columns=[cc.code, cc.patient_id]):
+                df = batch.to_pandas()
+                batch_counts = df.groupby(cc.code).agg(**{cc.records: (cc.patient_id, 'size'),
+                                                          cc.patients: (cc.patient_id, 'nunique')})
+                # the patient of the previous batch end is counted once
+                if last is not None and len(df) and tuple(df.iloc[0]) == last and last[0] in batch_counts.index:
+                    batch_counts.loc[last[0], cc.patients] -= 1
+                if len(df):
+                    last = tuple(df.iloc[-1])
+                counts.append(batch_counts)
+        catalog_df = pd.concat(counts).groupby(level=0).sum() if counts else \
+            pd.DataFrame(columns=[cc.records, cc.patients], index=pd.Index([], name=cc.code))
+        catalog_df = catalog_df.reset_index().astype({cc.code: str, cc.records: 'int64', cc.patients: 'int64'})
+        catalog_df.insert(0, cc.table_name, table_name)
+        catalog_path = self.__table_path(ct.code_catalog)
+        catalog_path.mkdir(parents=True, exist_ok=True)
+        # hidden files are not read by the catalog dataset
+        tmp_file = catalog_path / f'.{table_name}.parquet.tmp'
+        pq.write_table(pa.Table.from_pandas(catalog_df, preserve_index=False), tmp_file, compression=self.compression)
+        tmp_file.replace(catalog_path / f'{table_name}.parquet')
+        self.__datasets.pop(ct.code_catalog, None)
+
+    def has_code_catalog(self, table_name: str) -> bool:
+        return (self.__table_path(ct.code_catalog) / f'{table_name}.parquet').exists()
+
+    def request_subcodes(self, codes, table_name) -> Optional[list]:
+        """
+        get sub codes of codes
+        :param codes: list of codes
+        :param table_name: table name for search subcodes
+        :return: list of subcodes
+        """
+        self.logger.debug(f'request_subcodes: code={codes}, table={table_name}')
+        df = self.__do_request_df(table_name, [cc.code], [self.__codes_condition(table_name, codes, True)])
+        if df is None:
+            return None
+        return df[cc.code].unique().tolist()
+
+    def request_icd9_icd10_map(self, codes, search_column, include_subcodes: bool = False):
+        self.logger.debug(f'request_icd9_icd10_map: code N={len(codes)}')
+        condition = reduce(operator.or_, [pc.starts_with(pc.field(search_column), c) for c in codes]) \
+            if include_subcodes else pc.field(search_column).isin(list(codes))
+        return self.__do_request_df(ct.icd9_map_icd10, [cc.icd9_code, cc.icd10_code], [condition])
+
+    def request_dead_patients(
+            self, patients_info: Optional[list] = None, columns: Optional[list] = None
+    ) -> Optional[pd.DataFrame]:
+        self.logger.debug(f'request_dead_patient_ids: column={columns}')
+        conditions = [pc.field(cc.date_of_death).is_valid(),
+                      self.__date_patient_condition(patients_info, cc.date_of_death)]
+        return self.__do_request_df(ct.patient, columns, conditions)
+
+    def request_patient_info(self, patients, columns):
+        self.logger.debug(f'request_patient_info: columns={columns}')
+        return self.__do_request_df(ct.patient, columns, [pc.field(cc.patient_id).isin(list(patients))])
+
+    def map_requests(self, f, params_list: list, ordered: bool = False) -> list:
+        """Run data requests concurrently, see DatabaseManager.map_requests"""
+        return ConcurrentUtil.do_async_job(f, params_list, ordered=ordered)
+
+    def request_codes_description(self, codes):
+        self.logger.debug(f'request_codes_description: codes={codes}'[:500])
+        df = self.__do_request_df(ct.code_description, None,
+                                  [pc.field(cc.code).isin(list({c for c, _ in codes}))])
+        if df is None:
+            return None
+        pairs = pd.DataFrame([(c, s) for c, systems in codes for s in systems], columns=[cc.code, cc.code_system])
+        return df.merge(pairs, on=[cc.code, cc.code_system])[df.columns]
+
+    def request_codes_description_batch(self, codes: list, code_systems: list) -> Optional[pd.DataFrame]:
+        self.logger.debug(f'request_codes_description_batch: codes N={len(codes)} code_systems={code_systems}')
+        return self.__do_request_df(ct.code_description, None,
+                                    [pc.field(cc.code).isin(list(codes)),
+                                     pc.field(cc.code_system).isin(list(code_systems))])
+
+    def request_code_counts(self, codes: list, prefixes: list, table: str) -> Optional[pd.DataFrame]:
+        """Number of records and patients of the codes from the catalog, see DatabaseManager.request_code_counts"""
+        self.logger.debug(f'request_code_counts: table={table} codes N={len(codes)} prefixes N={len(prefixes)}')
+        df = self.__do_request_df(ct.code_catalog, [cc.code, cc.records, cc.patients],
+                                  [pc.field(cc.table_name) == table,
+                                   self.__codes_condition(ct.code_catalog, codes + prefixes, bool(prefixes))])
+        if df is None:
+            return None
+        counts = df[df[cc.code].isin(codes)].assign(**{cc.subcodes: 0})
+        prefix_counts = [(p, 1, int(df.loc[m, cc.records].sum()), int(df.loc[m, cc.patients].sum()))
+                         for p in prefixes for m in [df[cc.code].str.startswith(p)]]
+        prefix_df = pd.DataFrame(prefix_counts, columns=[cc.code, cc.subcodes, cc.records, cc.patients])
+        return pd.concat([counts[prefix_df.columns], prefix_df], ignore_index=True)
+
+    def request_patients_count(self) -> Optional[int]:
+        try:
+            return self.__dataset(ct.patient).count_rows()
+        except (OSError, pa.ArrowException) as e:
+            self.logger.debug(e)
+            return None
+
+    def request_code_info(self, codes: Optional[list], table: str, columns: Optional[list] = None,
+                          include_subcodes: bool = False, patients_info: Optional[list] = None,
+                          first_incident: bool = False, num_value: str = None, text_value: str = None,
+                          having: Optional[AttributeFilter] = None, exclusion: Optional[AttributeFilter] = None
+                          ) -> Optional[pd.DataFrame]:
+        """
+        Get codes records from table. Parameters are the same as for DatabaseManager.request_code_info.
+        Attribute events filters are not supported
+        :param codes: codes for search
+        :param table: table where to search codes
+        :param columns: columns to return
+        :param include_subcodes: get subcodes of the given codes
+        :param patients_info: list of tuples with min_date, max_date, patients ids for this dates
+        :param first_incident: get only first (earliest) fitted record for each patient
+        :param num_value: numerical value threshold for labs and vitals. Contains operation sign and value ">18"
+        :param text_value: text value to filter for labs and vitals.
+        :return: dataframe with result
+        """
+        self.logger.debug(f'request_codes_info: codes={codes} table={table} '
+                          f'column={columns} include_subcodes = {include_subcodes} first_incident = {first_incident} '
+                          f'num_value = {num_value} text_value = {text_value}')
+        if having is not None or exclusion is not None:
+            raise ValueError('Attribute events filter is not supported by the local store')
+        if columns is None:
+            columns = [c for c in self.__dataset(table).schema.names if c != self.code_group]
+        group_first = first_incident and cc.date in columns
+        read_columns = self.__read_columns(columns, [cc.patient_id, cc.code] if group_first else [])
+        conditions = [self.__codes_condition(table, codes, include_subcodes) if codes else None,
+                      self.__date_patient_condition(patients_info, cc.date),
+                      self.__values_condition(num_value, text_value)]
+        df = self.__do_request_df(table, read_columns, conditions)
+        if df is None:
+            return None
+        if cc.type in columns:
+            df = self.__join_encounter_type(df)
+        if group_first:
+            df = df.sort_values(cc.date, kind='stable').drop_duplicates([cc.patient_id, cc.code])
+        return df[columns].dropna().drop_duplicates()
+
+    def request_batch_code_info(self, code_sets: list[CodeSet], table: str, columns: list,
+                                patients_info: Optional[list] = None, first_incident: bool = False
+                                ) -> Optional[pd.DataFrame]:
+        """
+        Get records of several code sets from the table in one request.
+        Parameters are the same as for DatabaseManager.request_batch_code_info
+        """
+        self.logger.debug(f'request_batch_code_info: code sets={[s.flag for s in code_sets]} table={table} '
+                          f'column={columns} first_incident = {first_incident}')
+        group_first = first_incident and cc.date in columns
+        value_columns = [c for c in (cc.num_value, cc.text_value) if any(getattr(s, c) is not None for s in code_sets)]
+        read_columns = self.__read_columns(columns, [cc.code] + value_columns +
+                                           ([cc.patient_id] if group_first else []))
+        sets_condition = reduce(operator.or_, [self.__code_set_condition(table, s) for s in code_sets])
+        df = self.__do_request_df(table, read_columns,
+                                  [sets_condition, self.__date_patient_condition(patients_info, cc.date)])
+        if df is None:
+            return None
+        flags = [s.flag for s in code_sets]
+        for code_set in code_sets:
+            df[code_set.flag] = self.__code_set_mask(df, code_set).astype('int64')
+        if cc.type in columns:
+            df = self.__join_encounter_type(df)
+        if group_first:
+            df = df.sort_values(cc.date, kind='stable').drop_duplicates([cc.patient_id, cc.code] + flags)
+        return df[columns + flags].dropna().drop_duplicates()
+
+    @staticmethod
+    def __read_columns(columns: list, extra_columns: list) -> list:
+        read_columns = [c for c in columns if c != cc.type]
+        extra_columns = ([cc.encounter_id] if cc.type in columns else []) + extra_columns
+        return read_columns + [c for c in dict.fromkeys(extra_columns) if c not in read_columns]
+
+    def __code_set_condition(self, table_name: str, code_set: CodeSet) -> pc.Expression:
+        conditions = [self.__codes_condition(table_name, list(code_set.codes), code_set.include_subcodes),
+                      self.__values_condition(code_set.num_value, code_set.text_value)]
+        return reduce(operator.and_, [c for c in conditions if c is not None])
+
+    def __code_set_mask(self, df: pd.DataFrame, code_set: CodeSet) -> pd.Series:
+        codes = df[cc.code].astype(str)
+        mask = codes.str.startswith(code_set.codes) if code_set.include_subcodes else codes.isin(code_set.codes)
+        if code_set.num_value is not None:
+            op, value = self.__parse_num_value(code_set.num_value)
+            mask &= op(df[cc.num_value], value)
+        elif code_set.text_value is not None:
+            mask &= df[cc.text_value] == code_set.text_value
+        return mask
+
+    def __join_encounter_type(self, df: pd.DataFrame) -> pd.DataFrame:
+        encounters = self.__do_request_df(ct.encounter, [cc.encounter_id, cc.type],
+                                          [pc.field(cc.encounter_id).isin(df[cc.encounter_id].unique())])
+        if encounters is None:
+            return df.assign(**{cc.type: None})
+        return df.merge(encounters, how='left', on=cc.encounter_id)
+
+    def __do_request_df(self, table_name: str, columns: Optional[list], conditions: list) -> Optional[pd.DataFrame]:
+        conditions = [c for c in conditions if c is not None]
+        condition = reduce(operator.and_, conditions) if conditions else None
+        self.logger.debug(f'__do_request_df: table={table_name} columns={columns} filter={str(condition)[:400]}')
+        try:
+            data = self.__dataset(table_name).to_table(columns=columns, filter=condition)
+        except (OSError, pa.ArrowException) as e:
+            self.logger.debug(e)
+            return None
+        return data.to_pandas()
+
+    def __dataset(self, table_name: str) -> ds.Dataset:
+        if table_name not in self.__datasets:
+            table_path = self.__table_path(table_name)
+            if not table_path.exists():
+                raise FileNotFoundError(f'Table {table_name} is not found in the local store {table_path.parent}')
+            partitioning = self.__partitioning() if self.__is_partitioned(table_name) else None
+            self.__datasets[table_name] = ds.dataset(table_path, format='parquet', partitioning=partitioning)
+        return self.__datasets[table_name]
+
+    def __is_partitioned(self, table_name: str) -> bool:
+        table_path = self.__table_path(table_name)
+        return table_path.exists() and any(p.name.startswith(f'{self.code_group}=') for p in table_path.iterdir())
+
+    def __table_path(self, table_name: str) -> Path:
+        return self.store_path / self.database_name / table_name
+
+    def __codes_condition(self, table_name: str, codes: list, include_subcodes: bool) -> pc.Expression:
+        if include_subcodes:
+            condition = reduce(operator.or_, [pc.starts_with(pc.field(cc.code), c) for c in codes])
+        else:
+            condition = pc.field(cc.code).isin(list(codes))
+        if self.__is_partitioned(table_name) and all(len(c) >= self.code_group_length for c in codes):
+            groups = list({self.__code_prefix(c) for c in codes})
+            condition = pc.field(self.code_group).isin(groups) & condition
+        return condition
+
+    @staticmethod
+    def __date_patient_condition(patients_info: Optional[list], date_column: str) -> Optional[pc.Expression]:
+        if not patients_info:
+            return None
+        res = []
+        for min_date, max_date, patients in patients_info:
+            condition = [pc.field(cc.patient_id).isin(list(patients))] if patients else []
+            if min_date is not None:
+                condition.append(pc.field(date_column) >= pa.scalar(pd.Timestamp(min_date), pa.timestamp('s')))
+            if max_date is not None:
+                condition.append(pc.field(date_column) <= pa.scalar(pd.Timestamp(max_date), pa.timestamp('s')))
+            if condition:
+                res.append(reduce(operator.and_, condition))
+        return reduce(operator.or_, res) if res else None
+
+    def __values_condition(self, num_value: Optional[str], text_value: Optional[str]) -> Optional[pc.Expression]:
+        if num_value is not None:
+            op, value = self.__parse_num_value(num_value)
+            return op(pc.field(cc.num_value), value)
+        if text_value is not None:
+            return pc.field(cc.text_value) == text_value
+        return None
+
+    def __parse_num_value(self, num_value: str) -> tuple:
+        match = self.__num_value_pattern.match(num_value)
+        if match is None:
+            raise ValueError(f'Invalid numeric value condition "{num_value}"')
+        return self.__operators[match.group(1)], float(match.group(2))
+
+    def __add_code_group(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        code_group = pc.utf8_slice_codeunits(batch.column(cc.code), 0, self.code_group_length)
+        return batch.append_column(self.code_group, code_group)
+
+    def __code_prefix(self, code: str) -> str:
+        return code[:self.code_group_length]
+
+    def __partitioning(self) -> ds.Partitioning:
+        return ds.partitioning(pa.schema([(self.code_group, pa.string())]), flavor='hive')
+
+    @staticmethod
+    def __is_fact_table(columns: list) -> bool:
+        return cc.code in columns and cc.patient_id in columns
+
+    @staticmethod
+    def __arrow_type(sql_type: str) -> pa.DataType:
+        sql_type = str(sql_type).upper()
+        if sql_type in ('DATE', 'DATETIME', 'TIMESTAMP'):
+            return pa.timestamp('s')
+        if sql_type in ('DECIMAL', 'FLOAT', 'DOUBLE'):
+            return pa.float64()
+        if sql_type.endswith('INT'):
+            return pa.int64()
+        return pa.string()
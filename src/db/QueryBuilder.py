@@ -1,8 +1,10 @@
 import logging
+from functools import lru_cache
 from typing import Optional
 
 from src.db import SqlUtil
-from src.db.SqlDataElement import ForeignKey
+from src.db.SqlDataElement import AttributeEvent, AttributeFilter, CodeSet, ForeignKey, SqlPartition, SqlQuery, \
+    SurrogateKey, surrogate_key_type
 from src.util.Error import QueryBuilderError
 from src.datamodel.DataColumns import CommonColumns as cc, CommonTables as ct
 
@@ -10,12 +12,14 @@ logger = logging.getLogger('QueryBuilder')
 
 
 def create_table(name: str, columns: list, types: list, primary_keys: list = None,
-                 foreign_keys: list[ForeignKey] = None) -> str:
+                 foreign_keys: list[ForeignKey] = None, partition: Optional[SqlPartition] = None,
+                 not_null: list = None) -> str:
     logger.debug(f'Compose create table SQL request for table {name}')
     if len(columns) != len(types):
         raise QueryBuilderError(
             f'Columns number should be the same as type number. Found {len(columns)} columns and {len(types)} types')
-    columns_str_list = [f'{c} {t}' for c, t in zip(columns, types)]
+    not_null = set(not_null or [])
+    columns_str_list = [f'{c} {t} NOT NULL' if c in not_null else f'{c} {t}' for c, t in zip(columns, types)]
     columns_str = ', '.join(columns_str_list)
     query_params = [columns_str]
 
@@ -30,7 +34,8 @@ def create_table(name: str, columns: list, types: list, primary_keys: list = Non
         query_params.append(foreign_key_str)
 
     query_params = ', '.join(query_params)
-    query = f'CREATE TABLE {name} ({query_params});'
+    partition_str = f' {partition}' if partition is not None else ''
+    query = f'CREATE TABLE {name} ({query_params}){partition_str};'
     logger.debug(f'Composed query : {query}')
     return query
 
@@ -46,65 +51,206 @@ def create_index(table_name: str, indexes: dict) -> str:
     """
     Add indexes in table
     :param table_name: table name
-    :param indexes: dictionary {index name : column name}. Only one column for each index is supported
+    :param indexes: dictionary {index name : column name or list of column names}.
+    For a list of columns a multi-column index is created with the columns in the list order
     :return:
     """
     logger.debug(f'Compose add index request for table {table_name}')
-    index_str = ', '.join([f'ADD INDEX {i} ({c})' for i, c in indexes.items()])
+    index_str = ', '.join([f'ADD INDEX {i} ({c if isinstance(c, str) else ", ".join(c)})'
+                           for i, c in indexes.items()])
     query = f'ALTER TABLE {table_name} {index_str}'
     logger.debug(f'Composed query: {query}')
     return query
 
 
-def upload_table_from_file(db_name: str, table_name: str, file_name: str) -> str:
-    return f"LOAD DATA LOCAL INFILE '{file_name}' INTO TABLE {db_name}.{table_name} " \
-           f"FIELDS TERMINATED BY ',' ENCLOSED BY '\"' LINES TERMINATED BY '\n' IGNORE 1 ROWS;"
+def create_surrogate_key_table(key: SurrogateKey, natural_type: str) -> str:
+    logger.debug(f'Compose create surrogate key table SQL request for table {key.table_name}')
+    query = f'CREATE TABLE {key.table_name} (' \
+            f'{cc.surrogate_id} {surrogate_key_type} NOT NULL AUTO_INCREMENT, ' \
+            f'{key.column_name} {natural_type} NOT NULL, ' \
+            f'PRIMARY KEY ({cc.surrogate_id}), ' \
+            f'UNIQUE KEY uk_{key.column_name} ({key.column_name}));'
+    logger.debug(f'Composed query : {query}')
+    return query
+
+
+def upload_table_from_file(db_name: str, table_name: str, file_name: str, columns: Optional[list] = None,
+                           surrogate_keys: Optional[list[SurrogateKey]] = None) -> str:
+    """
+    Load data from CSV file into the table
+    :param db_name: database name
+    :param table_name: table name
+    :param file_name: CSV file with the header. The file columns order should be the same as in the table
+    :param columns: file columns. Required if surrogate keys are set
+    :param surrogate_keys: key columns with natural ids in the file to be replaced with their surrogate ids.
+    Natural ids missing in the key table are loaded as NULL
+    :return: query
+    """
+    query = f"LOAD DATA LOCAL INFILE '{file_name}' INTO TABLE {db_name}.{table_name} " \
+            f"FIELDS TERMINATED BY ',' ENCLOSED BY '\"' LINES TERMINATED BY '\n' IGNORE 1 ROWS"
+    if not surrogate_keys:
+        return f'{query};'
+    key_columns = {k.column_name: k for k in surrogate_keys}
+    columns_expr = ', '.join([f'@{c}' if c in key_columns else c for c in columns])
+    set_expr = ', '.join([f'{c} = (SELECT {cc.surrogate_id} FROM {db_name}.{k.table_name} '
+                          f'WHERE {k.table_name}.{c} = @{c})'
+                          for c, k in key_columns.items()])
+    return f'{query} ({columns_expr}) SET {set_expr};'
+
+
+def staging_table(table_name: str) -> str:
+    return f'{table_name}_staging'
+
+
+def create_staging_table(db_name: str, table_name: str, surrogate_keys: list[SurrogateKey]) -> str:
+    """
+    Create an empty temporary copy of the table to load a file with surrogate keys. The table exists in the
+    connection only, its key columns are nullable to keep the records with natural ids missing in the key tables
+    """
+    keys_expr = ', '.join([f'{k.column_name} {surrogate_key_type} NULL' for k in surrogate_keys])
+    return f'CREATE TEMPORARY TABLE {db_name}.{staging_table(table_name)} ({keys_expr}) ' \
+           f'SELECT * FROM {db_name}.{table_name} LIMIT 0;'
+
+
+def insert_from_staging_table(db_name: str, table_name: str, columns: list,
+                              required_keys: list[SurrogateKey]) -> str:
+    """
+    Insert the records loaded to the staging table into the table
+    :param columns: table columns
+    :param required_keys: keys the ids of which must be found in the key tables, e.g. patient ids of the fact
+    tables. Records with unknown ids are not inserted, so they never break the foreign keys of the table
+    :return: query
+    """
+    columns_str = ', '.join(columns)
+    query = f'INSERT INTO {db_name}.{table_name} ({columns_str}) ' \
+            f'SELECT {columns_str} FROM {db_name}.{staging_table(table_name)}'
+    if not required_keys:
+        return f'{query};'
+    return f"{query} WHERE {' AND '.join([f'{k.column_name} IS NOT NULL' for k in required_keys])};"
+
+
+def drop_staging_table(db_name: str, table_name: str) -> str:
+    return f'DROP TEMPORARY TABLE IF EXISTS {db_name}.{staging_table(table_name)};'
+
+
+def register_surrogate_keys_from_file(db_name: str, key: SurrogateKey, file_name: str, columns: list) -> str:
+    """
+    Add natural ids of the key column from CSV file into the key table. Already registered ids are ignored.
+    """
+    columns_expr = ', '.join([c if c == key.column_name else '@skip' for c in columns])
+    return f"LOAD DATA LOCAL INFILE '{file_name}' IGNORE INTO TABLE {db_name}.{key.table_name} " \
+           f"FIELDS TERMINATED BY ',' ENCLOSED BY '\"' LINES TERMINATED BY '\n' IGNORE 1 ROWS " \
+           f"({columns_expr});"
 
 
-def get_codes_description(codes_and_system: list):
-    codes_and_system_str = []
-    for c, s in codes_and_system:
-        systems = [f"'{system}'" for system in s]
-        systems = ",".join(systems)
-        code_system_str = f"(code='{c}' and code_system in ({systems}))"
-        codes_and_system_str.append(code_system_str)
-    codes_and_system_str = ' or '.join(codes_and_system_str)
-    return f'select * from {ct.code_description} where {codes_and_system_str};'
+def get_natural_ids(key: SurrogateKey, surrogate_ids: list) -> SqlQuery:
+    in_expression = SqlUtil.in_expression(cc.surrogate_id, surrogate_ids)
+    return SqlQuery.concat(f'select {cc.surrogate_id}, {key.column_name} from {key.table_name} where ', in_expression)
 
 
-def get_subcodes(codes, table_name):
+def has_table(table_name: str) -> SqlQuery:
+    return SqlQuery('SHOW TABLES LIKE %s', (table_name,))
+
+
+def get_codes_description(codes_and_system: list) -> SqlQuery:
+    conditions = [SqlQuery.join(' and ', [SqlUtil.in_expression(cc.code, [c]),
+                                          SqlUtil.in_expression(cc.code_system, s)])
+                  for c, s in codes_and_system]
+    return SqlQuery.concat(f'select * from {ct.code_description} where ', SqlQuery.join(' or ', conditions, wrap=True))
+
+
+def get_codes_description_batch(codes: list, code_systems: list) -> SqlQuery:
+    codes_expr = SqlUtil.in_expression(cc.code, codes)
+    systems_expr = SqlUtil.in_expression(cc.code_system, code_systems)
+    return SqlQuery.concat(f'select * from {ct.code_description} where ', codes_expr, ' and ', systems_expr)
+
+
+def get_subcodes(codes, table_name) -> SqlQuery:
     like_expr = SqlUtil.like_expression(cc.code, codes)
-    return f"SELECT {cc.code} FROM {table_name} " \
-           f"WHERE {like_expr}"
+    return SqlQuery.concat(f"SELECT {cc.code} FROM {table_name} WHERE ", like_expr)
+
+
+def create_code_catalog_table() -> str:
+    return f'CREATE TABLE IF NOT EXISTS {ct.code_catalog} (' \
+           f'{cc.table_name} VARCHAR(64) NOT NULL, ' \
+           f'{cc.code} VARCHAR(100) NOT NULL, ' \
+           f'{cc.records} BIGINT NOT NULL, ' \
+           f'{cc.patients} BIGINT NOT NULL, ' \
+           f'PRIMARY KEY ({cc.table_name}, {cc.code}));'
+
+
+def delete_code_catalog(table: str) -> str:
+    return f"DELETE FROM {ct.code_catalog} WHERE {cc.table_name} = '{table}';"
+
+
+def insert_code_catalog(table: str) -> str:
+    """Count the records and the distinct patients of every code of the table into the code catalog"""
+    return f"INSERT INTO {ct.code_catalog} ({cc.table_name}, {cc.code}, {cc.records}, {cc.patients}) " \
+           f"SELECT '{table}', {cc.code}, count(*), count(distinct {cc.patient_id}) FROM {table} " \
+           f"WHERE {cc.code} IS NOT NULL GROUP BY {cc.code};"
 
 
-def get_icd9_icd10_map(codes, code_search_column):
-    list_expr = SqlUtil.in_expression(code_search_column, codes)
-    return f'select {cc.icd9_code}, {cc.icd10_code} ' \
-           f'from {ct.icd9_map_icd10} ' \
-           f'where {list_expr}'
+def has_code_catalog(table: str) -> SqlQuery:
+    return SqlQuery(f'select 1 from {ct.code_catalog} where {cc.table_name} = %s limit 1', (table,))
 
 
-def request_dead_patients(patients_info: Optional[list] = None, columns: Optional[list] = None) -> str:
+def get_code_counts(codes: list, prefixes: list, table: str) -> SqlQuery:
+    """
+    Number of records and distinct patients of the codes and of the codes starting with the prefixes from the code
+    catalog in one request. The patients of a prefix are the sum of the patients of its subcodes.
+    Codes without records are not returned, prefixes are always returned with the subcodes flag
+    """
+    table_expr = SqlQuery(f'{cc.table_name} = %s', (table,))
+    parts = []
+    if codes:
+        parts.append(SqlQuery.concat(f'select {cc.code}, 0 as {cc.subcodes}, {cc.records}, {cc.patients} '
+                                     f'from {ct.code_catalog} where ', table_expr, ' and ',
+                                     SqlUtil.in_expression(cc.code, codes)))
+    # every prefix is summed by a range scan of the catalog primary key
+    parts += [SqlQuery.concat(SqlQuery(f'select %s as {cc.code}, 1 as {cc.subcodes}, ', (prefix,)),
+                              f'coalesce(sum({cc.records}), 0) as {cc.records}, '
+                              f'coalesce(sum({cc.patients}), 0) as {cc.patients} from {ct.code_catalog} where ',
+                              table_expr, ' and ', SqlUtil.like_expression(cc.code, [prefix]))
+              for prefix in prefixes]
+    return SqlQuery.join(' union all ', parts)
+
+
+def get_patients_count() -> SqlQuery:
+    return SqlQuery(f'select count(*) from {ct.patient}')
+
+
+def get_icd9_icd10_map(codes, code_search_column, include_subcodes: bool = False) -> SqlQuery:
+    list_expr = SqlUtil.like_expression(code_search_column, codes) if include_subcodes \
+        else SqlUtil.in_expression(code_search_column, codes)
+    return SqlQuery.concat(f'select {cc.icd9_code}, {cc.icd10_code} from {ct.icd9_map_icd10} where ', list_expr)
+
+
+def request_dead_patients(patients_info: Optional[list] = None, columns: Optional[list] = None) -> SqlQuery:
     columns = SqlUtil.selected_columns_expr(columns)
     # date-patient condition
     date_patient_condition = compose_date_patient_condition(patients_info, cc.date_of_death, ct.patient)
 
     # add date condition
-    where = f'where not isnull({cc.date_of_death})'
-    where += f' and ({date_patient_condition})' if date_patient_condition else ''
-    return f'select {columns} ' \
-           f'from {ct.patient} ' \
-           f'{where}'
+    where = SqlQuery.join(' and ', [f'not isnull({cc.date_of_death})', date_patient_condition], wrap=True)
+    return SqlQuery.concat(f'select {columns} from {ct.patient} where ', where)
 
 
-def get_patient_info(patients, columns=None):
+def get_patient_info(patients, columns=None) -> SqlQuery:
     in_expression = SqlUtil.in_expression(cc.patient_id, patients)
     columns = SqlUtil.selected_columns_expr(columns)
-    return f'select {columns} from {ct.patient} where {in_expression}'
+    return SqlQuery.concat(f'select {columns} from {ct.patient} where ', in_expression)
+
+
+def compose_date_condition(date_col: str, min_date, max_date) -> Optional[SqlQuery]:
+    conditions = []
+    if min_date is not None:
+        conditions.append(SqlQuery(f'{date_col} >= %s', (str(min_date),)))
+    if max_date is not None:
+        conditions.append(SqlQuery(f'{date_col} <= %s', (str(max_date),)))
+    return SqlQuery.join(' AND ', conditions)
 
 
-def compose_date_patient_condition(patients_info: list, date_column: str, table: str) -> Optional[str]:
+def compose_date_patient_condition(patients_info: list, date_column: str, table: str) -> Optional[SqlQuery]:
     if not patients_info:
         return None
     patient_id_col = f'{table}.{cc.patient_id}'
@@ -112,21 +258,95 @@ def compose_date_patient_condition(patients_info: list, date_column: str, table:
     res = []
     for min_date, max_date, patients in patients_info:
         condition = [SqlUtil.in_expression(patient_id_col, patients)] if patients else []
-        if min_date is not None:
-            condition.append(f"{date_col} >= '{min_date}'")
-        if max_date is not None:
-            condition.append(f"{date_col} <= '{max_date}'")
-        if condition:
-            condition = '(' + ' AND '.join(condition) + ')'
-            res.append(condition)
-    return ' OR '.join(res) if res else None
+        condition.append(compose_date_condition(date_col, min_date, max_date))
+        res.append(SqlQuery.join(' AND ', condition))
+    return SqlQuery.join(' OR ', res, wrap=True)
 
 
-def get_code_info(codes: list, table: str, columns: list, include_subcodes: bool = False,
-                  patients_info: Optional[list] = None, first_incident=False, num_value: str = None,
-                  text_value: str = None
-                  ) -> str:
-    # select column expression
+def compose_date_bounds_condition(patients_info: list, date_column: str, table: str) -> Optional[SqlQuery]:
+    """
+    Common date range of all patient groups. It duplicates the date-patient condition but, unlike a disjunction of
+    the groups, it can be used by the optimizer for partition pruning and index range scan.
+    """
+    if not patients_info or len(patients_info) < 2:
+        return None
+    min_dates = [x[0] for x in patients_info]
+    max_dates = [x[1] for x in patients_info]
+    return compose_date_condition(f'{table}.{date_column}',
+                                  min(min_dates) if None not in min_dates else None,
+                                  max(max_dates) if None not in max_dates else None)
+
+
+def compose_codes_condition(codes: Optional[list], table: str, include_subcodes: bool = False) -> Optional[SqlQuery]:
+    if not codes:
+        return None
+    request_code_column = f'{table}.{cc.code}'
+    return SqlUtil.like_expression(request_code_column, codes) if include_subcodes else \
+        SqlUtil.in_expression(request_code_column, codes)
+
+
+def compose_values_condition(num_value: Optional[str] = None, text_value: Optional[str] = None,
+                             table: Optional[str] = None) -> Optional[SqlQuery]:
+    # values conditions for labs and vitals
+    prefix = f'{table}.' if table is not None else ''
+    if num_value is not None:
+        return SqlUtil.num_value_expression(f'{prefix}{cc.num_value}', num_value)
+    if text_value is not None:
+        return SqlQuery(f'{prefix}{cc.text_value}=%s', (text_value,))
+    return None
+
+
+def compose_attribute_condition(attribute_filter: AttributeFilter, table: str, alias: str,
+                                exclude: bool = False) -> SqlQuery:
+    """
+    Correlated EXISTS subquery for each attribute event, combined by the filter mode.
+    Subqueries of nested attribute events are compiled recursively, every subquery table gets its own alias.
+    :param attribute_filter: attribute events condition
+    :param table: table or alias of the records to check
+    :param alias: alias prefix of the attribute events tables
+    :param exclude: if True, records with the attribute events are excluded (NOT EXISTS)
+    :return: condition
+    """
+    operator = ' and ' if attribute_filter.all_match else ' or '
+    condition = SqlQuery.join(operator, [
+        SqlQuery.concat('exists (', compose_attribute_subquery(e, table, f'{alias}_{i}'), ')')
+        for i, e in enumerate(attribute_filter.events)
+    ])
+    return SqlQuery.concat('not (' if exclude else '(', condition, ')')
+
+
+def compose_attribute_subquery(attribute_event: AttributeEvent, table: str, alias: str) -> SqlQuery:
+    date_col = f'{alias}.{cc.date}'
+    conditions = [f'{alias}.{cc.patient_id} = {table}.{cc.patient_id}']
+    if attribute_event.min_t is not None:
+        conditions.append(SqlQuery(f'{date_col} >= date_add({table}.{cc.date}, interval %s day)',
+                                   (int(attribute_event.min_t),)))
+    if attribute_event.max_t is not None:
+        conditions.append(SqlQuery(f'{date_col} <= date_add({table}.{cc.date}, interval %s day)',
+                                   (int(attribute_event.max_t),)))
+
+    codes_conditions = [
+        compose_codes_condition(list(attribute_event.codes), alias, attribute_event.include_subcodes),
+        compose_codes_condition(list(attribute_event.mapped_codes), alias)
+    ]
+    conditions.append(SqlQuery.join(' or ', codes_conditions, wrap=True))
+    conditions.append(compose_values_condition(attribute_event.num_value, attribute_event.text_value, alias))
+    if attribute_event.having is not None:
+        conditions.append(compose_attribute_condition(attribute_event.having, alias, f'{alias}_having'))
+    if attribute_event.exclusion is not None:
+        conditions.append(compose_attribute_condition(attribute_event.exclusion, alias, f'{alias}_excl', exclude=True))
+
+    where = SqlQuery.join(' and ', conditions, wrap=True)
+    return SqlQuery.concat(f'select 1 from {attribute_event.table} as {alias} where ', where)
+
+
+@lru_cache(maxsize=None)
+def compose_code_columns(table: str, columns: tuple, first_incident: bool = False) -> tuple[tuple, tuple]:
+    """
+    Select columns of the codes request and its group by columns.
+    If first incident is requested, the earliest date is selected for each patient and code
+    :return: tuple of request columns and group by columns
+    """
     request_columns = []
     for c in columns:
         if c == cc.type:
@@ -135,48 +355,140 @@ def get_code_info(codes: list, table: str, columns: list, include_subcodes: bool
             c = f'{table}.{c}'
         request_columns.append(c)
 
-    # group by expression
+    group_by_columns = []
     if first_incident and cc.date in columns:
         date_column = f'{table}.{cc.date}'
-        code_column = f'{table}.{cc.code}'
-        patient_column = f'{table}.{cc.patient_id}'
         request_columns.remove(date_column)
         request_columns.append(f'min({date_column}) as {cc.date}')
-        group_by_expr = f'group by {",".join([patient_column, code_column])}'
-    else:
-        group_by_expr = ''
-    columns_expr = SqlUtil.selected_columns_expr(request_columns)
+        group_by_columns = [f'{table}.{cc.patient_id}', f'{table}.{cc.code}']
+    return tuple(request_columns), tuple(group_by_columns)
+
 
-    # from expression
+@lru_cache(maxsize=None)
+def compose_code_from_expression(table: str, columns: tuple) -> str:
     if cc.type in columns:
-        from_expr = f'{table} left join {ct.encounter} ' \
-                    f'on {table}.{cc.encounter_id} = {ct.encounter}.{cc.encounter_id}'
-    else:
-        from_expr = f'{table}'
+        return f'{table} left join {ct.encounter} ' \
+               f'on {table}.{cc.encounter_id} = {ct.encounter}.{cc.encounter_id}'
+    return f'{table}'
 
-    # date-patient condition
-    date_patient_condition = compose_date_patient_condition(patients_info, cc.date, table)
 
-    # codes condition
-    codes_condition = None
-    if codes:
-        request_code_column = f'{table}.{cc.code}'
-        codes_condition = SqlUtil.like_expression(request_code_column, codes) if include_subcodes else \
-            SqlUtil.in_expression(request_code_column, codes)
+def compose_where(conditions: list) -> Optional[SqlQuery]:
+    where = SqlQuery.join(' and ', conditions, wrap=True)
+    return SqlQuery.concat('where ', where) if where is not None else None
 
-    # values conditions for labs and vitals
-    values_condition = None
-    if num_value is not None:
-        values_condition = f'{cc.num_value}{num_value}'
-    elif text_value is not None:
-        values_condition = f'{cc.text_value}="{text_value}"'
+
+def get_code_info(codes: list, table: str, columns: list, include_subcodes: bool = False,
+                  patients_info: Optional[list] = None, first_incident=False, num_value: str = None,
+                  text_value: str = None, having: Optional[AttributeFilter] = None,
+                  exclusion: Optional[AttributeFilter] = None
+                  ) -> SqlQuery:
+    """
+    Request codes records of the table.
+    Having and exclusion attribute events are checked by correlated subqueries, so only the records with (or without)
+    the attribute events are returned. If first incident is requested, the attribute events are checked for the
+    first incident records.
+    """
+    request_columns, group_by_columns = compose_code_columns(table, tuple(columns), first_incident)
+    columns_expr = SqlUtil.selected_columns_expr(request_columns)
+    group_by_expr = f'group by {",".join(group_by_columns)}' if group_by_columns else ''
+    from_expr = compose_code_from_expression(table, tuple(columns))
+
+    # date-patient condition
+    date_patient_condition = compose_date_patient_condition(patients_info, cc.date, table)
+    date_bounds_condition = compose_date_bounds_condition(patients_info, cc.date, table)
+    codes_condition = compose_codes_condition(codes, table, include_subcodes)
+    values_condition = compose_values_condition(num_value, text_value)
+
+    # the first incident records are selected before the attribute events check
+    records_table = 'first_records' if group_by_columns else table
+    attribute_conditions = []
+    if having is not None:
+        attribute_conditions.append(compose_attribute_condition(having, records_table, 'having'))
+    if exclusion is not None:
+        attribute_conditions.append(compose_attribute_condition(exclusion, records_table, 'excl', exclude=True))
 
     # request body
-    cond_list = [codes_condition, date_patient_condition, values_condition]
-    where = ' and '.join([f"({x})" for x in cond_list if x is not None])
-    where_expr = f'where {where}' if len(where) > 0 else ''
+    cond_list = [codes_condition, date_bounds_condition, date_patient_condition, values_condition]
+    if not group_by_columns:
+        cond_list += attribute_conditions
 
-    request = f"select {columns_expr} from {from_expr} {where_expr} {group_by_expr}"
+    request = SqlQuery.concat(f'select {columns_expr} from {from_expr} ', compose_where(cond_list),
+                              f' {group_by_expr}')
+    if group_by_columns and attribute_conditions:
+        request = SqlQuery.concat('select * from (', request, f') as {records_table} where ',
+                                  SqlQuery.join(' and ', attribute_conditions))
 
     return request
 
+
+def get_batch_code_info(code_sets: list[CodeSet], table: str, columns: list, patients_info: Optional[list] = None,
+                        first_incident=False) -> SqlQuery:
+    """
+    Request records of several code sets from the same table at once. Each code set gets a flag column that is 1 if
+    the record matches the code set, and 0 otherwise. A record can match several code sets.
+    If first incident is requested, the earliest date is selected for each patient, code and flags combination.
+    :param code_sets: code sets to search. Flag column of each code set is added to the result
+    :param table: table where to search codes
+    :param columns: columns to return
+    :param patients_info: list of tuples with min_date, max_date, patients ids for this dates
+    :param first_incident: get only first (earliest) fitted record
+    :return: query
+    """
+    request_columns, group_by_columns = compose_code_columns(table, tuple(columns), first_incident)
+    set_conditions = []
+    flag_columns = []
+    for code_set in code_sets:
+        condition = SqlQuery.join(' and ', [
+            compose_codes_condition(code_set.codes, table, code_set.include_subcodes),
+            compose_values_condition(code_set.num_value, code_set.text_value)
+        ], wrap=True)
+        set_conditions.append(condition)
+        flag_columns.append(SqlQuery.concat('case when ', condition, f' then 1 else 0 end as {code_set.flag}'))
+    if group_by_columns:
+        group_by_columns += tuple(code_set.flag for code_set in code_sets)
+    columns_expr = SqlQuery.join(',', [SqlUtil.selected_columns_expr(request_columns)] + flag_columns)
+    group_by_expr = f'group by {",".join(group_by_columns)}' if group_by_columns else ''
+    from_expr = compose_code_from_expression(table, tuple(columns))
+
+    sets_condition = SqlQuery.join(' or ', set_conditions, wrap=True)
+    date_patient_condition = compose_date_patient_condition(patients_info, cc.date, table)
+    date_bounds_condition = compose_date_bounds_condition(patients_info, cc.date, table)
+    cond_list = [sets_condition, date_bounds_condition, date_patient_condition]
+
+    return SqlQuery.concat('select ', columns_expr, f' from {from_expr} ', compose_where(cond_list),
+                           f' {group_by_expr}')
+
+
+def get_code_absence_windows(codes: list, table: str, patients_info: list, include_subcodes: bool = False,
+                             mapped_codes: Optional[list] = None, num_value: Optional[str] = None,
+                             text_value: Optional[str] = None) -> SqlQuery:
+    """
+    Request patient windows without the codes records. The patient table is the source of the windows patients, and
+    the codes records are checked by NOT EXISTS subquery, so only the windows without records are returned.
+    :param codes: codes to search
+    :param table: table where to search codes
+    :param patients_info: list of tuples with min_date, max_date, patients ids for this dates. None date means the
+    window is unbounded from that side
+    :param include_subcodes: search subcodes of the codes
+    :param mapped_codes: codes searched exactly in addition to the codes (e.g. ICD9 analogs)
+    :param num_value: numerical value condition for labs and vitals
+    :param text_value: text value condition for labs and vitals
+    :return: query of patient id and window end date as the date column
+    """
+    alias = 'positive'
+    codes_condition = SqlQuery.join(' or ', [compose_codes_condition(codes, alias, include_subcodes),
+                                             compose_codes_condition(mapped_codes, alias)], wrap=True)
+    values_condition = compose_values_condition(num_value, text_value, alias)
+
+    requests = []
+    for min_date, max_date, patients in patients_info:
+        conditions = [f'{alias}.{cc.patient_id} = {ct.patient}.{cc.patient_id}', codes_condition, values_condition,
+                      compose_date_condition(f'{alias}.{cc.date}', min_date, max_date)]
+        where = SqlQuery.join(' and ', conditions, wrap=True)
+        date_expr = SqlQuery('%s', (str(max_date),)) if max_date is not None else 'null'
+        requests.append(SqlQuery.concat(
+            f'select {ct.patient}.{cc.patient_id}, ', date_expr, f' as {cc.date} from {ct.patient} where ',
+            SqlUtil.in_expression(f'{ct.patient}.{cc.patient_id}', patients),
+            f' and not exists (select 1 from {table} as {alias} where ', where, ')'
+        ))
+    return SqlQuery.join(' union all ', requests)
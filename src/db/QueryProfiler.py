@@ -0,0 +1,133 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
+
+from src.datamodel.QueryRecord import QueryRecord
+from src.db.SqlDataElement import SqlQuery
+
+
+class QueryProfiler:
+    """
+    Capture of the database queries. Every query executed by the manager is appended as a JSON line of QueryRecord
+    to the queries-<pid>.jsonl file of the query log directory, so the worker processes of a study write their own
+    files. The calling stage of the query (study, group, level, event id, cohort) is kept in a context variable:
+    it is set with stage() by the use cases and follows the requests to the thread pools of ConcurrentUtil and to the
+    greenlets of the async manager, which run the requests in a copy of the caller context.
+    """
+    file_prefix = 'queries-'
+    __stage = contextvars.ContextVar('query_stage', default={})
+    __lock = threading.Lock()
+
+    def __init__(self, log_dir: str):
+        """
+        :param log_dir: query log directory, created if it does not exist
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    @contextmanager
+    def stage(**values):
+        """Set the stage values of the queries executed within the context, e.g. stage(level=1)"""
+        token = QueryProfiler.__stage.set(QueryProfiler.__stage.get() | values)
+        try:
+            yield
+        finally:
+            QueryProfiler.__stage.reset(token)
+
+    @staticmethod
+    def current_stage() -> dict:
+        return dict(QueryProfiler.__stage.get())
+
+    @staticmethod
+    def call_in_stage(f: Callable, params: tuple, **values):
+        """Call the function with the params in the stage"""
+        with QueryProfiler.stage(**values):
+            return f(*params)
+
+    @staticmethod
+    def fingerprint(template: str) -> str:
+        """
+        Hash of the template with the whitespaces collapsed and the lists of placeholders replaced with a single one,
+        so the queries of the same shape with different numbers of the values have the same fingerprint
+        """
+        normalized = re.sub(r'\s+', ' ', template.strip())
+        normalized = re.sub(r'%s(\s*,\s*%s)+', '%s', normalized)
+        return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+    def run(self, sql_query: SqlQuery, f: Callable):
+        """
+        Execute the query function and capture the query. Errors are captured and raised
+        :param sql_query: executed query
+        :param f: function executing the query and returning a data frame or a tuple of rows
+        :return: result of the function
+        """
+        start = time.time()
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            result = f()
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.__write(self.__make_record(sql_query, start, latency_ms, result, error))
+
+    def __make_record(self, sql_query: SqlQuery, start: float, latency_ms: float, result, error: Optional[str]
+                      ) -> QueryRecord:
+        params = [p.item() if hasattr(p, 'item') else p for p in sql_query.params]
+        if isinstance(result, pd.DataFrame):
+            rows, result_bytes = len(result), int(result.memory_usage(index=False, deep=True).sum())
+        elif result is not None:
+            rows, result_bytes = len(result), sum(len(str(v)) for row in result for v in row)
+        else:
+            rows, result_bytes = 0, 0
+        return QueryRecord(
+            start=start,
+            fingerprint=self.fingerprint(sql_query.template),
+            template=sql_query.template,
+            params=params,
+            sql_bytes=len(sql_query.template.encode()) + sum(len(str(p)) for p in params),
+            params_count=len(params),
+            latency_ms=latency_ms,
+            rows=rows,
+            result_bytes=result_bytes,
+            stage=self.current_stage(),
+            pid=os.getpid(),
+            thread=threading.current_thread().name,
+            error=error
+        )
+
+    def __write(self, record: QueryRecord):
+        line = json.dumps(record.to_dict(), default=str) + '\n'
+        # the file is opened per record, so the forked worker processes never share a file object
+        with QueryProfiler.__lock, open(self.log_dir / f'{self.file_prefix}{os.getpid()}.jsonl', 'a') as f:
+            f.write(line)
+
+    @staticmethod
+    def read(query_log: str) -> list[QueryRecord]:
+        """
+        Read the captured queries
+        :param query_log: query log directory or a single queries file
+        :return: queries in the start time order
+        """
+        path = Path(query_log)
+        files = sorted(path.glob(f'{QueryProfiler.file_prefix}*.jsonl')) if path.is_dir() else [path]
+        records = []
+        for file in files:
+            with open(file) as f:
+                records.extend(QueryRecord.from_dict(json.loads(line)) for line in f if line.strip())
+        return sorted(records, key=lambda r: r.start)
@@ -1,7 +1,8 @@
+import copy
 from dataclasses import dataclass
 from typing import Optional
 
-from src.datamodel.DataColumns import DataDictionaryColumns as dd
+from src.datamodel.DataColumns import DataDictionaryColumns as dd, CommonColumns as cc, CommonTables as ct
 
 import pandas as pd
 
@@ -17,6 +18,168 @@ class ForeignKey:
                f'ON DELETE SET NULL'
 
 
+@dataclass(frozen=True)
+class SqlIndex:
+    name: str
+    columns: tuple
+
+    def __str__(self):
+        return f'INDEX {self.name} ({", ".join(self.columns)})'
+
+
+@dataclass(frozen=True)
+class SqlPartition:
+    method: str
+    column_name: str
+    first_year: Optional[int] = None
+    last_year: Optional[int] = None
+    partitions: Optional[int] = None
+
+    def __str__(self):
+        if self.method == dd.partition_key:
+            return f'PARTITION BY KEY ({self.column_name}) PARTITIONS {self.partitions}'
+        # yearly partitions, records before the first year go to the first partition
+        ranges = [f"PARTITION p{y} VALUES LESS THAN ('{y + 1}-01-01')"
+                  for y in range(self.first_year, self.last_year + 1)]
+        ranges.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+        return f'PARTITION BY RANGE COLUMNS ({self.column_name}) ({", ".join(ranges)})'
+
+
+@dataclass(frozen=True)
+class CodeSet:
+    """
+    Codes condition of the batch codes request. Records matched the condition are marked by the flag column
+    """
+    flag: str
+    codes: tuple
+    include_subcodes: bool = False
+    num_value: Optional[str] = None
+    text_value: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class AttributeEvent:
+    """
+    Attribute event of the codes request. A request record has the attribute event if the table has a record of the
+    same patient within [date + min_t, date + max_t] days of the request record date. None bound means the window is
+    unbounded from that side.
+    Mapped codes (e.g. ICD9 analogs of the codes) are searched as exact codes in addition to the codes.
+    Attribute event can have its own having and exclusion attribute events.
+    """
+    table: str
+    codes: tuple
+    include_subcodes: bool = False
+    mapped_codes: tuple = ()
+    num_value: Optional[str] = None
+    text_value: Optional[str] = None
+    min_t: Optional[int] = None
+    max_t: Optional[int] = None
+    having: Optional['AttributeFilter'] = None
+    exclusion: Optional['AttributeFilter'] = None
+
+
+@dataclass(frozen=True)
+class AttributeFilter:
+    """
+    Attribute events condition of the codes request. If all match flag is True, a record should have all attribute
+    events, otherwise any of them.
+    """
+    events: tuple[AttributeEvent, ...]
+    all_match: bool = False
+
+
+@dataclass(frozen=True)
+class SqlQuery:
+    """
+    SQL template with %s placeholders and the values bound to them. Values are escaped by the driver on execution,
+    so queries of the same shape have the same template whatever the values are.
+    Literal % signs of the template are doubled.
+    """
+    template: str
+    params: tuple = ()
+
+    @staticmethod
+    def concat(*parts) -> 'SqlQuery':
+        """
+        Concatenate query parts in order. A string part is a literal SQL text, None parts are skipped
+        """
+        templates, params = [], []
+        for part in parts:
+            if part is None:
+                continue
+            if isinstance(part, SqlQuery):
+                templates.append(part.template)
+                params.extend(part.params)
+            else:
+                templates.append(str(part).replace('%', '%%'))
+        return SqlQuery(''.join(templates), tuple(params))
+
+    @staticmethod
+    def join(separator: str, parts, wrap: bool = False) -> Optional['SqlQuery']:
+        """
+        Join query parts by the separator, None parts are skipped
+        :param separator: literal SQL separator, e.g. ' and '
+        :param parts: query or string parts
+        :param wrap: if True, every part is enclosed in parentheses
+        :return: joined query or None if there are no parts
+        """
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            return None
+        items = []
+        for i, part in enumerate(parts):
+            if i > 0:
+                items.append(separator)
+            items += ['(', part, ')'] if wrap else [part]
+        return SqlQuery.concat(*items)
+
+    def __str__(self):
+        # rendered query for logs only, it is never executed
+        return self.template % tuple(repr(p) for p in self.params) if self.params else self.template.replace('%%', '%')
+
+
+@dataclass(frozen=True)
+class SurrogateKey:
+    """
+    Mapping of natural string ids of a column to dense integer ids stored in the key table.
+    Ids are registered in the key table from the data files of the source tables, None means every table that has
+    the column.
+    """
+    table_name: str
+    column_name: str
+    source_tables: Optional[tuple] = None
+
+    def is_registered_by(self, table_name: str) -> bool:
+        return self.source_tables is None or table_name in self.source_tables
+
+
+surrogate_key_type = 'INT UNSIGNED'
+# patient ids of all tables must exist in the patient table, encounter ids can be absent in the encounter table
+default_surrogate_keys = (
+    SurrogateKey(ct.patient_key, cc.patient_id, (ct.patient,)),
+    SurrogateKey(ct.encounter_key, cc.encounter_id)
+)
+
+
+# Covering indexes for the event queries built by QueryBuilder.get_code_info: every request filters by
+# code IN/LIKE, patient_id IN and a date range and reads patient_id, code and date only. The second index serves
+# requests without codes (all records of the patients within the dates).
+_fact_table_indexes = (
+    SqlIndex('idx_code_patient_date', (cc.code, cc.patient_id, cc.date)),
+    SqlIndex('idx_patient_date_code', (cc.patient_id, cc.date, cc.code))
+)
+recommended_indexes = {
+    ct.diagnosis: _fact_table_indexes,
+    ct.medication: _fact_table_indexes,
+    ct.procedures: _fact_table_indexes,
+    ct.lab_result: _fact_table_indexes,
+    ct.vital_sign: _fact_table_indexes,
+    ct.code_description: (SqlIndex('idx_code_code_system', (cc.code, cc.code_system)),),
+    ct.icd9_map_icd10: (SqlIndex('idx_icd10_icd9', (cc.icd10_code, cc.icd9_code)),
+                        SqlIndex('idx_icd9_icd10', (cc.icd9_code, cc.icd10_code)))
+}
+
+
 class SqlColumn:
     int16_cols = {
         "line",
@@ -45,9 +208,13 @@ class SqlColumn:
         "lab_result_num_val",
         "value"
     }
+    # the columns of the compiled schema are shared by its tables and must not be modified in place, with_type
+    # returns a modified copy. The slots only reduce the size of the pickled schema, they do not prevent changes
+    __slots__ = ('name', 'type', 'dtype', 'length', 'is_nullable', 'is_pk', 'is_index', 'foreign_key',
+                 'composite_indexes', 'partition')
 
     def __init__(self, name: str, data_type: str, length: int, is_nullable: bool, is_primary_key: bool,
-                 is_index: bool, foreign_key: str = None):
+                 is_index: bool, foreign_key: str = None, index_spec: str = None, partition_spec: str = None):
         self.name = name.strip()
         self.type = data_type
         self.dtype = self.__get_dtype()
@@ -56,6 +223,24 @@ class SqlColumn:
         self.is_pk = is_primary_key
         self.is_index = is_index
         self.foreign_key = self.parse_foreign_key(foreign_key)
+        self.composite_indexes = self.parse_index_spec(index_spec)
+        self.partition = self.parse_partition(partition_spec)
+
+    def __repr__(self):
+        return f'SqlColumn({self.name} {self.type})'
+
+    def with_type(self, data_type: str, length: Optional[int] = None) -> 'SqlColumn':
+        """
+        Copy of the column with another SQL type
+        :param data_type: SQL data type
+        :param length: length of the type
+        :return: new column
+        """
+        column = copy.copy(self)
+        column.type = data_type
+        column.length = None if length is None else str(length)
+        column.dtype = column.__get_dtype()
+        return column
 
     def __get_dtype(self):
         if self.name in self.int64_cols:
@@ -64,6 +249,9 @@ class SqlColumn:
             return pd.UInt16Dtype()
         if self.name in self.float_cols:
             return float
+        # surrogate ids of the key columns, null for the nullable keys
+        if self.type == surrogate_key_type:
+            return pd.UInt32Dtype()
         return str
 
     def parse_foreign_key(self, foreign_key: Optional[str]) -> Optional[ForeignKey]:
@@ -75,12 +263,61 @@ class SqlColumn:
             return None
         return ForeignKey(self.name, table, column)
 
+    def parse_partition(self, partition_spec: Optional[str]) -> Optional[SqlPartition]:
+        """
+        Parse table partitioning by the column
+        :param partition_spec: "RANGE:first_year:last_year" for yearly range partitions of a date column or
+        "KEY:partitions_number" for hash partitions
+        :return: partition definition or None if the table is not partitioned by the column
+        """
+        if partition_spec is None or str(partition_spec).strip() in ('', 'nan'):
+            return None
+        items = [x.strip() for x in str(partition_spec).split(dd.partition_separator)]
+        method = items[0].upper()
+        if method == dd.partition_range and len(items) == 3:
+            return SqlPartition(method, self.name, first_year=int(items[1]), last_year=int(items[2]))
+        if method == dd.partition_key and len(items) == 2:
+            return SqlPartition(method, self.name, partitions=int(items[1]))
+        raise ValueError(f'Invalid partition definition "{partition_spec}" for column {self.name}')
+
+    @staticmethod
+    def parse_index_spec(index_spec: Optional[str]) -> list[tuple[str, int]]:
+        """
+        Parse composite indexes the column belongs to.
+        :param index_spec: value of the data dictionary Index column, e.g. "Yes;idx_code_date:0".
+        Each "index_name:position" item adds the column into a multi-column index at the given position
+        :return: list of tuples (index name, column position)
+        """
+        if index_spec is None or str(index_spec) == 'nan':
+            return []
+        res = []
+        for item in str(index_spec).split(dd.index_separator):
+            if dd.index_position_separator not in item:
+                continue
+            name, position = item.split(dd.index_position_separator)
+            res.append((name.strip(), int(position)))
+        return res
+
 
 class SqlTable:
-    def __init__(self, name: str, src: Optional[str], columns: list[SqlColumn]):
+    def __init__(self, name: str, src: Optional[str], columns: list[SqlColumn], use_recommended_indexes: bool = True):
         self.name = name
         self.src_file = src
         self.columns = columns
+        self.use_recommended_indexes = use_recommended_indexes
+        self.surrogate_keys: list[SurrogateKey] = []
+
+    def apply_surrogate_keys(self, keys) -> 'SqlTable':
+        """
+        Store integer surrogate ids instead of natural ids in the key columns of the table
+        :param keys: list of SurrogateKey
+        :return: self
+        """
+        names = self.column_names()
+        self.surrogate_keys = [k for k in keys if k.column_name in names]
+        key_columns = {k.column_name for k in self.surrogate_keys}
+        self.columns = [c.with_type(surrogate_key_type) if c.name in key_columns else c for c in self.columns]
+        return self
 
     def column_names(self) -> list[str]:
         return [c.name for c in self.columns]
@@ -89,18 +326,58 @@ class SqlTable:
         return [f'{c.type}({c.length})' if c.length is not None else c.type
                 for c in self.columns]
 
+    def not_null_columns(self) -> list[str]:
+        """Key columns of the surrogate keys that are not nullable, the records of unknown ids are not loaded"""
+        key_columns = {k.column_name for k in self.surrogate_keys}
+        return [c.name for c in self.columns if c.name in key_columns and not c.is_nullable]
+
     def primary_keys(self) -> list[str]:
         return [c.name for c in self.columns if c.is_pk]
 
+    @property
+    def partition(self) -> Optional[SqlPartition]:
+        return next((c.partition for c in self.columns if c.partition is not None), None)
+
     def foreign_keys(self):
+        # MariaDB does not support foreign keys for partitioned tables
+        if self.partition is not None:
+            return []
         return [c.foreign_key for c in self.columns if c.foreign_key is not None]
 
     def foreign_key_names(self):
-        return [c.foreign_key.column_name for c in self.columns if c.foreign_key is not None]
+        return [fk.column_name for fk in self.foreign_keys()]
 
     def indexes(self):
         return [c.name for c in self.columns if c.is_index]
 
+    def composite_indexes(self) -> list[SqlIndex]:
+        """
+        Multi-column indexes defined in the data dictionary followed by the recommended ones for the table.
+        Recommended indexes are added only if all their columns exist in the table.
+        """
+        groups = {}
+        for c in self.columns:
+            for name, position in c.composite_indexes:
+                groups.setdefault(name, []).append((position, c.name))
+        res = [SqlIndex(name, tuple(c for _, c in sorted(cols))) for name, cols in groups.items()]
+        if self.use_recommended_indexes:
+            names = set(self.column_names())
+            res += [i for i in recommended_indexes.get(self.name, ())
+                    if set(i.columns) <= names and i.columns not in [x.columns for x in res]]
+        return res
+
+    def index_definitions(self) -> list[SqlIndex]:
+        """
+        All indexes to create after data upload.
+        Single column index is skipped if the column is a leading column of a multi-column index
+        or MariaDB creates an index for it automatically (PK and FK).
+        """
+        composite = self.composite_indexes()
+        leading_columns = {i.columns[0] for i in composite}
+        single = [SqlIndex(f'idx_{c}', (c,)) for c in self.indexes()
+                  if c not in self.primary_keys() and c not in self.foreign_key_names() and c not in leading_columns]
+        return single + composite
+
     def get_dtypes(self):
         # due to values inconsistency all columns read as string
         return {c.name: c.dtype for c in self.columns}
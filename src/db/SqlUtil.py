@@ -1,13 +1,60 @@
-def in_expression(column, values):
-    l = [f"'{x}'" for x in values]
-    s = ','.join(l)
-    return f'{column} in ({s})'
+import re
+from functools import lru_cache
+from numbers import Integral
 
+from src.db.SqlDataElement import SqlQuery
 
-def like_expression(column, values):
-    chunks = [f"{column} LIKE '{val}%'" for val in values]
-    like_exp = ' OR '.join(chunks)
-    return like_exp
+num_value_pattern = re.compile(r'^\s*(>=|<=|<>|!=|=|>|<)\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*$')
+
+
+def sql_value(value):
+    # integer ids (e.g. surrogate keys) are bound as numbers to keep comparison numeric, other values as strings
+    return int(value) if isinstance(value, Integral) else str(value)
+
+
+def list_size(n: int) -> int:
+    """
+    Number of placeholders of a values list. Lists are padded to the power of two sizes, so the requests with
+    different numbers of patients or codes share a few templates
+    """
+    return 1 << max(n - 1, 0).bit_length()
+
+
+@lru_cache(maxsize=None)
+def in_template(column: str, size: int) -> str:
+    return f'{column} in ({",".join(["%s"] * size)})'
+
+
+@lru_cache(maxsize=None)
+def like_template(column: str, size: int) -> str:
+    return ' OR '.join([f'{column} LIKE %s'] * size)
+
+
+def in_expression(column, values) -> SqlQuery:
+    values = [sql_value(x) for x in values]
+    if not values:
+        return SqlQuery(f'{column} in (null)')
+    size = list_size(len(values))
+    # padding repeats the last value, it does not change the condition
+    values += values[-1:] * (size - len(values))
+    return SqlQuery(in_template(column, size), tuple(values))
+
+
+def like_expression(column, values) -> SqlQuery:
+    values = [f'{x}%' for x in values]
+    return SqlQuery(like_template(column, len(values)), tuple(values))
+
+
+def num_value_expression(column: str, num_value: str) -> SqlQuery:
+    """
+    Numeric value condition
+    :param column: value column
+    :param num_value: operation sign and value, e.g. ">18", "<=0.01"
+    """
+    match = num_value_pattern.match(num_value)
+    if match is None:
+        raise ValueError(f'Invalid numeric value condition "{num_value}"')
+    return SqlQuery(f'{column}{match.group(1)}%s', (float(match.group(2)),))
 
 
 def selected_columns_expr(columns, prefix=None):
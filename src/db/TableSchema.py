@@ -0,0 +1,142 @@
+import logging
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.DataColumns import DataDictionaryColumns as dd
+from src.db.SqlDataElement import SqlColumn, SqlTable
+
+date_types = ('DATETIME', 'DATE')
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    name: str
+    file_name: str
+    columns: tuple[SqlColumn, ...]
+    date_columns: tuple[str, ...]
+
+    def dtypes(self) -> dict:
+        return {c.name: c.dtype for c in self.columns}
+
+
+@dataclass(frozen=True)
+class TableSchema:
+    """
+    Tables of the data model compiled from the data dictionary. The schema is built once and pickled to the cache
+    directory and next to the converted data files, so the conversion workers and the import read it without
+    parsing the data dictionary. A pickled schema is used while its version, the size and the modification time of
+    the data dictionary are the same as the compiled ones.
+    """
+    source: tuple
+    tables: tuple[TableSpec, ...]
+
+    file_name = 'table_schema.pickle'
+    # version of the compiled schema, increase it when the compilation or the pickled classes TableSchema, TableSpec
+    # and SqlColumn are changed, so the schemas pickled by the previous code are compiled again
+    version = 2
+    __logger = logging.getLogger('TableSchema')
+
+    @classmethod
+    def signature(cls, data_dictionary_file: Path) -> tuple:
+        stat = Path(data_dictionary_file).stat()
+        return cls.version, stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def compile(cls, data_dictionary_file: Path) -> 'TableSchema':
+        """
+        Compile the schema of the data dictionary
+        :param data_dictionary_file: data dictionary csv file
+        :return: schema
+        """
+        cls.__logger.debug(f'Compile schema of {data_dictionary_file}')
+        df = pd.read_csv(data_dictionary_file)
+        if dd.partition not in df.columns:
+            df[dd.partition] = None
+        index_items = df[dd.index].astype(str).str.split(dd.index_separator)
+        df = df.assign(**{
+            dd.nullable: df[dd.nullable] == dd.val_yes,
+            dd.primary_key: df[dd.primary_key] == dd.val_yes,
+            'is_index': [dd.val_yes in items for items in index_items],
+            dd.foreign_key: df[dd.foreign_key].fillna('')
+        })
+        tables = []
+        for table_name, t in df.groupby(dd.table_name, sort=False):
+            columns = tuple(SqlColumn(*values) for values in zip(
+                t[dd.column_name], t[dd.data_type], t[dd.length], t[dd.nullable], t[dd.primary_key], t['is_index'],
+                t[dd.foreign_key], t[dd.index], t[dd.partition]))
+            cls.__check_partition(table_name, columns)
+            date_columns = tuple(dict.fromkeys(c.name for c in columns if c.type in date_types))
+            tables.append(TableSpec(table_name, t[dd.file_name].iloc[0], columns, date_columns))
+        return cls(cls.signature(data_dictionary_file), tuple(tables))
+
+    @staticmethod
+    def __check_partition(table_name: str, columns: tuple[SqlColumn, ...]):
+        """
+        MariaDB partitions a table by one column only, and the primary key of a partitioned table must include it
+        :raise ValueError: if the partitioning of the table can not be created
+        """
+        partition_columns = [c.name for c in columns if c.partition is not None]
+        if not partition_columns:
+            return
+        if len(partition_columns) > 1:
+            raise ValueError(f'Table {table_name} is partitioned by more than one column: {partition_columns}')
+        primary_keys = [c.name for c in columns if c.is_pk]
+        if primary_keys and partition_columns[0] not in primary_keys:
+            raise ValueError(f'Table {table_name} is partitioned by {partition_columns[0]}, which is not in its '
+                             f'primary key {primary_keys}')
+
+    @classmethod
+    def load(cls, data_dictionary_file: Path, schema_dir: Optional[Path] = None) -> 'TableSchema':
+        """
+        Load the pickled schema of the data dictionary. The schema is compiled and saved to the directory if it is
+        not found or outdated
+        :param data_dictionary_file: data dictionary csv file
+        :param schema_dir: directory of the pickled schema
+        :return: schema
+        """
+        file_path = None if schema_dir is None else Path(schema_dir) / cls.file_name
+        if file_path is not None and file_path.exists():
+            try:
+                with open(file_path, 'rb') as f:
+                    schema = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError) as e:
+                # the file is damaged or pickled by an incompatible code
+                cls.__logger.debug(f'Table schema {file_path} is not loaded: {e}')
+                schema = None
+            if isinstance(schema, cls) and schema.source == cls.signature(data_dictionary_file):
+                return schema
+        schema = cls.compile(data_dictionary_file)
+        if schema_dir is not None:
+            schema.save(schema_dir)
+        return schema
+
+    def save(self, schema_dir: Path):
+        file_path = Path(schema_dir) / self.file_name
+        try:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = file_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(file_path)
+        except OSError as e:
+            self.__logger.warning(f'Table schema is not saved: {e}')
+
+    def table(self, table_name: str) -> Optional[TableSpec]:
+        return next((t for t in self.tables if t.name == table_name), None)
+
+    def date_columns(self, table_name: str) -> tuple[str, ...]:
+        table = self.table(table_name)
+        return () if table is None else table.date_columns
+
+    def sql_tables(self, files_path: str) -> list[SqlTable]:
+        """
+        Tables of the schema with the data files in the path. The tables share the schema columns, which are
+        replaced and not modified by the tables
+        :param files_path: path of the data files
+        :return: list of tables
+        """
+        return [SqlTable(name=t.name, src=f'{files_path}/{t.file_name}', columns=list(t.columns)) for t in self.tables]
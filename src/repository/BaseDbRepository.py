@@ -7,19 +7,24 @@ import pandas as pd
 
 from src.datamodel.CodeFormat import CodeFormat
 from src.db.DatabaseManager import DatabaseManager
-from src.util.ConcurrentUtil import ConcurrentUtil
-from src.datamodel.Event import Event
+from src.db.SqlDataElement import AttributeEvent, AttributeFilter, CodeSet
+from src.util.FrameSchema import FrameSchema
+from src.util.IntervalJoin import IntervalJoin
+from src.datamodel.Event import AttributeMode, Event, EventCategory, EventTimeInterval
 from src.datamodel.DataColumns import CommonColumns as cc
 
 
 class BaseDbRepository(metaclass=ABCMeta):
+    __flag_prefix = 'event_flag_'
 
     def __init__(self, db_manager: DatabaseManager):
         self.logger = logging.getLogger(type(self).__name__)
         self.db_manager = db_manager
 
     def _get_codes_info(self, event: Event, columns: list, date_patient_map: Optional[dict] = None,
-                        include_icd9: bool = False, first_incident: bool = False) -> Optional[pd.DataFrame]:
+                        include_icd9: bool = False, first_incident: bool = False,
+                        having: Optional[AttributeFilter] = None,
+                        exclusion: Optional[AttributeFilter] = None) -> Optional[pd.DataFrame]:
         """
         Get codes info
         Codes can have two formats:
@@ -41,6 +46,8 @@ class BaseDbRepository(metaclass=ABCMeta):
         their info will be added to the result. In the end all ICD9 codes will be converted to the corresponded ICD10.
         WARNING!!! Initial ICD9 codes will not be converted to ICD10 during the event search
         :param first_incident: get only first (earliest) fitted record for each patient
+        :param having: attribute events the records should have, checked by the database
+        :param exclusion: attribute events the records should not have, checked by the database
         :return: dataframe from table with columns or None
         """
         self.logger.debug(f'_get_codes_info: codes = {event.codes}')
@@ -49,38 +56,186 @@ class BaseDbRepository(metaclass=ABCMeta):
         patient_groups = self._group_patient_params(date_patient_map) if date_patient_map else [None]
 
         params = [(event.codes, event.get_data_table(), columns, patient_info, include_icd9, first_incident,
-                   event.negation, event.include_subcodes, event.num_value, event.text_value)
+                   event.negation, event.include_subcodes, event.num_value, event.text_value, having, exclusion)
                   for patient_info in patient_groups]
 
         self.db_manager.open_ssh_tunnel()
-        res_dfs = ConcurrentUtil.do_async_job(self.__get_code_info_job, params)
+        res_dfs = self.db_manager.map_requests(self.__get_code_info_job, params)
         self.db_manager.close_ssh_tunnel()
         self.logger.debug(f'concat result of {len(res_dfs)}')
-        df = pd.concat(res_dfs) \
-            if res_dfs and any([x is not None for x in res_dfs]) \
-            else None
-        self.logger.debug(f'return codes info for {event.id} with {df.shape} records')
+        df = FrameSchema.concat(res_dfs) if res_dfs else None
+        self.logger.debug(f'return codes info for {event.id} with {None if df is None else df.shape} records')
         return df
 
+    def _get_batch_codes_info(self, events: list[Event], columns: list, date_patient_map: Optional[dict] = None,
+                              include_icd9: bool = False, first_incident: bool = False) -> list:
+        """
+        Get codes info of several events in one request per patients group. The events should have the same data
+        table and should not be negation events. Each event is a code set with its flag column in the request, so the
+        table is scanned once for all events, and the result is split by the flags.
+        Codes of each event are processed in the same way as in _get_codes_info.
+        :param events: events with the same data table
+        :param columns: list of columns to request
+        :param date_patient_map: map of (start_date, end_date) on patients ids to get codes for
+        :param include_icd9: if True, ICD9 analogs of ICD10 codes are searched too and converted to ICD10
+        :param first_incident: get only first (earliest) fitted record for each patient
+        :return: list of dataframes or None values in the events order
+        """
+        self.logger.debug(f'_get_batch_codes_info: events = {[e.id for e in events]}')
+        table_name = events[0].get_data_table()
+        patient_groups = self._group_patient_params(date_patient_map) if date_patient_map else [None]
+
+        self.db_manager.open_ssh_tunnel()
+        icd9_maps = None
+        if include_icd9:
+            params = [(e.codes, table_name, e.include_subcodes) for e in events]
+            icd9_maps = self.db_manager.map_requests(self.__get_icd10_to_icd9_map, params, ordered=True)
+
+        code_sets = []
+        for i, e in enumerate(events):
+            code_sets.append(CodeSet(self.__event_flag(i), tuple(e.codes), e.include_subcodes, e.num_value,
+                                     e.text_value))
+            if icd9_maps is not None and icd9_maps[i] is not None:
+                code_sets.append(CodeSet(self.__event_flag(i, icd9=True), tuple(icd9_maps[i][cc.icd9_code].unique()),
+                                         False, e.num_value, e.text_value))
+        # code column is needed to split the result
+        query_columns = columns if cc.code in columns else columns + [cc.code]
+
+        params = [(events, code_sets, table_name, query_columns, columns, patient_info, icd9_maps, first_incident)
+                  for patient_info in patient_groups]
+        res_dfs = self.db_manager.map_requests(self.__get_batch_code_info_job, params)
+        self.db_manager.close_ssh_tunnel()
+        return [FrameSchema.concat([r[i] for r in res_dfs]) for i in range(len(events))]
+
+    def __get_batch_code_info_job(self, events: list[Event], code_sets: list[CodeSet], table_name: str,
+                                  query_columns: list, columns: list, patients_info: Optional[list],
+                                  icd9_maps: Optional[list], first_incident: bool) -> list:
+        self.logger.debug(f'__get_batch_code_info_job: table={table_name}')
+        df = self.db_manager.request_batch_code_info(code_sets, table_name, query_columns, patients_info,
+                                                     first_incident)
+        res = []
+        for i, e in enumerate(events):
+            event_df = self.__split_batch_codes_info(df, self.__event_flag(i), columns, first_incident)
+            icd9_df = None
+            if icd9_maps is not None:
+                icd9_df = pd.DataFrame() if icd9_maps[i] is None else self.__convert_icd9_to_icd10(
+                    self.__split_batch_codes_info(df, self.__event_flag(i, icd9=True), columns, first_incident),
+                    icd9_maps[i]
+                )
+            event_df = self.__combine_positive_event_codes(event_df, icd9_df, e.codes, e.include_subcodes,
+                                                           first_incident)
+            res.append(FrameSchema.apply(event_df))
+        return res
+
+    @staticmethod
+    def __split_batch_codes_info(df: Optional[pd.DataFrame], flag: str, columns: list,
+                                 first_incident: bool) -> Optional[pd.DataFrame]:
+        if df is None:
+            return None
+        df = df[df[flag] == 1]
+        if first_incident and cc.date in columns:
+            # batch request selects the earliest record for each flags combination, so the earliest record of the
+            # event is the earliest one among the combinations with the event flag
+            df = df.sort_values(cc.date, kind='stable').drop_duplicates([cc.patient_id, cc.code])
+        return df[columns].drop_duplicates()
+
+    def __event_flag(self, event_number: int, icd9: bool = False) -> str:
+        return f'{self.__flag_prefix}{event_number}' + ('_icd9' if icd9 else '')
+
+    def _get_attribute_filters(self, event: Event, include_icd9: bool = False,
+                               first_incident: bool = False) -> Optional[tuple]:
+        """
+        Compile having and exclusion attribute events of the event to the filters checked by the database.
+        Negation, patient and codeless attribute events can not be compiled. First incident of the event with subcodes
+        is selected after the subcodes conversion, so its attribute events can not be checked by the database as well.
+        :param event: event with attribute events
+        :param include_icd9: if True, ICD9 analogs of the attribute events codes are searched too
+        :param first_incident: the event records are the first incident records
+        :return: tuple of having and exclusion filters (each can be None) or None if the event is not supported
+        """
+        if not event.has_attribute_events() or not self.__is_attribute_filter_supported(event):
+            return None
+        if first_incident and event.include_subcodes:
+            return None
+        self.logger.debug(f'_get_attribute_filters: event = {event.id}')
+        self.db_manager.open_ssh_tunnel()
+        having = self.__make_attribute_filter(event.having_events, event.having_period, event.inclusion_mode,
+                                              include_icd9)
+        exclusion = self.__make_attribute_filter(event.exclusion_events, event.exclusion_period,
+                                                 event.exclusion_mode, include_icd9)
+        self.db_manager.close_ssh_tunnel()
+        return having, exclusion
+
+    def __is_attribute_filter_supported(self, event: Event) -> bool:
+        for e in (event.having_events or []) + (event.exclusion_events or []):
+            if e.negation or not e.codes or e.category == EventCategory.Patient:
+                return False
+            if not self.__is_attribute_filter_supported(e):
+                return False
+        return True
+
+    def __make_attribute_filter(self, events: Optional[list[Event]], period: Optional[EventTimeInterval],
+                                mode: AttributeMode, include_icd9: bool) -> Optional[AttributeFilter]:
+        if not events:
+            return None
+        return AttributeFilter(tuple([self.__make_attribute_event(e, period, include_icd9) for e in events]),
+                               all_match=mode == AttributeMode.all)
+
+    def __make_attribute_event(self, event: Event, period: Optional[EventTimeInterval],
+                               include_icd9: bool) -> AttributeEvent:
+        table_name = event.get_data_table()
+        mapped_codes = ()
+        if include_icd9:
+            icd10_to_icd9_map_df = self.__get_icd10_to_icd9_map(event.codes, table_name, event.include_subcodes)
+            if icd10_to_icd9_map_df is not None:
+                mapped_codes = tuple(icd10_to_icd9_map_df[cc.icd9_code].unique())
+
+        if period is None and event.period is None:
+            # attribute event before the event date
+            min_t, max_t = None, -1
+        else:
+            min_t = event.period.min_t if event.period is not None else period.min_t
+            max_t = event.period.max_t if event.period is not None else period.max_t
+
+        return AttributeEvent(
+            table=table_name, codes=tuple(event.codes), include_subcodes=event.include_subcodes,
+            mapped_codes=mapped_codes, num_value=event.num_value, text_value=event.text_value, min_t=min_t,
+            max_t=max_t,
+            having=self.__make_attribute_filter(event.having_events, event.having_period, event.inclusion_mode,
+                                                include_icd9),
+            exclusion=self.__make_attribute_filter(event.exclusion_events, event.exclusion_period,
+                                                   event.exclusion_mode, include_icd9)
+        )
+
     def __get_code_info_job(self, codes: Optional[list], table_name: str, columns: list, patients_info: list,
                             include_icd9: bool, first_incident: bool, negation_event: bool = False,
-                            include_subcodes: bool = False, num_value: str = None, text_value: str = None
+                            include_subcodes: bool = False, num_value: str = None, text_value: str = None,
+                            having: Optional[AttributeFilter] = None, exclusion: Optional[AttributeFilter] = None
                             ) -> Optional[pd.DataFrame]:
         self.logger.debug(f'__get_code_info_job: table={table_name}')
         if not codes:
-            return self.__get_all_codes_info(table_name, columns, patients_info, first_incident, num_value, text_value)
+            return FrameSchema.apply(
+                self.__get_all_codes_info(table_name, columns, patients_info, first_incident, num_value, text_value)
+            )
+
+        if negation_event and patients_info and self.db_manager.supports_absence_request:
+            return FrameSchema.apply(self.__get_negative_codes_info(
+                codes=codes, table_name=table_name, columns=columns, patients_info=patients_info,
+                include_icd9=include_icd9, include_subcodes=include_subcodes, num_value=num_value,
+                text_value=text_value
+            ))
 
         df = self.__process_positive_event_codes(
             codes=codes, table_name=table_name, columns=columns,
             include_subcodes=include_subcodes, patients_info=patients_info,
             first_incident=first_incident, include_icd9=include_icd9,
-            num_value=num_value, text_value=text_value
+            num_value=num_value, text_value=text_value, having=having, exclusion=exclusion
         )
 
         if negation_event:
             df = self.__process_negative_codes(positive_codes_df=df, patients_info=patients_info, codes=codes)
         self.logger.debug(f'finish with code info for {codes}')
-        return df
+        return FrameSchema.apply(df)
 
     def __get_all_codes_info(
             self, table_name: str, columns: list, patients_info: Optional[list] = None, first_incident: bool = False,
@@ -104,11 +259,26 @@ class BaseDbRepository(metaclass=ABCMeta):
 
     def __get_icd9_mapped_code_info(self, icd10_codes: list, table_name: str, columns: list, patients_info: list,
                                     first_incident: bool, include_subcodes: bool,
-                                    num_value: str, text_value: str) -> Optional[pd.DataFrame]:
+                                    num_value: str, text_value: str, having: Optional[AttributeFilter] = None,
+                                    exclusion: Optional[AttributeFilter] = None) -> Optional[pd.DataFrame]:
         self.logger.debug(f'__get_icd9_mapped_code_info: codes={icd10_codes}')
-        if not icd10_codes:
+        icd10_to_icd9_map_df = self.__get_icd10_to_icd9_map(icd10_codes, table_name, include_subcodes)
+        if icd10_to_icd9_map_df is None:
             return pd.DataFrame()
 
+        mapped_icd9_codes = icd10_to_icd9_map_df[cc.icd9_code].unique().tolist()
+        icd9_df = self.db_manager.request_code_info(
+            table=table_name, columns=columns, codes=mapped_icd9_codes, include_subcodes=False,
+            patients_info=patients_info, first_incident=first_incident, num_value=num_value, text_value=text_value,
+            having=having, exclusion=exclusion
+        )
+        return self.__convert_icd9_to_icd10(icd9_df, icd10_to_icd9_map_df)
+
+    def __get_icd10_to_icd9_map(self, icd10_codes: list, table_name: str,
+                                include_subcodes: bool) -> Optional[pd.DataFrame]:
+        if not icd10_codes:
+            return None
+
         icd10_subcodes = self.db_manager.request_subcodes(icd10_codes, table_name) if include_subcodes else icd10_codes
         if icd10_subcodes:
             icd10_codes = icd10_subcodes
@@ -117,13 +287,12 @@ class BaseDbRepository(metaclass=ABCMeta):
                                                                       search_column=cc.icd10_code)
         if icd10_to_icd9_map_df is None or icd10_to_icd9_map_df.empty:
             self.logger.warning('No data')
-            return pd.DataFrame()
+            return None
+        return icd10_to_icd9_map_df
 
-        mapped_icd9_codes = icd10_to_icd9_map_df[cc.icd9_code].unique().tolist()
-        icd9_df = self.db_manager.request_code_info(
-            table=table_name, columns=columns, codes=mapped_icd9_codes, include_subcodes=False,
-            patients_info=patients_info, first_incident=first_incident, num_value=num_value, text_value=text_value
-        )
+    @staticmethod
+    def __convert_icd9_to_icd10(icd9_df: Optional[pd.DataFrame],
+                                icd10_to_icd9_map_df: pd.DataFrame) -> Optional[pd.DataFrame]:
         if icd9_df is None:
             return None
         if cc.code in icd9_df.columns:
@@ -177,75 +346,105 @@ class BaseDbRepository(metaclass=ABCMeta):
         # exclude it record at this event. All codes come from the single event
         self.logger.debug(f'process_negative_codes')
 
-        positive_codes_df[cc.date] = pd.to_datetime(positive_codes_df[cc.date].astype(str))
-
-        patient_date_range_df = self.__build_dataframe_from_patient_info(patients_info)
-
-        col_within_time = 'within_time'
         col_min_date = 'min_date'
         col_max_date = 'max_date'
+        patient_date_range_df = self.__build_dataframe_from_patient_info(patients_info)
+
+        # patient windows without positive records
+        positive_count = IntervalJoin.count_between(
+            patient_date_range_df[cc.patient_id], patient_date_range_df[col_min_date],
+            patient_date_range_df[col_max_date], positive_codes_df[cc.patient_id], positive_codes_df[cc.date]
+        )
+        patient_date_range_df = patient_date_range_df[positive_count == 0] \
+            .drop_duplicates(subset=[cc.patient_id, col_max_date])
+        return self.__make_negative_records(patient_date_range_df[cc.patient_id].values,
+                                            patient_date_range_df[col_max_date].values,
+                                            list(positive_codes_df.columns), codes)
+
+    def __get_negative_codes_info(self, codes: list, table_name: str, columns: list, patients_info: list,
+                                  include_icd9: bool, include_subcodes: bool, num_value: Optional[str],
+                                  text_value: Optional[str]) -> Optional[pd.DataFrame]:
+        """
+        Get negation event records from the windows without the codes records found by the database, so the
+        positive records are not transferred.
+        """
+        self.logger.debug(f'__get_negative_codes_info for codes {codes}')
+        mapped_codes = None
+        if include_icd9:
+            icd10_to_icd9_map_df = self.__get_icd10_to_icd9_map(codes, table_name, include_subcodes)
+            if icd10_to_icd9_map_df is not None:
+                mapped_codes = icd10_to_icd9_map_df[cc.icd9_code].unique().tolist()
 
-        patient_date_range_df = patient_date_range_df.merge(positive_codes_df, how='left', on=cc.patient_id)
-        patient_date_range_df[col_within_time] = \
-            (patient_date_range_df[cc.date] >= patient_date_range_df[col_min_date]) & \
-            (patient_date_range_df[cc.date] <= patient_date_range_df[col_max_date])
-        patient_date_range_df[col_within_time] = patient_date_range_df.groupby(
-            [cc.patient_id, col_min_date, col_max_date]
-        )[col_within_time].transform('sum')
-        patient_date_range_df = patient_date_range_df[patient_date_range_df[col_within_time] == 0] \
-            .drop_duplicates(subset=[cc.patient_id, col_max_date]) \
-            .drop(columns=[cc.date, col_within_time])
-        patient_date_range_df = patient_date_range_df.rename(columns={col_max_date: cc.date})
-        patient_date_range_df = patient_date_range_df[positive_codes_df.columns]
-        patient_date_range_df[cc.code] = CodeFormat.simple_to_negative(codes)
-        # clean all columns except patient/code/date
-        clear_cols = [x for x in patient_date_range_df.columns
-                      if x not in [cc.patient_id, cc.code, cc.date]]
-        patient_date_range_df[clear_cols] = np.nan
-        return patient_date_range_df
+        windows_df = self.db_manager.request_code_absence_windows(
+            codes=codes, table=table_name, patients_info=patients_info, include_subcodes=include_subcodes,
+            mapped_codes=mapped_codes, num_value=num_value, text_value=text_value
+        )
+        if windows_df is None:
+            return None
+        return self.__make_negative_records(windows_df[cc.patient_id].values, windows_df[cc.date].values, columns,
+                                            codes)
+
+    @staticmethod
+    def __make_negative_records(patients: np.ndarray, dates: np.ndarray, columns: list,
+                                codes: list) -> pd.DataFrame:
+        # negative record has the window end date, all columns except patient/code/date are empty
+        negative_code = CodeFormat.simple_to_negative(codes)
+        return pd.DataFrame({
+            c: patients if c == cc.patient_id
+            else dates if c == cc.date
+            else negative_code if c == cc.code
+            else np.nan
+            for c in columns
+        }, index=range(len(patients)))
 
     def __build_dataframe_from_patient_info(self, patients_info: list) -> pd.DataFrame:
         self.logger.debug('__build_dataframe_from_patient_info')
-        patients_data = list()
-        max_date_data = list()
-        min_date_data = list()
-        for min_date, max_date, patients in patients_info:
-            patients_data.extend(patients)
-            max_date_data.extend([max_date] * len(patients))
-            min_date_data.extend([min_date] * len(patients))
+        sizes = [len(patients) for _, _, patients in patients_info]
         df = pd.DataFrame()
-        df[cc.patient_id] = patients_data
-        df['min_date'] = pd.Series(data=min_date_data, dtype='datetime64[ns]')
-        df['max_date'] = pd.Series(data=max_date_data, dtype='datetime64[ns]')
+        df[cc.patient_id] = np.concatenate([np.asarray(list(patients)) for _, _, patients in patients_info]) \
+            if patients_info else []
+        df['min_date'] = np.repeat(pd.to_datetime([x[0] for x in patients_info]).values, sizes)
+        df['max_date'] = np.repeat(pd.to_datetime([x[1] for x in patients_info]).values, sizes)
 
         return df
 
     def __process_positive_event_codes(self, codes: Optional[list], table_name: str, columns: Optional[list] = None,
                                        include_subcodes: bool = False, patients_info: Optional[list] = None,
                                        first_incident: bool = False, include_icd9: bool = False,
-                                       num_value: str = None, text_value: str = None) -> Optional[pd.DataFrame]:
+                                       num_value: str = None, text_value: str = None,
+                                       having: Optional[AttributeFilter] = None,
+                                       exclusion: Optional[AttributeFilter] = None) -> Optional[pd.DataFrame]:
         self.logger.debug(f'process_positive_event_codes for codes {codes}')
         df = self.db_manager.request_code_info(
             codes=codes, table=table_name, columns=columns,
             include_subcodes=include_subcodes, patients_info=patients_info,
-            first_incident=first_incident, num_value=num_value, text_value=text_value
+            first_incident=first_incident, num_value=num_value, text_value=text_value,
+            having=having, exclusion=exclusion
         )
 
+        icd9_df = None
         if include_icd9:
             icd9_df = self.__get_icd9_mapped_code_info(
                 icd10_codes=codes, table_name=table_name, columns=columns, patients_info=patients_info,
                 first_incident=first_incident, include_subcodes=include_subcodes, num_value=num_value,
-                text_value=text_value
+                text_value=text_value, having=having, exclusion=exclusion
             )
-            if icd9_df is not None:
-                df = pd.concat([df, icd9_df]).drop_duplicates()
+        return self.__combine_positive_event_codes(df, icd9_df, codes, include_subcodes, first_incident)
+
+    def __combine_positive_event_codes(self, df: Optional[pd.DataFrame], icd9_df: Optional[pd.DataFrame],
+                                       codes: list, include_subcodes: bool,
+                                       first_incident: bool) -> Optional[pd.DataFrame]:
+        if icd9_df is not None:
+            df = pd.concat([df, icd9_df]).drop_duplicates()
 
         # convert all codes to base ones determined in config if subcodes flag is True and result df is not empty
         if include_subcodes and (df is not None) and (not df.empty) and (cc.code in df.columns):
             df = self.__convert_to_base_codes(df, codes)
             # if first_incident flag is True, remove all records that are not first occurrence of the code
             if first_incident:
-                df = df[df.index == df.groupby([cc.patient_id, cc.code])[cc.date].transform('idxmin')]
+                # concatenated and exploded records have repeated index labels, so make it unique for idxmin
+                df = df.reset_index(drop=True)
+                df = df[df.index == df.groupby([cc.patient_id, cc.code], observed=True)[cc.date].transform('idxmin')]
 
         return df
 
@@ -0,0 +1,105 @@
+import logging
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db.DatabaseManager import DatabaseManager
+
+
+class CodeCatalogRepository:
+    """
+    Records and patients counts of the codes in the fact tables. The counts are requested from the code catalog that
+    is built by the data import, so the fact tables are not scanned. The catalog of a table imported before is built
+    once on the first request. Codes of a table are requested together by batches, so checking the codes of many
+    studies takes a few requests per table
+    """
+    table = 'table'
+
+    def __init__(self, db_manager: DatabaseManager, batch_size: int = 1000):
+        """
+        :param db_manager: data manager
+        :param batch_size: max number of codes in a single request
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+
+    def get_code_counts(self, table_codes: dict) -> Optional[pd.DataFrame]:
+        """
+        Get counts of the codes
+        :param table_codes: map of a table name on a set of tuples (code, subcodes flag). Subcodes flag means the code
+        is counted with its subcodes
+        :return: dataframe with the table, code, subcodes flag, records and patients columns, one row for every found
+        code and for every subcodes code. None if the requests failed
+        """
+        params = []
+        for table, codes in table_codes.items():
+            exact = sorted(c for c, subcodes in codes if not subcodes)
+            prefixes = sorted(c for c, subcodes in codes if subcodes)
+            # the prefixes are a union of the range scans, they are requested by smaller batches
+            params += [(exact[i:i + self.batch_size], [], table) for i in range(0, len(exact), self.batch_size)]
+            prefix_batch = max(1, self.batch_size // 10)
+            params += [([], prefixes[i:i + prefix_batch], table) for i in range(0, len(prefixes), prefix_batch)]
+        self.logger.debug(f'get_code_counts: {len(params)} requests for tables {list(table_codes)}')
+        if not params:
+            return None
+
+        self.db_manager.open_ssh_tunnel()
+        for table in table_codes:
+            if not self.db_manager.has_code_catalog(table):
+                self.logger.info(f'Code catalog of table {table} is not found, the codes of the table are counted')
+                self.db_manager.update_code_catalog(table)
+        res_dfs = self.db_manager.map_requests(self.__request_code_counts, params, ordered=True)
+        self.db_manager.close_ssh_tunnel()
+        if any(d is None for d in res_dfs):
+            self.logger.warning('Code counts request failed')
+            return None
+        return pd.concat(res_dfs, ignore_index=True)
+
+    def get_icd9_codes(self, codes: set) -> Optional[pd.DataFrame]:
+        """
+        Get ICD9 analogs of the codes, as the events search them
+        :param codes: set of tuples (code, subcodes flag). Analogs of the subcodes are found for the subcodes codes
+        :return: dataframe with the code, subcodes flag and ICD9 code columns. None if the requests failed
+        """
+        exact = sorted(c for c, subcodes in codes if not subcodes)
+        prefixes = sorted(c for c, subcodes in codes if subcodes)
+        params = [(exact[i:i + self.batch_size], False) for i in range(0, len(exact), self.batch_size)]
+        params += [(prefixes[i:i + self.batch_size], True) for i in range(0, len(prefixes), self.batch_size)]
+        self.logger.debug(f'get_icd9_codes: {len(params)} requests')
+        columns = [cc.code, cc.subcodes, cc.icd9_code]
+        if not params:
+            return pd.DataFrame(columns=columns)
+
+        self.db_manager.open_ssh_tunnel()
+        res_dfs = self.db_manager.map_requests(self.__request_icd9_codes, params, ordered=True)
+        self.db_manager.close_ssh_tunnel()
+        if any(d is None for d in res_dfs):
+            self.logger.warning('ICD9 map request failed')
+            return None
+        return pd.concat(res_dfs, ignore_index=True)[columns].drop_duplicates(ignore_index=True)
+
+    def get_patients_count(self) -> Optional[int]:
+        self.db_manager.open_ssh_tunnel()
+        count = self.db_manager.request_patients_count()
+        self.db_manager.close_ssh_tunnel()
+        return count
+
+    def __request_code_counts(self, codes: list, prefixes: list, table: str) -> Optional[pd.DataFrame]:
+        df = self.db_manager.request_code_counts(codes, prefixes, table)
+        if df is None:
+            return None
+        df.insert(0, self.table, table)
+        return df.astype({cc.code: str, cc.subcodes: bool, cc.records: 'int64', cc.patients: 'int64'})
+
+    def __request_icd9_codes(self, codes: list, subcodes: bool) -> Optional[pd.DataFrame]:
+        df = self.db_manager.request_icd9_icd10_map(codes, search_column=cc.icd10_code, include_subcodes=subcodes)
+        if df is None:
+            return None
+        df = df.astype({cc.icd9_code: str, cc.icd10_code: str})
+        if not subcodes:
+            return df.rename(columns={cc.icd10_code: cc.code}).assign(**{cc.subcodes: False})
+        # a mapped subcode belongs to every requested prefix of it
+        return pd.concat([df[df[cc.icd10_code].str.startswith(p)].assign(**{cc.code: p, cc.subcodes: True})
+                          for p in codes], ignore_index=True)
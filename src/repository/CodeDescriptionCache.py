@@ -0,0 +1,101 @@
+import logging
+import shutil
+import threading
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.FileProvider import FileProvider
+
+
+class CodeDescriptionCache:
+    """
+    Persistent cache of the code description table records. Every requested (code, code system) pair is stored,
+    pairs without descriptions are stored with the not found flag so that they are not requested again.
+    The cache is kept per database and data manager type in the project cache directory and is dropped when data
+    is imported to the database.
+    """
+    file_name = 'code_description.parquet'
+    found_column = 'description_found'
+
+    __frames: dict = {}
+    __lock = threading.Lock()
+    __logger = logging.getLogger('CodeDescriptionCache')
+
+    @staticmethod
+    def key(db_manager) -> tuple:
+        """Cache key of the data manager database"""
+        return db_manager.database_name, type(db_manager).__name__
+
+    @classmethod
+    def get(cls, key: tuple, pairs: list) -> tuple[Optional[pd.DataFrame], list]:
+        """
+        Get cached descriptions of the codes
+        :param key: cache key of the database
+        :param pairs: list of tuples (code, code system)
+        :return: tuple of the descriptions dataframe (None if nothing is found) and the list of not cached pairs
+        """
+        with cls.__lock:
+            frame = cls.__load(key)
+        if frame is None:
+            return None, list(dict.fromkeys(pairs))
+        requested = pd.MultiIndex.from_tuples(pairs, names=[cc.code, cc.code_system])
+        cached = requested.isin(pd.MultiIndex.from_frame(frame[[cc.code, cc.code_system]]))
+        missing = list(dict.fromkeys(requested[~cached]))
+        df = frame[frame[cls.found_column] & pd.MultiIndex.from_frame(frame[[cc.code, cc.code_system]]).isin(requested)]
+        df = df.drop(columns=[cls.found_column])
+        return (None if df.empty else df.reset_index(drop=True)), missing
+
+    @classmethod
+    def add(cls, key: tuple, pairs: list, df: Optional[pd.DataFrame]):
+        """
+        Add requested pairs and their descriptions to the cache and save it
+        :param key: cache key of the database
+        :param pairs: list of tuples (code, code system) that were requested
+        :param df: code description table records of the pairs
+        """
+        df = pd.DataFrame(columns=[cc.code, cc.code_system]) if df is None else df.copy()
+        df[cls.found_column] = True
+        found = pd.MultiIndex.from_frame(df[[cc.code, cc.code_system]])
+        not_found = [p for p in dict.fromkeys(pairs) if p not in found]
+        not_found_df = pd.DataFrame(not_found, columns=[cc.code, cc.code_system]).assign(**{cls.found_column: False})
+        with cls.__lock:
+            frames = [f for f in [cls.__load(key), df, not_found_df] if f is not None and not f.empty]
+            if not frames:
+                return
+            frame = pd.concat(frames, ignore_index=True).astype({cc.code: str, cc.code_system: str})
+            frame = frame.drop_duplicates().reset_index(drop=True)
+            cls.__frames[key] = frame
+            cls.__save(key, frame)
+
+    @classmethod
+    def clear(cls, database_name: str):
+        """Remove cached descriptions of the database"""
+        with cls.__lock:
+            for key in [k for k in cls.__frames if k[0] == database_name]:
+                del cls.__frames[key]
+            shutil.rmtree(FileProvider().cache_path / database_name, ignore_errors=True)
+
+    @classmethod
+    def __load(cls, key: tuple) -> Optional[pd.DataFrame]:
+        if key not in cls.__frames:
+            file_path = cls.__file_path(key)
+            cls.__frames[key] = pd.read_parquet(file_path) if file_path.exists() else None
+        return cls.__frames[key]
+
+    @classmethod
+    def __save(cls, key: tuple, frame: pd.DataFrame):
+        file_path = cls.__file_path(key)
+        try:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = file_path.with_suffix('.tmp')
+            frame.to_parquet(tmp_path, index=False)
+            tmp_path.replace(file_path)
+        except OSError as e:
+            cls.__logger.warning(f'Code descriptions cache is not saved: {e}')
+
+    @staticmethod
+    def __file_path(key: tuple):
+        database_name, manager_type = key
+        return FileProvider().cache_path / database_name / manager_type / CodeDescriptionCache.file_name
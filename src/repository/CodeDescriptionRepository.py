@@ -1,25 +1,71 @@
 import logging
 
+import pandas as pd
+
 from src.db.DatabaseManager import DatabaseManager
+from src.repository.CodeDescriptionCache import CodeDescriptionCache
 
 
 class CodeDescriptionRepository:
 
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, batch_size: int = 1000):
+        """
+        :param db_manager: data manager
+        :param batch_size: max number of codes in a single description request
+        """
         self.logger = logging.getLogger(type(self).__name__)
         self.db_manager = db_manager
+        self.batch_size = batch_size
 
     def get_code_description(self, codes: list):
-        self.logger.debug(f'get_code_description: codes={codes}')
+        """
+        Get descriptions of the codes. Descriptions are taken from the persistent cache, not cached codes are
+        requested by batches of codes with the same code systems.
+        :param codes: list of tuples (code, list of code systems)
+        :return: dataframe with code description table records or None
+        """
+        self.logger.debug(f'get_code_description: codes={codes}'[:500])
         if len(codes) == 0:
             return None
-
-        # find all descriptions from terminology table
-        self.db_manager.open_ssh_tunnel()
-        df = self.db_manager.request_codes_description(codes)
-        self.db_manager.close_ssh_tunnel()
+        key = CodeDescriptionCache.key(self.db_manager)
+        pairs = [(c, s) for c, systems in codes for s in systems]
+        if not pairs:
+            return None
+        cached_df, missing = CodeDescriptionCache.get(key, pairs)
+        dfs = [cached_df]
+        if missing:
+            dfs.append(self.__request_descriptions(key, missing))
+        dfs = [d for d in dfs if d is not None]
+        if not dfs:
+            return None
+        df = pd.concat(dfs, ignore_index=True)
         if df.empty:
             return None
         df = df.drop_duplicates()
         df = df.fillna('No Description')
         return df
+
+    def __request_descriptions(self, key: tuple, pairs: list):
+        self.logger.debug(f'request descriptions of not cached codes N={len(pairs)}')
+        # codes with the same code systems are requested together by code IN and code_system IN conditions
+        system_codes = dict()
+        for c, s in pairs:
+            system_codes.setdefault(c, []).append(s)
+        groups = dict()
+        for c, systems in system_codes.items():
+            groups.setdefault(tuple(sorted(systems)), []).append(c)
+        params = [(group_codes[i:i + self.batch_size], list(systems))
+                  for systems, group_codes in groups.items()
+                  for i in range(0, len(group_codes), self.batch_size)]
+
+        self.db_manager.open_ssh_tunnel()
+        res_dfs = self.db_manager.map_requests(self.db_manager.request_codes_description_batch, params)
+        self.db_manager.close_ssh_tunnel()
+        if any(d is None for d in res_dfs):
+            # failed requests are not cached, the codes are requested again next time
+            self.logger.warning('Codes description request failed')
+            res_dfs = [d for d in res_dfs if d is not None]
+            return pd.concat(res_dfs, ignore_index=True) if res_dfs else None
+        df = pd.concat(res_dfs, ignore_index=True)
+        CodeDescriptionCache.add(key, pairs, df)
+        return df
@@ -2,15 +2,30 @@ from typing import Optional
 
 import pandas as pd
 
+from src.db.DatabaseManager import DatabaseManager
+from src.db.SqlDataElement import AttributeFilter
 from src.repository.BaseDbRepository import BaseDbRepository
 from src.datamodel.Event import Event
-from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.FrameSchema import FrameSchema
 
 
 class EventRepository(BaseDbRepository):
 
+    def __init__(self, db_manager: DatabaseManager, attribute_pushdown: bool = False):
+        """
+        :param db_manager: data manager
+        :param attribute_pushdown: if True, having and exclusion attribute events are checked by the database in the
+        event request where it is possible. It is ignored if the data manager does not support it
+        """
+        super().__init__(db_manager)
+        self.attribute_pushdown = attribute_pushdown and db_manager.supports_attribute_pushdown
+        if attribute_pushdown and not self.attribute_pushdown:
+            self.logger.warning(f'Attribute events pushdown is not supported by {type(db_manager).__name__}')
+
     def get_event_info(self, event: Event, columns: Optional[list] = None, date_patient_map: Optional[dict] = None,
-                       first_incident: bool = False, include_icd9: bool = True) -> Optional[pd.DataFrame]:
+                       first_incident: bool = False, include_icd9: bool = True,
+                       having: Optional[AttributeFilter] = None,
+                       exclusion: Optional[AttributeFilter] = None) -> Optional[pd.DataFrame]:
         """
         Get vitals signs info by their ids
         :param event: event object with parameters to search records
@@ -18,15 +33,42 @@ class EventRepository(BaseDbRepository):
         :param date_patient_map: date to patient ids list map
         :param first_incident: get only first (earliest) fitted record for each patient
         :param include_icd9: IfTrue, then all ICD10 codes will be matched to ICD9. Records will be searched by both ICD10 and ICD9 codes.
+        :param having: attribute events the records should have, see get_attribute_filters
+        :param exclusion: attribute events the records should not have, see get_attribute_filters
         :return: dataframe from vitals signs table with columns or None
         """
         df = self._get_codes_info(event=event, columns=columns, include_icd9=include_icd9,
-                                  date_patient_map=date_patient_map, first_incident=first_incident)
+                                  date_patient_map=date_patient_map, first_incident=first_incident,
+                                  having=having, exclusion=exclusion)
         if df is None or df.empty:
             return None
-        for c in df.columns:
-            if c in cc.date_columns:
-                self.logger.debug(f'convert date column {c} to datetime')
-                df[c] = pd.to_datetime(df[c], format='%Y-%m-%d')
+        return FrameSchema.apply(df)
+
+    def get_attribute_filters(self, event: Event, first_incident: bool = False,
+                              include_icd9: bool = True) -> Optional[tuple]:
+        """
+        Get having and exclusion filters of the event to check them by the database
+        :param event: event with attribute events
+        :param first_incident: the event is requested with first incident flag
+        :param include_icd9: If True, then ICD9 analogs of the attribute events codes are searched too
+        :return: tuple of having and exclusion filters or None if the attribute events should be filtered by the client
+        """
+        if not self.attribute_pushdown:
+            return None
+        return self._get_attribute_filters(event, include_icd9, first_incident)
 
-        return df
+    def get_events_info(self, events: list[Event], columns: Optional[list] = None,
+                        date_patient_map: Optional[dict] = None, first_incident: bool = False,
+                        include_icd9: bool = True) -> list:
+        """
+        Get info of several events from the same table in one request per patients group
+        :param events: events with the same data table. Negation events are not supported
+        :param columns: list of columns to request
+        :param date_patient_map: date to patient ids list map
+        :param first_incident: get only first (earliest) fitted record for each patient
+        :param include_icd9: IfTrue, then all ICD10 codes will be matched to ICD9.
+        :return: list of dataframes or None values in the events order
+        """
+        dfs = self._get_batch_codes_info(events=events, columns=columns, include_icd9=include_icd9,
+                                         date_patient_map=date_patient_map, first_incident=first_incident)
+        return [None if df is None or df.empty else FrameSchema.apply(df) for df in dfs]
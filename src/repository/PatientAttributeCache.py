@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.FrameSchema import FrameSchema
+
+
+class PatientAttributeCache:
+    """
+    Process-wide cache of the patient table attributes. The patient table is small relative to the fact tables, so
+    the attributes of the study patients are loaded once and the death windows and metadata requests are answered
+    from the cached frame. The frame is indexed by patient id and has the memory-lean dtypes of FrameSchema.
+    Worker processes forked after the loading share the cache of the parent process.
+    The cache size is bounded by max_bytes: the least recently used databases are removed first, and the earliest
+    loaded patients of the database are removed if it does not fit alone. Removed patients are requested again.
+    The cache is cleared at the end of every study.
+    """
+    columns = [cc.patient_id, cc.date_of_birth, cc.date_of_death, cc.sex, cc.race, cc.ethnicity]
+    max_bytes = 512 * 1024 * 1024
+
+    __frames: OrderedDict = OrderedDict()
+    __loaded_ids: dict = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def key(db_manager) -> tuple:
+        """Cache key of the data manager database, the same as the key of CodeDescriptionCache"""
+        return db_manager.database_name, type(db_manager).__name__
+
+    @classmethod
+    def add(cls, key: tuple, patients: list, df: Optional[pd.DataFrame]):
+        """
+        Add attributes of the loaded patients to the cache
+        :param key: cache key of the database
+        :param patients: requested patient ids. Patients without records in the patient table are loaded as well
+        :param df: patient table records of the patients with the cache columns
+        """
+        with cls.__lock:
+            frames = [f for f in [cls.__frames.get(key), FrameSchema.apply(df)] if f is not None]
+            frame = FrameSchema.concat([f.reset_index() for f in frames]) if frames else None
+            if frame is not None:
+                frame = frame.drop_duplicates(subset=[cc.patient_id]).set_index(cc.patient_id)
+            cls.__frames[key] = frame
+            cls.__frames.move_to_end(key)
+            loaded_ids = cls.__loaded_ids.get(key, pd.Index([]))
+            cls.__loaded_ids[key] = loaded_ids.append(pd.Index(list(patients))).unique()
+            cls.__evict()
+
+    @classmethod
+    def missing(cls, key: tuple, patients) -> list:
+        """Patients that are not loaded to the cache"""
+        patients = pd.Index(list(patients))
+        loaded_ids = cls.__loaded_ids.get(key)
+        if loaded_ids is None:
+            return patients.unique().tolist()
+        return patients[~patients.isin(loaded_ids)].unique().tolist()
+
+    @classmethod
+    def get(cls, key: tuple, patients) -> Optional[pd.DataFrame]:
+        """
+        Get cached attributes of the patients. Rows are in the patients order, patients without records in the
+        patient table have no rows
+        :return: dataframe indexed by patient id or None if some of the patients are not loaded
+        """
+        with cls.__lock:
+            if cls.missing(key, patients):
+                return None
+            frame = cls.__frames.get(key)
+            if key in cls.__frames:
+                cls.__frames.move_to_end(key)
+        if frame is None:
+            return pd.DataFrame(columns=cls.columns).set_index(cc.patient_id)
+        patients = pd.Index(list(patients))
+        return frame.loc[patients[patients.isin(frame.index)]].rename_axis(cc.patient_id)
+
+    @classmethod
+    def clear(cls, key: Optional[tuple] = None):
+        """Remove the database patients from the cache, or all patients if the key is None"""
+        with cls.__lock:
+            if key is None:
+                cls.__frames.clear()
+                cls.__loaded_ids.clear()
+            else:
+                cls.__frames.pop(key, None)
+                cls.__loaded_ids.pop(key, None)
+
+    @classmethod
+    def size(cls) -> int:
+        """Memory usage of the cached frames in bytes"""
+        return sum(cls.__frame_size(f) for f in cls.__frames.values())
+
+    @classmethod
+    def __evict(cls):
+        sizes = {k: cls.__frame_size(f) for k, f in cls.__frames.items()}
+        while sum(sizes.values()) > cls.max_bytes and len(sizes) > 1:
+            key = next(iter(cls.__frames))
+            del cls.__frames[key], cls.__loaded_ids[key], sizes[key]
+        if sum(sizes.values()) <= cls.max_bytes:
+            return
+        # patients are appended to the frame, so the last rows are the latest loaded ones
+        key, frame = next(iter(cls.__frames.items()))
+        size = sizes[key]
+        while size > cls.max_bytes and len(frame) > 0:
+            frame = frame.iloc[len(frame) - int(len(frame) * cls.max_bytes / size):]
+            size = cls.__frame_size(frame)
+        cls.__frames[key] = frame
+        loaded_ids = cls.__loaded_ids[key]
+        cls.__loaded_ids[key] = loaded_ids[loaded_ids.isin(frame.index)]
+
+    @staticmethod
+    def __frame_size(frame: Optional[pd.DataFrame]) -> int:
+        if frame is None:
+            return 0
+        # the index hash table is built by the first lookup, so the index values are counted only
+        index_size = pd.Series(frame.index.array).memory_usage(index=False, deep=True)
+        return int(frame.memory_usage(index=False, deep=True).sum() + index_size)
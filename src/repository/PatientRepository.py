@@ -1,16 +1,45 @@
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
-from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.DataColumns import CommonColumns as cc, CommonTables as ct
+from src.db.SqlDataElement import default_surrogate_keys
 from src.repository.BaseDbRepository import BaseDbRepository
-from src.util.ConcurrentUtil import ConcurrentUtil
+from src.repository.PatientAttributeCache import PatientAttributeCache
+from src.util.FrameSchema import FrameSchema
 
 
 class PatientRepository(BaseDbRepository):
 
+    def preload_patients(self, patients, chunk_size: int = 10_000):
+        """
+        Load attributes of the patients to the process-wide patient attribute cache. Already loaded patients are not
+        requested again. Death windows and metadata of the loaded patients are found without database requests.
+        :param patients: list of patient ids
+        :param chunk_size: max number of ids in a single request
+        """
+        key = PatientAttributeCache.key(self.db_manager)
+        patients = PatientAttributeCache.missing(key, patients)
+        self.logger.debug(f'preload_patients: patients N={len(patients)}')
+        if not patients:
+            return
+        columns = PatientAttributeCache.columns
+        params = [(patients[i:i + chunk_size], columns) for i in range(0, len(patients), chunk_size)]
+        self.db_manager.open_ssh_tunnel()
+        res_dfs = self.db_manager.map_requests(self.db_manager.request_patient_info, params)
+        self.db_manager.close_ssh_tunnel()
+        if any(d is None for d in res_dfs):
+            self.logger.warning('Patients attributes were not loaded')
+            return
+        PatientAttributeCache.add(key, patients, FrameSchema.concat(res_dfs))
+
     def get_patients_info(self, patients, columns):
         self.logger.debug(f'get_patients_info: columns={columns}')
+        cached_df = self.__get_cached_patients(patients, columns)
+        if cached_df is not None:
+            cached_df = cached_df.reset_index()[columns].drop_duplicates()
+            return None if cached_df.empty else cached_df
         self.db_manager.open_ssh_tunnel()
         df = self.db_manager.request_patient_info(patients, columns)
         self.db_manager.close_ssh_tunnel()
@@ -18,7 +47,7 @@ class PatientRepository(BaseDbRepository):
             return None
 
         df = df.drop_duplicates()
-        return df
+        return FrameSchema.apply(df)
 
     def get_dead_patients(
             self, columns: Optional[list] = None, date_patient_map: Optional[dict] = None
@@ -26,14 +55,73 @@ class PatientRepository(BaseDbRepository):
         self.logger.debug(f'get_dead_patients: columns={columns}, '
                           f'date_patient_map length = {len(date_patient_map)}')
         patient_groups = self._group_patient_params(date_patient_map) if date_patient_map else[None]
+        if date_patient_map:
+            df = self.__get_cached_dead_patients(columns, [w for group in patient_groups for w in group])
+            if df is not None:
+                return None if df.empty else df
+
         params = [(patient_info, columns) for patient_info in patient_groups]
 
         self.db_manager.open_ssh_tunnel()
-        res_dfs = ConcurrentUtil.do_async_job(self.db_manager.request_dead_patients, params)
+        res_dfs = self.db_manager.map_requests(self.db_manager.request_dead_patients, params)
         self.db_manager.close_ssh_tunnel()
 
-        if all([r is None for r in res_dfs]):
+        df = FrameSchema.concat(res_dfs)
+        return None if df is None or df.empty else df
+
+    def __get_cached_patients(self, patients, columns: Optional[list]) -> Optional[pd.DataFrame]:
+        if columns is None or not set(columns).issubset(PatientAttributeCache.columns):
             return None
-        df = pd.concat(res_dfs)
+        return PatientAttributeCache.get(PatientAttributeCache.key(self.db_manager), patients)
 
-        return None if df.empty else df
+    def __get_cached_dead_patients(self, columns: Optional[list], patients_info: list) -> Optional[pd.DataFrame]:
+        """
+        Find patients died within their windows in the patient attribute cache
+        :param columns: columns to return
+        :param patients_info: list of tuples with min_date, max_date and patients ids
+        :return: dataframe with columns or None if the patients are not cached
+        """
+        # a window without patients means all patients of the database, it is requested from the database
+        if any(not patients for _, _, patients in patients_info):
+            return None
+        sizes = [len(patients) for _, _, patients in patients_info]
+        patients = pd.Index([p for _, _, patients in patients_info for p in patients])
+        cached_df = self.__get_cached_patients(patients, columns)
+        if cached_df is None:
+            return None
+        self.logger.debug(f'get dead patients from cache: patients N={len(patients)}')
+
+        # one row per window patient, patients without records get NaT date of death
+        df = cached_df[~cached_df.index.duplicated()].reindex(patients)
+        date_of_death = df[cc.date_of_death].to_numpy(dtype='datetime64[ns]')
+        min_dates = np.repeat(pd.to_datetime([x[0] for x in patients_info]).to_numpy(), sizes)
+        max_dates = np.repeat(pd.to_datetime([x[1] for x in patients_info]).to_numpy(), sizes)
+        within = ~np.isnat(date_of_death) & \
+            (np.isnat(min_dates) | (date_of_death >= min_dates)) & \
+            (np.isnat(max_dates) | (date_of_death <= max_dates))
+        df = df[within].rename_axis(cc.patient_id).reset_index()
+        return FrameSchema.apply(df[columns].drop_duplicates().reset_index(drop=True))
+
+    def get_patient_id_map(self, patients, chunk_size: int = 10_000) -> Optional[pd.Series]:
+        """
+        Get original patient ids of the surrogate ids
+        :param patients: list of patient surrogate ids
+        :param chunk_size: max number of ids in a single request
+        :return: series of original ids indexed by surrogate ids or None if the database stores original ids
+        """
+        self.logger.debug(f'get_patient_id_map: patients N={len(patients)}')
+        key = next(k for k in default_surrogate_keys if k.table_name == ct.patient_key)
+        patients = list(patients)
+        self.db_manager.open_ssh_tunnel()
+        if not self.db_manager.has_table(key.table_name):
+            self.db_manager.close_ssh_tunnel()
+            return None
+        params = [(key, patients[i:i + chunk_size]) for i in range(0, len(patients), chunk_size)]
+        res_dfs = self.db_manager.map_requests(self.db_manager.request_natural_ids, params)
+        self.db_manager.close_ssh_tunnel()
+
+        res_dfs = [d for d in res_dfs if d is not None]
+        if not res_dfs:
+            return pd.Series(dtype=object)
+        df = pd.concat(res_dfs)
+        return df.set_index(cc.surrogate_id)[key.column_name]
@@ -0,0 +1,199 @@
+import logging
+from functools import reduce
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.FileProvider import FileProvider
+from src.util.FrameSchema import FrameSchema
+
+
+class StudyResult:
+    """
+    Reader of the study outcome files. Levels, transitions and chains are opened as lazy Arrow datasets of the
+    patient group files: nothing is read until a scan, the files are memory-mapped and the filters by patients, codes
+    and event ids are pushed down to the parquet row groups, so only the matching row groups are read.
+    The group number is the `group` column of the datasets.
+    """
+    group = 'group'
+
+    def __init__(self, outcome_dir: str, result_path: Optional[str] = None, memory_map: bool = True):
+        """
+        :param outcome_dir: outcome directory of the study
+        :param result_path: directory of the study results. The result path of FileProvider if None
+        :param memory_map: memory-map the files instead of reading them to the buffers
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        self.outcome_dir = outcome_dir
+        self.__fp = FileProvider()
+        self.result_path = self.__fp.result_path if result_path is None else Path(result_path)
+        self.__filesystem = fs.LocalFileSystem(use_mmap=memory_map)
+        self.__datasets = {}
+
+    @property
+    def levels(self) -> list:
+        """Numbers of the levels with the events files"""
+        levels = []
+        while self.__path(self.__fp.get_events_path(self.outcome_dir, len(levels))).exists():
+            levels.append(len(levels))
+        return levels
+
+    @property
+    def has_chains(self) -> bool:
+        return self.__path(self.__fp.get_chains_path(self.outcome_dir)).exists()
+
+    def events(self, level_number: int) -> ds.Dataset:
+        """Dataset of the level events"""
+        return self.__dataset(self.__path(self.__fp.get_events_path(self.outcome_dir, level_number)))
+
+    def transitions(self, end_level_number: int) -> ds.Dataset:
+        """Dataset of the transitions from the previous level to the level"""
+        path = self.__fp.get_transitions_path(self.outcome_dir, end_level_number)
+        return self.__dataset(self.__path(path))
+
+    def chains(self) -> ds.Dataset:
+        """Dataset of the chains output"""
+        return self.__dataset(self.__path(self.__fp.get_chains_path(self.outcome_dir)))
+
+    def events_metadata(self) -> pd.DataFrame:
+        return pd.read_parquet(self.__path(Path(*self.__fp.events_metadata_file_location(self.outcome_dir))))
+
+    def transition_stats(self) -> Optional[pd.DataFrame]:
+        file_path = self.__path(Path(*self.__fp.transition_stats_file_location(self.outcome_dir)))
+        return pd.read_parquet(file_path) if file_path.exists() else None
+
+    @staticmethod
+    def expression(level_number: Optional[int] = None, patients: Optional[list] = None,
+                   codes: Optional[list] = None, event_ids: Optional[list] = None) -> Optional[ds.Expression]:
+        """
+        Filter expression of the records. Expressions of several levels are combined with & and |
+        :param level_number: level of the code and event id columns
+        :param patients: patient ids
+        :param codes: codes of the level
+        :param event_ids: event ids of the level
+        :return: expression or None if there is no condition
+        """
+        conditions = []
+        if patients is not None:
+            conditions.append(ds.field(cc.patient_id).isin(pa.array(list(patients)).cast(pa.string())))
+        for column, values in [(cc.code, codes), (cc.event_id, event_ids)]:
+            if values is None:
+                continue
+            if level_number is None:
+                raise ValueError(f'Level number of the {column} filter is not set')
+            conditions.append(ds.field(cc.get_column_at_level(column, level_number)).isin(list(values)))
+        return reduce(lambda a, b: a & b, conditions) if conditions else None
+
+    def read_events(self, level_number: int, patients: Optional[list] = None, codes: Optional[list] = None,
+                    event_ids: Optional[list] = None, columns: Optional[list] = None,
+                    filter: Optional[ds.Expression] = None) -> pd.DataFrame:
+        """
+        Read the level events
+        :param patients: patient ids
+        :param codes: codes of the level
+        :param event_ids: event ids of the level
+        :param columns: columns to read, all columns if None
+        :param filter: additional filter expression
+        :return: data frame indexed by the patient ids
+        """
+        expression = self.__combine(self.expression(level_number, patients, codes, event_ids), filter)
+        return self.__to_frame(self.events(level_number).to_table(columns=self.__columns(columns), filter=expression))
+
+    def read_transitions(self, end_level_number: int, patients: Optional[list] = None, codes: Optional[list] = None,
+                         event_ids: Optional[list] = None, columns: Optional[list] = None,
+                         filter: Optional[ds.Expression] = None) -> pd.DataFrame:
+        """
+        Read the transitions from the previous level to the level
+        :param patients: patient ids
+        :param codes: codes of the end level
+        :param event_ids: event ids of the end level
+        :param columns: columns to read, all columns if None
+        :param filter: additional filter expression, e.g. by the start level codes
+        :return: data frame indexed by the patient ids
+        """
+        expression = self.__combine(self.expression(end_level_number, patients, codes, event_ids), filter)
+        dataset = self.transitions(end_level_number)
+        return self.__to_frame(dataset.to_table(columns=self.__columns(columns), filter=expression))
+
+    def iter_chains(self, patients: Optional[list] = None, filter: Optional[ds.Expression] = None,
+                    columns: Optional[list] = None, batch_size: int = 64 * 1024) -> Iterator[pa.RecordBatch]:
+        """
+        Iterate over the full chains as record batches with the event id, code and date columns of every level and
+        the time intervals between the levels. The chains are read from the chains output. Otherwise, they are
+        joined from the transition files group by group, so only one group is in memory at once.
+        :param patients: patient ids
+        :param filter: filter expression of the chain columns, e.g. expression(level_number=2, codes=[...])
+        :param columns: columns to read, all columns if None
+        :param batch_size: max number of rows in a batch
+        """
+        expression = self.__combine(self.expression(patients=patients), filter)
+        if self.has_chains:
+            yield from self.chains().to_batches(columns=self.__columns(columns), filter=expression,
+                                                batch_size=batch_size)
+            return
+        for group in self.__groups():
+            table = self.__join_group_chains(group, patients)
+            if table is None:
+                continue
+            if expression is not None:
+                table = table.filter(expression)
+            if columns is not None:
+                table = table.select(self.__columns(columns))
+            yield from table.to_batches(max_chunksize=batch_size)
+
+    def __join_group_chains(self, group: int, patients: Optional[list]) -> Optional[pa.Table]:
+        levels = self.levels
+        group_filter = self.__combine(ds.field(self.group) == group, self.expression(patients=patients))
+        key_columns = [[cc.get_column_at_level(c, i) for c in [cc.event_id, cc.code, cc.date]] for i in levels]
+        chains_df = self.events(0).to_table(columns=[cc.patient_id] + key_columns[0], filter=group_filter) \
+            .to_pandas(ignore_metadata=True).drop_duplicates()
+        for i in levels[1:]:
+            index_columns = [cc.patient_id] + key_columns[i - 1]
+            transition_columns = index_columns + [cc.get_column_at_level(cc.time_interval, i - 1)] + key_columns[i]
+            transition_df = self.transitions(i).to_table(columns=transition_columns, filter=group_filter) \
+                .to_pandas(ignore_metadata=True).drop_duplicates()
+            chains_df = FrameSchema.merge(chains_df, transition_df, on=index_columns)
+            if chains_df.empty:
+                return None
+        # the same layout and types as the chains output files: patient id index column followed by the group column
+        table = pa.Table.from_pandas(chains_df.set_index(cc.patient_id))
+        schema = pa.schema([pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type))
+                            if pa.types.is_dictionary(f.type) else f
+                            for f in table.schema], metadata=table.schema.metadata)
+        table = table.cast(schema)
+        return table.append_column(self.group, pa.array([group] * len(table), pa.int32()))
+
+    def __groups(self) -> list:
+        events_path = self.__path(self.__fp.get_events_path(self.outcome_dir, 0))
+        return sorted(int(p.name.split('=')[1]) for p in events_path.glob(f'{self.group}=*'))
+
+    def __path(self, path: Path) -> Path:
+        """Path of the FileProvider result file in the result path of the reader"""
+        return self.result_path / path.relative_to(self.__fp.result_path)
+
+    def __dataset(self, path: Path) -> ds.Dataset:
+        if path not in self.__datasets:
+            self.__datasets[path] = ds.dataset(str(path), format='parquet', partitioning='hive',
+                                               filesystem=self.__filesystem, ignore_prefixes=['.', '_'])
+        return self.__datasets[path]
+
+    @staticmethod
+    def __columns(columns: Optional[list]) -> Optional[list]:
+        if columns is None or cc.patient_id in columns:
+            return columns
+        return [cc.patient_id] + list(columns)
+
+    @staticmethod
+    def __combine(*expressions: Optional[ds.Expression]) -> Optional[ds.Expression]:
+        expressions = [e for e in expressions if e is not None]
+        return reduce(lambda a, b: a & b, expressions) if expressions else None
+
+    @staticmethod
+    def __to_frame(table: pa.Table) -> pd.DataFrame:
+        df = table.to_pandas(ignore_metadata=True)
+        return df.set_index(cc.patient_id) if cc.patient_id in df.columns else df
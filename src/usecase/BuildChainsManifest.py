@@ -0,0 +1,46 @@
+import json
+import logging
+
+import pyarrow.parquet as pq
+
+from src.datamodel.ChainsManifest import ChainsGroupFile, ChainsLevel, ChainsManifest
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.ExperimentConfig import ExperimentConfig
+from src.util.FileProvider import FileProvider
+
+
+class BuildChainsManifest:
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fp = FileProvider()
+
+    def execute(self, experiment_config: ExperimentConfig) -> ChainsManifest:
+        """
+        Describe the chains files of the study groups and save the manifest next to the events metadata.
+        Only the parquet footers and the patient id columns of the files are read
+        """
+        self.logger.debug('execute')
+        manifest = ChainsManifest(
+            study=experiment_config.name,
+            levels=[ChainsLevel(level=level.level, name=level.name, event_ids=[e.id for e in level.events])
+                    for level in experiment_config.levels])
+        outcome_path = self.fp.get_result_file_path(experiment_config.outcome_dir)
+        chains_path = self.fp.get_chains_path(experiment_config.outcome_dir)
+        group_files = sorted(chains_path.glob('group=*/*.parquet'), key=lambda f: int(f.parent.name.split('=')[1]))
+        for f in group_files:
+            parquet_file = pq.ParquetFile(f)
+            if not manifest.columns:
+                manifest.columns = {s.name: str(s.type) for s in parquet_file.schema_arrow}
+            patients = parquet_file.read(columns=[cc.patient_id]).column(cc.patient_id).unique()
+            manifest.files.append(ChainsGroupFile(group=int(f.parent.name.split('=')[1]),
+                                                  path=f.relative_to(outcome_path).as_posix(),
+                                                  records=parquet_file.metadata.num_rows,
+                                                  patients=len(patients)))
+        manifest.records = sum(f.records for f in manifest.files)
+        # patient groups do not intersect
+        manifest.patients = sum(f.patients for f in manifest.files)
+        file_dir, file_name = self.fp.chains_manifest_file_location(experiment_config.outcome_dir)
+        file_dir.mkdir(parents=True, exist_ok=True)
+        (file_dir / file_name).write_text(json.dumps(manifest.to_dict(), indent=2))
+        return manifest
@@ -0,0 +1,33 @@
+import logging
+import shutil
+
+import pandas as pd
+
+from src.datamodel.ExperimentConfig import ExperimentConfig
+from src.util.FileProvider import FileProvider
+from src.util.TransitionStats import TransitionStats
+
+
+class BuildTransitionStats:
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fp = FileProvider()
+
+    def execute(self, experiment_config: ExperimentConfig):
+        """
+        Merge partial transition statistics of the patient groups, save the final statistics next to the events
+        metadata and remove the partial files
+        """
+        self.logger.debug('execute')
+        file_dir, file_name = self.fp.get_transition_stats_group_location(experiment_config.outcome_dir, 0)
+        partial_dir = file_dir.parent
+        partial_df = TransitionStats.merge_partial(
+            [pd.read_parquet(f) for f in sorted(partial_dir.glob(f'group=*/{file_name}'))])
+        if partial_df is None:
+            self.logger.debug('No transitions found')
+        else:
+            file_dir, file_name = self.fp.transition_stats_file_location(experiment_config.outcome_dir)
+            self.fp.save_dataframe_file(df=TransitionStats.summarize(partial_df), file_dir=file_dir,
+                                        filename=file_name)
+        shutil.rmtree(partial_dir, ignore_errors=True)
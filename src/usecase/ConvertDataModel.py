@@ -5,8 +5,8 @@ import zipfile
 
 import pandas as pd
 
-from src.datamodel.DataColumns import DataDictionaryColumns as dd_cols, CommonColumns as cc_cols, \
-    TnxMapColumns as map_cols
+from src.datamodel.DataColumns import CommonColumns as cc_cols, TnxMapColumns as map_cols
+from src.db.TableSchema import TableSchema
 from src.util.ConcurrentUtil import ConcurrentUtil
 from src.util.FileProvider import FileProvider
 
@@ -17,7 +17,8 @@ class ConvertDataModel:
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.fp = FileProvider()
-        self.datadictionary = pd.read_csv(self.fp.data_dictionary_file)
+        # the compiled schema is pickled with the instance to the workers
+        self.schema = TableSchema.load(self.fp.data_dictionary_file, self.fp.cache_path)
         self.conversion_map = None
 
     def execute(self, data_path: str, source_type: str):
@@ -51,6 +52,7 @@ class ConvertDataModel:
         params = [(f, src_path, dest_path, conversion_map[conversion_map[map_cols.tnx_file] == f])
                   for f in tnx_files]
         ConcurrentUtil.run_in_separate_processes(self.convert_tnx_to_common, params)
+        self.schema.save(dest_path)
         if src_is_zip is not None:
             self.logger.debug(f'Remove unzipped archive directory {src_path}')
             shutil.rmtree(src_path)
@@ -76,8 +78,7 @@ class ConvertDataModel:
             df[cc_cols.date_of_death] = pd.to_datetime(df[cc_cols.date_of_death], format='%Y%m') + pd.offsets.MonthEnd()
         else:
             table_name = table_map[map_cols.table].tolist()[0]
-            date_columns = [c for c in self.get_tnx_table_date_columns(table_name)]
-            for c in date_columns:
+            for c in self.get_tnx_table_date_columns(table_name):
                 df[c] = pd.to_datetime(df[c], format='%Y%m%d')
         # Save to a new CSV file
         out_file_name = table_map[map_cols.file].tolist()[0]
@@ -87,10 +88,7 @@ class ConvertDataModel:
         df.to_csv(f'{dest_path}/{out_file_name}', index=False)
 
     def get_tnx_table_date_columns(self, table_name: str) -> list:
-        selection = ((self.datadictionary[dd_cols.table_name] == table_name)
-                     & ((self.datadictionary[dd_cols.data_type] == "DATETIME")
-                        | (self.datadictionary[dd_cols.data_type] == "DATE")))
-        return self.datadictionary.loc[selection, dd_cols.column_name].unique().tolist()
+        return list(self.schema.date_columns(table_name))
 
     def extract_files_from_zip_async(self, src_path: str, tnx_files: list) -> str:
         extraction_path = src_path[:-4]
@@ -1,7 +1,7 @@
 import logging
 
 from src.db.DatabaseManager import DatabaseManager
-from src.db.SqlDataElement import SqlTable, SqlColumn
+from src.db.SqlDataElement import SqlTable, SqlColumn, default_surrogate_keys
 
 
 class CreateSqlTablesStructure:
@@ -9,16 +9,39 @@ class CreateSqlTablesStructure:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.db_manager = db_manager
 
-    def execute(self, db_name: str, tables: list[SqlTable]) -> list[SqlTable]:
+    def execute(self, db_name: str, tables: list[SqlTable], surrogate_keys: bool = False) -> list[SqlTable]:
+        """
+        Create database and its tables
+        :param db_name: database name
+        :param tables: tables to create
+        :param surrogate_keys: if True, patient and encounter ids are stored as integer surrogate ids.
+        Natural ids are kept in the key tables
+        :return: created tables in the creation order
+        """
         self.logger.debug(f'Execute. DB: {db_name}, tables: {[t.name for t in tables]}')
         self.db_manager.open_ssh_tunnel()
         self.db_manager.create_db(db_name)
+        if surrogate_keys:
+            self.__create_surrogate_key_tables(tables)
         tables = self.__order_tables(tables)
         for t in tables:
+            if t.partition is not None:
+                self.logger.debug(f'Table {t.name} is partitioned: {t.partition}. '
+                                  f'Foreign keys are not created for partitioned tables')
             self.db_manager.create_table(t)
         self.db_manager.close_ssh_tunnel()
         return tables
 
+    def __create_surrogate_key_tables(self, tables: list[SqlTable]):
+        for key in default_surrogate_keys:
+            natural_type = next((t.column_types()[t.column_names().index(key.column_name)]
+                                 for t in tables if key.column_name in t.column_names()), None)
+            if natural_type is None:
+                continue
+            self.db_manager.create_surrogate_key_table(key, natural_type)
+        for t in tables:
+            t.apply_surrogate_keys(default_surrogate_keys)
+
     def __order_tables(self, tables: list[SqlTable]) -> list[SqlTable]:
         self.logger.debug(f'__order_tables. tables: {[t.name for t in tables]}')
         if len(tables) == 0:
@@ -31,12 +54,16 @@ class CreateSqlTablesStructure:
         self.logger.debug(f'result order: {[t.name for t in res_tables]}')
         return res_tables
 
-    def create_code_map_table(self, db_name: str, file_path: str) -> SqlTable:
-        self.logger.debug(f'create_code_map_table {db_name} from {file_path}')
+    @staticmethod
+    def code_map_table(file_path: str) -> SqlTable:
         cols = [SqlColumn('icd9_code', "VARCHAR", 100, False, False, True),
                 SqlColumn('icd10_code', "VARCHAR", 100, False, False, True),
                 SqlColumn('code_description', "VARCHAR", 1200, False, False, False)]
-        map_table = SqlTable(name='icd9_map_icd10', src=file_path, columns=cols)
+        return SqlTable(name='icd9_map_icd10', src=file_path, columns=cols)
+
+    def create_code_map_table(self, db_name: str, file_path: str) -> SqlTable:
+        self.logger.debug(f'create_code_map_table {db_name} from {file_path}')
+        map_table = self.code_map_table(file_path)
 
         self.db_manager.open_ssh_tunnel()
         self.db_manager.create_db(db_name)
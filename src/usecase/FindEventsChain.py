@@ -11,24 +11,46 @@ from src.datamodel.CodeFormat import CodeFormat
 from src.datamodel.DataColumns import CommonColumns as cc
 from src.datamodel.ExperimentConfig import ExperimentConfig, ExperimentLevel, ExperimentTimeFrame, \
     ExperimentTimeInterval, MatchMode
+from src.db.QueryProfiler import QueryProfiler
 from src.repository.EventRepository import EventRepository
 from src.repository.PatientRepository import PatientRepository
 from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
 from src.usecase.GetEventData import GetEventData
+from src.util.DatasetWriter import DatasetWriter
 from src.util.FileProvider import FileProvider
+from src.util.FrameSchema import FrameSchema
+from src.util.FrameSpill import FrameSpill
+from src.util.TransitionStats import TransitionStats
 
 
 class FindEventsChain:
     __col_total_time = 'total_time'
     __col_time_period = 't'
+    __spill_chain = 'chain'
+    __spill_level = 'level'
+    __spill_chains = 'chains'
+    __event_columns = [cc.patient_id, cc.code, cc.date]
 
     def __init__(self, patient_repo: PatientRepository, event_repo: EventRepository,
-                 cd_repo: CodeDescriptionRepository):
+                 cd_repo: CodeDescriptionRepository, memory_budget: Optional[int] = None, chains_output: bool = False):
+        """
+        :param memory_budget: memory budget of the chain and level frames in bytes. If the frames exceed it, they are
+        spilled to disk by patient partitions, and the next levels are loaded and matched partition by partition.
+        The budget is checked before a level is loaded and after it, so only the level that exceeds the budget first
+        is loaded at once. None means no limit
+        :param chains_output: if True, only the event id, code and date columns of the levels are kept, and the full
+        chains of the group are saved in a single chains file with the level columns instead of the level and
+        transition files
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.__memory_budget = memory_budget
+        self.__chains_output = chains_output
         self.__patient_repo = patient_repo
         self.__event_repo = event_repo
         self.__cd_repo = cd_repo
         self.__file_provider = FileProvider()
+        self.__patient_id_map: Optional[pd.Series] = None
+        self.__transition_stats: Optional[TransitionStats] = None
 
     def execute(self, patient_group: tuple,
                 experiment_config: Optional[ExperimentConfig] = None,
@@ -65,9 +87,12 @@ class FindEventsChain:
         if None in experiment_config.levels:
             return None
 
-        self.__build_events_chain(
-            experiment_config, include_icd9, patient_group[1], patient_group[0]
-        )
+        self.__transition_stats = TransitionStats()
+        with QueryProfiler.stage(study=experiment_config.name, group=patient_group[0]):
+            self.__build_events_chain(
+                experiment_config, include_icd9, patient_group[1], patient_group[0]
+            )
+        self.__save_transition_stats(experiment_config.outcome_dir, patient_group[0])
 
     def __build_events_chain(self, experiment_config: ExperimentConfig, include_icd9: bool, patients: list,
                              pgroup_number: int):
@@ -77,39 +102,92 @@ class FindEventsChain:
         """
         self.logger.debug('__build_events_chain')
 
+        # original patient ids to restore in the result files if the database uses surrogate ids
+        self.__patient_id_map = self.__patient_repo.get_patient_id_map(patients)
+        # death events of the group are found in the patient attributes cache, loaded patients are skipped
+        self.__patient_repo.preload_patients(patients)
         # get all index events for the patients group
         date_patient_map = self.__init_date_patient_map(experiment_config.time_frame, patients)
 
         chain_df = None
-        n_levels = len(experiment_config.levels)
-        for i, experiment_level in enumerate(experiment_config.levels):
-            curr_level_number = experiment_level.level
-            self.logger.debug(f'__build_events_chain: build level {curr_level_number}')
-            first_incident = experiment_level.match_mode == MatchMode.first_match
-            df = self.__get_events_data(experiment_level, date_patient_map, experiment_config.time_frame, include_icd9,
-                                        first_incident)
-            if df is None or df.empty:
-                self.logger.debug(f'No data for level {curr_level_number}')
-                return None
-            # calc time interval for each patient for the next level
-            if i < n_levels - 1:
-                next_level_dist = experiment_config.levels[i + 1].period
-                date_patient_map = self.__get_date_patient_map(df, next_level_dist, experiment_config.time_frame)
-            # rename columns with level number
-            curr_level_columns = [cc.get_column_at_level(c, curr_level_number) for c in df.columns if c != cc.patient_id]
-            df.columns = [cc.patient_id] + curr_level_columns
-            if curr_level_number == 0:
-                chain_df = df
-            else:
-                # merge with previous levels
-                chain_df = self.__merge_levels(index_df=chain_df, target_df=df,
-                                               index_level=experiment_config.get_level_by_number(curr_level_number - 1),
-                                               target_level=experiment_level)
-                # if not possible to connect levels, return None values
-                if chain_df is None:
+        # full chains of the chains output ending at the current level
+        chains_df = None
+        # the chain and the levels frames are spilled to disk if they exceed the memory budget
+        spill: Optional[FrameSpill] = None
+        try:
+            n_levels = len(experiment_config.levels)
+            for i, experiment_level in enumerate(experiment_config.levels):
+                curr_level_number = experiment_level.level
+                self.logger.debug(f'__build_events_chain: build level {curr_level_number}')
+                first_incident = experiment_level.match_mode == MatchMode.first_match
+                if spill is None and self.__exceeds_memory_budget(chain_df, chains_df):
+                    # the level is loaded by the partitions of the spilled chain
+                    spill = self.__spill_chain_frame(patients, chain_df, None, chains_df)
+                    chain_df = chains_df = None
+                if spill is not None:
+                    date_patient_map = self.__load_spilled_level(spill, experiment_config, i, date_patient_map,
+                                                                 include_icd9)
+                    if date_patient_map is None:
+                        self.logger.debug(f'No data for level {curr_level_number}')
+                        return None
+                    if not self.__build_spilled_level(spill, experiment_config, experiment_level, pgroup_number):
+                        return None
+                    continue
+
+                with QueryProfiler.stage(level=curr_level_number):
+                    df = self.__get_events_data(experiment_level, date_patient_map, experiment_config.time_frame,
+                                                include_icd9, first_incident)
+                if df is None or df.empty:
+                    self.logger.debug(f'No data for level {curr_level_number}')
                     return None
-                # save current level-to-level interaction
-                file_dir, file_name = self.__file_provider.get_transition_group_location(
+                # calc time interval for each patient for the next level
+                if i < n_levels - 1:
+                    next_level_dist = experiment_config.levels[i + 1].period
+                    date_patient_map = self.__get_date_patient_map(df, next_level_dist, experiment_config.time_frame)
+                df = self.__to_level_frame(df, curr_level_number)
+
+                if self.__exceeds_memory_budget(chain_df, df, chains_df):
+                    spill = self.__spill_chain_frame(patients, chain_df, df, chains_df)
+                    chain_df = chains_df = None
+                    spill.write_frame(self.__spill_level, df)
+                    del df
+                    if not self.__build_spilled_level(spill, experiment_config, experiment_level, pgroup_number):
+                        return None
+                    continue
+
+                if curr_level_number == 0:
+                    chain_df = df
+                else:
+                    # merge with previous levels
+                    chain_df = self.__merge_levels(index_df=chain_df, target_df=df,
+                                                   index_level=experiment_config.get_level_by_number(
+                                                       curr_level_number - 1),
+                                                   target_level=experiment_level)
+                    # if not possible to connect levels, return None values
+                    if chain_df is None:
+                        return None
+                    self.__transition_stats.add(chain_df, curr_level_number)
+                    if self.__chains_output:
+                        chains_df = self.__extend_chains(chains_df, chain_df, curr_level_number)
+                    else:
+                        # save current level-to-level interaction
+                        file_dir, file_name = self.__file_provider.get_transition_group_location(
+                            experiment_config.outcome_dir, curr_level_number, pgroup_number
+                        )
+                        self.__save_to_file(
+                            df=chain_df,
+                            file_dir=file_dir,
+                            file_name=file_name,
+                            index=cc.patient_id)
+
+                # remove previous level to work further only with a new one
+                chain_df = self.__get_level_records(chain_df, curr_level_number)
+                if self.__chains_output:
+                    if curr_level_number == 0:
+                        chains_df = chain_df
+                    continue
+                # save current level record in a separate file
+                file_dir, file_name = self.__file_provider.get_event_group_location(
                     experiment_config.outcome_dir, curr_level_number, pgroup_number
                 )
                 self.__save_to_file(
@@ -118,25 +196,177 @@ class FindEventsChain:
                     file_name=file_name,
                     index=cc.patient_id)
 
-            curr_level_columns = [c for c in chain_df.columns if c.endswith(f'_{curr_level_number}')]
-            # remove previous level to work further only with a new one
-            chain_df = chain_df[[cc.patient_id] + curr_level_columns].drop_duplicates()
-            # save current level record in a separate file
-            file_dir, file_name = self.__file_provider.get_event_group_location(
-                experiment_config.outcome_dir, curr_level_number, pgroup_number
-            )
-            self.__save_to_file(
-                df=chain_df,
-                file_dir=file_dir,
-                file_name=file_name,
-                index=cc.patient_id)
+            if self.__chains_output:
+                self.__save_chains(experiment_config.outcome_dir, pgroup_number, chains_df, spill)
+        finally:
+            if spill is not None:
+                spill.clear()
+
+    def __to_level_frame(self, df: pd.DataFrame, level_number: int) -> pd.DataFrame:
+        """
+        Rename the columns of the level records with the level number and sort the records by all the columns. The
+        records are loaded by the group or by the spilled partition, so only the loaded frame is sorted. The merges
+        keep the order of the sorted records, and the saved files do not depend on the order of the requested records
+        and of the patient partitions
+        """
+        df.columns = [cc.patient_id] + [cc.get_column_at_level(c, level_number)
+                                        for c in df.columns if c != cc.patient_id]
+        if self.__chains_output:
+            df = df[[cc.patient_id] + self.__get_chain_columns(level_number)].drop_duplicates()
+        # the columns of a spilled partition can be in another order, the sort columns do not depend on it
+        columns = [cc.patient_id] + sorted(c for c in df.columns if c != cc.patient_id)
+        return df.sort_values(columns, key=self.__sort_key, kind='stable', ignore_index=True)
+
+    def __load_spilled_level(self, spill: FrameSpill, experiment_config: ExperimentConfig, level_index: int,
+                             date_patient_map: dict, include_icd9: bool) -> Optional[dict]:
+        """
+        Load the level records partition by partition to the spill, so the level frame is never loaded at once.
+        Partitions are read with the columns of the level in the order of the level frame loaded at once
+        :return: date-patient map of the next level, or None if the level has no records
+        """
+        experiment_level = experiment_config.levels[level_index]
+        level_number = experiment_level.level
+        first_incident = experiment_level.match_mode == MatchMode.first_match
+        has_next_level = level_index < len(experiment_config.levels) - 1
+        next_date_patient_map = {}
+        dtypes = {}
+        for p in range(spill.n_partitions):
+            partition_patients = spill.partition_patients(p)
+            partition_map = {dates: ps & partition_patients for dates, ps in date_patient_map.items()
+                             if not partition_patients.isdisjoint(ps)}
+            if not partition_map:
+                continue
+            self.logger.debug(f'load level {level_number} for partition {p} of {spill.n_partitions}')
+            with QueryProfiler.stage(level=level_number):
+                df = self.__get_events_data(experiment_level, partition_map, experiment_config.time_frame,
+                                            include_icd9, first_incident)
+            if df is None or df.empty:
+                continue
+            if has_next_level:
+                for dates, ps in self.__get_date_patient_map(df, experiment_config.levels[level_index + 1].period,
+                                                             experiment_config.time_frame).items():
+                    next_date_patient_map.setdefault(dates, set()).update(ps)
+            df = self.__to_level_frame(df, level_number)
+            dtypes.update({c: df[c].dtype for c in df.columns if c not in dtypes})
+            spill.write(self.__spill_level, p, df)
+        if not dtypes:
+            return None
+        order = [cc.patient_id] + [cc.get_column_at_level(c, level_number)
+                                   for c in GetEventData.columns_order(experiment_level, self.__event_columns)
+                                   if c != cc.patient_id]
+        order = [c for c in order if c in dtypes] + [c for c in dtypes if c not in order]
+        spill.set_columns(self.__spill_level, {c: dtypes[c] for c in order})
+        return next_date_patient_map
+
+    def __exceeds_memory_budget(self, *frames: Optional[pd.DataFrame]) -> bool:
+        if self.__memory_budget is None:
+            return False
+        return sum(FrameSpill.memory_size(f) for f in frames) > self.__memory_budget
+
+    def __spill_chain_frame(self, patients: list, chain_df: Optional[pd.DataFrame], df: Optional[pd.DataFrame],
+                            chains_df: Optional[pd.DataFrame]) -> FrameSpill:
+        size = sum(FrameSpill.memory_size(f) for f in [chain_df, df, chains_df])
+        # partitions of the chain and level frames together take a half of the budget, the rest is for matching
+        n_partitions = -(-2 * size // self.__memory_budget)
+        self.logger.debug(f'Frames of {size} bytes exceed the memory budget, spill them to {n_partitions} partitions')
+        # partitions are ordered by the saved patient ids and the records of the patients are sorted when they are
+        # loaded, so the result files are the same as the files of the frames in memory
+        spill = FrameSpill(patients, n_partitions, self.__patient_id_map)
+        spill.write_frame(self.__spill_chain, chain_df)
+        spill.write_frame(self.__spill_chains, chains_df)
+        return spill
+
+    def __build_spilled_level(self, spill: FrameSpill, experiment_config: ExperimentConfig,
+                              experiment_level: ExperimentLevel, pgroup_number: int) -> bool:
+        """
+        Match the spilled level with the spilled chain partition by partition. The level records of the chain replace
+        the chain partitions, the transitions and the level records are appended to the result files, or extend the
+        spilled full chains for the chains output.
+        :return: False if the levels are not connected
+        """
+        curr_level_number = experiment_level.level
+        index_level = experiment_config.get_level_by_number(curr_level_number - 1) if curr_level_number > 0 else None
+        transition_writer = self.__open_writer(
+            *self.__file_provider.get_transition_group_location(
+                experiment_config.outcome_dir, curr_level_number, pgroup_number))
+        event_writer = self.__open_writer(
+            *self.__file_provider.get_event_group_location(
+                experiment_config.outcome_dir, curr_level_number, pgroup_number))
+        matched = False
+        with transition_writer, event_writer:
+            for p in range(spill.n_partitions):
+                self.logger.debug(f'build level {curr_level_number} for partition {p} of {spill.n_partitions}')
+                chain_df = spill.read(self.__spill_level, p)
+                if index_level is not None:
+                    index_df = spill.read(self.__spill_chain, p)
+                    # patients without previous levels records are not in the chain
+                    chain_df = self.__merge_levels(index_df=index_df, target_df=chain_df, index_level=index_level,
+                                                   target_level=experiment_level) if index_df is not None else None
+                    if chain_df is not None:
+                        self.__transition_stats.add(chain_df, curr_level_number)
+                    if chain_df is not None and self.__chains_output:
+                        spill.write(self.__spill_chains, p, self.__extend_chains(
+                            spill.read(self.__spill_chains, p), chain_df, curr_level_number))
+                    elif chain_df is not None:
+                        transition_writer.write(self.__prepare_to_save(chain_df, cc.patient_id))
+                    else:
+                        spill.write(self.__spill_chains, p, None)
+                if chain_df is not None:
+                    chain_df = self.__get_level_records(chain_df, curr_level_number)
+                    if self.__chains_output:
+                        if index_level is None:
+                            spill.write(self.__spill_chains, p, chain_df)
+                    else:
+                        event_writer.write(self.__prepare_to_save(chain_df, cc.patient_id))
+                    matched = True
+                spill.write(self.__spill_chain, p, chain_df)
+        spill.drop(self.__spill_level)
+        return matched
+
+    @staticmethod
+    def __get_level_records(chain_df: pd.DataFrame, level_number: int) -> pd.DataFrame:
+        curr_level_columns = [c for c in chain_df.columns if c.endswith(f'_{level_number}')]
+        return chain_df[[cc.patient_id] + curr_level_columns].drop_duplicates()
+
+    @staticmethod
+    def __get_chain_columns(level_number: int) -> list:
+        """Columns of the level kept in the chains output"""
+        return [cc.get_column_at_level(c, level_number) for c in [cc.event_id, cc.code, cc.date]]
+
+    def __extend_chains(self, chains_df: Optional[pd.DataFrame], transition_df: pd.DataFrame,
+                        level_number: int) -> Optional[pd.DataFrame]:
+        """
+        Join the full chains ending at the previous level with the transitions from the previous level to the level
+        :return: full chains ending at the level or None if no chain is extended
+        """
+        if chains_df is None:
+            return None
+        index_columns = [cc.patient_id] + self.__get_chain_columns(level_number - 1)
+        transition_df = transition_df[index_columns + [cc.get_column_at_level(cc.time_interval, level_number - 1)] +
+                                      self.__get_chain_columns(level_number)].drop_duplicates()
+        chains_df = FrameSchema.merge(chains_df, transition_df, on=index_columns)
+        return None if chains_df.empty else chains_df
+
+    def __save_chains(self, outcome_dir: str, pgroup_number: int, chains_df: Optional[pd.DataFrame],
+                      spill: Optional[FrameSpill]):
+        """Save the full chains of the group from memory or from the spilled partitions in the patients order"""
+        file_dir, file_name = self.__file_provider.get_chains_group_location(outcome_dir, pgroup_number)
+        with self.__open_writer(file_dir, file_name) as writer:
+            if spill is None:
+                if chains_df is not None:
+                    writer.write(self.__prepare_to_save(chains_df, cc.patient_id))
+                return
+            for p in range(spill.n_partitions):
+                chains_df = spill.read(self.__spill_chains, p)
+                if chains_df is not None:
+                    writer.write(self.__prepare_to_save(chains_df, cc.patient_id))
 
     def __get_events_data(self, level: ExperimentLevel, date_patient_map: Optional[dict] = None,
                           etf: ExperimentTimeFrame = None,
                           include_icd9: bool = True, first_incident: bool = False) -> Optional[pd.DataFrame]:
         self.logger.debug(f'__get_events_data: events={level.events}')
 
-        columns = [cc.patient_id, cc.code, cc.date]
+        columns = self.__event_columns
         df = GetEventData(self.__patient_repo, self.__event_repo) \
             .execute(level, columns, date_patient_map, etf, include_icd9, first_incident)
         if df is None:
@@ -167,7 +397,7 @@ class FindEventsChain:
         if target_level.match_mode == MatchMode.first_match:
             # take only the earliest target records of each patient+event+code
             target_df = target_df.groupby(
-                [cc.patient_id, col_target_event_id, col_target_code], as_index=False
+                [cc.patient_id, col_target_event_id, col_target_code], as_index=False, observed=True
             )[col_target_date].min()
 
         index_cols = index_df.columns.tolist()
@@ -205,7 +435,7 @@ class FindEventsChain:
                 group_col = [cc.patient_id, col_index_event_id, col_index_code, col_target_event_id,
                              col_target_code]
                 curr_index_df = curr_index_df[
-                    curr_index_df.index == curr_index_df.groupby(group_col)[col_index_date].transform('idxmin')]
+                    curr_index_df.index == curr_index_df.groupby(group_col, observed=True)[col_index_date].transform('idxmin')]
 
             curr_index_df = curr_index_df[res_columns_order]
             merge_result.append(curr_index_df)
@@ -213,7 +443,7 @@ class FindEventsChain:
         if not merge_result:
             self.logger.warning('Nothing to match')
             return None
-        return pd.concat(merge_result)
+        return FrameSchema.concat(merge_result)
 
     def __filter_events_within_period(self, df: pd.DataFrame, start_level: ExperimentLevel, end_level: ExperimentLevel):
         self.logger.debug(
@@ -230,7 +460,7 @@ class FindEventsChain:
         # exclude negative codes from mask
         time_mask = ~is_negative_code
 
-        df[col_distance] = (df[col_end_date] - df[col_start_date]).dt.days
+        df[col_distance] = (df[col_end_date] - df[col_start_date]).dt.days.astype(FrameSchema.distance_dtype)
         # time mask for positive codes
         df_res = []
         for event in end_level.events:
@@ -250,17 +480,38 @@ class FindEventsChain:
                 event_time_mask = event_time_mask | (is_negative_code & (df_event[col_distance] == period))
 
             df_res.append(df_event[event_time_mask])
-        return pd.concat(df_res)
+        return FrameSchema.concat(df_res)
+
+    def __save_transition_stats(self, outcome_dir: str, pgroup_number: int):
+        """Save partial transition statistics of the group, they are merged when all groups are processed"""
+        stats_df = self.__transition_stats.frame()
+        if stats_df is None:
+            return
+        file_dir, file_name = self.__file_provider.get_transition_stats_group_location(outcome_dir, pgroup_number)
+        self.__file_provider.save_dataframe_file(df=stats_df, file_dir=file_dir, filename=file_name)
 
-    def __save_to_file(
-            self, df: pd.DataFrame, file_dir: Path, file_name: str, file_format: str = 'parquet', index=None
-    ):
+    def __save_to_file(self, df: pd.DataFrame, file_dir: Path, file_name: str, index=None):
         self.logger.debug(f'__save_to_file: {file_name} index={index}')
-        if cc.patient_id in df.columns:
-            df = df.sort_values(by=[cc.patient_id], ascending=[True])
+        with self.__open_writer(file_dir, file_name) as writer:
+            writer.write(self.__prepare_to_save(df, index))
+
+    def __open_writer(self, file_dir: Path, file_name: str) -> DatasetWriter:
+        # every written part is sorted by patients, the parts of spilled partitions are written in the patients order
+        return self.__file_provider.open_dataset_writer(file_dir, file_name, sort_by=cc.patient_id)
+
+    def __prepare_to_save(self, df: pd.DataFrame, index=None) -> pd.DataFrame:
+        if self.__patient_id_map is not None and cc.patient_id in df.columns:
+            df = df.assign(**{cc.patient_id: df[cc.patient_id].map(self.__patient_id_map)})
         if index is not None:
             df = df.set_index(index)
-        self.__file_provider.save_dataframe_file(df=df, file_dir=file_dir, filename=file_name, file_format=file_format)
+        return df
+
+    @staticmethod
+    def __sort_key(column: pd.Series) -> pd.Series:
+        # categorical values are compared by the values, their categories order depends on the loaded records
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            return column.cat.reorder_categories(sorted(column.cat.categories))
+        return column
 
     def __init_date_patient_map(self, etf: ExperimentTimeFrame, patients: list) -> dict:
         self.logger.debug('init experiment time frame')
@@ -5,6 +5,7 @@ import pandas as pd
 
 from src.datamodel.ExperimentConfig import ExperimentConfig, ExperimentLevel, MatchMode
 from src.datamodel.DataColumns import CommonColumns as cc
+from src.db.QueryProfiler import QueryProfiler
 from src.repository.EventRepository import EventRepository
 from src.repository.PatientRepository import PatientRepository
 from src.usecase.GetEventData import GetEventData
@@ -30,8 +31,16 @@ class FindPatients:
         if None in study_config.levels:
             return None
 
-        index_patients = self.__get_index_patients(study_config.levels[0], include_icd9)
-        patients_df = self.__get_patients_metadata(index_patients)
+        with QueryProfiler.stage(study=study_config.name):
+            with QueryProfiler.stage(level=study_config.levels[0].level):
+                index_patients = self.__get_index_patients(study_config.levels[0], include_icd9)
+            # patients attributes are loaded once, metadata and death events are found in the cache
+            self.__patient_repo.preload_patients(index_patients)
+            patients_df = self.__get_patients_metadata(index_patients)
+            # databases with surrogate keys return integer ids, restore the original ones in the result file
+            patient_id_map = self.__patient_repo.get_patient_id_map(index_patients)
+        if patient_id_map is not None:
+            patients_df[cc.patient_id] = patients_df[cc.patient_id].map(patient_id_map)
         patients_df = patients_df.sort_values(by=[cc.patient_id], ascending=[True]).set_index(cc.patient_id)
 
         file_dir, file_name = self.__file_provider.patients_metadata_file_location(study_config.outcome_dir)
@@ -41,13 +50,15 @@ class FindPatients:
         return patient_groups
 
     def __split_patients_on_groups(self, index_patients: list) -> list:
-        # split patients by the first character of their id. Maximum there will be 16 groups [0..f]
+        # split patients by the first character of their id or by the remainder of division by 16 for integer
+        # surrogate ids. Maximum there will be 16 groups
         res = {}
         for p in index_patients:
-            if p[0] in res:
-                res[p[0]].append(p)
+            group = p[0] if isinstance(p, str) else p % 16
+            if group in res:
+                res[group].append(p)
             else:
-                res[p[0]] = [p]
+                res[group] = [p]
         return list(res.values())
 
     def __get_index_patients(self, index_level: ExperimentLevel, include_icd9: bool = True) -> Optional[list]:
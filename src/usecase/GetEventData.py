@@ -2,15 +2,19 @@ import logging
 from datetime import timedelta, datetime
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
-from src.datamodel.Event import Event, AttributeMode
+from src.datamodel.Event import Event, AttributeMode, EventTimeInterval
 from src.datamodel.Event import EventCategory, EventConstant
 from src.datamodel.ExperimentConfig import ExperimentLevel, ExperimentTimeFrame
+from src.db.QueryProfiler import QueryProfiler
 from src.repository.PatientRepository import PatientRepository
 from src.repository.EventRepository import EventRepository
 from src.util.ConcurrentUtil import ConcurrentUtil
 from src.util.FileProvider import FileProvider
+from src.util.FrameSchema import FrameSchema
+from src.util.IntervalJoin import IntervalJoin
 
 from src.datamodel.DataColumns import CommonColumns as cc
 
@@ -28,27 +32,64 @@ class GetEventData:
                 etf: Optional[ExperimentTimeFrame], include_icd9: bool = True, first_incident: bool = False):
         events = [Event.from_experiment_event(e) for e in level.events]
 
-        def adjust_columns(event, cols):
-            if event.category == EventCategory.Medication:
-                cols = cols + [cc.strength, cc.route, cc.brand]
-            elif event.category == EventCategory.LabResult or event.category == EventCategory.VitalSign:
-                if event.num_value is not None:
-                    cols = cols + [cc.num_value]
-                if event.text_value is not None:
-                    cols = cols + [cc.text_value]
-            return cols
-
-        params = [(event,
-                   adjust_columns(event, columns),
-                   self.__adjust_event_period(event, date_patient_map, etf),
+        # events of the same table and period are requested together
+        batches = {}
+        for i, event in enumerate(events):
+            batch_key = self.__batch_key(event, self.__event_columns(event, columns))
+            batches.setdefault(batch_key if batch_key is not None else i, []).append(event)
+
+        params = [(batch,
+                   self.__event_columns(batch[0], columns),
+                   self.__adjust_event_period(batch[0], date_patient_map, etf),
                    include_icd9,
                    first_incident)
-                  for event in events]
-        res_data = ConcurrentUtil.do_async_job(self.__request_event_info, params_list=params)
+                  for batch in batches.values()]
+        # frames are concatenated in the order of the level events, so the result does not depend on the timing
+        res_data = ConcurrentUtil.do_async_job(self.__request_events_info, params_list=params, ordered=True)
+        res_data = [df for batch_data in res_data for df in batch_data]
         if len(res_data) == 0 or all(v is None for v in res_data):
             return None
-        res_data = pd.concat(res_data)
-        return res_data
+        res_data = FrameSchema.concat(res_data)
+        order = self.columns_order(level, columns)
+        order = [c for c in order if c in res_data.columns] + [c for c in res_data.columns if c not in order]
+        return res_data if res_data.columns.tolist() == order else res_data[order]
+
+    @staticmethod
+    def columns_order(level: ExperimentLevel, columns: list) -> list:
+        """
+        Order of the level result columns: the requested columns, the event id and the columns of the event
+        categories in the order of the level events. The result has the columns of the events with records only
+        :param level: level
+        :param columns: requested columns
+        :return: all columns the level result can have
+        """
+        events = [Event.from_experiment_event(e) for e in level.events]
+        return list(dict.fromkeys(columns + [cc.event_id] +
+                                  [c for e in events for c in GetEventData.__event_columns(e, columns)]))
+
+    @staticmethod
+    def __event_columns(event: Event, columns: list) -> list:
+        if event.category == EventCategory.Medication:
+            columns = columns + [cc.strength, cc.route, cc.brand]
+        elif event.category == EventCategory.LabResult or event.category == EventCategory.VitalSign:
+            if event.num_value is not None:
+                columns = columns + [cc.num_value]
+            if event.text_value is not None:
+                columns = columns + [cc.text_value]
+        return columns
+
+    def __batch_key(self, event: Event, columns: list) -> Optional[tuple]:
+        """
+        Events with the same key can be requested in one batch request. Adjusted event period depends on the event
+        period only, so the events with the same key have the same date-patient map.
+        Events with attribute events pushed down to the database are requested separately.
+        :return: batch key or None if event can not be requested in a batch
+        """
+        if event.category == EventCategory.Patient or event.negation or not event.codes:
+            return None
+        if self.__event_repo.attribute_pushdown and event.has_attribute_events():
+            return None
+        return event.get_data_table(), tuple(columns), event.period
 
     def __adjust_event_period(
             self, event: Event, date_patient_map: Optional[dict], etf: ExperimentTimeFrame
@@ -87,6 +128,18 @@ class GetEventData:
 
         return new_map
 
+    def __request_events_info(self, events: list[Event], columns: list, date_patient_map: Optional[dict] = None,
+                              include_icd9: bool = True, first_incident: bool = False) -> list:
+        with QueryProfiler.stage(event_id=','.join(e.id for e in events)):
+            if len(events) == 1:
+                return [self.__request_event_info(events[0], columns, date_patient_map, include_icd9, first_incident)]
+            self.logger.debug(f'Batch request for events: {[e.id for e in events]}')
+            dfs = self.__event_repo.get_events_info(
+                events=events, columns=columns, date_patient_map=date_patient_map,
+                include_icd9=include_icd9, first_incident=first_incident
+            )
+        return [self.__process_event_info(event, df) for event, df in zip(events, dfs)]
+
     def __request_event_info(self, event: Event, columns: list, date_patient_map: Optional[dict] = None,
                              include_icd9: bool = True, first_incident: bool = False) -> Optional[pd.DataFrame]:
         df = None
@@ -103,14 +156,24 @@ class GetEventData:
                     df[col_left] = None
                 df = df[columns]
         else:
+            attribute_filters = self.__event_repo.get_attribute_filters(event, first_incident, include_icd9) \
+                if event.has_attribute_events() else None
+            having, exclusion = attribute_filters if attribute_filters is not None else (None, None)
             df = self.__event_repo.get_event_info(
                 event=event, columns=columns, date_patient_map=date_patient_map,
-                include_icd9=include_icd9, first_incident=first_incident
+                include_icd9=include_icd9, first_incident=first_incident, having=having, exclusion=exclusion
             )
+            if attribute_filters is not None:
+                self.logger.debug(f'Attribute events of {event.id} were filtered by the database')
+                return self.__process_event_info(event, df, filter_attributes=False)
+        return self.__process_event_info(event, df)
 
+    def __process_event_info(self, event: Event, df: Optional[pd.DataFrame],
+                             filter_attributes: bool = True) -> Optional[pd.DataFrame]:
         if (df is not None) and (not df.empty):
             df[cc.event_id] = event.id
-            if event.has_attribute_events():
+            df = FrameSchema.apply(df)
+            if filter_attributes and event.has_attribute_events():
                 df = self.__filter_attribute_evens(df, event)
         self.logger.debug(f'Returning event info for event: {event.id}, data size: {0 if df is None else df.shape}')
         return df
@@ -119,38 +182,72 @@ class GetEventData:
         # if no event to filter return df as is
         if (exclude and not event.exclusion_events) or (not exclude and not event.having_events):
             return None
-        gdf = df.groupby(cc.date)[cc.patient_id].apply(list).reset_index()
-
         period = event.exclusion_period if exclude else event.having_period
         events = event.exclusion_events if exclude else event.having_events
         if period is not None:
-            gdf['start_date'] = gdf[cc.date] + timedelta(days=period.min_t)
-            gdf['end_date'] = gdf[cc.date] + timedelta(days=period.max_t)
+            date_patient_map = self.__make_date_patient_map(df, period.min_t, period.max_t)
         else:
-            gdf['start_date'] = None
-            gdf['end_date'] = gdf[cc.date]  # todo make it None for the default case
-        date_patient_map = {(row['start_date'], row["end_date"]): row[cc.patient_id]
-                            for i, row in gdf.iterrows()}
+            date_patient_map = self.__make_date_patient_map(df, None, 0)  # todo make it None for the default case
         # get all patients with attribute events
         params = [(e, [cc.patient_id, cc.date],
                    self.__make_date_patient_map_for_event(e, df, date_patient_map),
                    True, False)
                   for e in events]
-        res_dfs = ConcurrentUtil.do_async_job(self.__request_event_info, params)
+        res_dfs = ConcurrentUtil.do_async_job(self.__request_event_info, params, ordered=True)
         res_dfs = [d for d in res_dfs if (d is not None) and (not d.empty)]
 
-        res_df = pd.concat(res_dfs) if res_dfs else None
+        res_df = FrameSchema.concat(res_dfs)
         return res_df
 
     def __make_date_patient_map_for_event(self, event: Event, df: pd.DataFrame, common_map: dict) -> dict:
         if event.period is None:
             return common_map
-        gdf = df.groupby(cc.date)[cc.patient_id].apply(list).reset_index()
-        gdf['start_date'] = gdf[cc.date] + timedelta(days=event.period.min_t)
-        gdf['end_date'] = gdf[cc.date] + timedelta(days=event.period.max_t)
-        date_patient_map = {(row['start_date'], row["end_date"]): row[cc.patient_id]
-                            for i, row in gdf.iterrows()}
-        return date_patient_map
+        return self.__make_date_patient_map(df, event.period.min_t, event.period.max_t)
+
+    @staticmethod
+    def __make_date_patient_map(df: pd.DataFrame, min_t: Optional[int], max_t: int) -> dict:
+        """
+        Make map of (start date, end date) windows around each event date to the patients of the date
+        :param df: events data
+        :param min_t: window start in days from the event date, None for window without start
+        :param max_t: window end in days from the event date
+        """
+        patients = df.groupby(cc.date, observed=True)[cc.patient_id].agg(list)
+        dates = patients.index
+        start_dates = [None] * len(dates) if min_t is None else dates + timedelta(days=min_t)
+        end_dates = dates + timedelta(days=max_t)
+        return dict(zip(zip(start_dates, end_dates), patients.values))
+
+    @staticmethod
+    def __attribute_event_mask(df: pd.DataFrame, attr_df: pd.DataFrame, attr_event: Event,
+                               period: Optional[EventTimeInterval]) -> np.ndarray:
+        """
+        Check for each record if the patient has the attribute event within the attribute period
+        :param df: events data
+        :param attr_df: attribute events data
+        :param attr_event: attribute event
+        :param period: attribute period of the main event
+        :return: boolean mask of the records
+        """
+        attr_df = attr_df[attr_df[cc.event_id] == attr_event.id]
+        if period is None and attr_event.period is None:
+            # attribute event before the event date
+            min_t, max_t = None, -1
+        else:
+            min_t = attr_event.period.min_t if attr_event.period is not None else period.min_t
+            max_t = attr_event.period.max_t if attr_event.period is not None else period.max_t
+        return IntervalJoin.any_within(df[cc.patient_id], df[cc.date], attr_df[cc.patient_id], attr_df[cc.date],
+                                       min_t, max_t)
+
+    def __attribute_events_mask(self, df: pd.DataFrame, attr_df: pd.DataFrame, attr_events: list[Event],
+                                period: Optional[EventTimeInterval], mode: AttributeMode) -> np.ndarray:
+        masks = [self.__attribute_event_mask(df, attr_df, e, period) for e in attr_events]
+        # check attribute mode and apply it
+        if len(masks) == 1 or mode == AttributeMode.any:
+            return np.logical_or.reduce(masks)
+        elif mode == AttributeMode.all:
+            return np.logical_and.reduce(masks)
+        raise ValueError(f'Invalid attribute mode: {mode}')
 
     def __filter_excluded_events(self, df: pd.DataFrame, excl_df: pd.DataFrame, event: Event) -> Optional[pd.DataFrame]:
         # remove all patients with exclusion events
@@ -159,50 +256,13 @@ class GetEventData:
             self.logger.debug('Nothing was excluded')
             return df
 
-        df = df.merge(excl_df, on=cc.patient_id, how='left', suffixes=('', '_excl'))
-        # records without any excluded events
-        df_na = df[df[cc.date + '_excl'].isna()]
-        # records with excluded events
-        df = df[~df[cc.date + '_excl'].isna()]
-        df['date_diff'] = (df[cc.date + '_excl'] - df[cc.date]).dt.days
-        # check each date with each exclusion date
-        filtered_dfs = []
-        for excl_event in event.exclusion_events:
-            excl_df = df[df[cc.event_id + '_excl'] == excl_event.id]
-            if event.exclusion_period is None and excl_event.period is None:
-                excl_df = excl_df[excl_df['date_diff'] < 0]
-            else:
-                min_t = excl_event.period.min_t if excl_event.period is not None else event.exclusion_period.min_t
-                max_t = excl_event.period.max_t if excl_event.period is not None else event.exclusion_period.max_t
-                excl_df = excl_df[(excl_df['date_diff']).between(min_t, max_t)]
-            excl_df = excl_df[[cc.patient_id, cc.date]].drop_duplicates()
-            filtered_dfs.append(excl_df)
-
-        # combine excluded events
-        excl_df = filtered_dfs[0]
-        if len(filtered_dfs) > 1:
-            # check inclusion mode and apply it
-            if event.exclusion_mode == AttributeMode.any:
-                excl_df = pd.concat(filtered_dfs).drop_duplicates()
-            elif event.exclusion_mode == AttributeMode.all:
-                for curr_df in filtered_dfs[1:]:
-                    excl_df = excl_df.merge(curr_df, on=[cc.patient_id, cc.date], how='inner')
-            else:
-                raise ValueError(f'Invalid exclusion mode: {event.exclusion_mode}')
-
-        excl_df = excl_df.set_index([cc.patient_id, cc.date])
-        # remove from all data excluded patients+dates
-        df = df.set_index([cc.patient_id, cc.date])
-        df = df[~df.index.isin(excl_df.index)]
-        df = df.reset_index()
-
-        if (df is not None and not df.empty) or (df_na is not None and not df_na.empty):
-            df = pd.concat([df, df_na])
-        else:
+        excluded = self.__attribute_events_mask(df, excl_df, event.exclusion_events, event.exclusion_period,
+                                                event.exclusion_mode)
+        df = df[~excluded]
+        if df.empty:
             return None
 
-        df = df.drop(
-            columns=[cc.date + '_excl', cc.event_id + '_excl', 'date_diff']).drop_duplicates()
+        df = df.drop_duplicates()
         self.logger.debug(f'Excluded {rows_count - df.shape[0]} records')
         return df
 
@@ -213,41 +273,9 @@ class GetEventData:
             self.logger.debug('No patients were found')
             return None
 
-        df = df.merge(having_df, on=cc.patient_id, suffixes=('', '_having'))
-        df['date_diff'] = (df[cc.date + '_having'] - df[cc.date]).dt.days
-        filtered_dfs = []
-        for having_event in event.having_events:
-            having_df = df[df[cc.event_id + '_having'] == having_event.id]
-            if event.having_period is None and having_event.period is None:
-                having_df = having_df[having_df['date_diff'] < 0]
-            else:
-                min_t = having_event.period.min_t if having_event.period is not None else event.having_period.min_t
-                max_t = having_event.period.max_t if having_event.period is not None else event.having_period.max_t
-                having_df = having_df[having_df['date_diff'].between(min_t, max_t)]
-            having_df = having_df[[cc.patient_id, cc.date]].drop_duplicates()
-            filtered_dfs.append(having_df)
-
-        # combine having events
-        having_df = filtered_dfs[0]
-        if len(filtered_dfs) > 1:
-            # check inclusion mode and apply it
-            if event.inclusion_mode == AttributeMode.any:
-                having_df = pd.concat(filtered_dfs).drop_duplicates()
-            elif event.inclusion_mode == AttributeMode.all:
-                for curr_df in filtered_dfs[1:]:
-                    having_df = having_df.merge(curr_df, on=[cc.patient_id, cc.date], how='inner')
-            else:
-                raise ValueError(f'Invalid inclusion mode: {event.inclusion_mode}')
-
-        having_df = having_df.set_index([cc.patient_id, cc.date])
-        # take only having patients+dates
-        df = df.set_index([cc.patient_id, cc.date])
-        df = df[df.index.isin(having_df.index)]
-        df = df.reset_index()
-
-        df = df.drop(
-            columns=[cc.date + '_having', cc.event_id + '_having', 'date_diff']
-        ).drop_duplicates()
+        having = self.__attribute_events_mask(df, having_df, event.having_events, event.having_period,
+                                              event.inclusion_mode)
+        df = df[having].drop_duplicates()
         self.logger.debug(f'Excluded {rows_count - df.shape[0]} records')
         return df
 
@@ -1,6 +1,7 @@
 import os
 
 from src.config.AppConfig import AppConfig
+from src.datamodel.DataColumns import CommonColumns as cc
 from src.db.DatabaseManager import DatabaseManager
 from src.db.SqlDataElement import SqlTable
 from src.util.ConcurrentUtil import ConcurrentUtil
@@ -34,10 +35,17 @@ def upload_table_process(app_config: AppConfig, local_access: bool, database: st
 
     db_manager = DatabaseManager(app_config, local_access=local_access, db_name=database)
     db_manager.open_ssh_tunnel()
-    db_manager.upload_file_to_sql(table.src_file, table.name)
+    for key in table.surrogate_keys:
+        if key.is_registered_by(table.name):
+            db_manager.register_surrogate_keys(table.src_file, key, table.column_names())
+    # the records of the patients missing in the patient table are rejected
+    db_manager.upload_file_to_sql(table.src_file, table.name, table.column_names(), table.surrogate_keys)
     # create indexes for the table
     if set_index:
         db_manager.create_indexes(table)
+    # codes of the fact tables are counted once, so the study validation requests the counts from the catalog
+    if {cc.code, cc.patient_id} <= set(table.column_names()):
+        db_manager.update_code_catalog(table.name)
     db_manager.close_ssh_tunnel()
 
 
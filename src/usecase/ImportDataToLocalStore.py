@@ -0,0 +1,31 @@
+import os
+from typing import Optional
+
+from src.db.LocalStoreManager import LocalStoreManager
+from src.db.SqlDataElement import SqlTable
+from src.util.ConcurrentUtil import ConcurrentUtil
+
+
+def execute(store_path: str, database: str, tables: list[SqlTable], archive_name: str, new_db: bool,
+            code_map_table: Optional[SqlTable] = None):
+    print(f'Process {os.getpid()} Main: Execute for {len(tables)} tables')
+
+    if not os.path.exists(archive_name):
+        print(f'Process {os.getpid()} Main: File {archive_name} was not found')
+        return
+
+    LocalStoreManager(store_path).create_db(database)
+    if code_map_table is not None and os.path.exists(code_map_table.src_file):
+        tables = tables + [code_map_table]
+
+    # local store tables have no foreign keys, so all tables are written in separate processes at once
+    params = [(store_path, database, t, new_db) for t in tables]
+    ConcurrentUtil.run_in_separate_processes(write_table_process, params, max_processes=len(params))
+
+
+def write_table_process(store_path: str, database: str, table: SqlTable, new_db: bool):
+    print(f'Process {os.getpid()} table {table.name}: Run thread for table {table.name}')
+    if table.src_file[-4:] != '.csv':
+        return
+    print(f'Process {os.getpid()} table {table.name}: Read data file {table.src_file}')
+    LocalStoreManager(store_path, db_name=database).write_table(table, replace=new_db)
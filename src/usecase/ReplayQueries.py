@@ -0,0 +1,75 @@
+import logging
+import time
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.QueryRecord import QueryRecord
+from src.db.DatabaseManager import DatabaseManager
+from src.db.QueryProfiler import QueryProfiler
+from src.db.SqlDataElement import SqlQuery
+from src.util.ConcurrentUtil import ConcurrentUtil
+
+
+class ReplayQueries:
+    """
+    Replay of the captured queries against a database to tune the server and the indexes offline.
+    Queries are sent in the capture order by the concurrent workers, the latencies are summarized by the query
+    fingerprints next to the captured ones
+    """
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.__db_manager = db_manager
+
+    def execute(self, query_log: str, concurrency: int = 8, repeat: int = 1,
+                fingerprints: Optional[list] = None) -> Optional[pd.DataFrame]:
+        """
+        :param query_log: query log directory or a single queries file
+        :param concurrency: number of the concurrent requests
+        :param repeat: number of the workload repeats
+        :param fingerprints: replay only the queries with the fingerprints
+        :return: latencies of the captured and the replayed queries by the fingerprints, the slowest first.
+        None if there are no queries to replay
+        """
+        records = [r for r in QueryProfiler.read(query_log) if fingerprints is None or r.fingerprint in fingerprints]
+        if not records:
+            self.logger.warning(f'No queries to replay in {query_log}')
+            return None
+        self.logger.info(f'Replay {len(records)} queries x {repeat} with concurrency {concurrency}')
+        self.__db_manager.open_ssh_tunnel()
+        start = time.perf_counter()
+        results = ConcurrentUtil.do_async_job(self.__replay, [(r,) for r in records * repeat],
+                                              max_workers=concurrency)
+        wall_time = time.perf_counter() - start
+        self.__db_manager.close_ssh_tunnel()
+        self.logger.info(f'Replayed {len(results)} queries in {wall_time:.2f} s, '
+                         f'{len(results) / wall_time:.1f} queries/s')
+        return self.__summarize(records, pd.DataFrame(results, columns=['fingerprint', 'latency_ms', 'rows', 'error']))
+
+    def __replay(self, record: QueryRecord) -> tuple:
+        start = time.perf_counter()
+        try:
+            rows = self.__db_manager.replay_query(SqlQuery(record.template, tuple(record.params)))
+            error = None
+        except Exception as e:
+            rows, error = 0, repr(e)
+        return record.fingerprint, (time.perf_counter() - start) * 1000, rows, error
+
+    @staticmethod
+    def __summarize(records: list[QueryRecord], replay_df: pd.DataFrame) -> pd.DataFrame:
+        captured_df = pd.DataFrame([(r.fingerprint, r.latency_ms, r.rows, r.template) for r in records],
+                                   columns=['fingerprint', 'latency_ms', 'rows', 'template'])
+        captured = captured_df.groupby('fingerprint').agg(
+            queries=('latency_ms', 'size'),
+            captured_p50_ms=('latency_ms', 'median'),
+            captured_p95_ms=('latency_ms', lambda x: x.quantile(0.95)),
+            captured_rows=('rows', 'mean'),
+            template=('template', 'first'))
+        replayed = replay_df.groupby('fingerprint').agg(
+            replay_p50_ms=('latency_ms', 'median'),
+            replay_p95_ms=('latency_ms', lambda x: x.quantile(0.95)),
+            replay_total_ms=('latency_ms', 'sum'),
+            replay_rows=('rows', 'mean'),
+            errors=('error', 'count'))
+        return captured.join(replayed).sort_values('replay_total_ms', ascending=False).reset_index()
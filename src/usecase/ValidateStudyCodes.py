@@ -0,0 +1,119 @@
+import logging
+from typing import Optional
+
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.Event import Event, EventCategory
+from src.datamodel.ExperimentConfig import ExperimentConfig
+from src.repository.CodeCatalogRepository import CodeCatalogRepository
+
+
+class ValidateStudyCodes:
+    """
+    Check of the event codes of a batch of studies against the database. The codes of all studies, including the
+    having and exclude events, are collected and deduplicated by the tables, and their counts are requested from the
+    code catalog by a few bulk requests for the whole batch. ICD9 analogs of the codes are counted as well, as the
+    study run searches them. Every study gets its unknown codes, i.e. codes without records of the code and of its
+    analogs, and the estimated patients of its levels.
+    """
+    study = 'study'
+    attribute = 'attribute'
+    known = 'known'
+    min_patients = 'min_patients'
+    max_patients = 'max_patients'
+    unknown_codes = 'unknown_codes'
+    icd9_records = 'icd9_records'
+    icd9_patients = 'icd9_patients'
+
+    def __init__(self, catalog_repo: CodeCatalogRepository):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.catalog_repo = catalog_repo
+
+    def execute(self, study_configs: list[ExperimentConfig], include_icd9: bool = True) -> Optional[pd.DataFrame]:
+        """
+        :param study_configs: configs of the studies
+        :param include_icd9: count the records of the ICD9 analogs of the codes too
+        :return: dataframe with a row for every code of an event: study, level, event id, attribute (having or
+        exclude for the attribute events), negation, table, code, subcodes flag, records, patients, records and
+        patients of the ICD9 analogs and known flag. None if the codes could not be checked
+        """
+        self.logger.debug(f'execute: {len(study_configs)} studies')
+        codes_df = pd.DataFrame([r for config in study_configs for r in self.__code_rows(config)],
+                                columns=[self.study, cc.level, cc.event_id, self.attribute, 'negation',
+                                         CodeCatalogRepository.table, cc.code, cc.subcodes])
+        if codes_df.empty:
+            return codes_df.assign(**{cc.records: 0, cc.patients: 0, self.icd9_records: 0, self.icd9_patients: 0,
+                                      self.known: True})
+        table_codes = {table: set(zip(df[cc.code], df[cc.subcodes]))
+                       for table, df in codes_df.groupby(CodeCatalogRepository.table)}
+        self.logger.debug(f'{sum(len(c) for c in table_codes.values())} unique codes of {len(codes_df)} study codes')
+        icd9_df = None
+        if include_icd9:
+            icd9_df = self.catalog_repo.get_icd9_codes(set().union(*table_codes.values()))
+            if icd9_df is None:
+                return None
+            # analogs are searched exactly in the table of the code
+            for table, codes in table_codes.items():
+                mapped = icd9_df[[c in codes for c in zip(icd9_df[cc.code], icd9_df[cc.subcodes])]]
+                table_codes[table] = codes | {(c, False) for c in mapped[cc.icd9_code]}
+        counts_df = self.catalog_repo.get_code_counts(table_codes)
+        if counts_df is None:
+            return None
+        keys = [CodeCatalogRepository.table, cc.code, cc.subcodes]
+        df = codes_df.merge(counts_df, how='left', on=keys)
+        df = df.merge(self.__icd9_counts(codes_df[keys].drop_duplicates(), icd9_df, counts_df), how='left', on=keys)
+        counts = [cc.records, cc.patients, self.icd9_records, self.icd9_patients]
+        df = df.fillna({c: 0 for c in counts}).astype({c: 'int64' for c in counts})
+        df[self.known] = (df[cc.records] + df[self.icd9_records]) > 0
+        return df
+
+    def summarize(self, report_df: pd.DataFrame, total_patients: Optional[int] = None) -> pd.DataFrame:
+        """
+        Summary of the studies by their levels: unknown codes and estimated patients of the level. The codes of the
+        level events may have the same patients, so the patients are estimated by the range from the maximum patients
+        of a code to the sum of the patients of the codes. Patients of a code include the patients of its ICD9
+        analogs. Negation and attribute events are not estimated
+        :param report_df: result of execute
+        :param total_patients: number of the patients of the database, the estimates do not exceed it
+        :return: dataframe with the study, level, unknown codes, min patients and max patients columns
+        """
+        df = report_df.assign(**{self.unknown_codes: report_df[cc.code].where(~report_df[self.known])})
+        positive = ~df['negation'] & df[self.attribute].isna()
+        df[cc.patients] = (df[cc.patients] + df[self.icd9_patients]).where(positive, 0)
+        summary_df = df.groupby([self.study, cc.level], sort=False).agg(**{
+            self.unknown_codes: (self.unknown_codes, lambda x: sorted(set(x.dropna()))),
+            self.min_patients: (cc.patients, 'max'),
+            self.max_patients: (cc.patients, 'sum')}).reset_index()
+        if total_patients is not None:
+            summary_df[[self.min_patients, self.max_patients]] = \
+                summary_df[[self.min_patients, self.max_patients]].clip(upper=total_patients)
+        return summary_df
+
+    def __icd9_counts(self, keys_df: pd.DataFrame, icd9_df: Optional[pd.DataFrame],
+                      counts_df: pd.DataFrame) -> pd.DataFrame:
+        """Records and patients of the ICD9 analogs of the codes, the counts of the analogs are summed"""
+        keys = [CodeCatalogRepository.table, cc.code, cc.subcodes]
+        if icd9_df is None or icd9_df.empty:
+            return keys_df.assign(**{self.icd9_records: 0, self.icd9_patients: 0})
+        analog_counts = counts_df[~counts_df[cc.subcodes]].rename(
+            columns={cc.code: cc.icd9_code, cc.records: self.icd9_records, cc.patients: self.icd9_patients})
+        df = keys_df.merge(icd9_df, on=[cc.code, cc.subcodes]) \
+            .merge(analog_counts.drop(columns=[cc.subcodes]), on=[CodeCatalogRepository.table, cc.icd9_code])
+        return df.groupby(keys, as_index=False)[[self.icd9_records, self.icd9_patients]].sum()
+
+    def __code_rows(self, config: ExperimentConfig) -> list:
+        rows = []
+        for level in config.levels:
+            for experiment_event in level.events:
+                event = Event.from_experiment_event(experiment_event)
+                attribute_events = [('having', e) for e in event.having_events or []] + \
+                                   [('exclude', e) for e in event.exclusion_events or []]
+                for attribute, e in [(None, event)] + attribute_events:
+                    # patient events are attributes of the patient table, not codes
+                    if e.category == EventCategory.Patient or not e.codes:
+                        continue
+                    event_id = e.id if attribute is None else f'{event.id}/{e.id}'
+                    rows += [(config.name, level.level, event_id, attribute, e.negation, e.get_data_table(), c,
+                              e.include_subcodes) for c in dict.fromkeys(e.codes)]
+        return rows
@@ -1,3 +1,4 @@
+import contextvars
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from concurrent.futures import as_completed
 from multiprocessing.pool import Pool
@@ -5,18 +6,20 @@ from multiprocessing.pool import Pool
 
 class ConcurrentUtil:
     @staticmethod
-    def do_async_job(f, params_list, max_workers=8):
+    def do_async_job(f, params_list, max_workers=8, ordered=False):
         """
-        create thread pool executor and submit function with set of params in the executor
+        create thread pool executor and submit function with set of params in the executor.
+        Every call runs in a copy of the caller context, so the context variables are passed to the threads
         :param f: function to execute
         :param params_list: list of tuples of params for the function to execute
         :param max_workers: maximum workers for the executor
+        :param ordered: if True, results are returned in the params order. Otherwise, in the completion order
         :return: list of result objects
         """
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(f, *p) for p in params_list]
-            res = [future.result() for future in as_completed(futures)]
+            futures = [executor.submit(contextvars.copy_context().run, f, *p) for p in params_list]
+            res = [future.result() for future in (futures if ordered else as_completed(futures))]
         return res
 
     @staticmethod
@@ -0,0 +1,223 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+class DatasetWriter:
+    """
+    Single-pass parquet writer of a data frame streamed by parts with the same columns.
+    The parts are converted to Arrow record batches and passed to pyarrow.dataset.write_dataset running in a writer
+    thread, so the file is written while the next parts are computed and no part is kept after it is written.
+    The batches are combined to row groups of the configured size, the file is compressed, dictionary encoded and has
+    column statistics that readers use to skip row groups by filters.
+    The file is created under a temporary name and replaces the existing file on close. A frame written by a single
+    part is written on close without the writer thread. When the writer context exits by an exception, the writing
+    is aborted and the existing file is kept.
+    Columns of the parts are matched by the names, so the parts can have a different columns order. The file schema
+    is the unified schema of the parts: a column that is null in the first parts gets the type of the later parts,
+    an integer column of the first parts becomes a float column if the later parts have floats.
+    Parts written before the schema changed are rewritten with the unified schema on close.
+    Dictionary (categorical) columns are stored with int32 indices, so the parts with different number of categories
+    have the same schema.
+    """
+    row_group_size = 128 * 1024
+    compression = 'zstd'
+    queue_size = 4
+
+    def __init__(self, file_path: Path, sort_by: Optional[str] = None, row_group_size: Optional[int] = None,
+                 compression: Optional[str] = None, use_dictionary: bool = True, write_statistics: bool = True):
+        """
+        :param file_path: parquet file path
+        :param sort_by: column to sort every written part by. Parts written in the order of the column give the sorted
+        file without sorting all the data at once
+        :param row_group_size: max number of rows in a row group
+        :param compression: parquet compression codec
+        :param use_dictionary: dictionary encoding of the columns
+        :param write_statistics: min/max statistics of the row groups
+        """
+        self.file_path = file_path
+        self.sort_by = sort_by
+        if row_group_size is not None:
+            self.row_group_size = row_group_size
+        if compression is not None:
+            self.compression = compression
+        self.use_dictionary = use_dictionary
+        self.write_statistics = write_statistics
+        self.__schema: Optional[pa.Schema] = None
+        # the first part is kept until the next one, so a single part frame is written without the thread
+        self.__first_part: Optional[pa.Table] = None
+        self.__queue: Optional[queue.Queue] = None
+        self.__thread: Optional[threading.Thread] = None
+        # files written by the dataset writer runs, a new run is started when the schema changes
+        self.__segments: list[list[str]] = []
+        self.__error: Optional[BaseException] = None
+
+    def write(self, df: pd.DataFrame):
+        table = self.__with_int32_dictionaries(pa.Table.from_pandas(df))
+        if self.sort_by is not None and len(table) > 1:
+            keys = table.column(self.sort_by)
+            if not pc.all(pc.greater_equal(keys[1:], keys[:-1])).as_py():
+                table = table.sort_by(self.sort_by)
+        if self.__schema is None:
+            self.__schema = table.schema
+            self.__first_part = table
+            return
+        schema = pa.unify_schemas([self.__schema, table.schema], promote_options='permissive')
+        if not schema.equals(self.__schema):
+            # the parts written with the previous schema are rewritten on close
+            self.__stop()
+            self.__schema = schema
+        if self.__thread is None:
+            self.__start()
+        if self.__first_part is not None:
+            self.__put_table(self.__first_part)
+            self.__first_part = None
+        self.__put_table(table)
+
+    def close(self):
+        if self.__first_part is not None:
+            self.__write_table(self.__conform(self.__first_part))
+            self.__first_part = None
+            return
+        if not self.__segments:
+            return
+        self.__stop()
+        files = [f for segment in self.__segments for f in segment]
+        if len(files) == 1 and self.__segments[-1]:
+            Path(files[0]).replace(self.file_path)
+        elif not files:
+            # parts without rows give the file with the schema only
+            self.__write_table(self.__schema.empty_table())
+        else:
+            self.__merge(files)
+        self.__segments = []
+
+    def abort(self):
+        """Stop the writer thread and remove the written parts, the existing file is not replaced"""
+        self.__first_part = None
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+        for segment in self.__segments:
+            for f in segment:
+                Path(f).unlink(missing_ok=True)
+        self.__segments = []
+        self.__error = None
+        self.__tmp_path().unlink(missing_ok=True)
+
+    def __start(self):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.__segments.append([])
+        self.__queue = queue.Queue(maxsize=self.queue_size)
+        self.__thread = threading.Thread(target=self.__write_dataset, args=(len(self.__segments) - 1,), daemon=True,
+                                         name=f'{type(self).__name__}-{self.file_path.name}')
+        self.__thread.start()
+
+    def __stop(self):
+        if self.__thread is None:
+            return
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__thread = None
+        if self.__error is not None:
+            for segment in self.__segments:
+                for f in segment:
+                    Path(f).unlink(missing_ok=True)
+            self.__segments = []
+            raise self.__error
+
+    def __put_table(self, table: pa.Table):
+        for batch in self.__conform(table).to_batches(max_chunksize=self.row_group_size):
+            if self.__error is not None:
+                self.__stop()
+            self.__queue.put(batch)
+
+    def __conform(self, table: pa.Table) -> pa.Table:
+        """Table with the columns of the file schema in its order, missing columns are null"""
+        for field in self.__schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(len(table), field.type))
+        return table.select(self.__schema.names).cast(self.__schema)
+
+    @staticmethod
+    def __with_int32_dictionaries(table: pa.Table) -> pa.Table:
+        if not any(pa.types.is_dictionary(f.type) for f in table.schema):
+            return table
+        schema = pa.schema([pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type))
+                            if pa.types.is_dictionary(f.type) else f for f in table.schema],
+                           metadata=table.schema.metadata)
+        return table.cast(schema)
+
+    def __tmp_path(self) -> Path:
+        return self.file_path.with_name(f'.{self.file_path.stem}.tmp')
+
+    def __write_table(self, table: pa.Table):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.__tmp_path()
+        try:
+            pq.write_table(table, tmp_path, row_group_size=self.row_group_size, compression=self.compression,
+                           use_dictionary=self.use_dictionary, write_statistics=self.write_statistics)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        tmp_path.replace(self.file_path)
+
+    def __merge(self, files: list[str]):
+        """Rewrite the files of the segments to the file by row groups"""
+        tmp_path = self.__tmp_path()
+        try:
+            with pq.ParquetWriter(tmp_path, self.__schema, compression=self.compression,
+                                  use_dictionary=self.use_dictionary, write_statistics=self.write_statistics) as w:
+                for f in files:
+                    parquet_file = pq.ParquetFile(f)
+                    for i in range(parquet_file.num_row_groups):
+                        w.write_table(self.__conform(parquet_file.read_row_group(i)),
+                                      row_group_size=self.row_group_size)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            for f in files:
+                Path(f).unlink(missing_ok=True)
+        tmp_path.replace(self.file_path)
+
+    def __write_dataset(self, segment: int):
+        file_format = ds.ParquetFileFormat()
+        try:
+            ds.write_dataset(
+                self.__batches(), self.file_path.parent, schema=self.__schema, format=file_format,
+                file_options=file_format.make_write_options(compression=self.compression,
+                                                            use_dictionary=self.use_dictionary,
+                                                            write_statistics=self.write_statistics),
+                basename_template=f'.{self.file_path.stem}-{segment}-{{i}}.tmp',
+                existing_data_behavior='overwrite_or_ignore',
+                min_rows_per_group=min(self.row_group_size, 16 * 1024), max_rows_per_group=self.row_group_size,
+                file_visitor=lambda f: self.__segments[segment].append(f.path),
+                # rows are written in the order of the parts
+                use_threads=False)
+        except BaseException as e:
+            self.__error = e
+            # the producer is not blocked by the full queue
+            while self.__queue.get() is not None:
+                pass
+
+    def __batches(self):
+        while (batch := self.__queue.get()) is not None:
+            yield batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
@@ -1,6 +1,10 @@
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
-import pandas as pd
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from src.util.DatasetWriter import DatasetWriter
 
 
 class FileProvider(object):
@@ -24,6 +28,14 @@ class FileProvider(object):
     def data_path(self) -> Path:
         return self.project_dir / "data"
 
+    @property
+    def local_store_path(self) -> Path:
+        return self.project_dir / "store"
+
+    @property
+    def cache_path(self) -> Path:
+        return self.project_dir / "cache"
+
     @property
     def log_config_file(self) -> Path:
         return self.config_path / "logging.conf"
@@ -65,13 +77,34 @@ class FileProvider(object):
         return (self.result_path / outcome_dir / 'transitions' /
                 f'transition_{end_level_number - 1}_{end_level_number}.parquet')
 
-    def save_dataframe_file(self, df: pd.DataFrame, file_dir: Path, filename: str, file_format: str = 'parquet'):
+    def get_chains_path(self, outcome_dir: str) -> Path:
+        return self.result_path / outcome_dir / 'chains.parquet'
+
+    def get_chains_group_location(self, outcome_dir: str, group_number: int) -> tuple:
+        return self.get_chains_path(outcome_dir) / f'group={group_number}', 'chains.parquet'
+
+    def chains_manifest_file_location(self, dir_name: str) -> tuple:
+        return self.result_path / dir_name, 'chains_manifest.json'
+
+    def get_transition_stats_group_location(self, outcome_dir: str, group_number: int) -> tuple:
+        return self.result_path / outcome_dir / 'transition_stats' / f'group={group_number}', 'transition_stats.parquet'
+
+    def transition_stats_file_location(self, dir_name: str) -> tuple:
+        return self.result_path / dir_name, 'transition_stats.parquet'
+
+    def save_dataframe_file(self, df: 'pd.DataFrame', file_dir: Path, filename: str, file_format: str = 'parquet'):
         file_dir.mkdir(parents=True, exist_ok=True)
         if file_format == 'csv':
             df.to_csv(file_dir / filename)
         elif file_format == 'parquet':
-            df.to_parquet(file_dir / filename, engine='pyarrow')
+            with self.open_dataset_writer(file_dir, filename) as writer:
+                writer.write(df)
+
+    def open_dataset_writer(self, file_dir: Path, filename: str, sort_by: Optional[str] = None) -> 'DatasetWriter':
+        """Parquet file writer of a data frame written by parts"""
+        # pyarrow is imported by the writers only, the file locations are used by the light commands as well
+        from src.util.DatasetWriter import DatasetWriter
+        return DatasetWriter(file_dir / filename, sort_by=sort_by)
 
     def events_metadata_file_location(self, dir_name) -> tuple:
         return self.result_path / dir_name, 'events.parquet'
-
@@ -0,0 +1,125 @@
+import re
+from functools import reduce
+from typing import Optional
+
+import pandas as pd
+from pandas.api.types import is_integer_dtype, is_datetime64_dtype
+
+from src.datamodel.DataColumns import CommonColumns as cc
+
+
+class FrameSchema:
+    """
+    Memory-lean dtypes of the study data frames.
+    Codes, event ids and other low cardinality text columns are categorical, integer patient ids (surrogate keys)
+    are uint32 and string ones are pyarrow strings, dates are timezone-naive datetime64[ns] as in the result files
+    and time intervals are int32.
+    Columns of the chain levels (e.g. code_1, t_0) get the dtype of their base column.
+    Frames keep the dtypes through FrameSchema.concat and FrameSchema.merge.
+    """
+    category_columns = {cc.code, cc.event_id, cc.code_system, cc.route, cc.brand, cc.strength, cc.text_value,
+                        cc.sex, cc.race, cc.ethnicity, cc.marital_status}
+    date_columns = set(cc.date_columns)
+    patient_id_int_dtype = 'uint32'
+    patient_id_str_dtype = 'string[pyarrow]'
+    date_dtype = 'datetime64[ns]'
+    distance_dtype = 'int32'
+
+    __level_column_pattern = re.compile(r'^(.+)_(\d+)$')
+
+    @staticmethod
+    def base_column(column: str) -> str:
+        """Column name without the level number suffix"""
+        match = FrameSchema.__level_column_pattern.match(column)
+        return match.group(1) if match else column
+
+    @staticmethod
+    def apply(df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """
+        Cast known columns of the data frame to the schema dtypes. The caller's frame is not modified: the casted
+        columns are set in a shallow copy, columns that already have the dtype are shared with the frame.
+        :param df: data frame
+        :return: the frame with the schema dtypes, the same frame if all columns already have them
+        """
+        if df is None:
+            return None
+        res = df
+        for c in df.columns:
+            values = FrameSchema.__cast(FrameSchema.base_column(c), df[c])
+            if values is not None:
+                if res is df:
+                    res = df.copy(deep=False)
+                res[c] = values
+        return res
+
+    @staticmethod
+    def __cast(base_column: str, values: pd.Series) -> Optional[pd.Series]:
+        """Values of the column casted to the schema dtype or None if the column has it or is not in the schema"""
+        if base_column in FrameSchema.date_columns:
+            dates = values if is_datetime64_dtype(values.dtype) else pd.to_datetime(values)
+            # timezone-aware dates are kept as they are
+            if dates.dt.tz is not None:
+                return None
+            if dates.dtype != FrameSchema.date_dtype:
+                return dates.astype(FrameSchema.date_dtype)
+            return None if dates is values else dates
+        if base_column == cc.patient_id:
+            dtype = FrameSchema.patient_id_int_dtype if is_integer_dtype(values.dtype) \
+                else FrameSchema.patient_id_str_dtype
+        elif base_column in FrameSchema.category_columns:
+            dtype = 'category'
+        elif base_column == cc.time_interval:
+            dtype = FrameSchema.distance_dtype if not values.hasnans else 'Int32'
+        else:
+            return None
+        return values.astype(dtype) if values.dtype != dtype else None
+
+    @staticmethod
+    def concat(dfs: list) -> Optional[pd.DataFrame]:
+        """
+        Concatenate data frames keeping the schema dtypes. Categories of the same column are unified before
+        concatenation, otherwise pandas converts categorical columns with different categories to object.
+        :param dfs: list of data frames, None values are skipped
+        :return: concatenated data frame or None if there is nothing to concatenate
+        """
+        dfs = [FrameSchema.apply(d) for d in dfs if d is not None]
+        if not dfs:
+            return None
+        if len(dfs) == 1:
+            return dfs[0]
+        category_columns = {c for d in dfs for c in d.columns if isinstance(d[c].dtype, pd.CategoricalDtype)}
+        return pd.concat(FrameSchema.__unify_categories(dfs, category_columns))
+
+    @staticmethod
+    def merge(left: pd.DataFrame, right: pd.DataFrame, on, **kwargs) -> pd.DataFrame:
+        """
+        Merge data frames keeping the schema dtypes. Categories of the key columns are unified before the merge,
+        otherwise pandas converts categorical keys with different categories to object.
+        :param left: left data frame
+        :param right: right data frame
+        :param on: key column or columns
+        :param kwargs: other arguments of pandas merge
+        :return: merged data frame
+        """
+        on = [on] if isinstance(on, str) else list(on)
+        category_columns = {c for c in on
+                            if isinstance(left[c].dtype, pd.CategoricalDtype)
+                            and isinstance(right[c].dtype, pd.CategoricalDtype)}
+        left, right = FrameSchema.__unify_categories([left, right], category_columns)
+        return FrameSchema.apply(left.merge(right, on=on, **kwargs))
+
+    @staticmethod
+    def __unify_categories(dfs: list, columns) -> list:
+        """Set the union of the categories of the columns in all frames. Frames are copied if changed"""
+        dfs = list(dfs)
+        for c in columns:
+            categories = [d[c].cat.categories for d in dfs if c in d.columns]
+            if all(x.equals(categories[0]) for x in categories[1:]):
+                continue
+            union = reduce(lambda a, b: a.union(b), categories)
+            for i, d in enumerate(dfs):
+                if c in d.columns:
+                    d = d.copy(deep=False)
+                    d[c] = d[c].cat.set_categories(union)
+                    dfs[i] = d
+        return dfs
@@ -0,0 +1,103 @@
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.FrameSchema import FrameSchema
+
+
+class FrameSpill:
+    """
+    On-disk storage of data frames that do not fit the memory budget. Every frame is split by patients into the same
+    partitions, and each partition is an Arrow IPC file, so the frames can be processed partition by partition.
+    Patients are split into contiguous ranges of their sort keys: partitions processed in order give the records
+    sorted by the key.
+    A frame written partition by partition can have partitions without some of its columns. Its columns are set with
+    set_columns, and the partitions are read with all the columns in the same order, the missing ones are nulls.
+    """
+
+    def __init__(self, patients, n_partitions: int, sort_keys: Optional[pd.Series] = None):
+        """
+        :param patients: all patient ids of the frames
+        :param n_partitions: number of partitions
+        :param sort_keys: sort keys of the patients indexed by the patient ids. The patient ids are the keys if None
+        """
+        self.logger = logging.getLogger(type(self).__name__)
+        patients = pd.Series(pd.unique(np.asarray(list(patients))))
+        keys = patients if sort_keys is None else patients.map(sort_keys)
+        patients = patients[keys.sort_values(kind='stable').index].to_numpy()
+        self.n_partitions = max(1, min(n_partitions, len(patients)))
+        bounds = np.linspace(0, len(patients), self.n_partitions + 1).astype(int)
+        self.__partition_map = pd.Series(np.repeat(np.arange(self.n_partitions), np.diff(bounds)), index=patients)
+        self.__directory = Path(tempfile.mkdtemp(prefix='spill_'))
+        self.__files = {}
+        self.__columns = {}
+        self.logger.debug(f'Spill {len(patients)} patients to {self.n_partitions} partitions in {self.__directory}')
+
+    @staticmethod
+    def memory_size(df: Optional[pd.DataFrame]) -> int:
+        return 0 if df is None else int(df.memory_usage(deep=True).sum())
+
+    def partition_patients(self, partition: int) -> set:
+        """Patients of the partition"""
+        return set(self.__partition_map.index[self.__partition_map.to_numpy() == partition])
+
+    def set_columns(self, name: str, dtypes: dict):
+        """
+        Set the columns of the frame
+        :param name: frame name
+        :param dtypes: map of the columns on their dtypes in the columns order
+        """
+        self.__columns[name] = dict(dtypes)
+
+    def write_frame(self, name: str, df: Optional[pd.DataFrame]):
+        """Split the frame by the patient partitions and write all its partitions"""
+        self.drop(name)
+        if df is None:
+            return
+        partitions = df[cc.patient_id].map(self.__partition_map).to_numpy()
+        for p, part in df.groupby(partitions, sort=True):
+            self.write(name, int(p), part)
+
+    def write(self, name: str, partition: int, df: Optional[pd.DataFrame]):
+        """Write the frame partition. None or empty frame removes the partition"""
+        path = self.__directory / f'{name}-{partition}.arrow'
+        self.__files.pop((name, partition), None)
+        if df is None or df.empty:
+            path.unlink(missing_ok=True)
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        self.__files[(name, partition)] = path
+
+    def read(self, name: str, partition: int) -> Optional[pd.DataFrame]:
+        """Read the frame partition, None if the partition has no records"""
+        path = self.__files.get((name, partition))
+        if path is None:
+            return None
+        with pa.OSFile(str(path), 'rb') as source:
+            table = pa.ipc.open_file(source).read_all()
+        df = table.to_pandas()
+        dtypes = self.__columns.get(name)
+        if dtypes is not None and df.columns.tolist() != list(dtypes):
+            for c in dtypes:
+                if c not in df.columns:
+                    df[c] = pd.Series(index=df.index, dtype=dtypes[c])
+            df = df[list(dtypes)]
+        return FrameSchema.apply(df)
+
+    def drop(self, name: str):
+        self.__columns.pop(name, None)
+        for key in [k for k in self.__files if k[0] == name]:
+            self.__files.pop(key).unlink(missing_ok=True)
+
+    def clear(self):
+        self.__files.clear()
+        shutil.rmtree(self.__directory, ignore_errors=True)
@@ -0,0 +1,111 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class IntervalJoin:
+    """
+    Interval join of patient records with patient events.
+    For each record it counts events of the same patient with the date within the record window. Dates are compared
+    with their full precision, as the merged records and events were compared.
+    Events are encoded as sorted keys (patient number, rank of the event date among the distinct event dates), so the
+    window of each record is a range of keys and the events number is found by binary search. Time and memory are
+    linear in the input size (plus sorting of the events), no records-events cross product is built.
+    """
+    __min_time = np.iinfo(np.int64).min
+    __max_time = np.iinfo(np.int64).max
+    __day = 86_400 * 10 ** 9
+    # window offsets are limited to keep the shifted dates within int64 nanoseconds
+    __max_days = 100_000
+
+    @staticmethod
+    def to_nanoseconds(dates) -> np.ndarray:
+        """
+        Convert dates to nanoseconds since epoch. NaT is converted to the minimal int64 value
+        """
+        return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    @staticmethod
+    def count_within(patients, dates, event_patients, event_dates, min_t: Optional[int],
+                     max_t: Optional[int]) -> np.ndarray:
+        """
+        Count events of the same patient within [min_t, max_t] days from the date for each record. The days of an
+        event are the whole days from the record date to the event date (Timedelta.days), so the window is
+        [date + min_t days, date + max_t + 1 days). For dates without time it is [date + min_t, date + max_t] days
+        :param patients: records patient ids
+        :param dates: records dates
+        :param event_patients: events patient ids
+        :param event_dates: events dates
+        :param min_t: window start in days from the record date. None means unbounded window start
+        :param max_t: window end in days from the record date. None means unbounded window end
+        :return: array of events number for each record
+        """
+        times = IntervalJoin.to_nanoseconds(dates)
+        missing = pd.isna(np.asarray(dates))
+        times[missing] = 0
+        start_times = np.full(len(times), IntervalJoin.__min_time) if min_t is None \
+            else IntervalJoin.__shift(times, min_t)
+        end_times = np.full(len(times), IntervalJoin.__max_time) if max_t is None \
+            else IntervalJoin.__shift(times, max_t + 1) - 1
+        counts = IntervalJoin.__count(patients, start_times, end_times, event_patients, event_dates)
+        # records without date have no window
+        counts[missing] = 0
+        return counts
+
+    @staticmethod
+    def count_between(patients, start_dates, end_dates, event_patients, event_dates) -> np.ndarray:
+        """
+        Count events of the same patient within [start_date, end_date] for each record
+        :param patients: records patient ids
+        :param start_dates: window start dates. NaT means unbounded window start
+        :param end_dates: window end dates. NaT means unbounded window end
+        :param event_patients: events patient ids
+        :param event_dates: events dates
+        :return: array of events number for each record
+        """
+        start_times = IntervalJoin.to_nanoseconds(start_dates)
+        start_times[pd.isna(np.asarray(start_dates))] = IntervalJoin.__min_time
+        end_times = IntervalJoin.to_nanoseconds(end_dates)
+        end_times[pd.isna(np.asarray(end_dates))] = IntervalJoin.__max_time
+        return IntervalJoin.__count(patients, start_times, end_times, event_patients, event_dates)
+
+    @staticmethod
+    def any_within(patients, dates, event_patients, event_dates, min_t: Optional[int],
+                   max_t: Optional[int]) -> np.ndarray:
+        """
+        Check if any event of the same patient is within [min_t, max_t] days from the date for each record
+        :return: boolean mask of records
+        """
+        return IntervalJoin.count_within(patients, dates, event_patients, event_dates, min_t, max_t) > 0
+
+    @staticmethod
+    def __shift(times: np.ndarray, days: int) -> np.ndarray:
+        """Shift the times by the days, the shifted times are saturated at the int64 limits"""
+        offset = int(np.clip(days, -IntervalJoin.__max_days, IntervalJoin.__max_days)) * IntervalJoin.__day
+        return np.clip(times, IntervalJoin.__min_time - min(offset, 0), IntervalJoin.__max_time - max(offset, 0)) + \
+            offset
+
+    @staticmethod
+    def __count(patients, start_times: np.ndarray, end_times: np.ndarray, event_patients,
+                event_dates) -> np.ndarray:
+        """Count events of the same patient within [start_time, end_time] for each record"""
+        patient_codes, uniques = pd.factorize(np.asarray(patients))
+        event_codes = pd.Index(uniques).get_indexer(np.asarray(event_patients))
+        event_times = IntervalJoin.to_nanoseconds(event_dates)
+        valid = (event_codes >= 0) & ~pd.isna(np.asarray(event_dates))
+        event_codes, event_times = event_codes[valid], event_times[valid]
+        if len(event_times) == 0 or len(patient_codes) == 0:
+            return np.zeros(len(patient_codes), dtype=np.int64)
+
+        # each patient has its own block of keys, the window bounds are ranks of the dates within the block
+        times = np.unique(event_times)
+        span = len(times) + 1
+        event_keys = np.sort(event_codes.astype(np.int64) * span + np.searchsorted(times, event_times))
+        block_start = patient_codes.astype(np.int64) * span
+        start_keys = block_start + np.searchsorted(times, start_times, side='left')
+        end_keys = block_start + np.searchsorted(times, end_times, side='right')
+
+        counts = np.searchsorted(event_keys, end_keys, side='left') - \
+            np.searchsorted(event_keys, start_keys, side='left')
+        return np.maximum(counts, 0)
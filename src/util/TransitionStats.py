@@ -0,0 +1,114 @@
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+
+
+class TransitionStats:
+    """
+    Mergeable statistics of the level-to-level transitions: for every (event id, code) -> (event id, code) transition
+    the number of unique patients, the number of records and the distribution of the time interval t.
+    The distribution is kept as a sparse histogram of the t values in days with exact counts, so the partial
+    statistics of the patient groups and partitions are merged by summing the counts, and the quantiles of the merged
+    statistics are exact. Patient counts are summed as well, as the patient groups do not intersect.
+    """
+    start_level = 'start_level'
+    start_event_id = 'start_event_id'
+    start_code = 'start_code'
+    end_level = 'end_level'
+    end_event_id = 'end_event_id'
+    end_code = 'end_code'
+    patients = 'patients'
+    records = 'records'
+    t_values = 't_values'
+    t_counts = 't_counts'
+    t_bins = 't_bins'
+    t_histogram = 't_histogram'
+
+    key_columns = [start_level, start_event_id, start_code, end_level, end_event_id, end_code]
+    quantiles = {'t_p05': 0.05, 't_p25': 0.25, 't_median': 0.5, 't_p75': 0.75, 't_p95': 0.95}
+    # lower bounds of the histogram bins in days
+    histogram_bins = [0, 1, 7, 14, 30, 60, 90, 180, 365, 730, 1095, 1825, 3650]
+
+    def __init__(self):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.__parts = []
+
+    def add(self, transition_df: pd.DataFrame, end_level_number: int):
+        """
+        Add records of the transition frame to the statistics
+        :param transition_df: transition records with the columns of the start and the end levels and t of the start
+        level, the patients of the frame are not added before
+        :param end_level_number: number of the end level
+        """
+        start_level_number = end_level_number - 1
+        columns = {cc.get_column_at_level(cc.event_id, start_level_number): self.start_event_id,
+                   cc.get_column_at_level(cc.code, start_level_number): self.start_code,
+                   cc.get_column_at_level(cc.event_id, end_level_number): self.end_event_id,
+                   cc.get_column_at_level(cc.code, end_level_number): self.end_code}
+        col_t = cc.get_column_at_level(cc.time_interval, start_level_number)
+        df = transition_df[[cc.patient_id, col_t] + list(columns)].rename(columns=columns | {col_t: cc.time_interval})
+        keys = list(columns.values())
+        grouped = df.groupby(keys, observed=True, sort=False)
+        counts = grouped.agg(**{self.patients: (cc.patient_id, 'nunique'), self.records: (cc.patient_id, 'size')})
+        t_counts = df.groupby(keys + [cc.time_interval], observed=True, sort=True).size()
+        t_counts = t_counts.reset_index(cc.time_interval).groupby(level=keys, observed=True, sort=False).agg(
+            **{self.t_values: (cc.time_interval, list), self.t_counts: (0, list)})
+        part = counts.join(t_counts).reset_index()
+        part.insert(0, self.start_level, start_level_number)
+        part.insert(3, self.end_level, end_level_number)
+        self.__parts.append(part.astype({k: str for k in keys}))
+
+    def frame(self) -> Optional[pd.DataFrame]:
+        """Partial statistics of the added transitions, None if nothing is added"""
+        if not self.__parts:
+            return None
+        return self.merge_partial(self.__parts)
+
+    @staticmethod
+    def merge_partial(parts: list) -> Optional[pd.DataFrame]:
+        """
+        Merge partial statistics frames
+        :return: partial statistics frame with a single row for every transition
+        """
+        parts = [p for p in parts if p is not None and not p.empty]
+        if not parts:
+            return None
+        ts = TransitionStats
+        df = pd.concat(parts, ignore_index=True)
+        keys = ts.key_columns
+        counts = df.groupby(keys, sort=True)[[ts.patients, ts.records]].sum()
+        t_df = df[keys + [ts.t_values, ts.t_counts]].explode([ts.t_values, ts.t_counts])
+        t_df = t_df.astype({ts.t_values: 'int64', ts.t_counts: 'int64'})
+        t_df = t_df.groupby(keys + [ts.t_values], sort=True)[ts.t_counts].sum().reset_index(ts.t_values)
+        t_df = t_df.groupby(level=keys, sort=True).agg(list)
+        return counts.join(t_df).reset_index()
+
+    @staticmethod
+    def summarize(partial_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Final statistics of the merged partial statistics: counts, min, max, mean and quantiles of t and
+        histogram of t by the histogram bins
+        """
+        ts = TransitionStats
+        bins = np.asarray(ts.histogram_bins)
+        rows = []
+        for values, counts in zip(partial_df[ts.t_values], partial_df[ts.t_counts]):
+            values, counts = np.asarray(values, dtype=np.int64), np.asarray(counts, dtype=np.int64)
+            cumulative = np.cumsum(counts)
+            row = {'t_min': values[0], 't_max': values[-1],
+                   't_mean': float(np.dot(values, counts) / cumulative[-1])}
+            for name, q in ts.quantiles.items():
+                # the lowest value with the cumulative count not less than the quantile of the records
+                row[name] = values[np.searchsorted(cumulative, q * cumulative[-1])]
+            # values below the first bin are counted in the first bin
+            bin_index = np.clip(np.searchsorted(bins, values, side='right') - 1, 0, None)
+            row[ts.t_histogram] = np.bincount(bin_index, weights=counts, minlength=len(bins)).astype(np.int64)
+            rows.append(row)
+        stats_df = pd.DataFrame(rows, index=partial_df.index)
+        df = pd.concat([partial_df.drop(columns=[ts.t_values, ts.t_counts]), stats_df], axis=1)
+        df[ts.t_bins] = [bins] * len(df)
+        return df
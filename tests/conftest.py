@@ -0,0 +1,8 @@
+import pytest
+
+from tests.study_data import UnorderedStore, create_store
+
+
+@pytest.fixture(scope='session')
+def store(tmp_path_factory) -> UnorderedStore:
+    return create_store(tmp_path_factory.mktemp('store'))
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.ExperimentConfig import ExperimentConfig
+from src.db.LocalStoreManager import LocalStoreManager
+from src.db.SqlDataElement import SqlColumn, SqlTable
+from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
+from src.repository.EventRepository import EventRepository
+from src.repository.PatientRepository import PatientRepository
+from src.usecase.BuildTransitionStats import BuildTransitionStats
+from src.usecase.FindEventsChain import FindEventsChain
+from src.util.FileProvider import FileProvider
+
+study = ExperimentConfig.from_json('''{"name": "spill", "levels": [
+  {"level": 0, "events": [{"id": "dm", "category": "diagnosis", "codes": ["E11"], "include_subcodes": true}]},
+  {"level": 1, "period": {"min_t": 0, "max_t": 2, "unit": "year"}, "events": [
+    {"id": "htn", "category": "diagnosis", "codes": ["I10"]},
+    {"id": "ckd", "category": "diagnosis", "codes": ["N18.3", "N18.4"]}]},
+  {"level": 2, "period": {"min_t": 0, "max_t": 3, "unit": "year"}, "events": [
+    {"id": "hf", "category": "diagnosis", "codes": ["I50.9"]}]}
+]}''')
+patients = [f'p{i}' for i in range(30)]
+
+
+class UnorderedStore(LocalStoreManager):
+    """Store returning the records in a random order, as a database does without ORDER BY"""
+
+    def __init__(self, store_path: str):
+        super().__init__(store_path)
+        self.rng = np.random.default_rng(1)
+
+    def request_code_info(self, *args, **kwargs):
+        return self.shuffle(super().request_code_info(*args, **kwargs))
+
+    def request_batch_code_info(self, *args, **kwargs):
+        return self.shuffle(super().request_batch_code_info(*args, **kwargs))
+
+    def shuffle(self, df):
+        return None if df is None else df.iloc[self.rng.permutation(len(df))].reset_index(drop=True)
+
+
+def create_store(tmp_path: Path) -> UnorderedStore:
+    """Store with the diagnosis records of the patients, the codes of every study level"""
+    rng = np.random.default_rng(7)
+    n = 1500
+    df = pd.DataFrame({cc.patient_id: rng.choice(patients, n),
+                       cc.code: rng.choice(['E11.9', 'E11.65', 'I10', 'N18.3', 'N18.4', 'I50.9'], n),
+                       cc.date: pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 2000, n), unit='D')})
+    df.to_csv(tmp_path / 'diagnosis.csv', index=False)
+    columns = [SqlColumn(cc.patient_id, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.code, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.date, 'DATETIME', float('nan'), False, False, True)]
+    store = UnorderedStore(str(tmp_path / 'store'))
+    store.create_db('db')
+    store.write_table(SqlTable('diagnosis', str(tmp_path / 'diagnosis.csv'), columns))
+    return store
+
+
+def run_study(store: LocalStoreManager, out_dir, memory_budget, chains_output: bool,
+              transition_stats: bool = False) -> dict:
+    fp = FileProvider()
+    result_path = fp.result_path
+    fp.set_result_path(str(out_dir))
+    try:
+        FindEventsChain(PatientRepository(store), EventRepository(store), CodeDescriptionRepository(store),
+                        memory_budget, chains_output).execute((0, patients), study, include_icd9=False)
+        if transition_stats:
+            BuildTransitionStats().execute(study)
+    finally:
+        fp.set_result_path(str(result_path))
+    return {str(f.relative_to(out_dir)): pd.read_parquet(f) for f in sorted(out_dir.rglob('*.parquet')) if f.is_file()}
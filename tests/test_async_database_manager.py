@@ -0,0 +1,110 @@
+import sys
+import threading
+import types
+
+import pytest
+
+from src.config.AppConfig import AppConfig
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db.AsyncDatabaseManager import AsyncDatabaseManager
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.description = None
+        self.rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, template: str, params: tuple):
+        self.pool.io_threads.add(threading.current_thread().name)
+        # one row per requested patient, the padding of the IN list repeats the patients
+        self.description = [(cc.patient_id,), (cc.date_of_birth,)]
+        self.rows = [(p, '1960-01-02') for p in dict.fromkeys(params)]
+
+    async def fetchmany(self, size: int):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def cursor(self, cursor_type):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    def __init__(self, params: dict):
+        self.params = params
+        self.io_threads = set()
+        self.closed = False
+
+    def acquire(self):
+        return FakeConnection(self)
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def pools(monkeypatch) -> list:
+    pools = []
+
+    async def create_pool(minsize: int, maxsize: int, autocommit: bool, **params):
+        pools.append(FakePool(params))
+        return pools[-1]
+
+    monkeypatch.setitem(sys.modules, 'aiomysql',
+                        types.SimpleNamespace(create_pool=create_pool, SSCursor=object))
+    return pools
+
+
+def create_manager() -> AsyncDatabaseManager:
+    app_config = AppConfig('ssh', 'user', 'password', 'user', 'password', 'localhost', 3306)
+    return AsyncDatabaseManager(app_config, db_name='db', pool_size=4, fetch_size=2)
+
+
+def test_map_requests(pools):
+    caller_threads = set()
+
+    def request(patients):
+        caller_threads.add(threading.current_thread().name)
+        return manager.request_patient_info(patients, [cc.patient_id, cc.date_of_birth])
+
+    with create_manager() as manager:
+        params = [([f'p{i}', f'q{i}', f'r{i}'],) for i in range(10)]
+        res = manager.map_requests(request, params, ordered=True)
+    assert [df[cc.patient_id].tolist() for df in res] == [p for p, in params]
+    assert all(str(df[cc.date_of_birth].dtype).startswith('datetime64') for df in res)
+    # the requests I/O runs on the loop, the functions and the decoding run in the map threads
+    assert pools[0].io_threads == {'AsyncDatabaseManagerLoop'}
+    assert 'AsyncDatabaseManagerLoop' not in caller_threads
+
+
+def test_close(pools):
+    manager = create_manager()
+    manager.close()
+    assert manager.request_patient_info(['p0'], [cc.patient_id]) is not None
+    manager.close()
+    assert len(pools) == 1 and pools[0].closed
+    assert not any(t.name == 'AsyncDatabaseManagerLoop' for t in threading.enumerate())
+    # the manager can be used after closing
+    assert manager.request_patient_info(['p1'], [cc.patient_id])[cc.patient_id].tolist() == ['p1']
+    manager.close()
+    assert len(pools) == 2 and pools[1].closed
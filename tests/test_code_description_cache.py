@@ -0,0 +1,113 @@
+from typing import Optional
+
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.repository.CodeDescriptionCache import CodeDescriptionCache
+from src.repository.CodeDescriptionRepository import CodeDescriptionRepository
+from src.util.FileProvider import FileProvider
+
+descriptions = pd.DataFrame({cc.code: ['I10', 'E11', 'I10'], cc.code_system: ['ICD10CM', 'ICD10CM', 'SNOMED'],
+                             cc.code_description: ['Hypertension', 'Diabetes', 'Hypertensive disorder']})
+
+
+class LocalStoreManager:
+    """Data manager of the code description table counting the requested codes"""
+
+    def __init__(self, database_name: str, fail: bool = False):
+        self.database_name = database_name
+        self.fail = fail
+        self.requests = []
+
+    def open_ssh_tunnel(self):
+        pass
+
+    def close_ssh_tunnel(self):
+        pass
+
+    def map_requests(self, f, params_list: list) -> list:
+        return [f(*params) for params in params_list]
+
+    def request_codes_description_batch(self, codes: list, code_systems: list) -> Optional[pd.DataFrame]:
+        self.requests += [(c, s) for c in codes for s in code_systems]
+        if self.fail:
+            return None
+        return descriptions[descriptions[cc.code].isin(codes) & descriptions[cc.code_system].isin(code_systems)]
+
+
+class DatabaseManager(LocalStoreManager):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(FileProvider, 'cache_path', property(lambda self: tmp_path))
+    yield tmp_path
+    for database_name in ['db', 'db2']:
+        CodeDescriptionCache.clear(database_name)
+
+
+def described_codes(df: pd.DataFrame) -> list:
+    return sorted(zip(df[cc.code], df[cc.code_system], df[cc.code_description]))
+
+
+def test_cached_codes_are_not_requested(cache_path):
+    manager = LocalStoreManager('db')
+    repo = CodeDescriptionRepository(manager)
+    df = repo.get_code_description([('I10', ['ICD10CM', 'SNOMED']), ('X99', ['ICD10CM'])])
+    assert described_codes(df) == [('I10', 'ICD10CM', 'Hypertension'), ('I10', 'SNOMED', 'Hypertensive disorder')]
+    assert sorted(manager.requests) == [('I10', 'ICD10CM'), ('I10', 'SNOMED'), ('X99', 'ICD10CM')]
+
+    # codes without description are cached as not found
+    manager.requests.clear()
+    assert described_codes(repo.get_code_description([('I10', ['SNOMED']), ('X99', ['ICD10CM'])])) == \
+        [('I10', 'SNOMED', 'Hypertensive disorder')]
+    assert manager.requests == []
+    df = repo.get_code_description([('I10', ['ICD10CM']), ('E11', ['ICD10CM'])])
+    assert described_codes(df) == [('E11', 'ICD10CM', 'Diabetes'), ('I10', 'ICD10CM', 'Hypertension')]
+    assert manager.requests == [('E11', 'ICD10CM')]
+    assert (cache_path / 'db' / 'LocalStoreManager' / CodeDescriptionCache.file_name).exists()
+
+
+def test_cache_is_loaded_from_file():
+    key = ('db', 'LocalStoreManager')
+    CodeDescriptionCache.add(key, [('I10', 'ICD10CM'), ('X99', 'ICD10CM')], descriptions.iloc[:1])
+    # a new process loads the saved cache
+    CodeDescriptionCache._CodeDescriptionCache__frames.clear()
+    df, missing = CodeDescriptionCache.get(key, [('I10', 'ICD10CM'), ('X99', 'ICD10CM'), ('E11', 'ICD10CM')])
+    assert described_codes(df) == [('I10', 'ICD10CM', 'Hypertension')]
+    assert missing == [('E11', 'ICD10CM')]
+
+
+def test_cache_keys_are_isolated():
+    managers = [LocalStoreManager('db'), DatabaseManager('db'), LocalStoreManager('db2')]
+    assert len({CodeDescriptionCache.key(m) for m in managers}) == 3
+    for manager in managers:
+        CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])])
+    # every database and manager type requests the codes once
+    assert [m.requests for m in managers] == [[('I10', 'ICD10CM')]] * 3
+    for manager in managers:
+        CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])])
+    assert [m.requests for m in managers] == [[('I10', 'ICD10CM')]] * 3
+
+
+def test_cache_is_cleared_per_database(cache_path):
+    managers = [LocalStoreManager('db'), DatabaseManager('db'), LocalStoreManager('db2')]
+    for manager in managers:
+        CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])])
+    # data import to the database drops its descriptions of every manager type
+    CodeDescriptionCache.clear('db')
+    assert not (cache_path / 'db').exists() and (cache_path / 'db2').exists()
+    for manager in managers:
+        CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])])
+    assert [len(m.requests) for m in managers] == [2, 2, 1]
+
+
+def test_failed_requests_are_not_cached():
+    manager = LocalStoreManager('db', fail=True)
+    assert CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])]) is None
+    manager.fail = False
+    df = CodeDescriptionRepository(manager).get_code_description([('I10', ['ICD10CM'])])
+    assert described_codes(df) == [('I10', 'ICD10CM', 'Hypertension')]
+    assert len(manager.requests) == 2
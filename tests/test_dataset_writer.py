@@ -0,0 +1,69 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pandas.testing import assert_frame_equal
+
+from src.util.DatasetWriter import DatasetWriter
+
+
+def parts():
+    return [pd.DataFrame({'patient_id': [1, 2], 'route': [None, None], 'code': pd.Categorical(['a', 'b'])}),
+            pd.DataFrame({'code': pd.Categorical(['c']), 'patient_id': [3], 'route': ['oral']}),
+            pd.DataFrame({'route': [None], 'patient_id': [4], 'code': pd.Categorical(['a'])})]
+
+
+def test_null_first_and_reordered_parts(tmp_path):
+    file_path = tmp_path / 'events.parquet'
+    with DatasetWriter(file_path, sort_by='patient_id', row_group_size=2) as writer:
+        for df in parts():
+            writer.write(df)
+
+    schema = pq.read_schema(file_path)
+    assert schema.names == ['patient_id', 'route', 'code']
+    assert schema.field('route').type == pa.string()
+    expected = pd.concat([df[['patient_id', 'route', 'code']] for df in parts()], ignore_index=True)
+    expected['code'] = expected['code'].astype(str)
+    df = pd.read_parquet(file_path).astype({'code': str})
+    assert_frame_equal(df, expected)
+    assert [p.name for p in tmp_path.iterdir()] == ['events.parquet']
+
+
+def test_single_part(tmp_path):
+    file_path = tmp_path / 'patients.parquet'
+    df = parts()[1]
+    with DatasetWriter(file_path) as writer:
+        writer.write(df)
+    assert_frame_equal(pd.read_parquet(file_path).astype({'code': str}), df.astype({'code': str}))
+
+
+def test_empty_parts(tmp_path):
+    file_path = tmp_path / 'empty.parquet'
+    with DatasetWriter(file_path) as writer:
+        writer.write(parts()[1].iloc[:0])
+        writer.write(parts()[1].iloc[:0])
+    df = pd.read_parquet(file_path)
+    assert df.empty and list(df.columns) == ['code', 'patient_id', 'route']
+
+
+def test_integer_and_float_parts(tmp_path):
+    file_path = tmp_path / 'values.parquet'
+    with DatasetWriter(file_path) as writer:
+        writer.write(pd.DataFrame({'patient_id': [1, 2], 'num_value': [6, 7]}))
+        writer.write(pd.DataFrame({'patient_id': [3], 'num_value': [6.5]}))
+    df = pd.read_parquet(file_path)
+    assert df['num_value'].tolist() == [6.0, 7.0, 6.5] and df['num_value'].dtype == 'float64'
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_exception_keeps_existing_file(tmp_path, n_parts):
+    file_path = tmp_path / 'events.parquet'
+    with DatasetWriter(file_path) as writer:
+        writer.write(parts()[1])
+    with pytest.raises(RuntimeError, match='study failed'):
+        with DatasetWriter(file_path, row_group_size=1) as writer:
+            for df in parts()[:n_parts]:
+                writer.write(df)
+            raise RuntimeError('study failed')
+    assert pd.read_parquet(file_path)['patient_id'].tolist() == [3]
+    assert [p.name for p in tmp_path.iterdir()] == ['events.parquet']
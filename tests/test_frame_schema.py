@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from src.util.FrameSchema import FrameSchema
+
+
+def level_frame(level: int, codes: list, dates: list) -> pd.DataFrame:
+    return FrameSchema.apply(pd.DataFrame({'patient_id': [1] * len(codes), f'code_{level}': codes,
+                                           f'date_{level}': dates}))
+
+
+def test_apply():
+    df = FrameSchema.apply(pd.DataFrame({'patient_id': ['p1'], 'code_1': ['I10'], 'event_id_1': ['htn'],
+                                         'date_1': ['2020-01-02 10:11:12'], 't_0': [3], 'num_value': [1.5]}))
+    assert df.dtypes.astype(str).to_dict() == {'patient_id': 'string', 'code_1': 'category', 'event_id_1': 'category',
+                                               'date_1': 'datetime64[ns]', 't_0': 'int32', 'num_value': 'float64'}
+
+
+def test_merge_keeps_categorical_keys():
+    chains_df = level_frame(0, ['I10', 'E11'], ['2020-01-01', '2020-02-01'])
+    transition_df = level_frame(0, ['I10'], ['2020-01-01']).assign(code_1=pd.Categorical(['N18.3']), t_0=10)
+    df = FrameSchema.merge(chains_df, transition_df, on=['patient_id', 'code_0', 'date_0'])
+    assert df['code_0'].dtype == 'category' and df['code_1'].dtype == 'category'
+    assert df['t_0'].dtype == FrameSchema.distance_dtype
+    assert df['code_0'].tolist() == ['I10'] and df['code_1'].tolist() == ['N18.3']
+    # the merged frames are not modified
+    assert chains_df['code_0'].cat.categories.tolist() == ['E11', 'I10']
+
+
+def test_concat_unifies_categories():
+    df = FrameSchema.concat([level_frame(0, ['I10'], ['2020-01-01']), None,
+                             level_frame(0, ['E11'], ['2020-01-01']).assign(route='oral')])
+    assert df['code_0'].dtype == 'category' and df['route'].dtype == 'category'
+    assert df['code_0'].tolist() == ['I10', 'E11']
+    assert df['date_0'].dtype == FrameSchema.date_dtype
+
+
+def test_apply_does_not_modify_frame(monkeypatch):
+    df = pd.DataFrame({'patient_id': ['p1', 'p2'], 'code': ['I10', 'E11'], 'date': ['2020-01-02', '2020-03-04'],
+                       'num_value': [1.5, 2.0]})
+    source = df.copy()
+    res = FrameSchema.apply(df)
+    pd.testing.assert_frame_equal(df, source)
+    assert res['date'].dtype == FrameSchema.date_dtype and res['code'].dtype == 'category'
+    # the columns of the schema dtypes are shared, a frame of the schema dtypes is returned as it is
+    assert np.shares_memory(res['num_value'].to_numpy(), df['num_value'].to_numpy())
+    assert FrameSchema.apply(res) is res
+
+    parts = [df.iloc[:1], df.iloc[1:]]
+    FrameSchema.concat(parts)
+    assert all(p.dtypes.equals(source.dtypes) for p in parts)
+
+    # the date column is parsed once
+    calls = []
+    to_datetime = pd.to_datetime
+    monkeypatch.setattr(pd, 'to_datetime', lambda *args, **kwargs: calls.append(args) or to_datetime(*args, **kwargs))
+    FrameSchema.apply(df)
+    assert len(calls) == 1
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.Event import AttributeMode, Event, EventCategory, EventTimeInterval
+from src.usecase.GetEventData import GetEventData
+from src.util.FrameSchema import FrameSchema
+from src.util.IntervalJoin import IntervalJoin
+
+windows = [(0, 30), (-10, 10), (0, 0), (-30, -1), (None, -1), (None, 5), (3, None), (None, None)]
+
+
+def random_frame(rng: np.random.Generator, n: int, with_time: bool, patients: int = 8,
+                 days: int = 120) -> pd.DataFrame:
+    """Records of a few patients, every patient has several records and some records have the same date"""
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, days, n), unit='D')
+    if with_time:
+        dates = dates + pd.to_timedelta(rng.integers(0, 24 * 60, n), unit='min')
+    return pd.DataFrame({cc.patient_id: rng.choice([f'p{i}' for i in range(patients)], n), cc.date: dates})
+
+
+def brute_force_count(df: pd.DataFrame, events_df: pd.DataFrame, min_t, max_t) -> np.ndarray:
+    """Counts of the merged records and events compared by the whole days between the dates, as before the join"""
+    merged = df.reset_index().merge(events_df, on=cc.patient_id, how='left', suffixes=('', '_event'))
+    days = (merged[cc.date + '_event'] - merged[cc.date]).dt.days
+    within = days.notna()
+    if min_t is not None:
+        within &= days >= min_t
+    if max_t is not None:
+        within &= days <= max_t
+    return within.groupby(merged['index']).sum().reindex(range(len(df)), fill_value=0).to_numpy()
+
+
+@pytest.mark.parametrize('with_time', [False, True])
+@pytest.mark.parametrize('min_t, max_t', windows)
+def test_count_within(with_time, min_t, max_t):
+    rng = np.random.default_rng(5)
+    df = random_frame(rng, 300, with_time)
+    # events of the patients without records are skipped
+    events_df = random_frame(rng, 400, with_time, patients=10)
+    counts = IntervalJoin.count_within(df[cc.patient_id], df[cc.date], events_df[cc.patient_id],
+                                       events_df[cc.date], min_t, max_t)
+    expected = brute_force_count(df, events_df, min_t, max_t)
+    assert expected.sum() > 0
+    np.testing.assert_array_equal(counts, expected)
+    np.testing.assert_array_equal(IntervalJoin.any_within(df[cc.patient_id], df[cc.date], events_df[cc.patient_id],
+                                                          events_df[cc.date], min_t, max_t), expected > 0)
+
+
+def test_window_edges():
+    date = pd.Timestamp('2020-01-10 12:00')
+    event_dates = pd.to_datetime(['2020-01-10 11:59', '2020-01-10 12:00', '2020-01-20 12:00', '2020-01-21 11:59',
+                                  '2020-01-21 12:00'])
+    expected = {
+        # an event a minute before the record date is -1 day from the record
+        (0, 10): [0, 1, 1, 1, 0],
+        (-1, -1): [1, 0, 0, 0, 0],
+        (None, -1): [1, 0, 0, 0, 0],
+        (11, None): [0, 0, 0, 0, 1],
+    }
+    for (min_t, max_t), within in expected.items():
+        counts = [IntervalJoin.count_within(['p'], [date], ['p'], [d], min_t, max_t)[0] for d in event_dates]
+        assert counts == within, (min_t, max_t)
+        assert IntervalJoin.count_within(['p'], [date], ['p'] * 5, event_dates, min_t, max_t).tolist() == \
+            [sum(within)]
+    # date-only windows include both bounds
+    assert IntervalJoin.count_within(['p'] * 2, pd.to_datetime(['2020-01-10', None]), ['p'] * 3,
+                                     pd.to_datetime(['2020-01-09', '2020-01-10', '2020-01-20']), -1, 10).tolist() == \
+        [3, 0]
+
+
+def test_empty_inputs():
+    dates = pd.to_datetime(['2020-01-01', '2020-02-01'])
+    empty = pd.Series([], dtype='datetime64[ns]')
+    assert IntervalJoin.count_within(['p', 'q'], dates, [], empty, 0, 10).tolist() == [0, 0]
+    assert IntervalJoin.count_within([], empty, ['p'], dates[:1], 0, 10).tolist() == []
+    assert IntervalJoin.count_between(['p'], [pd.NaT], [pd.NaT], [], empty).tolist() == [0]
+    # events of other patients or without date are not counted
+    assert IntervalJoin.count_within(['p', 'q'], dates, ['x', 'p'], [dates[0], pd.NaT], None, None).tolist() == [0, 0]
+
+
+def test_count_between():
+    rng = np.random.default_rng(9)
+    events_df = random_frame(rng, 300, with_time=True)
+    windows_df = random_frame(rng, 200, with_time=False).rename(columns={cc.date: 'start_date'})
+    windows_df['end_date'] = windows_df['start_date'] + pd.to_timedelta(rng.integers(0, 60, len(windows_df)), 'D')
+    # windows without start or end dates are unbounded from that side
+    windows_df.loc[::7, 'start_date'] = pd.NaT
+    windows_df.loc[::5, 'end_date'] = pd.NaT
+    counts = IntervalJoin.count_between(windows_df[cc.patient_id], windows_df['start_date'], windows_df['end_date'],
+                                        events_df[cc.patient_id], events_df[cc.date])
+    merged = windows_df.reset_index().merge(events_df, on=cc.patient_id)
+    within = (merged['start_date'].isna() | (merged[cc.date] >= merged['start_date'])) & \
+        (merged['end_date'].isna() | (merged[cc.date] <= merged['end_date']))
+    expected = within.groupby(merged['index']).sum().reindex(range(len(windows_df)), fill_value=0).to_numpy()
+    np.testing.assert_array_equal(counts, expected)
+
+
+def brute_force_attribute_filter(df: pd.DataFrame, attr_df: pd.DataFrame, attr_events: list[Event],
+                                 period, mode: AttributeMode, exclude: bool) -> pd.DataFrame:
+    """Having or exclusion filter by the merged records and attribute events, as before the join"""
+    merged = df.merge(attr_df, on=cc.patient_id, suffixes=('', '_attr'))
+    merged['date_diff'] = (merged[cc.date + '_attr'] - merged[cc.date]).dt.days
+    keys = []
+    for attr_event in attr_events:
+        event_df = merged[merged[cc.event_id + '_attr'] == attr_event.id]
+        if period is None and attr_event.period is None:
+            event_df = event_df[event_df['date_diff'] < 0]
+        else:
+            min_t = attr_event.period.min_t if attr_event.period is not None else period.min_t
+            max_t = attr_event.period.max_t if attr_event.period is not None else period.max_t
+            event_df = event_df[event_df['date_diff'].between(min_t, max_t)]
+        keys.append(set(zip(event_df[cc.patient_id], event_df[cc.date])))
+    matched = set.union(*keys) if mode == AttributeMode.any else set.intersection(*keys)
+    has_attribute = np.array([k in matched for k in zip(df[cc.patient_id], df[cc.date])])
+    return df[~has_attribute if exclude else has_attribute].drop_duplicates()
+
+
+def sorted_records(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.astype({c: str for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize('exclude', [False, True])
+@pytest.mark.parametrize('mode', [AttributeMode.any, AttributeMode.all])
+@pytest.mark.parametrize('period, asthma_period', [(None, None), (EventTimeInterval(-30, 0), None),
+                                                   (EventTimeInterval(-30, 0), EventTimeInterval(0, 15)),
+                                                   (None, EventTimeInterval(-5, 5))])
+def test_attribute_filters(exclude, mode, period, asthma_period):
+    rng = np.random.default_rng(11)
+    attr_events = [Event(id='asthma', category=EventCategory.Diagnosis, codes=['J45'], period=asthma_period),
+                   Event(id='copd', category=EventCategory.Diagnosis, codes=['J44'])]
+    event = Event(id='dm', category=EventCategory.Diagnosis, codes=['E11'],
+                  exclusion_events=attr_events if exclude else None, exclusion_period=period if exclude else None,
+                  having_events=None if exclude else attr_events, having_period=None if exclude else period,
+                  inclusion_mode=mode, exclusion_mode=mode)
+    df = FrameSchema.apply(random_frame(rng, 200, True, patients=20, days=720).assign(**{cc.code: 'E11',
+                                                                                          cc.event_id: 'dm'}))
+    attr_df = random_frame(rng, 300, True, patients=20, days=720)
+    attr_df[cc.event_id] = rng.choice(['asthma', 'copd'], len(attr_df))
+    attr_df = FrameSchema.apply(attr_df)
+
+    event_data = GetEventData(None, None)
+    if exclude:
+        res = event_data._GetEventData__filter_excluded_events(df, attr_df, event)
+    else:
+        res = event_data._GetEventData__filter_having_events(df, attr_df, event)
+    expected = brute_force_attribute_filter(df, attr_df, attr_events, period, mode, exclude)
+    assert 0 < len(expected) < len(df)
+    pd.testing.assert_frame_equal(sorted_records(res), sorted_records(expected))
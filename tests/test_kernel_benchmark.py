@@ -0,0 +1,26 @@
+import logging
+
+import pytest
+
+from benchmark.KernelBenchmark import KernelBenchmark, KernelResult
+
+
+def result(kernel: str, rows: int, throughput: float) -> KernelResult:
+    return KernelResult(kernel=kernel, rows=rows, seconds=rows / throughput, throughput=throughput)
+
+
+def test_regressions():
+    baseline = [result('match_events', 1000, 100.0), result('match_events', 10000, 100.0)]
+    results = [result('match_events', 1000, 90.0), result('match_events', 10000, 70.0)]
+    assert KernelBenchmark.regressions(results, baseline, 0.2) == [('match_events', 10000, 100.0, 70.0)]
+
+
+def test_regressions_without_baseline_measurements(caplog):
+    baseline = [result('match_events', 1000, 100.0)]
+    results = [result('match_events', 1000, 100.0), result('match_events', 10000, 10.0)]
+    with caplog.at_level(logging.WARNING):
+        assert KernelBenchmark.regressions(results, baseline, 0.2) == []
+    assert "[('match_events', 10000)]" in caplog.text
+    # nothing is compared, e.g. the baseline of other sizes
+    with pytest.raises(ValueError, match='No measurement matches the baseline'):
+        KernelBenchmark.regressions([result('filter_having_events', 1000, 10.0)], baseline, 0.2)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db.LocalStoreManager import LocalStoreManager
+from src.db.SqlDataElement import CodeSet, SqlColumn, SqlTable
+
+sort_columns = [cc.code, cc.patient_id, cc.date]
+
+
+def diagnosis_frame(n: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1000, n), unit='D')
+    df = pd.DataFrame({cc.patient_id: [f'p{i}' for i in rng.integers(0, 50, n)],
+                       cc.code: rng.choice(['I10', 'I11.0', 'E11', 'E11.9', 'N18.3'], n),
+                       cc.date: dates, cc.num_value: rng.normal(size=n)})
+    # records without a date are sorted last
+    df.loc[df.index % 97 == 0, cc.date] = pd.NaT
+    return df
+
+
+def write_store(tmp_path, frames: list) -> LocalStoreManager:
+    store = LocalStoreManager(str(tmp_path / 'store'))
+    store.create_db('db')
+    store.sort_run_rows, store.merge_batch_rows, store.row_group_size = 100, 32, 64
+    columns = [SqlColumn(cc.patient_id, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.code, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.date, 'DATETIME', float('nan'), True, False, False),
+               SqlColumn(cc.num_value, 'DOUBLE', float('nan'), True, False, False)]
+    for i, df in enumerate(frames):
+        file_path = tmp_path / f'diagnosis_{i}.csv'
+        df.to_csv(file_path, index=False)
+        store.write_table(SqlTable('diagnosis', str(file_path), columns), replace=i == 0)
+    return store
+
+
+def test_partitions_are_sorted(tmp_path):
+    frames = [diagnosis_frame(1500, 1), diagnosis_frame(700, 2)]
+    write_store(tmp_path, frames)
+    expected = pd.concat(frames, ignore_index=True)
+    partitions = sorted((tmp_path / 'store' / 'db' / 'diagnosis').iterdir())
+    assert [p.name for p in partitions] == ['code_group=E', 'code_group=I', 'code_group=N']
+    rows = 0
+    for p in partitions:
+        # the source and run files are replaced by one file
+        assert [f.name for f in p.iterdir()] == ['part-0.parquet']
+        df = pq.read_table(p / 'part-0.parquet', partitioning=None).to_pandas().astype({cc.date: 'datetime64[ns]'})
+        assert df[sort_columns].equals(df.sort_values(sort_columns, na_position='last')[sort_columns]
+                                       .reset_index(drop=True))
+        part = expected[expected[cc.code].str.startswith(p.name[-1])]
+        pd.testing.assert_frame_equal(df.sort_values(sort_columns + [cc.num_value]).reset_index(drop=True),
+                                      part.sort_values(sort_columns + [cc.num_value]).reset_index(drop=True),
+                                      check_dtype=False)
+        rows += len(df)
+    assert rows == len(expected)
+
+
+def test_request_code_info(tmp_path):
+    df = diagnosis_frame(500, 3)
+    store = write_store(tmp_path, [df])
+    res = store.request_code_info(['I1'], 'diagnosis', [cc.patient_id, cc.code, cc.date], include_subcodes=True)
+    expected = df[df[cc.code].str.startswith('I1')].dropna()[[cc.patient_id, cc.code, cc.date]].drop_duplicates()
+    key = [cc.patient_id, cc.code, cc.date]
+    pd.testing.assert_frame_equal(res.sort_values(key).reset_index(drop=True),
+                                  expected.sort_values(key).reset_index(drop=True), check_dtype=False)
+    assert store.request_code_info(['E11'], 'diagnosis', [cc.patient_id])[cc.patient_id].isin(
+        df.loc[df[cc.code] == 'E11', cc.patient_id]).all()
+
+
+def test_request_batch_code_info(tmp_path):
+    df = diagnosis_frame(500, 4).dropna()
+    store = write_store(tmp_path, [df])
+    code_sets = [CodeSet('f_0', ('I10',)), CodeSet('f_1', ('I1', 'E11.9'), include_subcodes=True)]
+    res = store.request_batch_code_info(code_sets, 'diagnosis', [cc.patient_id, cc.code, cc.date])
+    assert set(res[cc.code].astype(str)) == {'I10', 'I11.0', 'E11.9'}
+    assert (res['f_0'] == (res[cc.code] == 'I10')).all()
+    assert (res['f_1'] == 1).all()
+    assert len(res) == len(df[df[cc.code].isin(['I10', 'I11.0', 'E11.9'])].drop_duplicates(
+        [cc.patient_id, cc.code, cc.date]))
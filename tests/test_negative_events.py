@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.datamodel.Event import Event, EventCategory
+from src.repository.EventRepository import EventRepository
+from tests.test_local_store import diagnosis_frame, write_store
+
+columns = [cc.patient_id, cc.code, cc.date]
+no_htn = Event(id='no_htn', category=EventCategory.Diagnosis, codes=['I10'], negation=True)
+
+
+def baseline_negative_records(positive_df: pd.DataFrame, patients_info: list) -> pd.DataFrame:
+    """Negative records of the windows merged with the positive records of the patients, as before the window count"""
+    windows_df = pd.DataFrame([(p, pd.Timestamp(min_date), pd.Timestamp(max_date))
+                               for min_date, max_date, patients in patients_info for p in patients],
+                              columns=[cc.patient_id, 'min_date', 'max_date'])
+    df = windows_df.merge(positive_df, how='left', on=cc.patient_id)
+    df['within_time'] = (df[cc.date] >= df['min_date']) & (df[cc.date] <= df['max_date'])
+    df['within_time'] = df.groupby([cc.patient_id, 'min_date', 'max_date'])['within_time'].transform('sum')
+    df = df[df['within_time'] == 0].drop_duplicates(subset=[cc.patient_id, 'max_date'])
+    return df[[cc.patient_id, 'max_date']].rename(columns={'max_date': cc.date})
+
+
+def sorted_records(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype({cc.patient_id: str}).sort_values([cc.patient_id, cc.date], ignore_index=True)
+
+
+def test_negative_records_of_windows(tmp_path):
+    df = diagnosis_frame(500, 3)
+    store = write_store(tmp_path, [df])
+    rng = np.random.default_rng(2)
+    patients = [f'p{i}' for i in range(50)]
+    # some patients are in several windows, the patients p100 and p101 have no records at all
+    date_patient_map = {}
+    for start in pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 900, 15), unit='D'):
+        end = start + pd.Timedelta(days=int(rng.integers(0, 200)))
+        date_patient_map[(start, end)] = list(rng.choice(patients, 8, replace=False))
+    date_patient_map[(pd.Timestamp('2020-03-01'), pd.Timestamp('2021-03-01'))] = ['p100', 'p1', 'p2']
+    date_patient_map[(pd.Timestamp('2022-01-01'), pd.Timestamp('2022-02-01'))] = ['p101']
+
+    res = EventRepository(store).get_event_info(no_htn, columns, date_patient_map, include_icd9=False)
+    assert set(res[cc.code]) == {'not [I10]'}
+
+    # the baseline merges the positive records of the same windows request
+    patients_info = [(start, end, ps) for (start, end), ps in date_patient_map.items()]
+    positive_df = store.request_code_info(['I10'], 'diagnosis', columns, patients_info=patients_info)
+    expected = baseline_negative_records(positive_df, patients_info)
+    assert {'p100', 'p101'} <= set(expected[cc.patient_id])
+    assert len(expected) < sum(len(ps) for ps in date_patient_map.values())
+    pd.testing.assert_frame_equal(sorted_records(res[[cc.patient_id, cc.date]]), sorted_records(expected),
+                                  check_dtype=False)
+
+
+def test_unbounded_windows(tmp_path):
+    df = pd.DataFrame({cc.patient_id: ['p1', 'p2'], cc.code: 'I10',
+                       cc.date: pd.to_datetime(['2020-01-01', '2021-01-01']), cc.num_value: 0.0})
+    store = write_store(tmp_path, [df])
+    # a window without start or end date is unbounded from that side
+    date_patient_map = {(None, pd.Timestamp('2020-06-01')): ['p1', 'p2', 'p3']}
+    res = EventRepository(store).get_event_info(no_htn, columns, date_patient_map, include_icd9=False)
+    assert sorted(res[cc.patient_id].astype(str)) == ['p2', 'p3']
+    assert (res[cc.date] == pd.Timestamp('2020-06-01')).all()
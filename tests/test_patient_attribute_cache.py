@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.repository.PatientAttributeCache import PatientAttributeCache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    PatientAttributeCache.clear()
+    yield
+    PatientAttributeCache.clear()
+
+
+def patients_frame(patients: list) -> pd.DataFrame:
+    return pd.DataFrame({cc.patient_id: patients, cc.date_of_birth: ['1960-01-01'] * len(patients),
+                         cc.date_of_death: [None] * len(patients), cc.sex: ['F'] * len(patients),
+                         cc.race: ['White'] * len(patients), cc.ethnicity: ['Unknown'] * len(patients)})
+
+
+def patients(start: int, n: int) -> list:
+    return [f'p{i}' for i in range(start, start + n)]
+
+
+def test_key_order():
+    class LocalStoreManager:
+        database_name = 'db'
+
+    assert PatientAttributeCache.key(LocalStoreManager()) == ('db', 'LocalStoreManager')
+
+
+def test_get_loaded_patients():
+    key = ('db', 'LocalStoreManager')
+    # p2 has no record in the patient table
+    PatientAttributeCache.add(key, ['p0', 'p1', 'p2'], patients_frame(['p0', 'p1']))
+    assert PatientAttributeCache.missing(key, ['p1', 'p2', 'p3']) == ['p3']
+    assert PatientAttributeCache.get(key, ['p1', 'p3']) is None
+    assert PatientAttributeCache.get(key, ['p1', 'p2', 'p0']).index.tolist() == ['p1', 'p0']
+
+
+def test_least_recently_used_database_is_removed(monkeypatch):
+    key_1, key_2, key_3 = ('db1', 'LocalStoreManager'), ('db2', 'LocalStoreManager'), ('db3', 'LocalStoreManager')
+    PatientAttributeCache.add(key_1, patients(0, 100), patients_frame(patients(0, 100)))
+    monkeypatch.setattr(PatientAttributeCache, 'max_bytes', int(PatientAttributeCache.size() * 2.5))
+    PatientAttributeCache.add(key_2, patients(0, 100), patients_frame(patients(0, 100)))
+    assert PatientAttributeCache.get(key_1, ['p0']) is not None
+    PatientAttributeCache.add(key_3, patients(0, 100), patients_frame(patients(0, 100)))
+    assert PatientAttributeCache.missing(key_2, ['p0']) == ['p0']
+    assert PatientAttributeCache.get(key_1, ['p0']) is not None
+    assert PatientAttributeCache.size() <= PatientAttributeCache.max_bytes
+
+
+def test_earliest_patients_are_removed(monkeypatch):
+    key = ('db', 'LocalStoreManager')
+    PatientAttributeCache.add(key, patients(0, 100), patients_frame(patients(0, 100)))
+    monkeypatch.setattr(PatientAttributeCache, 'max_bytes', int(PatientAttributeCache.size() * 1.5))
+    PatientAttributeCache.add(key, patients(100, 100), patients_frame(patients(100, 100)))
+    assert PatientAttributeCache.size() <= PatientAttributeCache.max_bytes
+    assert PatientAttributeCache.missing(key, patients(0, 10)) == patients(0, 10)
+    assert PatientAttributeCache.get(key, patients(150, 50)).index.tolist() == patients(150, 50)
@@ -0,0 +1,147 @@
+from src.datamodel.DataColumns import CommonColumns as cc, CommonTables as ct
+from src.db import QueryBuilder
+from src.db.SqlDataElement import AttributeEvent, AttributeFilter, CodeSet, SqlColumn, SqlTable
+
+columns = [cc.patient_id, cc.code, cc.date]
+having = AttributeFilter((AttributeEvent('medication', ('A10',), True, ('250.00',), min_t=-30, max_t=0),))
+
+
+def test_batch_code_info():
+    code_sets = [CodeSet('f_0', ('I10',)), CodeSet('f_1', ('E11',), include_subcodes=True)]
+    patients_info = [(None, '2020-01-01', [1, 2, 3]), ('2019-01-01', None, [4])]
+    query = QueryBuilder.get_batch_code_info(code_sets, 'diagnosis', columns, patients_info)
+    assert query.template == \
+        'select diagnosis.patient_id,diagnosis.code,diagnosis.date,' \
+        'case when (diagnosis.code in (%s)) then 1 else 0 end as f_0,' \
+        'case when (diagnosis.code LIKE %s) then 1 else 0 end as f_1 from diagnosis ' \
+        'where (((diagnosis.code in (%s))) or ((diagnosis.code LIKE %s))) and (' \
+        '(diagnosis.patient_id in (%s,%s,%s,%s) AND diagnosis.date <= %s) OR ' \
+        '(diagnosis.patient_id in (%s) AND diagnosis.date >= %s)) '
+    assert query.params == ('I10', 'E11%', 'I10', 'E11%', 1, 2, 3, 3, '2020-01-01', 4, '2019-01-01')
+
+
+def test_batch_code_info_first_incident():
+    code_sets = [CodeSet('f_0', ('I10',)), CodeSet('f_1', ('4548-4',), num_value='>6.5')]
+    query = QueryBuilder.get_batch_code_info(code_sets, 'lab', columns, first_incident=True)
+    # the earliest record of every patient, code and flags combination
+    assert query.template == \
+        'select lab.patient_id,lab.code,min(lab.date) as date,' \
+        'case when (lab.code in (%s)) then 1 else 0 end as f_0,' \
+        'case when (lab.code in (%s)) and (num_value>%s) then 1 else 0 end as f_1 from lab ' \
+        'where (((lab.code in (%s))) or ((lab.code in (%s)) and (num_value>%s))) ' \
+        'group by lab.patient_id,lab.code,f_0,f_1'
+    assert query.params == ('I10', '4548-4', 6.5, 'I10', '4548-4', 6.5)
+
+
+def test_code_info_attribute_filters():
+    exclusion = AttributeFilter((AttributeEvent('lab', ('4548-4',), num_value='>6.5', min_t=0),))
+    query = QueryBuilder.get_code_info(['I10'], 'diagnosis', [cc.patient_id, cc.date], having=having,
+                                       exclusion=exclusion)
+    assert query.template == \
+        'select diagnosis.patient_id,diagnosis.date from diagnosis where (diagnosis.code in (%s)) and (' \
+        '(exists (select 1 from medication as having_0 where (having_0.patient_id = diagnosis.patient_id) and ' \
+        '(having_0.date >= date_add(diagnosis.date, interval %s day)) and ' \
+        '(having_0.date <= date_add(diagnosis.date, interval %s day)) and ' \
+        '((having_0.code LIKE %s) or (having_0.code in (%s)))))) and (' \
+        'not (exists (select 1 from lab as excl_0 where (excl_0.patient_id = diagnosis.patient_id) and ' \
+        '(excl_0.date >= date_add(diagnosis.date, interval %s day)) and ((excl_0.code in (%s))) and ' \
+        '(excl_0.num_value>%s)))) '
+    assert query.params == ('I10', -30, 0, 'A10%', '250.00', 0, '4548-4', 6.5)
+
+
+def test_code_info_attribute_filters_of_first_incident():
+    query = QueryBuilder.get_code_info(['I10'], 'diagnosis', columns, first_incident=True, having=having)
+    # attribute events are checked for the first incident records
+    assert query.template == \
+        'select * from (select diagnosis.patient_id,diagnosis.code,min(diagnosis.date) as date from diagnosis ' \
+        'where (diagnosis.code in (%s)) group by diagnosis.patient_id,diagnosis.code) as first_records where ' \
+        '(exists (select 1 from medication as having_0 where (having_0.patient_id = first_records.patient_id) and ' \
+        '(having_0.date >= date_add(first_records.date, interval %s day)) and ' \
+        '(having_0.date <= date_add(first_records.date, interval %s day)) and ' \
+        '((having_0.code LIKE %s) or (having_0.code in (%s)))))'
+    assert query.params == ('I10', -30, 0, 'A10%', '250.00')
+
+
+def test_nested_attribute_filters():
+    nested = AttributeEvent('diagnosis', ('N18',), True, exclusion=having)
+    query = QueryBuilder.compose_attribute_condition(AttributeFilter((nested,)), 'diagnosis', 'having')
+    # every nested subquery table gets its own alias
+    assert query.template == \
+        '(exists (select 1 from diagnosis as having_0 where (having_0.patient_id = diagnosis.patient_id) and ' \
+        '((having_0.code LIKE %s)) and (not (exists (select 1 from medication as having_0_excl_0 where ' \
+        '(having_0_excl_0.patient_id = having_0.patient_id) and ' \
+        '(having_0_excl_0.date >= date_add(having_0.date, interval %s day)) and ' \
+        '(having_0_excl_0.date <= date_add(having_0.date, interval %s day)) and ' \
+        '((having_0_excl_0.code LIKE %s) or (having_0_excl_0.code in (%s))))))))'
+    assert query.params == ('N18%', -30, 0, 'A10%', '250.00')
+
+
+def test_code_absence_windows():
+    patients_info = [('2019-01-01', '2020-01-01', [1, 2, 3]), (None, None, [4])]
+    query = QueryBuilder.get_code_absence_windows(['I10'], 'diagnosis', patients_info, include_subcodes=True,
+                                                  mapped_codes=['401.9'])
+    # a window of every patient group, the end of the window is its date
+    assert query.template == \
+        'select patient.patient_id, %s as date from patient where patient.patient_id in (%s,%s,%s,%s) and ' \
+        'not exists (select 1 from diagnosis as positive where (positive.patient_id = patient.patient_id) and ' \
+        '((positive.code LIKE %s) or (positive.code in (%s))) and ' \
+        '(positive.date >= %s AND positive.date <= %s)) union all ' \
+        'select patient.patient_id, null as date from patient where patient.patient_id in (%s) and ' \
+        'not exists (select 1 from diagnosis as positive where (positive.patient_id = patient.patient_id) and ' \
+        '((positive.code LIKE %s) or (positive.code in (%s))))'
+    assert query.params == ('2020-01-01', 1, 2, 3, 3, 'I10%', '401.9', '2019-01-01', '2020-01-01',
+                            4, 'I10%', '401.9')
+
+
+def test_code_absence_windows_of_values():
+    query = QueryBuilder.get_code_absence_windows(['4548-4'], 'lab', [(None, '2020-01-01', [1])], num_value='>6.5')
+    assert query.template == \
+        'select patient.patient_id, %s as date from patient where patient.patient_id in (%s) and ' \
+        'not exists (select 1 from lab as positive where (positive.patient_id = patient.patient_id) and ' \
+        '((positive.code in (%s))) and (positive.num_value>%s) and (positive.date <= %s))'
+    assert query.params == ('2020-01-01', 1, '4548-4', 6.5, '2020-01-01')
+
+
+def test_code_counts_from_catalog():
+    query = QueryBuilder.get_code_counts(['I10', 'E11.9'], ['N18'], 'diagnosis')
+    assert query.template == \
+        'select code, 0 as subcodes, records, patients from code_catalog where table_name = %s and ' \
+        'code in (%s,%s) union all ' \
+        'select %s as code, 1 as subcodes, coalesce(sum(records), 0) as records, ' \
+        'coalesce(sum(patients), 0) as patients from code_catalog where table_name = %s and code LIKE %s'
+    assert query.params == ('diagnosis', 'I10', 'E11.9', 'N18', 'diagnosis', 'N18%')
+
+
+def fact_table(name: str, use_recommended_indexes: bool = True) -> SqlTable:
+    # the data dictionary index of (encounter_id, date) lists its columns out of the index order
+    columns = [SqlColumn(cc.patient_id, 'VARCHAR', 64, False, False, True, foreign_key=f'{cc.patient_id}|patient'),
+               SqlColumn(cc.date, 'DATETIME', float('nan'), True, False, True, index_spec='Yes;idx_encounter_date:1'),
+               SqlColumn(cc.code, 'VARCHAR', 32, False, False, True),
+               SqlColumn(cc.encounter_id, 'VARCHAR', 64, True, False, False, index_spec='idx_encounter_date:0'),
+               SqlColumn(cc.num_value, 'DOUBLE', float('nan'), True, False, True)]
+    return SqlTable(name, None, columns, use_recommended_indexes)
+
+
+def index_query(table: SqlTable) -> str:
+    return QueryBuilder.create_index(table.name, {i.name: list(i.columns) for i in table.index_definitions()})
+
+
+def test_create_indexes():
+    assert index_query(fact_table(ct.diagnosis)) == \
+        'ALTER TABLE diagnosis ADD INDEX idx_date (date), ADD INDEX idx_num_value (num_value), ' \
+        'ADD INDEX idx_encounter_date (encounter_id, date), ' \
+        'ADD INDEX idx_code_patient_date (code, patient_id, date), ' \
+        'ADD INDEX idx_patient_date_code (patient_id, date, code)'
+    # the leading columns of the composite indexes and the foreign keys have no single column index
+    assert index_query(fact_table(ct.diagnosis, use_recommended_indexes=False)) == \
+        'ALTER TABLE diagnosis ADD INDEX idx_date (date), ADD INDEX idx_code (code), ' \
+        'ADD INDEX idx_num_value (num_value), ADD INDEX idx_encounter_date (encounter_id, date)'
+    assert index_query(fact_table('notes')) == \
+        'ALTER TABLE notes ADD INDEX idx_date (date), ADD INDEX idx_code (code), ' \
+        'ADD INDEX idx_num_value (num_value), ADD INDEX idx_encounter_date (encounter_id, date)'
+    # the recommended indexes of the mapping table in both lookup directions
+    mapping = SqlTable(ct.icd9_map_icd10, None, [SqlColumn(cc.icd9_code, 'VARCHAR', 16, False, False, False),
+                                                 SqlColumn(cc.icd10_code, 'VARCHAR', 16, False, False, False)])
+    assert index_query(mapping) == \
+        'ALTER TABLE icd9_map_icd10 ADD INDEX idx_icd10_icd9 (icd10_code, icd9_code), ' \
+        'ADD INDEX idx_icd9_icd10 (icd9_code, icd10_code)'
@@ -0,0 +1,96 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import pandas as pd
+from click.testing import CliRunner
+
+from src import Application
+from src.config.AppConfig import AppConfig
+from src.db.DatabaseManager import DatabaseManager
+from src.db.QueryProfiler import QueryProfiler
+from src.util.ConcurrentUtil import ConcurrentUtil
+
+app_config = AppConfig('ssh', 'user', 'password', 'user', 'password', 'localhost', 3306)
+
+
+class RowsDatabaseManager(DatabaseManager):
+    """Database manager returning the subcodes of the requested codes without a database"""
+
+    def __init__(self, query_log=None):
+        super().__init__(app_config, db_name='db', query_log=query_log)
+        self.replayed = []
+
+    def _fetch_rows(self, sql_query) -> tuple:
+        self.replayed.append(sql_query)
+        return tuple((f'{p.rstrip("%")}.{i}',) for p in sql_query.params for i in range(2))
+
+
+def request_in_worker(query_log: str, group: int) -> int:
+    """Requests of the patient group run in a worker process"""
+    with QueryProfiler.stage(study='study', group=group):
+        RowsDatabaseManager(query_log).request_subcodes(['I10'], 'diagnosis')
+    return os.getpid()
+
+
+def test_stage_of_queries(tmp_path):
+    manager = RowsDatabaseManager(str(tmp_path))
+    with QueryProfiler.stage(study='study', group=0):
+        with QueryProfiler.stage(level=1):
+            assert sorted(manager.request_subcodes(['I10'], 'diagnosis')) == ['I10.0', 'I10.1']
+            # the requests of the thread pool have the stage of the caller and their cohort
+            manager.map_requests(manager.request_subcodes, [(['E11'], 'diagnosis'), (['N18'], 'diagnosis')],
+                                 ordered=True)
+        manager.request_subcodes(['I50'], 'diagnosis')
+    assert QueryProfiler.current_stage() == {}
+
+    records = QueryProfiler.read(str(tmp_path))
+    stages = {r.params[0]: r.stage for r in records}
+    assert stages == {'I10%': {'study': 'study', 'group': 0, 'level': 1},
+                      'E11%': {'study': 'study', 'group': 0, 'level': 1, 'cohort': 0},
+                      'N18%': {'study': 'study', 'group': 0, 'level': 1, 'cohort': 1},
+                      'I50%': {'study': 'study', 'group': 0}}
+    # the queries of the same shape have the same fingerprint
+    assert len({r.fingerprint for r in records}) == 1
+    assert all(r.rows == 2 and r.error is None and r.pid == os.getpid() for r in records)
+
+
+def test_queries_of_worker_processes_are_merged(tmp_path):
+    pids = ConcurrentUtil.run_in_separate_processes(request_in_worker, [(str(tmp_path), g) for g in range(3)],
+                                                    max_processes=3)
+    files = sorted(tmp_path.glob(f'{QueryProfiler.file_prefix}*.jsonl'))
+    assert [f.name for f in files] == sorted(f'{QueryProfiler.file_prefix}{pid}.jsonl' for pid in set(pids))
+    records = QueryProfiler.read(str(tmp_path))
+    assert sorted(r.stage['group'] for r in records) == [0, 1, 2]
+    assert {r.pid for r in records} == set(pids)
+    assert [r.start for r in records] == sorted(r.start for r in records)
+
+
+def load_cli():
+    spec = importlib.util.spec_from_file_location('cli', Path(__file__).resolve().parents[1] / '__main__.py')
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+    return cli
+
+
+def test_replay_command(tmp_path, monkeypatch):
+    manager = RowsDatabaseManager(str(tmp_path / 'log'))
+    with QueryProfiler.stage(study='study'):
+        for codes in [['I10'], ['E11', 'E10'], ['N18']]:
+            manager.request_subcodes(codes, 'diagnosis')
+    captured = QueryProfiler.read(str(tmp_path / 'log'))
+
+    replay_manager = RowsDatabaseManager()
+    monkeypatch.setattr(Application, 'init_app_config', lambda: app_config)
+    monkeypatch.setattr(Application, 'create_db_manager', lambda *args, **kwargs: replay_manager)
+    result = CliRunner().invoke(load_cli().run, ['replay', '--db', 'db', '--query_log', str(tmp_path / 'log'),
+                                                 '--repeat', '2', '--out', str(tmp_path / 'replay.csv')])
+    assert result.exit_code == 0, result.output
+    # every captured query is replayed with its values
+    assert sorted(q.params for q in replay_manager.replayed) == sorted([tuple(r.params) for r in captured] * 2)
+    summary_df = pd.read_csv(tmp_path / 'replay.csv')
+    fingerprints = pd.Series([r.fingerprint for r in captured]).value_counts()
+    assert dict(zip(summary_df['fingerprint'], summary_df['queries'])) == fingerprints.to_dict()
+    assert (summary_df['errors'] == 0).all()
+    assert (summary_df['replay_rows'] == summary_df['captured_rows']).all()
+    assert all(f in result.output for f in fingerprints.index)
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.util.TransitionStats import TransitionStats
+from tests.study_data import run_study, study
+
+
+@pytest.mark.parametrize('chains_output', [False, True])
+def test_spilled_results_are_the_same(store, tmp_path, chains_output):
+    in_memory = run_study(store, tmp_path / 'memory', None, chains_output)
+    # every level exceeds the budget, the frames are spilled to a partition per patient
+    spilled = run_study(store, tmp_path / 'spill', 1, chains_output)
+    assert list(spilled) == list(in_memory)
+    assert len(in_memory) == (2 if chains_output else 6)
+    for name, df in in_memory.items():
+        assert not df.empty
+        pd.testing.assert_frame_equal(spilled[name], df, obj=name)
+
+
+def expected_transition_stats(transition_df: pd.DataFrame, end_level: int) -> pd.DataFrame:
+    start_level = end_level - 1
+    ts = TransitionStats
+    df = transition_df.reset_index().rename(columns={
+        cc.get_column_at_level(cc.event_id, start_level): ts.start_event_id,
+        cc.get_column_at_level(cc.code, start_level): ts.start_code,
+        cc.get_column_at_level(cc.event_id, end_level): ts.end_event_id,
+        cc.get_column_at_level(cc.code, end_level): ts.end_code,
+        cc.get_column_at_level(cc.time_interval, start_level): cc.time_interval})
+    keys = [ts.start_event_id, ts.start_code, ts.end_event_id, ts.end_code]
+    df = df.astype({k: str for k in keys})
+    expected = df.groupby(keys).agg(**{ts.patients: (cc.patient_id, 'nunique'), ts.records: (cc.patient_id, 'size'),
+                                       't_min': (cc.time_interval, 'min'), 't_max': (cc.time_interval, 'max'),
+                                       't_mean': (cc.time_interval, 'mean'),
+                                       't_median': (cc.time_interval, lambda t: t.quantile(0.5, 'lower'))})
+    expected.insert(0, ts.start_level, start_level)
+    expected.insert(1, ts.end_level, end_level)
+    return expected.reset_index()
+
+
+def test_transition_stats_of_transition_files(store, tmp_path):
+    ts = TransitionStats
+    columns = [ts.start_level, ts.end_level, ts.start_event_id, ts.start_code, ts.end_event_id, ts.end_code,
+               ts.patients, ts.records, 't_min', 't_max', 't_mean', 't_median']
+    in_memory = run_study(store, tmp_path / 'memory', None, False, transition_stats=True)
+    spilled = run_study(store, tmp_path / 'spill', 1, False, transition_stats=True)
+    stats_file = f'{study.outcome_dir}/transition_stats.parquet'
+    # the partial statistics of the groups are removed after merging
+    assert not any('transition_stats/' in name for name in in_memory)
+    pd.testing.assert_frame_equal(spilled[stats_file], in_memory[stats_file])
+
+    stats_df = in_memory[stats_file]
+    expected = pd.concat([expected_transition_stats(in_memory[f'{study.outcome_dir}/transitions/'
+                                                               f'transition_{n - 1}_{n}.parquet/group=0/'
+                                                               f'transition_{n - 1}_{n}.parquet'], n)
+                          for n in [1, 2]], ignore_index=True)
+    sort_columns = columns[:6]
+    stats_df = stats_df[columns].sort_values(sort_columns, ignore_index=True)
+    expected = expected[columns].sort_values(sort_columns, ignore_index=True)
+    assert not expected.empty
+    pd.testing.assert_frame_equal(stats_df, expected, check_dtype=False)
+    # every record is in a histogram bin
+    assert (in_memory[stats_file][ts.t_histogram].map(sum) == in_memory[stats_file][ts.records]).all()
@@ -0,0 +1,46 @@
+import numpy as np
+import pymysql.converters
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db import QueryBuilder, SqlUtil
+from src.db.SqlDataElement import SqlQuery
+
+
+def render(query: SqlQuery) -> str:
+    # client side binding of the driver
+    return query.template % tuple(pymysql.converters.escape_item(p, 'utf8mb4') for p in query.params)
+
+
+def test_list_size():
+    assert [SqlUtil.list_size(n) for n in [0, 1, 2, 3, 4, 5, 9, 1000]] == [1, 1, 2, 4, 4, 8, 16, 1024]
+
+
+def test_in_expression_padding():
+    query = SqlUtil.in_expression('t.patient_id', [np.int64(7), 8, 9])
+    # the padding repeats the last value, integer ids are bound as numbers
+    assert query.template == 't.patient_id in (%s,%s,%s,%s)'
+    assert query.params == (7, 8, 9, 9) and type(query.params[0]) is int
+    # lists of the padded size share the template
+    assert SqlUtil.in_expression('t.patient_id', [1, 2, 3, 4]).template is query.template
+    assert SqlUtil.in_expression('t.patient_id', []) == SqlQuery('t.patient_id in (null)')
+
+
+def test_values_are_bound():
+    query = QueryBuilder.get_code_info(["I10') or 1=1 -- "], 'diagnosis', [cc.patient_id], text_value="50%")
+    assert query.template == 'select diagnosis.patient_id from diagnosis ' \
+                             'where (diagnosis.code in (%s)) and (text_value=%s) '
+    assert render(query) == "select diagnosis.patient_id from diagnosis " \
+                            "where (diagnosis.code in ('I10\\') or 1=1 -- ')) and (text_value='50%') "
+
+
+def test_concat_escapes_literal_percent():
+    query = SqlQuery.concat("code like 'E11%' and ", SqlQuery('date >= %s', ('2020-01-01',)))
+    assert query.template == "code like 'E11%%' and date >= %s"
+    assert render(query) == str(query) == "code like 'E11%' and date >= '2020-01-01'"
+
+
+def test_num_value_expression():
+    assert SqlUtil.num_value_expression('lab.num_value', ' >= 6.5') == SqlQuery('lab.num_value>=%s', (6.5,))
+    with pytest.raises(ValueError, match='Invalid numeric value condition'):
+        SqlUtil.num_value_expression('lab.num_value', '>6.5 or 1=1')
@@ -0,0 +1,85 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.repository.StudyResult import StudyResult
+from tests.study_data import run_study, study
+
+
+@pytest.fixture(scope='module')
+def outputs(store, tmp_path_factory) -> dict:
+    """Result directories of the study run with and without the chains output"""
+    outputs = {}
+    for chains_output in [False, True]:
+        out_dir = tmp_path_factory.mktemp(f'chains_{chains_output}')
+        run_study(store, out_dir, None, chains_output)
+        outputs[chains_output] = out_dir
+    return outputs
+
+
+def read_file(result_path, name: str) -> pd.DataFrame:
+    """File of the only patient group"""
+    file_name = f'{name.split("/")[-1]}.parquet'
+    return pd.read_parquet(result_path / study.outcome_dir / f'{name}.parquet' / 'group=0' / file_name)
+
+
+def as_str(df: pd.DataFrame) -> pd.DataFrame:
+    """Frame with the categorical columns as strings and sorted rows, the categories depend on the read files"""
+    df = df.reset_index().drop(columns=[StudyResult.group], errors='ignore')
+    df = df.astype({c: str for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+def test_read_events(outputs):
+    result = StudyResult(study.outcome_dir, result_path=str(outputs[False]))
+    assert result.levels == [0, 1, 2] and not result.has_chains
+    events_df = read_file(outputs[False], 'events/event_1')
+
+    df = result.read_events(1, codes=['N18.3', 'N18.4'], patients=['p1', 'p2', 'p3'])
+    expected = events_df[events_df[cc.get_column_at_level(cc.code, 1)].isin(['N18.3', 'N18.4']) &
+                         events_df.index.isin(['p1', 'p2', 'p3'])]
+    assert not expected.empty
+    pd.testing.assert_frame_equal(as_str(df), as_str(expected))
+
+    df = result.read_events(1, event_ids=['htn'], columns=[cc.get_column_at_level(cc.date, 1)])
+    assert list(df.columns) == [cc.get_column_at_level(cc.date, 1)]
+    assert len(df) == (events_df[cc.get_column_at_level(cc.event_id, 1)] == 'htn').sum()
+
+
+def test_read_transitions_by_start_level(outputs):
+    result = StudyResult(study.outcome_dir, result_path=str(outputs[False]))
+    transitions_df = read_file(outputs[False], 'transitions/transition_1_2')
+    df = result.read_transitions(2, event_ids=['hf'], filter=result.expression(1, codes=['N18.4']))
+    expected = transitions_df[(transitions_df[cc.get_column_at_level(cc.code, 1)] == 'N18.4') &
+                              (transitions_df[cc.get_column_at_level(cc.event_id, 2)] == 'hf')]
+    assert not expected.empty
+    pd.testing.assert_frame_equal(as_str(df), as_str(expected))
+    assert result.read_transitions(2, event_ids=['missing']).empty
+
+
+def test_chains_of_transitions_and_chains_output(outputs):
+    patients = ['p0', 'p5', 'p7']
+    expression = StudyResult.expression(2, event_ids=['hf']) & StudyResult.expression(1, codes=['I10'])
+    joined = StudyResult(study.outcome_dir, result_path=str(outputs[False]))
+    chains = StudyResult(study.outcome_dir, result_path=str(outputs[True]))
+    assert chains.has_chains
+    joined_batches = list(joined.iter_chains(patients=patients, filter=expression, batch_size=100))
+    chains_batches = list(chains.iter_chains(patients=patients, filter=expression, batch_size=100))
+    # the same schema of the batches read from the chains output and joined from the transitions
+    assert joined_batches[0].schema.equals(chains_batches[0].schema)
+    assert all(len(batch) <= 100 for batch in joined_batches + chains_batches)
+    joined_df = as_str(pa.Table.from_batches(joined_batches).to_pandas())
+    chains_df = as_str(pa.Table.from_batches(chains_batches).to_pandas())
+    pd.testing.assert_frame_equal(joined_df, chains_df)
+
+    expected = read_file(outputs[True], 'chains')
+    expected = expected[expected.index.isin(patients) & (expected[cc.get_column_at_level(cc.code, 1)] == 'I10')]
+    assert not expected.empty
+    pd.testing.assert_frame_equal(chains_df, as_str(expected))
+
+
+def test_expression_level_is_required():
+    with pytest.raises(ValueError, match='Level number of the code filter is not set'):
+        StudyResult.expression(codes=['I10'])
+    assert StudyResult.expression() is None
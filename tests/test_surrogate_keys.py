@@ -0,0 +1,134 @@
+import sqlite3
+
+import pandas as pd
+import pymysql
+
+from src.config.AppConfig import AppConfig
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db import QueryBuilder
+from src.db.DatabaseManager import DatabaseManager
+from src.db.SqlDataElement import SqlColumn, SqlTable, default_surrogate_keys, surrogate_key_type
+
+patient_key, encounter_key = default_surrogate_keys
+
+
+def diagnosis_table() -> SqlTable:
+    columns = [SqlColumn(cc.patient_id, 'VARCHAR', 200, False, False, True),
+               SqlColumn(cc.encounter_id, 'VARCHAR', 200, True, False, False),
+               SqlColumn(cc.code, 'VARCHAR', 20, False, False, True)]
+    return SqlTable('diagnosis', 'diagnosis.csv', columns).apply_surrogate_keys(default_surrogate_keys)
+
+
+def test_key_columns_types():
+    table = diagnosis_table()
+    assert table.surrogate_keys == [patient_key, encounter_key]
+    assert table.column_types() == [surrogate_key_type, surrogate_key_type, 'VARCHAR(20)']
+    patient_column = table.columns[0]
+    assert (patient_column.name, patient_column.type, patient_column.length, patient_column.is_nullable) == \
+        (cc.patient_id, surrogate_key_type, None, False)
+    assert patient_column.dtype == pd.UInt32Dtype()
+    # the patient ids are required, the encounter ids can be null
+    assert table.not_null_columns() == [cc.patient_id]
+    assert QueryBuilder.create_table(table.name, table.column_names(), table.column_types(),
+                                     not_null=table.not_null_columns()) == \
+        'CREATE TABLE diagnosis (patient_id INT UNSIGNED NOT NULL, encounter_id INT UNSIGNED, code VARCHAR(20));'
+
+
+def test_upload_queries():
+    table = diagnosis_table()
+    assert QueryBuilder.create_staging_table('db', table.name, table.surrogate_keys) == \
+        'CREATE TEMPORARY TABLE db.diagnosis_staging (patient_id INT UNSIGNED NULL, encounter_id INT UNSIGNED NULL) ' \
+        'SELECT * FROM db.diagnosis LIMIT 0;'
+    query = QueryBuilder.upload_table_from_file('db', QueryBuilder.staging_table(table.name), 'diagnosis.csv',
+                                                table.column_names(), table.surrogate_keys)
+    assert query.startswith("LOAD DATA LOCAL INFILE 'diagnosis.csv' INTO TABLE db.diagnosis_staging ")
+    assert query.endswith(
+        '(@patient_id, @encounter_id, code) SET '
+        'patient_id = (SELECT surrogate_id FROM db.patient_key WHERE patient_key.patient_id = @patient_id), '
+        'encounter_id = (SELECT surrogate_id FROM db.encounter_key WHERE encounter_key.encounter_id = @encounter_id);')
+    assert not patient_key.is_registered_by('diagnosis')
+    assert encounter_key.is_registered_by('diagnosis')
+    assert QueryBuilder.insert_from_staging_table('db', table.name, table.column_names(), [patient_key]) == \
+        'INSERT INTO db.diagnosis (patient_id, encounter_id, code) ' \
+        'SELECT patient_id, encounter_id, code FROM db.diagnosis_staging WHERE patient_id IS NOT NULL;'
+
+
+class SqliteCursor:
+    """
+    Cursor running the queries of the upload on the sqlite database. The file is loaded to the staging table with the
+    surrogate ids of the key tables as LOAD DATA does with the SET expressions
+    """
+
+    def __init__(self, db: sqlite3.Connection, queries: list):
+        self.db = db
+        self.queries = queries
+
+    def execute(self, query: str) -> int:
+        self.queries.append(query)
+        if query.startswith('CREATE TEMPORARY TABLE'):
+            self.db.execute('CREATE TABLE db.diagnosis_staging AS SELECT * FROM db.diagnosis WHERE 0')
+            return 0
+        if query.startswith('DROP TEMPORARY TABLE'):
+            self.db.execute('DROP TABLE db.diagnosis_staging')
+            return 0
+        if query.startswith('LOAD DATA'):
+            df = pd.read_csv(query.split("'")[1], dtype=str)
+            for key in default_surrogate_keys:
+                ids = dict(self.db.execute(f'SELECT {key.column_name}, surrogate_id FROM db.{key.table_name}'))
+                df[key.column_name] = df[key.column_name].map(ids).astype(object)
+            df = df.astype(object).where(df.notna(), None)
+            self.db.executemany('INSERT INTO db.diagnosis_staging VALUES (?, ?, ?)', df.values.tolist())
+            return len(df)
+        return self.db.execute(query).rowcount
+
+
+class SqliteConnection:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.queries = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return SqliteCursor(self.db, self.queries)
+
+    def commit(self):
+        self.commits += 1
+        self.db.commit()
+
+    def close(self):
+        self.closed = True
+
+
+def test_unknown_patients_are_not_loaded(tmp_path, monkeypatch):
+    db = sqlite3.connect(':memory:')
+    db.execute(f"ATTACH '{tmp_path / 'db.sqlite'}' AS db")
+    db.execute('PRAGMA foreign_keys = ON')
+    db.execute('CREATE TABLE db.patient_key (surrogate_id INTEGER PRIMARY KEY, patient_id TEXT)')
+    db.execute('CREATE TABLE db.encounter_key (surrogate_id INTEGER PRIMARY KEY, encounter_id TEXT)')
+    db.execute('CREATE TABLE db.patient (patient_id INTEGER PRIMARY KEY)')
+    # the foreign key of the patient ids rejects the records of unknown patients
+    db.execute('CREATE TABLE db.diagnosis (patient_id INTEGER NOT NULL REFERENCES patient (patient_id), '
+               'encounter_id INTEGER, code TEXT)')
+    db.executemany('INSERT INTO db.patient_key VALUES (?, ?)', [(1, 'p1'), (2, 'p2')])
+    db.executemany('INSERT INTO db.encounter_key VALUES (?, ?)', [(1, 'e1')])
+    db.executemany('INSERT INTO db.patient VALUES (?)', [(1,), (2,)])
+    pd.DataFrame({cc.patient_id: ['p1', 'x', 'p2', 'y', 'p1'], cc.encounter_id: ['e1', 'e1', None, 'e1', 'e2'],
+                  cc.code: ['I10', 'I10', 'E11', 'E11', 'N18']}).to_csv(tmp_path / 'diagnosis.csv', index=False)
+
+    connections = []
+
+    def connect(*args, **kwargs):
+        connections.append(SqliteConnection(db))
+        return connections[-1]
+
+    monkeypatch.setattr(pymysql, 'connect', connect)
+    manager = DatabaseManager(AppConfig('ssh', 'user', 'password', 'user', 'password', 'localhost', 3306), 'db')
+    table = diagnosis_table()
+    assert manager.upload_file_to_sql(str(tmp_path / 'diagnosis.csv'), table.name, table.column_names(),
+                                      table.surrogate_keys) == 2
+    assert db.execute('SELECT patient_id, encounter_id, code FROM db.diagnosis').fetchall() == \
+        [(1, 1, 'I10'), (2, None, 'E11'), (1, None, 'N18')]
+    # the temporary staging table exists in the connection of the upload only
+    assert len(connections) == 1 and connections[0].closed and connections[0].commits == 1
+    assert [q.split(' ')[0] for q in connections[0].queries] == ['CREATE', 'LOAD', 'INSERT', 'DROP']
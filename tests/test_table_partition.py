@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import DataDictionaryColumns as dd
+from src.db import QueryBuilder
+from src.db.SqlDataElement import SqlColumn, SqlTable
+from src.db.TableSchema import TableSchema
+
+
+def diagnosis_table(partition_spec: str, date_is_pk: bool = False) -> SqlTable:
+    columns = [SqlColumn('patient_id', 'VARCHAR', 200, False, False, True),
+               SqlColumn('code', 'VARCHAR', 20, False, False, True),
+               SqlColumn('date', 'DATETIME', float('nan'), False, date_is_pk, True, partition_spec=partition_spec)]
+    return SqlTable('diagnosis', None, columns)
+
+
+def create_table(t: SqlTable) -> str:
+    return QueryBuilder.create_table(t.name, t.column_names(), t.column_types(), t.primary_keys(),
+                                     t.foreign_keys(), t.partition)
+
+
+def test_range_partition_ddl():
+    assert create_table(diagnosis_table('RANGE:2019:2020')) == \
+        'CREATE TABLE diagnosis (patient_id VARCHAR(200), code VARCHAR(20), date DATETIME) ' \
+        'PARTITION BY RANGE COLUMNS (date) (' \
+        "PARTITION p2019 VALUES LESS THAN ('2020-01-01'), " \
+        "PARTITION p2020 VALUES LESS THAN ('2021-01-01'), " \
+        'PARTITION pmax VALUES LESS THAN (MAXVALUE));'
+
+
+def test_key_partition_ddl():
+    assert create_table(diagnosis_table('key:8', date_is_pk=True)) == \
+        'CREATE TABLE diagnosis (patient_id VARCHAR(200), code VARCHAR(20), date DATETIME, PRIMARY KEY (date)) ' \
+        'PARTITION BY KEY (date) PARTITIONS 8;'
+
+
+def test_invalid_partition_spec():
+    with pytest.raises(ValueError, match='date'):
+        diagnosis_table('RANGE:2019')
+
+
+def write_data_dictionary(path, rows: list[tuple]) -> str:
+    columns = [dd.file_name, dd.table_name, dd.column_name, dd.data_type, dd.length, dd.nullable, dd.primary_key,
+               dd.index, dd.foreign_key, dd.partition]
+    file_path = path / 'datadictionary.csv'
+    pd.DataFrame([('t.csv', 't') + r for r in rows], columns=columns).to_csv(file_path, index=False)
+    return file_path
+
+
+def test_partition_column_not_in_primary_key(tmp_path):
+    file_path = write_data_dictionary(tmp_path, [
+        ('id', 'INT', None, 'No', 'Yes', 'No', None, None),
+        ('date', 'DATETIME', None, 'No', 'No', 'Yes', None, 'RANGE:2019:2020')])
+    with pytest.raises(ValueError, match='Table t is partitioned by date, which is not in its primary key'):
+        TableSchema.compile(file_path)
+
+
+def test_partitioned_table_without_primary_key(tmp_path):
+    file_path = write_data_dictionary(tmp_path, [
+        ('id', 'INT', None, 'No', 'No', 'No', None, None),
+        ('date', 'DATETIME', None, 'No', 'No', 'Yes', None, 'KEY:4')])
+    table = TableSchema.compile(file_path).sql_tables('.')[0]
+    assert str(table.partition) == 'PARTITION BY KEY (date) PARTITIONS 4'
+    assert table.foreign_keys() == []
+
+
+def test_several_partition_columns(tmp_path):
+    file_path = write_data_dictionary(tmp_path, [
+        ('id', 'INT', None, 'No', 'No', 'No', None, 'KEY:4'),
+        ('date', 'DATETIME', None, 'No', 'No', 'Yes', None, 'RANGE:2019:2020')])
+    with pytest.raises(ValueError, match='Table t is partitioned by more than one column'):
+        TableSchema.compile(file_path)
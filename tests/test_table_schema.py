@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc
+from src.db.SqlDataElement import SqlColumn, default_surrogate_keys, surrogate_key_type
+from src.db.TableSchema import TableSchema
+from tests.test_table_partition import write_data_dictionary
+
+
+@pytest.fixture
+def data_dictionary(tmp_path):
+    return write_data_dictionary(tmp_path, [
+        (cc.patient_id, 'VARCHAR', 200, 'No', 'Yes', 'No', None, None),
+        (cc.date, 'DATETIME', None, 'No', 'No', 'Yes', None, None)])
+
+
+@pytest.fixture
+def compiled(monkeypatch) -> list:
+    """Data dictionaries compiled by TableSchema.load"""
+    compiled = []
+    compile_schema = TableSchema.compile
+
+    def compile_and_count(data_dictionary_file):
+        compiled.append(data_dictionary_file)
+        return compile_schema(data_dictionary_file)
+
+    monkeypatch.setattr(TableSchema, 'compile', compile_and_count)
+    return compiled
+
+
+def test_pickled_schema_is_loaded(tmp_path, data_dictionary, compiled):
+    schema = TableSchema.load(data_dictionary, tmp_path / 'cache')
+    assert schema.source == (TableSchema.version,) + TableSchema.signature(data_dictionary)[1:]
+    loaded = TableSchema.load(data_dictionary, tmp_path / 'cache')
+    assert len(compiled) == 1 and loaded.source == schema.source
+    assert [c.name for c in loaded.table('t').columns] == [cc.patient_id, cc.date]
+    assert schema.table('t').date_columns == (cc.date,)
+
+
+def test_schema_of_other_version_is_compiled(tmp_path, data_dictionary, compiled, monkeypatch):
+    TableSchema.load(data_dictionary, tmp_path / 'cache')
+    monkeypatch.setattr(TableSchema, 'version', TableSchema.version + 1)
+    schema = TableSchema.load(data_dictionary, tmp_path / 'cache')
+    assert len(compiled) == 2 and schema.source[0] == TableSchema.version
+    # the schema of the new version is saved
+    assert TableSchema.load(data_dictionary, tmp_path / 'cache').source == schema.source and len(compiled) == 2
+
+
+def test_damaged_schema_is_compiled(tmp_path, data_dictionary, compiled):
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / TableSchema.file_name).write_bytes(b'not a pickle')
+    schema = TableSchema.load(data_dictionary, tmp_path / 'cache')
+    assert len(compiled) == 1 and schema.table('t') is not None
+
+
+def test_with_type_dtype():
+    column = SqlColumn(cc.patient_id, 'VARCHAR', 200, False, True, True)
+    key_column = column.with_type(surrogate_key_type)
+    assert (key_column.type, key_column.length, key_column.dtype) == (surrogate_key_type, None, pd.UInt32Dtype())
+    # the column of the schema is not modified
+    assert (column.type, column.length, column.dtype) == ('VARCHAR', '200', str)
+    assert column.with_type('VARCHAR', 100).dtype is str
+
+
+def test_schema_tables_with_surrogate_keys(tmp_path, data_dictionary):
+    schema = TableSchema.compile(data_dictionary)
+    table = schema.sql_tables(str(tmp_path))[0].apply_surrogate_keys(default_surrogate_keys)
+    assert table.get_dtypes() == {cc.patient_id: pd.UInt32Dtype(), cc.date: pd.Int64Dtype()}
+    assert schema.table('t').dtypes() == {cc.patient_id: str, cc.date: pd.Int64Dtype()}
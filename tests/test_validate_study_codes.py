@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.datamodel.DataColumns import CommonColumns as cc, CommonTables as ct
+from src.datamodel.ExperimentConfig import ExperimentConfig
+from src.db.LocalStoreManager import LocalStoreManager
+from src.db.SqlDataElement import SqlColumn, SqlTable
+from src.repository.CodeCatalogRepository import CodeCatalogRepository
+from src.usecase.CreateSqlTablesStructure import CreateSqlTablesStructure
+from src.usecase.ValidateStudyCodes import ValidateStudyCodes
+
+study_1 = ExperimentConfig.from_json('''{"name": "study_1", "levels": [
+  {"level": 0, "events": [{"id": "dm", "category": "diagnosis", "codes": ["E11"], "include_subcodes": true}]},
+  {"level": 1, "period": {"min_t": 0, "max_t": 365}, "events": [
+    {"id": "htn", "category": "diagnosis", "codes": ["I10", "X99.9"]},
+    {"id": "no_hf", "category": "diagnosis", "codes": ["I50.9"], "negation": true}]}
+]}''')
+study_2 = ExperimentConfig.from_json('''{"name": "study_2", "levels": [
+  {"level": 0, "events": [{"id": "hhd", "category": "diagnosis", "codes": ["I11.0"]},
+                          {"id": "ckd", "category": "diagnosis", "codes": ["N18"], "include_subcodes": true}]}
+]}''')
+
+
+@pytest.fixture
+def store(tmp_path) -> LocalStoreManager:
+    rng = np.random.default_rng(3)
+    n = 2000
+    patients = [f'p{i}' for i in range(100)]
+    # I11.0 has ICD9 records only, X99.9 has no records
+    codes = ['E11.9', 'E11.65', 'I10', 'I50.9', 'N18.3', '402.91', '585.3']
+    diagnosis_df = pd.DataFrame({cc.patient_id: rng.choice(patients, n), cc.code: rng.choice(codes, n),
+                                 cc.date: '2020-01-01'})
+    diagnosis_df.to_csv(tmp_path / 'diagnosis.csv', index=False)
+    pd.DataFrame({cc.patient_id: patients}).to_csv(tmp_path / 'patient.csv', index=False)
+    pd.DataFrame({cc.icd9_code: ['402.91', '585.3', '250.00'], cc.icd10_code: ['I11.0', 'N18.3', 'E11.9'],
+                  cc.code_description: ''}).to_csv(tmp_path / 'map.csv', index=False)
+
+    store = LocalStoreManager(str(tmp_path / 'store'))
+    # the catalog counts the patients of the codes by batches
+    store.merge_batch_rows = 64
+    store.create_db('db')
+    columns = [SqlColumn(cc.patient_id, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.code, 'VARCHAR', 20, False, False, True),
+               SqlColumn(cc.date, 'DATETIME', float('nan'), False, False, True)]
+    store.write_table(SqlTable(ct.diagnosis, str(tmp_path / 'diagnosis.csv'), columns))
+    store.write_table(SqlTable(ct.patient, str(tmp_path / 'patient.csv'), columns[:1]))
+    store.write_table(CreateSqlTablesStructure.code_map_table(str(tmp_path / 'map.csv')))
+    store.diagnosis_df = diagnosis_df
+    return store
+
+
+def code_counts(df: pd.DataFrame, codes: list) -> tuple:
+    df = df[df[cc.code].isin(codes)]
+    return len(df), df[cc.patient_id].nunique()
+
+
+def test_code_catalog(store):
+    assert store.has_code_catalog(ct.diagnosis) and not store.has_code_catalog(ct.patient)
+    df = store.request_code_counts(['I10', 'X99.9'], ['E11'], ct.diagnosis)
+    assert df[cc.code].tolist() == ['I10', 'E11']
+    for code, subcodes, records, patients in df.itertuples(index=False):
+        codes = ['E11.9', 'E11.65'] if subcodes else [code]
+        # the patients of the subcodes are summed
+        expected = sum(code_counts(store.diagnosis_df, [c])[1] for c in codes)
+        assert (records, patients) == (code_counts(store.diagnosis_df, codes)[0], expected)
+
+
+def test_report(store):
+    validator = ValidateStudyCodes(CodeCatalogRepository(store))
+    report_df = validator.execute([study_1, study_2])
+    report_df = report_df.set_index([validator.study, cc.code])
+    diagnosis_df = store.diagnosis_df
+
+    assert not report_df.loc[('study_1', 'X99.9'), validator.known]
+    # I11.0 is found by its ICD9 analog
+    hhd = report_df.loc[('study_2', 'I11.0')]
+    assert hhd[validator.known] and hhd[cc.records] == 0
+    assert (hhd[validator.icd9_records], hhd[validator.icd9_patients]) == code_counts(diagnosis_df, ['402.91'])
+    ckd = report_df.loc[('study_2', 'N18')]
+    assert (ckd[cc.records], ckd[cc.patients]) == code_counts(diagnosis_df, ['N18.3'])
+    assert (ckd[validator.icd9_records], ckd[validator.icd9_patients]) == code_counts(diagnosis_df, ['585.3'])
+    assert (report_df.loc[('study_1', 'I10'), [cc.records, cc.patients]].tolist() ==
+            list(code_counts(diagnosis_df, ['I10'])))
+
+    summary_df = validator.summarize(report_df.reset_index()).set_index([validator.study, cc.level])
+    assert summary_df.loc[('study_1', 1), validator.unknown_codes] == ['X99.9']
+    assert summary_df.loc[('study_2', 0), validator.unknown_codes] == []
+    # negation events are not estimated
+    assert summary_df.loc[('study_1', 1), validator.max_patients] == code_counts(diagnosis_df, ['I10'])[1]
+    # the estimates do not exceed the patients of the database
+    total_patients = CodeCatalogRepository(store).get_patients_count()
+    assert total_patients == 100
+    assert summary_df.loc[('study_2', 0), validator.max_patients] > total_patients
+    summary_df = validator.summarize(report_df.reset_index(), total_patients)
+    assert (summary_df[[validator.min_patients, validator.max_patients]] <= total_patients).all(axis=None)
+
+
+def test_report_without_icd9(store):
+    validator = ValidateStudyCodes(CodeCatalogRepository(store))
+    report_df = validator.execute([study_2], include_icd9=False).set_index(cc.code)
+    assert not report_df.loc['I11.0', validator.known]
+    assert (report_df[validator.icd9_records] == 0).all()
+
+
+def test_catalog_is_built_on_request(store):
+    (store.store_path / 'db' / ct.code_catalog / f'{ct.diagnosis}.parquet').unlink()
+    assert not store.has_code_catalog(ct.diagnosis)
+    df = CodeCatalogRepository(store).get_code_counts({ct.diagnosis: {('I10', False)}})
+    assert store.has_code_catalog(ct.diagnosis)
+    assert df[[cc.records, cc.patients]].values.tolist() == [list(code_counts(store.diagnosis_df, ['I10']))]